@@ -258,6 +258,77 @@ CHANNEL_LAYERS = {
     },
 }
 
+# 协作会话存储配置
+# RedisSessionStore 默认复用 CHANNEL_LAYERS 的 hosts，多个 Daphne 进程共享会话状态
+# 测试或单进程开发环境可改用 'user.session_store.InMemorySessionStore'
+COLLABORATION_SESSION_STORE = {
+    'BACKEND': 'user.session_store.RedisSessionStore',
+    'OPTIONS': {
+        'ttl': 60 * 60 * 2,  # 会话过期时间（秒），每次写入时刷新
+        'journal_ttl': 60 * 60 * 24 * 7,  # 会话结束后未落库的设计文档保留时间（秒）
+    },
+}
+
+# 协作编辑收到后延迟写回设计记录的时间（秒），期间的编辑合并为一次写入
+COLLABORATION_PERSIST_INTERVAL = 30
+
+# 协作在线状态配置
+# 每个工作进程每隔 INTERVAL 秒刷新本进程连接的在线状态，并移除超过 TIMEOUT 秒未刷新的协作者
+COLLABORATION_PRESENCE_INTERVAL = 30
+COLLABORATION_PRESENCE_TIMEOUT = 90
+# 消息处理时 last_active 的最小写入间隔（秒）
+COLLABORATION_ACTIVITY_WRITE_INTERVAL = 5
+
+# 缓存配置
+# default 保持进程内缓存；shared 保存需要多个进程共享的状态（协作权限缓存的失效版本号、
+# 会员计划目录版本号、会话调试开关、定时任务锁），复用Redis的独立库。
+# 未配置 shared 时这些状态使用 default（单进程开发和测试环境）
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://127.0.0.1:6379/1',
+    },
+}
+
+# WebSocket连接时会员/设计权限检查结果的缓存时间（秒）
+COLLABORATION_ACCESS_CACHE_TTL = 60
+
+# 光标移动合并配置：窗口内每个用户只广播最新位置，以 cursor_batch 消息批量广播；
+# 两者均为0时逐条转发 cursor_move。前端支持 cursor_batch 后再启用（如 40 / 20）
+COLLABORATION_CURSOR_WINDOW_MS = 0  # 合并窗口（毫秒）
+COLLABORATION_CURSOR_MAX_FRAME_RATE = 0  # 每个房间每秒最多广播的批量帧数
+
+# 管理仪表盘趋势数据的缓存时间（秒），历史数据由 rollup_dashboard_metrics 命令汇总
+DASHBOARD_METRICS_CACHE_TTL = 60
+
+# 设计图片缩略图（user.renditions）：{名称: (最大宽度, 最大高度)}，修改尺寸后运行
+# generate_design_renditions 命令生成新尺寸
+DESIGN_IMAGE_RENDITIONS = {
+    'thumbnail': (320, 240),  # 列表卡片
+    'preview': (1024, 768),  # 详情预览
+}
+DESIGN_IMAGE_RENDITION_FORMAT = 'WEBP'  # WEBP 或 JPEG，Pillow 不支持 WebP 时自动使用 JPEG
+DESIGN_IMAGE_RENDITION_QUALITY = 80
+
+# 设计图服务端渲染（user.course_renderer）
+DESIGN_RENDER_FONT = None  # 中文字体路径（如 /usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc），None 使用 Pillow 默认字体
+DESIGN_RENDER_MAX_DPI = 600  # 下载接口允许的最大 DPI
+
+# 渲染任务队列（user.render_jobs），由 render_worker 命令执行
+RENDER_WORKER_PROCESSES = 2  # 每个 worker 的渲染进程数
+RENDER_JOB_TIMEOUT = 300  # 执行超过该时间（秒）的任务视为 worker 已退出，重新领取
+RENDER_JOB_MAX_ATTEMPTS = 3  # 超过该次数仍未完成的任务标记为失败
+
+# 设计图片和设计文件按内容寻址保存（user.content_storage），gc_blobs 命令清理没有引用的文件；
+# 保存后该时间（秒）内的文件即使没有引用也不清理，避免删除正在上传、还没有写入设计记录的文件
+CONTENT_STORAGE_GC_GRACE_PERIOD = 86400
+
+# 上传设计文件时解析为设计文档和摘要字段（user.design_summary），超过该大小（字节）的文件不解析
+DESIGN_DOCUMENT_MAX_BYTES = 10 * 1024 * 1024
+
 
 # 创建日志目录
 LOGS_DIR = os.path.join(BASE_DIR, 'logs')
@@ -281,7 +352,8 @@ LOGGING = {
         },
         'file': {
             'level': 'DEBUG',
-            'class': 'logging.FileHandler',
+            # 后台线程写文件，不阻塞 WebSocket 消费者所在的事件循环
+            'class': 'user.log_handlers.QueueFileHandler',
             'filename': os.path.join(LOGS_DIR, 'django-channels.log'),
             'formatter': 'verbose',
         },
@@ -294,12 +366,16 @@ LOGGING = {
         },
         'django.channels': {
             'handlers': ['console', 'file'],  # 同时输出到控制台和文件
-            'level': 'DEBUG',
+            # 协作事件按类型采样记录，完整消息体通过 collaboration_debug 命令按会话开启
+            'level': 'INFO',
             'propagate': False,
         },
     },
 }
 
+# 协作日志的事件采样率，未列出的事件使用 user.collaboration_log.DEFAULT_SAMPLE_RATES
+COLLABORATION_LOG_SAMPLE_RATES = {}
+
 # 支付宝配置
 ALIPAY_APPID = '9021000144617885'  # 替换为实际的支付宝应用ID
 ALIPAY_APP_PRIVATE_KEY_PATH = os.path.join(
@@ -309,3 +385,15 @@ ALIPAY_ALIPAY_PUBLIC_KEY_PATH = os.path.join(
 ALIPAY_NOTIFY_URL = f"{SITE_DOMAIN}/api/payment/alipay/notify/"
 ALIPAY_RETURN_URL = f"{SITE_DOMAIN}/payment/success/"
 ALIPAY_DEBUG = True  # 开发环境使用沙箱模式
+# 支付宝客户端在进程内缓存，替换密钥文件后自动重新加载；密钥内容不变但需要强制重建时递增此值
+ALIPAY_KEY_VERSION = 1
+# 使用本地模拟的支付宝网关（user.fake_alipay），仅用于测试和本地开发
+ALIPAY_USE_FAKE_GATEWAY = False
+
+# 待支付订单对账（reconcile_orders 命令）：向支付宝查询支付状态，查询间隔按次数指数增长
+ORDER_RECONCILE_BATCH_SIZE = 50  # 每批查询的订单数
+ORDER_RECONCILE_CONCURRENCY = 4  # 同时向支付宝发起的查询数
+ORDER_RECONCILE_BASE_DELAY = 5  # 首次查询间隔（秒）
+ORDER_RECONCILE_MAX_DELAY = 300  # 最大查询间隔（秒）
+ORDER_RECONCILE_MAX_AGE = 86400  # 创建超过该时间（秒）仍未支付的订单不再查询
+ORDER_RECONCILE_INTERVAL = 2  # 常驻运行时每轮之间的间隔（秒）
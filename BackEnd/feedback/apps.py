@@ -5,3 +5,7 @@ class FeedbackConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'feedback'
     verbose_name = '反馈管理'
+
+    def ready(self):
+        # 注册仪表盘指标汇总的信号处理函数
+        from . import signals  # noqa: F401
@@ -0,0 +1,40 @@
+"""
+统计管理仪表盘的日/月指标汇总
+
+默认统计最近两天（昨天和前天，覆盖跨零点到达的支付回调）以及涉及的已结束月份，
+建议每天凌晨通过定时任务执行一次。首次部署或修正历史数据时用 --since 回填。
+
+用法:
+    python manage.py rollup_dashboard_metrics
+    python manage.py rollup_dashboard_metrics --days 7
+    python manage.py rollup_dashboard_metrics --since 2025-01-01
+"""
+
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from feedback.metrics import rollup
+
+
+class Command(BaseCommand):
+    help = '统计管理仪表盘的日/月指标汇总'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=2, help='统计最近多少天，默认 2')
+        parser.add_argument('--since', help='从指定日期（YYYY-MM-DD）开始回填，优先于 --days')
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        if options['since']:
+            try:
+                since = date.fromisoformat(options['since'])
+            except ValueError:
+                raise CommandError(f'无效的日期: {options["since"]}')
+        else:
+            since = today - timedelta(days=options['days'])
+
+        days, months = rollup(since, today)
+        self.stdout.write(self.style.SUCCESS(
+            f'汇总完成: {since} 至 {today - timedelta(days=1)}，{days} 天，{months} 个月'))
@@ -0,0 +1,187 @@
+"""
+管理仪表盘指标汇总
+
+FeedbackIndexView 原先每次打开都实时聚合订单表和用户表（6 个月 × 3 个查询，
+每个会员计划 1 个查询）。本模块把已结束的日/月周期汇总到 DashboardMetric：
+- rollup_dashboard_metrics 命令每天统计前一天和上个月（可回填任意区间）
+- 订单和用户保存时，如果影响的是已结束的周期（例如补发的支付回调、退款），
+  信号会重新统计对应的日/月记录
+- 仪表盘读取汇总表，只有当天的数据实时统计；缺失的汇总记录在读取时补齐
+
+统计周期按本地时区的自然日/自然月划分，分组统计见 feedback.timeseries，
+任意长度的区间每个指标只需一次查询。
+
+配置（settings.py）：
+- DASHBOARD_METRICS_CACHE_TTL: 仪表盘趋势数据的缓存时间（秒）
+"""
+
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from user.models import MembershipOrder
+
+from .models import DashboardMetric
+from .timeseries import add_months, month_start, next_bucket, time_series
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_TTL = 60
+
+METRIC_FIELDS = ('income', 'paid_orders', 'new_users', 'new_premium_users')
+
+# 已支付订单按 payment_time 分组统计的指标
+ORDER_METRICS = {
+    'income': Sum('amount'),
+    'paid_orders': Count('id'),
+    # 按周期分组后去重，按月统计时不能由每日数据相加得到
+    'new_premium_users': Count('user', distinct=True),
+}
+
+# 用户按 date_joined 分组统计的指标
+USER_METRICS = {
+    'new_users': Count('id'),
+}
+
+
+def paid_orders():
+    """统计收入和新增会员使用的订单"""
+    return MembershipOrder.objects.filter(status='paid')
+
+
+def is_closed(period, bucket, today=None):
+    """周期是否已经结束"""
+    today = today or timezone.localdate()
+    if period == 'day':
+        return bucket < today
+    return bucket < month_start(today)
+
+
+def aggregate_buckets(period, since, until):
+    """
+    实时统计 [since, until) 内各周期的指标（订单和用户各一次查询）
+
+    返回:
+        dict: {周期开始日期: {'income', 'paid_orders', 'new_users', 'new_premium_users'}}
+    """
+    orders = time_series(paid_orders(), 'payment_time', period, since, until, **ORDER_METRICS)
+    users = time_series(User.objects.all(), 'date_joined', period, since, until, **USER_METRICS)
+    return {bucket: {**values, **users[bucket]} for bucket, values in orders.items()}
+
+
+def refresh_buckets(period, since, until):
+    """重新统计 [since, until) 内的周期并保存汇总记录，返回保存的记录"""
+    metrics = [
+        DashboardMetric(period=period, bucket=bucket, **values)
+        for bucket, values in aggregate_buckets(period, since, until).items()
+    ]
+    options = {}
+    if connection.features.supports_update_conflicts_with_target:
+        options['unique_fields'] = ['period', 'bucket']
+    DashboardMetric.objects.bulk_create(
+        metrics, update_conflicts=True, update_fields=[*METRIC_FIELDS, 'updated_at'], **options)
+    return metrics
+
+
+def refresh_for_time(moment):
+    """
+    某个时间点的数据发生变化后，重新统计其所在的已结束周期
+
+    当天和当月的数据由仪表盘实时统计，不需要处理。
+    """
+    if moment is None:
+        return
+    day = timezone.localdate(moment)
+    for period, bucket in (('day', day), ('month', month_start(day))):
+        if is_closed(period, bucket):
+            refresh_buckets(period, bucket, next_bucket(period, bucket))
+
+
+def rollup(since, until):
+    """
+    统计 [since, until) 内已结束的日周期，以及涉及的已结束月周期
+
+    返回:
+        tuple: (统计的天数, 统计的月数)
+    """
+    today = timezone.localdate()
+    until = min(until, today)
+    if since >= until:
+        return 0, 0
+    days = refresh_buckets('day', since, until)
+    # 区间涉及的月份中已结束的部分
+    last_month = month_start(until - timedelta(days=1))
+    months = refresh_buckets('month', since, min(add_months(last_month, 1), month_start(today)))
+    return len(days), len(months)
+
+
+def _metric_dict(metric):
+    data = {'bucket': metric.bucket}
+    for field in METRIC_FIELDS:
+        data[field] = getattr(metric, field)
+    return data
+
+
+def current_month_metrics(today):
+    """
+    当月指标：已结束各天读汇总表（缺失时重新统计），当天实时统计，
+    新增会员数需要在整月内去重，单独实时统计
+    """
+    current = month_start(today)
+    days = DashboardMetric.objects.filter(period='day', bucket__gte=current, bucket__lt=today)
+    if days.count() < (today - current).days:
+        refresh_buckets('day', current, today)
+
+    closed = days.aggregate(
+        income=Sum('income'), paid_orders=Sum('paid_orders'), new_users=Sum('new_users'))
+    live = aggregate_buckets('day', today, today + timedelta(days=1))[today]
+    month = time_series(
+        paid_orders(), 'payment_time', 'month', current, add_months(current, 1),
+        new_premium_users=ORDER_METRICS['new_premium_users'])[current]
+    return {
+        'bucket': current,
+        'income': (closed['income'] or 0) + live['income'],
+        'paid_orders': (closed['paid_orders'] or 0) + live['paid_orders'],
+        'new_users': (closed['new_users'] or 0) + live['new_users'],
+        'new_premium_users': month['new_premium_users'],
+    }
+
+
+def get_monthly_series(months=6, today=None):
+    """
+    最近 months 个月（含当月）的月度指标，按时间先后排列
+
+    已结束的月份读取汇总表（缺失时重新统计并保存），当月见 current_month_metrics。
+    结果缓存 DASHBOARD_METRICS_CACHE_TTL 秒。
+
+    返回:
+        list: [{'bucket': 月份第一天, 'income': ..., 'paid_orders': ...,
+                'new_users': ..., 'new_premium_users': ...}]
+    """
+    today = today or timezone.localdate()
+    cache_key = f'dashboard_metrics:{months}:{today.isoformat()}'
+    series = cache.get(cache_key)
+    if series is not None:
+        return series
+
+    current = month_start(today)
+    first = add_months(current, 1 - months)
+    rows = {
+        metric.bucket: metric
+        for metric in DashboardMetric.objects.filter(
+            period='month', bucket__gte=first, bucket__lt=current)
+    }
+    if len(rows) < months - 1:
+        logger.info(f"仪表盘月度汇总缺失，重新统计: {first} 至 {current}")
+        rows = {metric.bucket: metric for metric in refresh_buckets('month', first, current)}
+    series = [_metric_dict(rows[bucket]) for bucket in sorted(rows)]
+    series.append(current_month_metrics(today))
+
+    cache.set(cache_key, series, getattr(settings, 'DASHBOARD_METRICS_CACHE_TTL', DEFAULT_CACHE_TTL))
+    return series
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.3 on 2026-10-17 01:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feedback', '0002_created_at_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DashboardMetric',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('day', '日'), ('month', '月')], max_length=10, verbose_name='统计周期')),
+                ('bucket', models.DateField(verbose_name='周期开始日期')),
+                ('income', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='收入')),
+                ('paid_orders', models.PositiveIntegerField(default=0, verbose_name='已支付订单数')),
+                ('new_users', models.PositiveIntegerField(default=0, verbose_name='新增用户数')),
+                ('new_premium_users', models.PositiveIntegerField(default=0, verbose_name='新增会员数')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+            ],
+            options={
+                'verbose_name': '仪表盘指标',
+                'verbose_name_plural': '仪表盘指标',
+                'ordering': ['period', 'bucket'],
+                'unique_together': {('period', 'bucket')},
+            },
+        ),
+    ]
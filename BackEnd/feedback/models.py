@@ -48,6 +48,42 @@ class Feedback(models.Model):
         verbose_name = '用户反馈'
         verbose_name_plural = '用户反馈'
         ordering = ['-created_at']
+        indexes = [
+            # 反馈列表：ORDER BY created_at DESC LIMIT ?
+            models.Index(fields=['created_at'], name='feedback_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.get_type_display()}: {self.title}"
+
+
+class DashboardMetric(models.Model):
+    """
+    管理仪表盘指标汇总（按日/按月）
+
+    只保存已结束的统计周期，由 rollup_dashboard_metrics 命令和订单/用户的
+    保存信号维护；当天的数据由仪表盘实时统计。
+    """
+
+    PERIOD_CHOICES = (
+        ('day', '日'),
+        ('month', '月'),
+    )
+
+    period = models.CharField('统计周期', max_length=10, choices=PERIOD_CHOICES)
+    bucket = models.DateField('周期开始日期')
+    income = models.DecimalField('收入', max_digits=12, decimal_places=2, default=0)
+    paid_orders = models.PositiveIntegerField('已支付订单数', default=0)
+    new_users = models.PositiveIntegerField('新增用户数', default=0)
+    # 周期内有已支付订单的用户数（去重），按月统计时不能由每日数据相加得到
+    new_premium_users = models.PositiveIntegerField('新增会员数', default=0)
+    updated_at = models.DateTimeField('更新时间', auto_now=True)
+
+    class Meta:
+        verbose_name = '仪表盘指标'
+        verbose_name_plural = '仪表盘指标'
+        ordering = ['period', 'bucket']
+        unique_together = ('period', 'bucket')
+
+    def __str__(self):
+        return f"{self.get_period_display()} {self.bucket}"
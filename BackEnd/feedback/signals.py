@@ -0,0 +1,49 @@
+"""
+仪表盘指标汇总的信号处理
+
+订单或用户的变化影响已结束的统计周期时（补发的支付回调、退款、删除），
+事务提交后重新统计对应的日/月汇总记录。
+"""
+
+import logging
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from user.models import MembershipOrder
+
+from .metrics import refresh_for_time
+
+logger = logging.getLogger(__name__)
+
+
+def _refresh_later(moment):
+    if moment is None:
+        return
+
+    def refresh():
+        try:
+            refresh_for_time(moment)
+        except Exception as e:
+            # 汇总失败不影响订单和用户的保存，下次执行 rollup_dashboard_metrics 时修正
+            logger.error(f"更新仪表盘指标汇总失败: {moment}, 错误: {str(e)}", exc_info=True)
+
+    transaction.on_commit(refresh)
+
+
+@receiver(post_save, sender=MembershipOrder)
+@receiver(post_delete, sender=MembershipOrder)
+def refresh_order_metrics(sender, instance, raw=False, **kwargs):
+    """订单变化后更新支付时间所在周期的汇总"""
+    if not raw:
+        _refresh_later(instance.payment_time)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def refresh_user_metrics(sender, instance, raw=False, **kwargs):
+    """用户新增或删除后更新注册时间所在周期的汇总"""
+    if not raw and kwargs.get('created', True):
+        _refresh_later(instance.date_joined)
@@ -1,3 +1,88 @@
+from datetime import date, datetime
+from decimal import Decimal
+from zoneinfo import ZoneInfo
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models import Count
 from django.test import TestCase
 
-# Create your tests here.
+from user.models import MembershipOrder
+
+from .metrics import aggregate_buckets, refresh_buckets, rollup
+from .models import DashboardMetric
+from .timeseries import time_series
+
+LOCAL = ZoneInfo('Asia/Shanghai')
+
+
+def local_time(*args):
+    """本地时区（Asia/Shanghai）的时间"""
+    return datetime(*args, tzinfo=LOCAL)
+
+
+class DashboardMetricsTests(TestCase):
+    """仪表盘按本地自然日/月统计，汇总表与实时统计结果一致"""
+
+    def setUp(self):
+        cache.clear()
+        self.users = [User.objects.create(username=f'member_{i}', date_joined=local_time(2025, 9, 1 + i))
+                      for i in range(3)]
+
+    def create_order(self, user, payment_time, amount='30.00', status='paid'):
+        return MembershipOrder.objects.create(
+            user=user, order_id=f'order_{MembershipOrder.objects.count()}',
+            amount=Decimal(amount), status=status, payment_time=payment_time)
+
+    def test_orders_near_month_boundary_use_local_month(self):
+        # 两个订单在 UTC 都是 9 月 30 日，本地时间分属 9 月和 10 月
+        self.create_order(self.users[0], local_time(2025, 9, 30, 23, 30), '30.00')
+        self.create_order(self.users[1], local_time(2025, 10, 1, 0, 30), '50.00')
+
+        months = aggregate_buckets('month', date(2025, 9, 1), date(2025, 11, 1))
+        self.assertEqual(months[date(2025, 9, 1)]['income'], Decimal('30.00'))
+        self.assertEqual(months[date(2025, 10, 1)]['income'], Decimal('50.00'))
+        self.assertEqual(months[date(2025, 10, 1)]['paid_orders'], 1)
+
+        days = time_series(MembershipOrder.objects.filter(status='paid'), 'payment_time', 'day',
+                           date(2025, 9, 30), date(2025, 10, 2), paid_orders=Count('id'))
+        self.assertEqual(days, {date(2025, 9, 30): {'paid_orders': 1}, date(2025, 10, 1): {'paid_orders': 1}})
+
+    def test_rollup_matches_live_aggregate(self):
+        self.create_order(self.users[0], local_time(2025, 8, 15, 10), '30.00')
+        self.create_order(self.users[0], local_time(2025, 9, 2, 9), '30.00')
+        self.create_order(self.users[1], local_time(2025, 9, 30, 23, 30), '300.00')
+        self.create_order(self.users[2], local_time(2025, 10, 1, 0, 30), '30.00')
+        self.create_order(self.users[2], local_time(2025, 10, 3, 12), '30.00', status='pending')
+
+        self.assertEqual(rollup(date(2025, 8, 1), date(2025, 11, 1)), (92, 3))
+        for period in ('day', 'month'):
+            live = aggregate_buckets(period, date(2025, 8, 1), date(2025, 11, 1))
+            stored = {
+                metric.bucket: {field: getattr(metric, field) for field in live[metric.bucket]}
+                for metric in DashboardMetric.objects.filter(period=period)
+            }
+            self.assertEqual(stored, live)
+
+        september = DashboardMetric.objects.get(period='month', bucket=date(2025, 9, 1))
+        self.assertEqual(september.income, Decimal('330.00'))
+        self.assertEqual(september.new_users, 3)
+        self.assertEqual(september.new_premium_users, 2)
+
+    def test_order_saved_for_closed_period_refreshes_rollup(self):
+        refresh_buckets('month', date(2025, 9, 1), date(2025, 10, 1))
+        refresh_buckets('day', date(2025, 9, 30), date(2025, 10, 1))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            order = self.create_order(self.users[0], local_time(2025, 9, 30, 23, 30), '30.00')
+        month = DashboardMetric.objects.get(period='month', bucket=date(2025, 9, 1))
+        day = DashboardMetric.objects.get(period='day', bucket=date(2025, 9, 30))
+        self.assertEqual((month.income, month.paid_orders), (Decimal('30.00'), 1))
+        self.assertEqual((day.income, day.paid_orders), (Decimal('30.00'), 1))
+
+        # 退款后重新统计
+        order.status = 'refunded'
+        with self.captureOnCommitCallbacks(execute=True):
+            order.save()
+        month.refresh_from_db()
+        self.assertEqual((month.income, month.paid_orders, month.new_premium_users), (0, 0, 0))
@@ -0,0 +1,115 @@
+"""
+时间序列聚合
+
+按本地时区（settings.TIME_ZONE，Asia/Shanghai）的自然日/自然月分组统计，
+使用 TruncDay/TruncMonth + values().annotate()，每个查询集一次查询返回所有周期，
+替代按周期循环调用 aggregate()/count()。仪表盘和报表接口都应使用这里的函数。
+
+MySQL 按时区截断日期依赖 CONVERT_TZ，数据库需要先加载时区表：
+    mysql_tzinfo_to_sql /usr/share/zoneinfo | mysql -u root mysql
+"""
+
+from datetime import date, datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+from django.conf import settings
+from django.db.models import DateField
+from django.db.models.functions import TruncDay, TruncMonth
+from django.utils import timezone
+
+TRUNC_FUNCTIONS = {
+    'day': TruncDay,
+    'month': TruncMonth,
+}
+
+
+def local_zone():
+    """统计使用的时区"""
+    return ZoneInfo(settings.TIME_ZONE)
+
+
+def month_start(day):
+    """所在月份的第一天"""
+    return day.replace(day=1)
+
+
+def add_months(day, months):
+    """day 所在月份加 months 个月后的第一天"""
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def local_midnight(day):
+    """本地时区 day 当天 0 点"""
+    return timezone.make_aware(datetime.combine(day, time.min), local_zone())
+
+
+def next_bucket(period, bucket):
+    """下一个周期的开始日期"""
+    return bucket + timedelta(days=1) if period == 'day' else add_months(bucket, 1)
+
+
+def period_buckets(period, since, until):
+    """
+    [since, until) 内各周期的开始日期
+
+    参数:
+        period: 'day' 或 'month'
+        since: 开始日期；按月统计时取所在月份
+        until: 结束日期（不含）
+    """
+    bucket = since if period == 'day' else month_start(since)
+    buckets = []
+    while bucket < until:
+        buckets.append(bucket)
+        bucket = next_bucket(period, bucket)
+    return buckets
+
+
+def grouped_queryset(queryset, field, period, buckets, **aggregates):
+    """
+    按周期分组的查询集，返回 [{'bucket': 周期开始日期, 聚合名称: 值}]
+
+    参数:
+        buckets: 统计的周期（period_buckets 的结果，不能为空）
+    """
+    trunc = TRUNC_FUNCTIONS[period](field, output_field=DateField(), tzinfo=local_zone())
+    return queryset.filter(**{
+        f'{field}__gte': local_midnight(buckets[0]),
+        f'{field}__lt': local_midnight(next_bucket(period, buckets[-1])),
+    }).annotate(bucket=trunc).values('bucket').annotate(**aggregates).order_by('bucket')
+
+
+def time_series(queryset, field, period, since, until, fill=0, **aggregates):
+    """
+    按自然日/月分组统计，一次查询返回 [since, until) 内的所有周期
+
+    参数:
+        queryset: 需要统计的查询集（已应用其他过滤条件）
+        field: 用于分组的时间字段
+        period: 'day' 或 'month'
+        since: 开始日期；按月统计时取所在月份
+        until: 结束日期（不含）；按月统计时应为某月第一天
+        fill: 没有数据的周期以及为 NULL 的聚合结果使用的值
+        aggregates: 聚合表达式，例如 income=Sum('amount')
+
+    返回:
+        dict: {周期开始日期: {聚合名称: 值}}，按时间先后排列，包含所有周期
+
+    示例:
+        time_series(MembershipOrder.objects.filter(status='paid'), 'payment_time',
+                    'month', date(2025, 1, 1), date(2025, 7, 1), income=Sum('amount'))
+    """
+    buckets = period_buckets(period, since, until)
+    series = {bucket: dict.fromkeys(aggregates, fill) for bucket in buckets}
+    if not buckets:
+        return series
+
+    for row in grouped_queryset(queryset, field, period, buckets, **aggregates):
+        values = series.get(row['bucket'])
+        if values is None:
+            continue
+        for name in aggregates:
+            if row[name] is not None:
+                values[name] = row[name]
+    return series
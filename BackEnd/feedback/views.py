@@ -6,10 +6,12 @@ from rest_framework import status
 from .models import Feedback
 from .serializers import FeedbackSerializer
 from django.contrib.auth.models import User
-from user.models import MembershipOrder, UserProfile, MembershipPlan
+from user.models import MembershipOrder, UserProfile
 from user.utils import success_response
-from django.db.models import Sum, Count
-from datetime import timedelta, date
+from django.db.models import Count
+from django.utils import timezone
+from .metrics import get_monthly_series
+from .timeseries import add_months, local_midnight
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
 from rest_framework.authentication import SessionAuthentication, BasicAuthentication
@@ -59,29 +61,18 @@ class FeedbackIndexView(APIView):
             return Response({"detail": "您没有权限访问此页面"}, status=status.HTTP_403_FORBIDDEN)
 
         try:
-            # 获取当前日期和时间（使用date对象避免时区问题）
-            today = date.today()
-            current_month_start = today.replace(day=1)
-            last_month_end = current_month_start - timedelta(days=1)
-            last_month_start = last_month_end.replace(day=1)
-            # 获取当月收入
-            current_month_orders = MembershipOrder.objects.filter(
-                status='paid',
-                payment_time__gte=current_month_start,
-                payment_time__lte=today
-            )
-            print(current_month_orders)
-            monthly_income = current_month_orders.aggregate(Sum('amount'))[
-                'amount__sum'] or 0
-
-            # 获取上月收入
-            last_month_orders = MembershipOrder.objects.filter(
-                status='paid',
-                payment_time__gte=last_month_start,
-                payment_time__lte=last_month_end
-            )
-            last_month_income = last_month_orders.aggregate(Sum('amount'))[
-                'amount__sum'] or 0
+            # 本地时区的今天和本月/上月的开始时间
+            today = timezone.localdate()
+            now = timezone.now()
+            last_month_start = local_midnight(add_months(today, -1))
+
+            # 最近6个月的收入、新增用户、新增会员（已结束的月份读汇总表，当天实时统计）
+            series = get_monthly_series(6, today)
+            current_month, last_month = series[-1], series[-2]
+
+            # 获取当月收入和上月收入
+            monthly_income = current_month['income']
+            last_month_income = last_month['income']
 
             # 计算收入环比增长率
             if last_month_income > 0:
@@ -90,17 +81,9 @@ class FeedbackIndexView(APIView):
             else:
                 income_trend = 100 if monthly_income > 0 else 0
 
-            # 获取当月新增用户数（使用date字段）
-            new_users = User.objects.filter(
-                date_joined__gte=current_month_start,
-                date_joined__lte=today
-            ).count()
-
-            # 获取上月新增用户数
-            last_month_new_users = User.objects.filter(
-                date_joined__gte=last_month_start,
-                date_joined__lte=last_month_end
-            ).count()
+            # 获取当月和上月新增用户数
+            new_users = current_month['new_users']
+            last_month_new_users = last_month['new_users']
 
             # 计算用户环比增长率
             if last_month_new_users > 0:
@@ -112,7 +95,7 @@ class FeedbackIndexView(APIView):
             # 获取当前会员数量
             premium_users = UserProfile.objects.filter(
                 is_premium=True,
-                premium_expire_date__gt=today
+                premium_expire_date__gt=now
             ).count()
 
             # 获取上月会员数量
@@ -131,65 +114,22 @@ class FeedbackIndexView(APIView):
             # 获取总用户数
             total_users = User.objects.count()
 
-            # 获取最近6个月的数据
-            six_months_ago = today - timedelta(days=180)
-            six_months_ago = six_months_ago.replace(day=1)
-
             # 准备月份数据
-            months = []
-            income_data = []
-            new_users_data = []
-            new_premium_data = []
-
-            for i in range(6):
-                month_date = (today - timedelta(days=30*i)).replace(day=1)
-                month_end = (month_date.replace(
-                    day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
-                month_name = month_date.strftime('%Y-%m')
-                months.append(month_name)
-
-                # 收入数据
-                month_income = MembershipOrder.objects.filter(
-                    status='paid',
-                    payment_time__gte=month_date,
-                    payment_time__lte=month_end
-                ).aggregate(Sum('amount'))['amount__sum'] or 0
-                income_data.append(float(month_income))
-
-                # 新增用户数据
-                month_users = User.objects.filter(
-                    date_joined__gte=month_date,
-                    date_joined__lte=month_end
-                ).count()
-                new_users_data.append(month_users)
-
-                # 新增会员数据
-                month_premium = MembershipOrder.objects.filter(
-                    status='paid',
-                    payment_time__gte=month_date,
-                    payment_time__lte=month_end
-                ).values('user').distinct().count()
-                new_premium_data.append(month_premium)
-
-            months.reverse()
-            income_data.reverse()
-            new_users_data.reverse()
-            new_premium_data.reverse()
-
-            # 获取会员计划分布数据
-            membership_plans = MembershipPlan.objects.all()
-            membership_distribution = []
-
-            for plan in membership_plans:
-                plan_users = UserProfile.objects.filter(
-                    membership_plan=plan,
-                    premium_expire_date__gt=today
-                ).count()
-                if plan_users > 0:
-                    membership_distribution.append({
-                        'name': plan.name,
-                        'value': plan_users
-                    })
+            months = [item['bucket'].strftime('%Y-%m') for item in series]
+            income_data = [float(item['income']) for item in series]
+            new_users_data = [item['new_users'] for item in series]
+            new_premium_data = [item['new_premium_users'] for item in series]
+
+            # 获取会员计划分布数据（一次分组查询）
+            membership_distribution = [
+                {'name': row['membership_plan__name'], 'value': row['value']}
+                for row in UserProfile.objects.filter(
+                    membership_plan__isnull=False,
+                    premium_expire_date__gt=now
+                ).values('membership_plan__name').annotate(
+                    value=Count('id')
+                ).order_by('membership_plan__monthly_price')
+            ]
 
             # 获取支付渠道分布数据
             payment_channels_data = MembershipOrder.objects.filter(
@@ -215,7 +155,7 @@ class FeedbackIndexView(APIView):
                 })
 
             # 获取最近10个订单
-            recent_orders = MembershipOrder.objects.all().order_by(
+            recent_orders = MembershipOrder.objects.select_related('user').order_by(
                 '-created_at')[:10]
 
             # 准备返回数据
@@ -0,0 +1,161 @@
+"""
+协作连接权限缓存模块
+
+WebSocket 连接时需要确认用户是否为高级会员、是否有权访问设计。
+本模块用一条查询同时取出用户的会员计划和设计的作者/分享状态，并按
+(user_id, design_id) 做短时缓存，避免部署后的重连风暴反复查询数据库。
+
+缓存失效：
+- 设计保存或删除（包括分享/取消分享）时递增该设计的版本号
+- 用户资料保存（会员状态、会员计划变化）时递增该用户的版本号
+缓存值中记录写入时的版本号，读取时版本不一致即视为失效。会员到期不会触发任何写入
+（到期由 expire_memberships 命令批量处理），因此缓存值还记录会员的到期时间，
+读取时已经到期的缓存同样视为失效。
+缓存和版本号保存在多个进程共享的缓存中（见 utils.get_shared_cache）。
+"""
+
+import logging
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import F, Subquery
+from django.utils import timezone
+
+from .utils import get_shared_cache
+
+logger = logging.getLogger('django.channels')
+
+# 高级会员计划名称（只有高级会员可以发起协作）
+PREMIUM_PLAN_NAME = '高级会员'
+
+DEFAULT_ACCESS_CACHE_TTL = 60
+
+
+def _design_version_key(design_id):
+    return f'collab_access:design_version:{design_id}'
+
+
+def _user_version_key(user_id):
+    return f'collab_access:user_version:{user_id}'
+
+
+def _access_key(user_id, design_id):
+    return f'collab_access:{user_id}:{design_id}'
+
+
+def _load_access(user_id, design_id, now):
+    """
+    一次查询加载协作权限，并返回高级会员的有效期
+
+    会员是否有效与 membership.MembershipStatus 的规则一致：当前计划已到期且有待生效的
+    计划时按待生效计划判断，计划为高级会员且到期时间晚于当前时间才有效。
+
+    返回:
+        tuple: (权限字典, 高级会员到期时间；不是有效的高级会员时为 None)
+    """
+    from .models import Design
+
+    design = Design.objects.filter(id=design_id)
+    row = User.objects.filter(id=user_id).annotate(
+        plan_name=F('profile__membership_plan__name'),
+        membership_active=F('profile__is_premium'),
+        expire_date=F('profile__premium_expire_date'),
+        pending_plan_name=F('profile__pending_membership_plan__name'),
+        pending_expire_date=F('profile__pending_membership_expire_date'),
+        design_author_id=Subquery(design.values('author_id')[:1]),
+        design_is_shared=Subquery(design.values('is_shared')[:1]),
+    ).values('plan_name', 'membership_active', 'expire_date', 'pending_plan_name', 'pending_expire_date',
+             'design_author_id', 'design_is_shared').first()
+
+    if row is None:
+        return {'is_premium': False, 'has_access': False, 'is_owner': False}, None
+
+    plan_name, expire_date = row['plan_name'], row['expire_date']
+    if (row['membership_active'] and expire_date is not None and expire_date <= now
+            and row['pending_plan_name'] is not None):
+        # 当前计划已到期，待生效的计划接续
+        plan_name, expire_date = row['pending_plan_name'], row['pending_expire_date']
+    premium_until = expire_date if (
+        row['membership_active'] and plan_name == PREMIUM_PLAN_NAME
+        and expire_date is not None and expire_date > now) else None
+
+    is_owner = row['design_author_id'] is not None and row['design_author_id'] == user_id
+    return {
+        'is_premium': premium_until is not None,
+        'has_access': is_owner or bool(row['design_is_shared']),
+        'is_owner': is_owner,
+    }, premium_until
+
+
+def load_collaboration_access(user_id, design_id):
+    """
+    一次查询加载用户的会员计划和设计的访问信息（不使用缓存）
+
+    返回:
+        dict: {'is_premium', 'has_access', 'is_owner'}
+    """
+    return _load_access(user_id, design_id, timezone.now())[0]
+
+
+def get_collaboration_access(user_id, design_id):
+    """
+    获取协作连接权限，优先读取缓存（同步方法，需在线程中调用）
+
+    参数:
+        user_id: 用户ID
+        design_id: 设计ID（来自URL，可能不是合法的整数）
+
+    返回:
+        dict: {'is_premium', 'has_access', 'is_owner'}
+    """
+    try:
+        design_id = int(design_id)
+    except (TypeError, ValueError):
+        return {'is_premium': False, 'has_access': False, 'is_owner': False}
+
+    now = timezone.now()
+    access_key = _access_key(user_id, design_id)
+    version_keys = (_user_version_key(user_id), _design_version_key(design_id))
+    cache = get_shared_cache()
+    try:
+        cached = cache.get_many((access_key,) + version_keys)
+    except Exception as e:
+        logger.error(f"读取协作权限缓存失败: {str(e)}")
+        return load_collaboration_access(user_id, design_id)
+
+    versions = [cached.get(key, 0) for key in version_keys]
+    entry = cached.get(access_key)
+    if entry is not None and entry['versions'] == versions:
+        # 缓存时仍有效的高级会员已经到期
+        premium_until = entry.get('premium_until')
+        if premium_until is None or premium_until > now:
+            return entry['access']
+
+    access, premium_until = _load_access(user_id, design_id, now)
+    ttl = getattr(settings, 'COLLABORATION_ACCESS_CACHE_TTL', DEFAULT_ACCESS_CACHE_TTL)
+    try:
+        cache.set(access_key, {'versions': versions, 'access': access, 'premium_until': premium_until}, ttl)
+    except Exception as e:
+        logger.error(f"写入协作权限缓存失败: {str(e)}")
+    return access
+
+
+def _bump_version(key):
+    cache = get_shared_cache()
+    try:
+        # incr 在键不存在时会抛出 ValueError，此时初始化为 1
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+    except Exception as e:
+        logger.error(f"更新协作权限缓存版本失败: {key}, 错误: {str(e)}")
+
+
+def invalidate_design_access(design_id):
+    """使某个设计的所有协作权限缓存失效"""
+    _bump_version(_design_version_key(design_id))
+
+
+def invalidate_user_access(user_id):
+    """使某个用户的所有协作权限缓存失效"""
+    _bump_version(_user_version_key(user_id))
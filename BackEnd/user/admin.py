@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Design, DesignLike, MembershipOrder, PasswordResetToken, UserProfile, MembershipPlan, CustomObstacle
+from .models import Design, DesignLike, MembershipOrder, PasswordResetToken, UserProfile, MembershipPlan, CustomObstacle, RenderJob, StoredBlob
 from django.contrib.auth.models import User
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin, GroupAdmin
 from django.contrib.auth.models import Group
@@ -9,6 +9,7 @@ from django.urls import reverse
 from django.utils.safestring import mark_safe
 import json
 from django.contrib.admin import SimpleListFilter
+from .design_summary import index_design_file
 
 admin.site.site_header = '用户中心'
 admin.site.site_title = '用户中心'
@@ -120,11 +121,14 @@ admin.site.register(User, CustomUserAdmin)
 @admin.register(Design)
 class DesignAdmin(admin.ModelAdmin):
     # 列表显示字段
-    list_display = ('title', 'author', 'display_image', 'create_time',
-                    'update_time', 'download_button', 'export_button')
+    list_display = ('title', 'author', 'display_image', 'obstacle_count', 'path_length',
+                    'create_time', 'update_time', 'download_button', 'export_button')
     list_filter = ('author',)
     search_fields = ('title', 'author__username')
-    readonly_fields = ('create_time', 'update_time',
+    # 设计文档通过设计文件上传，摘要由文档生成（见 user.design_summary）
+    exclude = ('document',)
+    readonly_fields = ('create_time', 'update_time', 'document_hash', 'obstacle_count',
+                       'field_width', 'field_height', 'path_length', 'obstacle_types',
                        'display_image', 'download_button', 'export_button')
 
     list_display_links = None
@@ -176,7 +180,8 @@ class DesignAdmin(admin.ModelAdmin):
 
     def get_queryset(self, request):
         """限制用户只能看到自己的设计图"""
-        qs = super().get_queryset(request)
+        # 设计文档只在需要重新生成设计文件时才加载
+        qs = super().get_queryset(request).defer('document')
         if request.user.is_superuser:
             return qs
         return qs.filter(author=request.user)
@@ -186,6 +191,9 @@ class DesignAdmin(admin.ModelAdmin):
         if not change:  # 只在创建新记录时设置作者
             obj.author = request.user
         super().save_model(request, obj, form, change)
+        # 上传了新的设计文件时重新解析文档和摘要
+        if 'download' in form.changed_data:
+            index_design_file(obj)
 
     def has_change_permission(self, request, obj=None):
         """只允许作者修改自己的设计图"""
@@ -509,3 +517,23 @@ class MembershipOrderAdmin(admin.ModelAdmin):
     list_filter = ('status', 'user')
     search_fields = ('user__username', 'order_id', 'membership_plan__name')
     ordering = ('-payment_time',)
+
+
+@admin.register(RenderJob)
+class RenderJobAdmin(admin.ModelAdmin):
+    list_display = ('job_id', 'design', 'file_format', 'dpi', 'status',
+                    'attempts', 'created_at', 'finished_at')
+    list_filter = ('status', 'file_format')
+    search_fields = ('job_id', 'design__title', 'source_hash')
+    raw_id_fields = ('design', 'requested_by')
+    readonly_fields = ('job_id', 'source_hash', 'result', 'error', 'attempts',
+                       'created_at', 'started_at', 'finished_at')
+    ordering = ('-created_at',)
+
+
+@admin.register(StoredBlob)
+class StoredBlobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'size', 'ref_count', 'created_at', 'last_saved_at')
+    search_fields = ('name', 'digest')
+    readonly_fields = ('name', 'digest', 'size', 'ref_count', 'created_at', 'last_saved_at')
+    ordering = ('-created_at',)
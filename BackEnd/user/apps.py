@@ -5,3 +5,7 @@ class UserConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'user'
     verbose_name = '用户管理'
+
+    def ready(self):
+        # 注册信号处理函数
+        from . import signals  # noqa: F401
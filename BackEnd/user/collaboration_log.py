@@ -0,0 +1,135 @@
+"""
+协作结构化日志模块
+
+WebSocket 消费者的日志按事件记录，替代原先每条消息都在 INFO 级别输出
+完整消息体和会话字典的做法：
+- 事件格式为 event=<名称> design=<设计ID> key=value ...，只在确定输出时才格式化
+- 按事件类型采样，高频事件（收到/转发消息）默认只记录一小部分，
+  WARNING 及以上级别不采样
+- 完整的消息体和会话字典只在该会话的调试开关打开时输出
+
+调试开关保存在缓存中，多个进程共享，各进程本地缓存 DEBUG_FLAG_REFRESH 秒：
+    python manage.py collaboration_debug <design_id>
+    python manage.py collaboration_debug <design_id> --off
+
+配置（settings.py）：
+- COLLABORATION_LOG_SAMPLE_RATES: {事件名称: 采样率}，覆盖 DEFAULT_SAMPLE_RATES
+"""
+
+import json
+import logging
+import random
+import time
+
+from django.conf import settings
+
+from .utils import get_shared_cache
+
+# 默认采样率，未列出的事件全部记录
+DEFAULT_SAMPLE_RATES = {
+    'message_received': 0.01,
+    'message_relayed': 0.01,
+    'sync_request': 0.1,
+}
+
+# 调试开关在进程内的缓存时间（秒）
+DEBUG_FLAG_REFRESH = 10
+
+# 默认调试开关有效期（秒）
+DEFAULT_DEBUG_TTL = 60 * 60
+
+# 结构: {design_id: (是否开启, 检查时间)}
+_debug_flags = {}
+
+
+def _debug_key(design_id):
+    return f'collab_debug:{design_id}'
+
+
+def set_session_debug(design_id, enabled=True, ttl=DEFAULT_DEBUG_TTL):
+    """打开或关闭某个协作会话的调试日志（输出完整消息体）"""
+    if enabled:
+        get_shared_cache().set(_debug_key(design_id), True, ttl)
+    else:
+        get_shared_cache().delete(_debug_key(design_id))
+    _debug_flags.pop(str(design_id), None)
+
+
+def is_session_debug(design_id):
+    """会话的调试开关是否打开"""
+    design_id = str(design_id)
+    now = time.monotonic()
+    flag = _debug_flags.get(design_id)
+    if flag is not None and now - flag[1] < DEBUG_FLAG_REFRESH:
+        return flag[0]
+    try:
+        enabled = bool(get_shared_cache().get(_debug_key(design_id)))
+    except Exception:
+        enabled = False
+    _debug_flags[design_id] = (enabled, now)
+    return enabled
+
+
+class _Event:
+    """延迟格式化的事件消息，只有在日志真正输出时才调用 __str__"""
+
+    __slots__ = ('name', 'design_id', 'fields')
+
+    def __init__(self, name, design_id, fields):
+        self.name = name
+        self.design_id = design_id
+        self.fields = fields
+
+    def __str__(self):
+        parts = [f'event={self.name}']
+        if self.design_id is not None:
+            parts.append(f'design={self.design_id}')
+        for key, value in self.fields.items():
+            if isinstance(value, (dict, list)):
+                value = json.dumps(value, ensure_ascii=False, default=str)
+            parts.append(f'{key}={value}')
+        return ' '.join(parts)
+
+
+class CollaborationLog:
+    """
+    协作事件日志
+
+    - event(): 记录一个事件，按事件类型采样
+    - payload(): 记录完整的消息体/会话字典，仅在会话调试开关打开时输出
+    """
+
+    def __init__(self, logger):
+        self.logger = logger
+
+    def _sampled(self, name):
+        rates = getattr(settings, 'COLLABORATION_LOG_SAMPLE_RATES', None) or {}
+        rate = rates.get(name, DEFAULT_SAMPLE_RATES.get(name, 1.0))
+        return rate >= 1.0 or random.random() < rate
+
+    def event(self, name, design_id=None, level=logging.INFO, **fields):
+        """
+        记录事件
+
+        参数:
+            name: 事件名称，同时作为采样的依据
+            design_id: 设计ID
+            level: 日志级别，WARNING 及以上不采样
+            fields: 附加字段
+        """
+        if not self.logger.isEnabledFor(level):
+            return
+        if level < logging.WARNING and not self._sampled(name):
+            return
+        self.logger.log(level, '%s', _Event(name, design_id, fields),
+                        extra={'event': name, 'design_id': design_id}, stacklevel=2)
+
+    def payload(self, name, design_id, **fields):
+        """会话调试开关打开时，在 INFO 级别输出包含完整数据的事件"""
+        if not self.logger.isEnabledFor(logging.INFO) or not is_session_debug(design_id):
+            return
+        self.logger.info('%s', _Event(name, design_id, fields),
+                         extra={'event': name, 'design_id': design_id}, stacklevel=2)
+
+
+collab_log = CollaborationLog(logging.getLogger('django.channels'))
@@ -0,0 +1,498 @@
+"""
+协作消息紧凑编码模块（WebSocket 子协议 equestrian.compact.v1）
+
+默认的JSON消息包含ISO时间戳、senderName 以及完整的障碍物对象，即使只改了
+position 或 rotation。客户端在建立连接时声明子协议 equestrian.compact.v1 后，
+编辑操作和光标消息改用二进制帧传输：
+- 只传输发生变化的字段，字段名使用固定的字段编号
+- 时间戳为整数毫秒
+- 障碍物ID和协作者使用本连接内的数字索引，首次出现时附带定义
+
+其余消息（join、session_update、sync_response、error 等）仍然是JSON文本帧。
+服务器在收发两端做转换，紧凑客户端和JSON客户端可以在同一个会话中协作。
+
+帧格式（整数均为无符号LEB128变长整数）：
+    opcode   1字节，消息类型编号，见 OPCODES
+    flags    1字节，FLAG_SEQ / FLAG_SENDER / FLAG_TARGET
+    seq      [FLAG_SEQ] 文档操作序号
+    time     毫秒时间戳，0 表示没有时间戳
+    sender   [FLAG_SENDER] 协作者引用
+    target   [FLAG_TARGET] 障碍物/路径ID引用
+    fields   字段表：数量 + (字段编号, 值)...
+
+cursor_batch 的 fields 之前为数量 + (sender, time, fields)... 的光标列表。
+
+引用的编码为 varint(index << 1 | 是否定义)，定义时其后紧跟字符串
+（协作者为ID和用户名，障碍物为ID）。每个方向各自维护一张索引表：
+服务器发出的索引由服务器分配，客户端发出的索引由客户端分配。
+
+增量：服务器记录本连接已发出的每个障碍物字段值，update_obstacle 只发送
+与已发出值不同的字段。客户端需要应用收到的所有帧（包括自己操作的回显）。
+"""
+
+import math
+import struct
+from datetime import datetime, timezone
+
+# WebSocket 子协议名称
+SUBPROTOCOL = 'equestrian.compact.v1'
+
+# 消息类型编号（只能追加，不能修改已有编号）
+OPCODES = {
+    'update_obstacle': 1,
+    'add_obstacle': 2,
+    'remove_obstacle': 3,
+    'update_path': 4,
+    'cursor_move': 5,
+    'cursor_batch': 6,
+}
+OPCODE_TYPES = {opcode: message_type for message_type, opcode in OPCODES.items()}
+
+# 可以使用紧凑编码的消息类型
+COMPACT_MESSAGE_TYPES = frozenset(OPCODES)
+
+# 字段名表，字段编号为下标 + 1，编号 0 表示其后跟随字段名字符串
+# （只能追加，不能修改已有顺序）
+FIELD_NAMES = (
+    'id', 'type', 'position', 'x', 'y', 'numberPosition', 'rotation', 'poles',
+    'number', 'height', 'width', 'color', 'spacing', 'wallProperties',
+    'liverpoolProperties', 'waterProperties', 'decorationProperties', 'customId',
+    'texture', 'waterDepth', 'waterColor', 'hasRail', 'railHeight', 'depth',
+    'borderColor', 'borderWidth', 'category', 'secondaryColor', 'svgData',
+    'imageUrl', 'text', 'textColor', 'trunkHeight', 'trunkWidth', 'foliageRadius',
+    'scale', 'showDirectionArrow', 'points', 'visible', 'startPoint', 'endPoint',
+    'controlPoint1', 'controlPoint2', 'isControlPoint1Moved', 'isControlPoint2Moved',
+)
+FIELD_IDS = {name: index + 1 for index, name in enumerate(FIELD_NAMES)}
+
+FLAG_SEQ = 0x01
+FLAG_SENDER = 0x02
+FLAG_TARGET = 0x04
+
+# 值类型标记
+TAG_NONE = 0
+TAG_FALSE = 1
+TAG_TRUE = 2
+TAG_INT = 3
+TAG_FLOAT32 = 4
+TAG_FLOAT64 = 5
+TAG_STR = 6
+TAG_LIST = 7
+TAG_DICT = 8
+
+# 嵌套深度上限，防止恶意数据导致递归过深
+MAX_DEPTH = 32
+
+_MISSING = object()
+_FLOAT32 = struct.Struct('<f')
+_FLOAT64 = struct.Struct('<d')
+
+
+class CompactProtocolError(ValueError):
+    """紧凑编码数据无效"""
+
+
+# ---------------------------------------------------------------------------
+# 基础编码
+# ---------------------------------------------------------------------------
+
+def _write_varint(out, value):
+    if value < 0:
+        raise CompactProtocolError(f'varint 不能为负数: {value}')
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return
+
+
+def _write_str(out, value):
+    data = value.encode('utf-8')
+    _write_varint(out, len(data))
+    out += data
+
+
+def _write_key(out, key):
+    field_id = FIELD_IDS.get(key)
+    if field_id is not None:
+        _write_varint(out, field_id)
+    else:
+        _write_varint(out, 0)
+        _write_str(out, str(key))
+
+
+def _fits_float32(value):
+    """判断浮点数能否被 float32 精确表示"""
+    if not math.isfinite(value) or abs(value) > 3.4e38:
+        return False
+    return _FLOAT32.unpack(_FLOAT32.pack(value))[0] == value
+
+
+def _write_value(out, value, depth=0):
+    if depth > MAX_DEPTH:
+        raise CompactProtocolError('嵌套层级过深')
+    if value is None:
+        out.append(TAG_NONE)
+    elif value is True:
+        out.append(TAG_TRUE)
+    elif value is False:
+        out.append(TAG_FALSE)
+    elif isinstance(value, int):
+        out.append(TAG_INT)
+        # zigzag 编码，使小的负数也只占用很少的字节
+        _write_varint(out, value * 2 if value >= 0 else -value * 2 - 1)
+    elif isinstance(value, float):
+        if value.is_integer() and abs(value) < 2 ** 53:
+            _write_value(out, int(value), depth)
+        elif _fits_float32(value):
+            # 只有能被 float32 精确表示时才使用 float32，保证两种客户端看到的值一致
+            out.append(TAG_FLOAT32)
+            out += _FLOAT32.pack(value)
+        else:
+            out.append(TAG_FLOAT64)
+            out += _FLOAT64.pack(value)
+    elif isinstance(value, str):
+        out.append(TAG_STR)
+        _write_str(out, value)
+    elif isinstance(value, (list, tuple)):
+        out.append(TAG_LIST)
+        _write_varint(out, len(value))
+        for item in value:
+            _write_value(out, item, depth + 1)
+    elif isinstance(value, dict):
+        out.append(TAG_DICT)
+        _write_fields(out, value, depth + 1)
+    else:
+        raise CompactProtocolError(f'不支持的值类型: {type(value).__name__}')
+
+
+def _write_fields(out, fields, depth=0):
+    _write_varint(out, len(fields))
+    for key, value in fields.items():
+        _write_key(out, key)
+        _write_value(out, value, depth)
+
+
+class _Reader:
+    """按顺序读取二进制帧"""
+
+    def __init__(self, data):
+        self.data = bytes(data)
+        self.pos = 0
+
+    def byte(self):
+        if self.pos >= len(self.data):
+            raise CompactProtocolError('数据不完整')
+        value = self.data[self.pos]
+        self.pos += 1
+        return value
+
+    def take(self, size):
+        end = self.pos + size
+        if end > len(self.data):
+            raise CompactProtocolError('数据不完整')
+        chunk = self.data[self.pos:end]
+        self.pos = end
+        return chunk
+
+    def varint(self):
+        result = 0
+        shift = 0
+        while True:
+            byte = self.byte()
+            result |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                return result
+            shift += 7
+            if shift > 63:
+                raise CompactProtocolError('varint 过长')
+
+    def str(self):
+        try:
+            return self.take(self.varint()).decode('utf-8')
+        except UnicodeDecodeError as e:
+            raise CompactProtocolError(f'字符串编码无效: {e}')
+
+    def key(self):
+        field_id = self.varint()
+        if field_id == 0:
+            return self.str()
+        if field_id > len(FIELD_NAMES):
+            raise CompactProtocolError(f'未知的字段编号: {field_id}')
+        return FIELD_NAMES[field_id - 1]
+
+    def value(self, depth=0):
+        if depth > MAX_DEPTH:
+            raise CompactProtocolError('嵌套层级过深')
+        tag = self.byte()
+        if tag == TAG_NONE:
+            return None
+        if tag == TAG_FALSE:
+            return False
+        if tag == TAG_TRUE:
+            return True
+        if tag == TAG_INT:
+            value = self.varint()
+            return value >> 1 if not value & 1 else -((value + 1) >> 1)
+        if tag == TAG_FLOAT32:
+            return _FLOAT32.unpack(self.take(4))[0]
+        if tag == TAG_FLOAT64:
+            return _FLOAT64.unpack(self.take(8))[0]
+        if tag == TAG_STR:
+            return self.str()
+        if tag == TAG_LIST:
+            return [self.value(depth + 1) for _ in range(self.varint())]
+        if tag == TAG_DICT:
+            return self.fields(depth + 1)
+        raise CompactProtocolError(f'未知的值类型标记: {tag}')
+
+    def fields(self, depth=0):
+        result = {}
+        for _ in range(self.varint()):
+            key = self.key()
+            result[key] = self.value(depth)
+        return result
+
+    def done(self):
+        if self.pos != len(self.data):
+            raise CompactProtocolError('帧末尾有多余数据')
+
+
+# ---------------------------------------------------------------------------
+# 时间戳转换
+# ---------------------------------------------------------------------------
+
+def timestamp_to_ms(value):
+    """将ISO格式时间戳转换为整数毫秒，无法解析时返回 0"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return max(int(value), 0)
+    if not isinstance(value, str) or not value:
+        return 0
+    try:
+        moment = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return 0
+    # 无时区的时间戳按服务器本地时间处理（与 datetime.now().isoformat() 一致）
+    return max(int(round(moment.timestamp() * 1000)), 0)
+
+
+def ms_to_timestamp(value):
+    """将整数毫秒转换为与前端 toISOString() 一致的时间戳，0 返回 None"""
+    if not value:
+        return None
+    moment = datetime.fromtimestamp(value / 1000, tz=timezone.utc)
+    return moment.isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+
+# ---------------------------------------------------------------------------
+# 连接级编解码器
+# ---------------------------------------------------------------------------
+
+class CompactCodec:
+    """
+    单个WebSocket连接的紧凑编解码器
+
+    - encode(): 将JSON格式的消息编码为发给客户端的二进制帧
+    - decode(): 将客户端发来的二进制帧解码为JSON格式的消息
+
+    编解码器保存本连接的索引表和已发出的字段值，每个连接使用独立的实例。
+    """
+
+    def __init__(self):
+        # 服务器 -> 客户端，结构: {id: index}
+        self._out_senders = {}
+        self._out_targets = {}
+        # 已发给客户端的障碍物字段值，结构: {obstacle_id: {field: value}}
+        self._sent_state = {}
+        # 客户端 -> 服务器，结构: {index: id}
+        self._in_targets = {}
+
+    # -- 编码 ---------------------------------------------------------------
+
+    def encode(self, message):
+        """
+        编码一条消息
+
+        参数:
+            message: JSON格式的消息字典
+
+        返回:
+            bytes: 二进制帧；消息类型不支持紧凑编码时返回 None
+        """
+        message_type = message.get('type')
+        if message_type not in COMPACT_MESSAGE_TYPES:
+            return None
+        payload = message.get('payload')
+        if not isinstance(payload, dict):
+            payload = {}
+
+        if message_type == 'cursor_batch':
+            return self._encode_cursor_batch(message, payload)
+
+        target, fields = self._outgoing_fields(message_type, payload)
+        if fields is None:
+            return None
+
+        flags = 0
+        seq = message.get('seq')
+        if isinstance(seq, int) and not isinstance(seq, bool) and seq >= 0:
+            flags |= FLAG_SEQ
+        sender_id = message.get('senderId')
+        if sender_id is not None:
+            flags |= FLAG_SENDER
+        if target is not None:
+            flags |= FLAG_TARGET
+
+        out = bytearray((OPCODES[message_type], flags))
+        if flags & FLAG_SEQ:
+            _write_varint(out, seq)
+        _write_varint(out, timestamp_to_ms(message.get('timestamp')))
+        if flags & FLAG_SENDER:
+            self._write_sender(out, sender_id, message.get('senderName'))
+        if flags & FLAG_TARGET:
+            self._write_target(out, target)
+        _write_fields(out, fields)
+        return bytes(out)
+
+    def _outgoing_fields(self, message_type, payload):
+        """返回 (目标ID, 需要发送的字段)，数据不完整时字段为 None"""
+        if message_type == 'update_obstacle':
+            obstacle_id = payload.get('obstacleId')
+            if obstacle_id is None:
+                return None, None
+            obstacle_id = str(obstacle_id)
+            updates = payload.get('updates')
+            if not isinstance(updates, dict):
+                updates = {}
+            state = self._sent_state.setdefault(obstacle_id, {})
+            delta = {
+                key: value for key, value in updates.items()
+                if state.get(key, _MISSING) != value
+            }
+            state.update(updates)
+            return obstacle_id, delta
+        if message_type == 'add_obstacle':
+            if payload.get('id') is None:
+                return None, None
+            obstacle_id = str(payload['id'])
+            fields = {key: value for key, value in payload.items() if key != 'id'}
+            self._sent_state[obstacle_id] = dict(fields)
+            return obstacle_id, fields
+        if message_type == 'remove_obstacle':
+            if payload.get('obstacleId') is None:
+                return None, None
+            obstacle_id = str(payload['obstacleId'])
+            self._sent_state.pop(obstacle_id, None)
+            return obstacle_id, {}
+        if message_type == 'update_path':
+            path_id = payload.get('pathId')
+            updates = payload.get('updates')
+            return (str(path_id) if path_id is not None else None,
+                    updates if isinstance(updates, dict) else {})
+        # cursor_move
+        return None, payload
+
+    def _encode_cursor_batch(self, message, payload):
+        cursors = payload.get('cursors') or []
+        out = bytearray((OPCODES['cursor_batch'], 0))
+        _write_varint(out, timestamp_to_ms(message.get('timestamp')))
+        _write_varint(out, len(cursors))
+        for cursor in cursors:
+            self._write_sender(out, cursor.get('senderId'), cursor.get('senderName'))
+            _write_varint(out, timestamp_to_ms(cursor.get('timestamp')))
+            position = cursor.get('payload')
+            _write_fields(out, position if isinstance(position, dict) else {})
+        return bytes(out)
+
+    def _write_sender(self, out, sender_id, sender_name):
+        sender_id = str(sender_id)
+        index = self._out_senders.get(sender_id)
+        if index is not None:
+            _write_varint(out, index << 1)
+            return
+        index = len(self._out_senders)
+        self._out_senders[sender_id] = index
+        _write_varint(out, index << 1 | 1)
+        _write_str(out, sender_id)
+        _write_str(out, str(sender_name or ''))
+
+    def _write_target(self, out, target_id):
+        index = self._out_targets.get(target_id)
+        if index is not None:
+            _write_varint(out, index << 1)
+            return
+        index = len(self._out_targets)
+        self._out_targets[target_id] = index
+        _write_varint(out, index << 1 | 1)
+        _write_str(out, target_id)
+
+    # -- 解码 ---------------------------------------------------------------
+
+    def decode(self, data):
+        """
+        解码客户端发来的二进制帧
+
+        客户端帧中的协作者引用会被忽略，发送者由服务器根据连接填写。
+
+        参数:
+            data: 二进制帧
+
+        返回:
+            dict: JSON格式的消息（不含 senderId / senderName）
+
+        异常:
+            CompactProtocolError: 数据无效
+        """
+        reader = _Reader(data)
+        message_type = OPCODE_TYPES.get(reader.byte())
+        if message_type is None or message_type == 'cursor_batch':
+            raise CompactProtocolError('不支持的消息类型')
+        flags = reader.byte()
+        message = {'type': message_type}
+        if flags & FLAG_SEQ:
+            reader.varint()
+        timestamp = ms_to_timestamp(reader.varint())
+        if timestamp is not None:
+            message['timestamp'] = timestamp
+        if flags & FLAG_SENDER:
+            self._read_sender(reader)
+        target = self._read_target(reader) if flags & FLAG_TARGET else None
+        fields = reader.fields()
+        reader.done()
+
+        if message_type in ('update_obstacle', 'add_obstacle', 'remove_obstacle') and target is None:
+            raise CompactProtocolError(f'{message_type} 缺少障碍物ID')
+        if message_type == 'update_obstacle':
+            message['payload'] = {'obstacleId': target, 'updates': fields}
+        elif message_type == 'add_obstacle':
+            message['payload'] = dict(fields, id=target)
+        elif message_type == 'remove_obstacle':
+            message['payload'] = {'obstacleId': target}
+        elif message_type == 'update_path':
+            message['payload'] = {'updates': fields}
+            if target is not None:
+                message['payload']['pathId'] = target
+        else:
+            message['payload'] = fields
+        return message
+
+    @staticmethod
+    def _read_sender(reader):
+        if reader.varint() & 1:
+            reader.str()
+            reader.str()
+
+    def _read_target(self, reader):
+        ref = reader.varint()
+        index = ref >> 1
+        if ref & 1:
+            target_id = reader.str()
+            self._in_targets[index] = target_id
+            return target_id
+        try:
+            return self._in_targets[index]
+        except KeyError:
+            raise CompactProtocolError(f'未定义的索引: {index}')
@@ -7,7 +7,13 @@
 - 处理用户加入和离开协作会话
 - 转发协作消息（障碍物更新、路径更新、光标移动等）
 - 维护协作会话状态和协作者列表
-- 支持通过链接加入协作（无需认证）
+- 维护会话的权威设计文档和操作日志，支持断线重连后的增量同步
+- 将协作编辑合并后延迟写回设计记录
+- 定期刷新在线状态，清理没有正常断开的协作者
+- 支持通过链接加入协作（同样需要登录并有权访问设计）
+- 支持紧凑二进制子协议（equestrian.compact.v1），与JSON客户端共享会话
+
+另有 OrderStatusConsumer，向支付页面推送会员订单的支付状态；RenderJobConsumer 推送设计图渲染任务的状态。
 """
 
 import json  # 用于JSON数据的序列化和反序列化
@@ -16,54 +22,43 @@ import json  # 用于JSON数据的序列化和反序列化
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async  # 用于在异步环境中执行同步数据库操作
 from django.contrib.auth.models import User  # Django用户模型
-import uuid  # 用于生成唯一标识符
 from datetime import datetime  # 用于处理日期和时间
 import logging  # 用于日志记录
 import traceback  # 用于异常跟踪
 import asyncio  # 用于异步IO操作
+import zlib  # 用于计算稳定的哈希值
+import time  # 用于在线状态时间戳
+from .session_store import get_session_store  # 协作会话共享存储
+from .design_document import DOCUMENT_OPERATIONS, load_design_document  # 设计文档操作
+from .cursor_aggregator import publish_cursor  # 光标移动合并广播
+from .message_encoding import broadcast_event, encode_message  # 广播消息只编码一次
+from .access_cache import get_collaboration_access  # 协作连接权限缓存
+from .design_persistence import get_design_writer  # 设计文档延迟写回
+from .presence import get_presence_reaper, get_activity_write_interval  # 在线状态心跳和清理
+from .collaboration_log import collab_log  # 结构化、按事件采样的日志
+from .compact_protocol import (  # 紧凑二进制编码子协议
+    SUBPROTOCOL, COMPACT_MESSAGE_TYPES, CompactCodec, CompactProtocolError)
+from .models import MembershipOrder  # 会员订单
+from .order_reconciler import order_group_name, order_status_event  # 订单状态推送
+from .render_jobs import job_group_name, job_status_event, visible_jobs  # 渲染任务状态推送
 
 # 设置日志记录器
 logger = logging.getLogger('django.channels')
 
-# 全局字典，用于存储所有活跃的协作会话
-# 结构: {design_id: {session_info}}
-active_sessions = {}
-
-# 添加获取用户资料的异步方法
-
-
-@database_sync_to_async
-def get_user_profile_info(user):
-    """异步获取用户资料信息"""
-    if not user or not user.is_authenticated:
-        return False
-    try:
-        profile = user.profile
-        return profile.membership_plan is not None and profile.membership_plan.name == '高级会员'
-    except Exception as e:
-        logger.error(f"获取用户资料失败: {str(e)}")
-        return False
-
 
 @database_sync_to_async
-def check_design_access(user, design_id):
+def get_connect_access(user, design_id):
     """
-    检查用户是否有权访问该设计
-    返回: (has_access, is_owner)
+    获取用户发起/加入协作的权限（一次查询，带短时缓存）
+    返回: {'is_premium', 'has_access', 'is_owner'}
     """
-    from .models import Design
     if not user or not user.is_authenticated:
-        return False, False
+        return {'is_premium': False, 'has_access': False, 'is_owner': False}
     try:
-        design = Design.objects.get(id=design_id)
-        is_owner = design.author_id == user.id
-        has_access = is_owner or design.is_shared
-        return has_access, is_owner
-    except Design.DoesNotExist:
-        return False, False
+        return get_collaboration_access(user.id, design_id)
     except Exception as e:
-        logger.error(f"检查设计访问权限失败: {str(e)}")
-        return False, False
+        logger.error(f"检查协作权限失败: {str(e)}")
+        return {'is_premium': False, 'has_access': False, 'is_owner': False}
 
 
 class CollaborationConsumer(AsyncWebsocketConsumer):
@@ -76,9 +71,14 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
     - 协作会话状态管理
     - 协作者信息管理
 
-    该类支持认证用户和匿名用户（通过链接加入）的协作。
+    所有连接都需要登录并通过设计访问权限检查，之后才会加载设计文档、响应同步请求。
     """
 
+    # 连接是否已通过登录和设计访问权限检查
+    authorized = False
+    # 是否可以编辑设计：设计作者，或不是通过链接加入（通过链接加入的协作者只能查看）
+    can_edit = False
+
     async def connect(self):
         """
         处理WebSocket连接请求
@@ -92,8 +92,19 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
             self.design_id = self.scope['url_route']['kwargs']['design_id']
             self.room_group_name = f'collaboration_{self.design_id}'
             self.user = self.scope.get('user', None)
-
-            logger.info(f'信息:{self.scope}')
+            self.session_store = get_session_store()
+            self.design_writer = get_design_writer()
+            self.presence = get_presence_reaper()
+            # 最近一次写入 last_active 的时间（time.monotonic()）
+            self._activity_written_at = 0
+
+            # 客户端声明了紧凑编码子协议时，编辑操作和光标消息使用二进制帧
+            if SUBPROTOCOL in self.scope.get('subprotocols', []):
+                self.subprotocol = SUBPROTOCOL
+                self.compact_codec = CompactCodec()
+            else:
+                self.subprotocol = None
+                self.compact_codec = None
 
             # 2. 检查是否通过链接加入
             query_string = self.scope.get('query_string', b'').decode('utf-8')
@@ -101,50 +112,41 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
             self.is_via_link = 'via_link=true' in query_string
 
             # 3. 记录连接信息
-            client = self.scope.get('client', ['-', '-'])
-            logger.info(
-                f"WebSocket连接请求 - 设计ID: {self.design_id}, 客户端: {client[0]}:{client[1]}")
-            logger.info(
-                f"连接信息 - 用户: {self.user.username if self.user else 'Anonymous'}, 通过链接加入: {self.is_via_link}")
-
-            # 4. 权限检查
-            if not self.is_via_link and self.user and self.user.is_authenticated:
-                # 检查用户是否是高级会员
-                if not await get_user_profile_info(self.user):
-                    logger.warning(f"用户 {self.user.username} 不是高级会员，无法创建会话")
-                    await self.accept()
-                    await self.send(text_data=json.dumps({
-                        'type': 'error',
-                        'message': '只有高级会员才能创建协作会话',
-                        'timestamp': datetime.now().isoformat()
-                    }))
-                    await self.close(code=4003)
-                    return
+            client = self.scope.get('client') or ['-', '-']
+            collab_log.event(
+                'connect', self.design_id,
+                client=f'{client[0]}:{client[1]}',
+                user=self.user.username if self.user else 'Anonymous',
+                via_link=self.is_via_link,
+                compact=self.subprotocol is not None)
+
+            # 4. 权限检查：通过检查之前不加载、不返回设计文档
+            if not self.user or not self.user.is_authenticated:
+                logger.warning(f"未登录的连接尝试加入协作: {self.design_id}")
+                await self._reject('请先登录后再加入协作', 4001)
+                return
 
-                # 检查设计访问权限
-                has_access, is_owner = await check_design_access(self.user, self.design_id)
-                if not has_access:
-                    logger.warning(f"用户 {self.user.username} 没有权限访问设计 {self.design_id}")
-                    await self.accept()
-                    await self.send(text_data=json.dumps({
-                        'type': 'error',
-                        'message': '您没有权限访问此设计',
-                        'timestamp': datetime.now().isoformat()
-                    }))
-                    await self.close(code=4004)
-                    return
+            access = await get_connect_access(self.user, self.design_id)
 
-                # 只有设计作者才能创建新的协作会话
-                if self.design_id not in active_sessions and not is_owner:
-                    logger.warning(f"用户 {self.user.username} 尝试为非自己的设计创建协作会话")
-                    await self.accept()
-                    await self.send(text_data=json.dumps({
-                        'type': 'error',
-                        'message': '只有设计作者才能发起协作',
-                        'timestamp': datetime.now().isoformat()
-                    }))
-                    await self.close(code=4005)
-                    return
+            # 检查用户是否是高级会员（通过链接加入的协作者不要求）
+            if not self.is_via_link and not access['is_premium']:
+                logger.warning(f"用户 {self.user.username} 不是高级会员，无法创建会话")
+                await self._reject('只有高级会员才能创建协作会话', 4003)
+                return
+
+            # 检查设计访问权限（通过链接加入同样检查：只能加入自己的或已分享的设计）
+            if not access['has_access']:
+                logger.warning(f"用户 {self.user.username} 没有权限访问设计 {self.design_id}")
+                await self._reject('您没有权限访问此设计', 4004)
+                return
+
+            # 只有设计作者才能创建新的协作会话
+            if not access['is_owner'] and not await self.session_store.session_exists(self.design_id):
+                logger.warning(f"用户 {self.user.username} 尝试为非自己的设计创建协作会话")
+                await self._reject('只有设计作者才能发起协作', 4005)
+                return
+            self.authorized = True
+            self.can_edit = access['is_owner'] or not self.is_via_link
 
             # 5. 加入房间组
             await self.channel_layer.group_add(
@@ -153,20 +155,10 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
             )
 
             # 6. 初始化或获取会话
-            if self.design_id not in active_sessions:
-                logger.info(f"创建新的会话: {self.design_id}")
-                active_sessions[self.design_id] = {
-                    'id': str(uuid.uuid4()),
-                    'design_id': self.design_id,
-                    'collaborators': [],
-                    'owner': None,
-                    'initiator': None,
-                    'created_at': datetime.now().isoformat()
-                }
-                logger.info(f"新会话创建完成: {active_sessions[self.design_id]}")
+            session = await self._ensure_session()
 
             # 7. 接受连接
-            await self.accept()
+            await self.accept(self.subprotocol)
 
             # 8. 发送连接成功消息
             await self.send(text_data=json.dumps({
@@ -174,74 +166,29 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
                 'message': '连接已建立',
                 'timestamp': datetime.now().isoformat(),
                 'design_id': self.design_id,
-                'session': {
-                    'id': active_sessions[self.design_id]['id'],
-                    'design_id': self.design_id,
-                    'collaborators': active_sessions[self.design_id]['collaborators'],
-                    'owner': active_sessions[self.design_id]['owner'],
-                    'initiator': active_sessions[self.design_id]['initiator'],
-                    'created_at': active_sessions[self.design_id]['created_at']
-                }
+                'session': session
             }))
 
-            # 9. 处理认证用户加入
-            if self.user and self.user.is_authenticated:
-                # 确定用户角色
-                user_role = 'collaborator'
-                if not self.is_via_link and not active_sessions[self.design_id]['initiator']:
-                    user_role = 'initiator'
-
-                # 创建协作者信息
-                collaborator = {
-                    'id': str(self.user.id),
-                    'username': self.user.username,
-                    'color': self._generate_color(),
-                    'role': user_role,
-                    'last_active': datetime.now().isoformat()
-                }
-
-                # 检查是否已存在
-                existing_collaborator = next(
-                    (c for c in active_sessions[self.design_id]['collaborators']
-                     if c['id'] == str(self.user.id)),
-                    None
-                )
-
-                if not existing_collaborator:
-                    # 添加新协作者
-                    active_sessions[self.design_id]['collaborators'].append(
-                        collaborator)
-
-                    # 设置所有者和发起者
-                    if not active_sessions[self.design_id]['owner']:
-                        active_sessions[self.design_id]['owner'] = str(
-                            self.user.id)
-                    if user_role == 'initiator' and not active_sessions[self.design_id]['initiator']:
-                        active_sessions[self.design_id]['initiator'] = str(
-                            self.user.id)
+            # 9. 登记协作者
+            session, user_role, is_new = await self._register_collaborator()
+            self.presence.register(self)
 
-                    # 广播加入消息
-                    await self.channel_layer.group_send(
-                        self.room_group_name,
-                        {
-                            'type': 'collaboration_message',
-                            'message': {
-                                'type': 'join',
-                                'senderId': str(self.user.id),
-                                'senderName': self.user.username,
-                                'sessionId': active_sessions[self.design_id]['id'],
-                                'timestamp': datetime.now().isoformat(),
-                                'payload': {
-                                    'session': active_sessions[self.design_id],
-                                    'user_role': user_role
-                                }
-                            }
+            if is_new:
+                # 广播加入消息
+                await self.channel_layer.group_send(
+                    self.room_group_name,
+                    broadcast_event({
+                        'type': 'join',
+                        'senderId': str(self.user.id),
+                        'senderName': self.user.username,
+                        'sessionId': session['id'],
+                        'timestamp': datetime.now().isoformat(),
+                        'payload': {
+                            'session': session,
+                            'user_role': user_role
                         }
-                    )
-                else:
-                    # 更新现有协作者的活跃时间
-                    existing_collaborator['last_active'] = datetime.now(
-                    ).isoformat()
+                    })
+                )
 
         except Exception as e:
             # 异常处理
@@ -251,7 +198,7 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
             try:
                 # 确保连接已接受
                 if not hasattr(self, 'accepted'):
-                    await self.accept()
+                    await self.accept(getattr(self, 'subprotocol', None))
 
                 # 发送错误消息
                 await self.send(text_data=json.dumps({
@@ -272,63 +219,50 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
         处理WebSocket连接断开
 
         主要步骤：
-        1. 如果用户已认证，将其从协作者列表中移除
+        1. 如果连接已通过权限检查，将用户从协作者列表中移除
         2. 广播离开消息
-        3. 如果没有剩余协作者，清理会话
+        3. 如果没有剩余协作者，清理会话（由会话存储原子完成），并立即写回设计文档
         4. 离开房间组
 
         参数:
             close_code: WebSocket关闭代码
         """
         try:
-            logger.info(
-                f"处理WebSocket断开连接: {self.design_id}, 用户: {self.user.username if self.user else 'None'}")
-
-            # 如果用户已认证，将其从协作者列表中移除
-            if self.user and self.user.is_authenticated and self.design_id in active_sessions:
-                logger.info(f"从协作者列表中移除用户: {self.user.username}")
-
-                # 记录移除前的协作者数量
-                before_count = len(
-                    active_sessions[self.design_id]['collaborators'])
-                logger.info(f"移除前的协作者数量: {before_count}")
-
-                # 移除用户（通过列表推导式过滤）
-                active_sessions[self.design_id]['collaborators'] = [
-                    c for c in active_sessions[self.design_id]['collaborators']
-                    if c['id'] != str(self.user.id)
-                ]
-
-                # 记录移除后的协作者数量
-                after_count = len(
-                    active_sessions[self.design_id]['collaborators'])
-                logger.info(f"移除后的协作者数量: {after_count}")
-
-                # 广播离开消息，包含更新后的会话信息
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'collaboration_message',
-                        'message': {
+            if hasattr(self, 'presence'):
+                self.presence.unregister(self)
+
+            # 已登记的协作者从列表中移除（被拒绝的连接没有登记）
+            if self.authorized:
+                # 移除用户，没有剩余协作者时会话会被一并删除
+                session = await self.session_store.remove_collaborator(
+                    self.design_id, str(self.user.id))
+
+                if session is not None:
+                    collab_log.event('collaborator_removed', self.design_id,
+                                     user=self.user.username,
+                                     collaborators=len(session['collaborators']))
+
+                    # 广播离开消息，包含更新后的会话信息
+                    await self.channel_layer.group_send(
+                        self.room_group_name,
+                        broadcast_event({
                             'type': 'leave',
                             'senderId': str(self.user.id),
                             'senderName': self.user.username,
-                            'sessionId': active_sessions[self.design_id]['id'],
+                            'sessionId': session['id'],
                             'timestamp': datetime.now().isoformat(),
                             'payload': {
-                                'session': active_sessions[self.design_id]
+                                'session': session
                             }
-                        }
-                    }
-                )
+                        })
+                    )
 
-                # 如果没有协作者了，清理会话
-                if not active_sessions[self.design_id]['collaborators']:
-                    logger.info(f"没有剩余协作者，清理会话: {self.design_id}")
-                    del active_sessions[self.design_id]
-                else:
-                    logger.info(
-                        f"剩余协作者: {active_sessions[self.design_id]['collaborators']}")
+                    if not session['collaborators']:
+                        collab_log.event('session_closed', self.design_id)
+                        await self.design_writer.flush(self.design_id, close=True)
+                    else:
+                        collab_log.payload('collaborators', self.design_id,
+                                           collaborators=session['collaborators'])
 
             # 离开房间组
             await self.channel_layer.group_discard(
@@ -336,12 +270,13 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
                 self.channel_name
             )
 
-            logger.info(f"WebSocket连接已断开: {self.design_id}, 代码: {close_code}")
+            collab_log.event('disconnect', self.design_id,
+                             user=self.user.username if self.user else None, code=close_code)
         except Exception as e:
             # 处理断开连接过程中的任何异常
             logger.error(f"断开连接时出错: {str(e)}", exc_info=True)
 
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         """
         接收并处理WebSocket消息
 
@@ -353,119 +288,43 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
 
         支持的消息类型：
         - join: 用户加入消息
-        - sync_request: 同步请求
+        - sync_request: 同步请求（payload.lastSeq 存在时返回增量操作或完整文档）
+        - update_obstacle/add_obstacle/remove_obstacle/update_path:
+          有编辑权限时应用到服务器文档，附加序号 seq 后转发，并安排延迟写回
+        - cursor_move: 启用合并时按房间合并后以 cursor_batch 批量广播，否则直接转发
+        - heartbeat: 刷新在线状态，不转发
         - 其他类型: 直接转发
 
+        使用紧凑子协议的客户端发送的二进制帧先转换为JSON格式的消息，再走相同的流程。
+        未通过连接权限检查（authorized）的连接发送的消息一律拒绝。
+
         参数:
             text_data: 接收到的文本数据
+            bytes_data: 接收到的二进制数据（紧凑编码）
         """
         try:
-            # 解析JSON消息
-            text_data_json = json.loads(text_data)
+            # 未通过权限检查的连接不处理任何消息（不返回文档，也不转发）
+            if not self.authorized:
+                await self._send_error('没有权限访问此协作会话')
+                return
+
+            # 解析消息
+            if bytes_data is not None:
+                text_data_json = self._decode_compact(bytes_data)
+            else:
+                text_data_json = json.loads(text_data)
             message_type = text_data_json.get('type')
-            logger.info(
-                f"收到消息类型: {message_type}, 发送者: {text_data_json.get('senderId')}")
-            logger.info(f"消息内容: {text_data_json}")
+            collab_log.event('message_received', self.design_id,
+                             type=message_type, sender=text_data_json.get('senderId'))
+            collab_log.payload('message', self.design_id, message=text_data_json)
 
             # 添加服务器时间戳
             text_data_json['server_timestamp'] = datetime.now().isoformat()
 
             # 处理加入消息
-            if message_type == 'join' and self.user and self.user.is_authenticated:
-                logger.info(f"处理加入消息: {self.user.username}")
-                logger.info(f"消息内容: {text_data_json}")
-
-                # 获取用户颜色（从消息中获取或生成新的）
-                user_color = text_data_json.get('payload', {}).get(
-                    'color', self._generate_color())
-                logger.info(f"用户颜色: {user_color}")
-
-                # 确定用户角色
-                user_role = 'collaborator'  # 默认为协作者
-                if not self.is_via_link and not active_sessions[self.design_id]['initiator']:
-                    user_role = 'initiator'  # 如果不是通过链接加入且没有发起者，则设为发起者
-
-                # 创建协作者信息对象
-                collaborator = {
-                    'id': str(self.user.id),
-                    'username': self.user.username,
-                    'color': user_color,
-                    'role': user_role,
-                    'last_active': datetime.now().isoformat()
-                }
-                logger.info(f"创建协作者信息: {collaborator}")
-
+            if message_type == 'join':
                 # 检查会话是否存在
-                if self.design_id in active_sessions:
-                    logger.info(f"会话存在: {self.design_id}")
-                    # 检查用户是否已经在协作者列表中
-                    existing_collaborator = next(
-                        (c for c in active_sessions[self.design_id]['collaborators']
-                         if c['id'] == collaborator['id']),
-                        None
-                    )
-
-                    if not existing_collaborator:
-                        # 如果用户不在协作者列表中，添加新协作者
-                        logger.info(f"添加新协作者: {collaborator}")
-                        active_sessions[self.design_id]['collaborators'].append(
-                            collaborator)
-                        logger.info(
-                            f"协作者列表更新后: {active_sessions[self.design_id]['collaborators']}")
-
-                        # 如果是第一个加入的用户，设置为所有者
-                        if not active_sessions[self.design_id]['owner']:
-                            logger.info(f"设置会话所有者: {self.user.username}")
-                            active_sessions[self.design_id]['owner'] = str(
-                                self.user.id)
-
-                        # 如果是发起者角色且没有设置发起者，则设置发起者
-                        if user_role == 'initiator' and not active_sessions[self.design_id]['initiator']:
-                            logger.info(f"设置会话发起者: {self.user.username}")
-                            active_sessions[self.design_id]['initiator'] = str(
-                                self.user.id)
-                    else:
-                        # 如果用户已在协作者列表中，更新信息
-                        logger.info(f"更新现有协作者: {self.user.username}")
-                        existing_collaborator['last_active'] = datetime.now(
-                        ).isoformat()
-                        existing_collaborator['color'] = collaborator['color']
-                        logger.info(f"更新后的协作者信息: {existing_collaborator}")
-
-                    logger.info(
-                        f"当前协作者列表: {active_sessions[self.design_id]['collaborators']}")
-                    logger.info(
-                        f"当前协作者数量: {len(active_sessions[self.design_id]['collaborators'])}")
-
-                    # 构建加入消息
-                    join_message = {
-                        'type': 'join',
-                        'senderId': str(self.user.id),
-                        'senderName': self.user.username,
-                        'sessionId': active_sessions[self.design_id]['id'],
-                        'timestamp': datetime.now().isoformat(),
-                        'payload': {
-                            'session': active_sessions[self.design_id],
-                            'user_role': user_role  # 添加用户角色信息
-                        }
-                    }
-                    logger.info(f"构建加入消息: {join_message}")
-
-                    # 广播更新后的会话信息
-                    await self.channel_layer.group_send(
-                        self.room_group_name,
-                        {
-                            'type': 'collaboration_message',
-                            'message': join_message
-                        }
-                    )
-                    logger.info("加入消息已广播")
-
-                    # 直接发送响应给当前用户
-                    await self.send(text_data=json.dumps(join_message))
-                    logger.info("已直接发送加入消息响应给当前用户")
-                    return
-                else:
+                if not await self.session_store.session_exists(self.design_id):
                     # 会话不存在，发送错误消息
                     logger.error(f"处理加入消息时会话不存在: {self.design_id}")
                     await self.send(text_data=json.dumps({
@@ -475,112 +334,122 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
                     }))
                     return
 
-            # 处理同步请求
-            elif message_type == 'sync_request' and self.design_id in active_sessions:
-                logger.info(
-                    f"处理同步请求: {self.user.username if self.user else 'Unknown'}")
-                logger.info(f"当前会话信息: {active_sessions[self.design_id]}")
-                logger.info(
-                    f"当前协作者列表: {active_sessions[self.design_id]['collaborators']}")
+                # 获取用户颜色（从消息中获取或生成新的）
+                user_color = text_data_json.get('payload', {}).get(
+                    'color', self._generate_color())
 
-                # 确保用户在协作者列表中
-                if self.user and self.user.is_authenticated:
-                    user_id = str(self.user.id)
-                    # 检查用户是否在协作者列表中
-                    existing_collaborator = next(
-                        (c for c in active_sessions[self.design_id]['collaborators']
-                         if c['id'] == user_id),
-                        None
-                    )
+                session, user_role, _ = await self._register_collaborator(color=user_color)
+                collab_log.event('join', self.design_id, user=self.user.username,
+                                 role=user_role, collaborators=len(session['collaborators']))
 
-                    # 确定用户角色
-                    user_role = 'collaborator'  # 默认为协作者
-                    if not self.is_via_link and not active_sessions[self.design_id]['initiator']:
-                        user_role = 'initiator'  # 如果不是通过链接加入且没有发起者，则设为发起者
-
-                    # 如果用户不在协作者列表中，添加用户
-                    if not existing_collaborator:
-                        logger.info(f"同步请求时添加用户到协作者列表: {self.user.username}")
-                        collaborator = {
-                            'id': user_id,
-                            'username': self.user.username,
-                            'color': self._generate_color(),
-                            'role': user_role,
-                            'last_active': datetime.now().isoformat()
-                        }
-                        active_sessions[self.design_id]['collaborators'].append(
-                            collaborator)
-
-                        # 如果是第一个加入的用户，设置为所有者
-                        if not active_sessions[self.design_id]['owner']:
-                            logger.info(f"设置会话所有者: {self.user.username}")
-                            active_sessions[self.design_id]['owner'] = user_id
-
-                        # 如果是发起者角色且没有设置发起者，则设置发起者
-                        if user_role == 'initiator' and not active_sessions[self.design_id]['initiator']:
-                            logger.info(f"设置会话发起者: {self.user.username}")
-                            active_sessions[self.design_id]['initiator'] = user_id
-                    else:
-                        # 更新用户的活跃时间
-                        existing_collaborator['last_active'] = datetime.now(
-                        ).isoformat()
+                # 构建加入消息
+                join_message = {
+                    'type': 'join',
+                    'senderId': str(self.user.id),
+                    'senderName': self.user.username,
+                    'sessionId': session['id'],
+                    'timestamp': datetime.now().isoformat(),
+                    'payload': {
+                        'session': session,
+                        'user_role': user_role  # 添加用户角色信息
+                    }
+                }
+
+                # 广播更新后的会话信息
+                event = broadcast_event(join_message)
+                await self.channel_layer.group_send(self.room_group_name, event)
+
+                # 直接发送响应给当前用户（复用已编码的文本）
+                await self.send(text_data=event['text'])
+                return
+
+            # 处理同步请求
+            elif message_type == 'sync_request' and await self.session_store.session_exists(self.design_id):
+                # 确保用户在协作者列表中
+                session, _, _ = await self._register_collaborator()
 
                 # 构建同步响应消息
                 sync_response = {
                     'type': 'sync_response',
                     'senderId': 'server',
                     'senderName': 'System',
-                    'sessionId': active_sessions[self.design_id]['id'],
+                    'sessionId': session['id'],
                     'timestamp': datetime.now().isoformat(),
                     'payload': {
-                        'session': active_sessions[self.design_id]
+                        'session': session
                     }
                 }
 
+                # 客户端提供了最后收到的序号时，附加文档同步数据
+                last_seq = (text_data_json.get('payload') or {}).get('lastSeq')
+                if isinstance(last_seq, int):
+                    sync_response['payload'].update(
+                        await self._build_document_sync(last_seq))
+
                 # 发送同步响应给请求用户
-                logger.info(f"发送同步响应: {sync_response}")
-                await self.send(text_data=json.dumps(sync_response))
+                collab_log.payload('sync_response', self.design_id, message=sync_response)
+                await self.send(text_data=encode_message(sync_response))
 
                 # 广播会话更新消息给所有用户
                 await self.channel_layer.group_send(
                     self.room_group_name,
-                    {
-                        'type': 'collaboration_message',
-                        'message': {
-                            'type': 'session_update',
-                            'senderId': 'server',
-                            'senderName': 'System',
-                            'sessionId': active_sessions[self.design_id]['id'],
-                            'timestamp': datetime.now().isoformat(),
-                            'payload': {
-                                'session': active_sessions[self.design_id]
-                            }
+                    broadcast_event({
+                        'type': 'session_update',
+                        'senderId': 'server',
+                        'senderName': 'System',
+                        'sessionId': session['id'],
+                        'timestamp': datetime.now().isoformat(),
+                        'payload': {
+                            'session': session
                         }
-                    }
+                    })
                 )
-                logger.info(
-                    f"已广播会话更新消息，当前协作者数量: {len(active_sessions[self.design_id]['collaborators'])}")
+                collab_log.event('sync_request', self.design_id,
+                                 user=self.user.username if self.user else None,
+                                 last_seq=last_seq, collaborators=len(session['collaborators']))
+                return
+
+            # 客户端心跳只刷新在线状态
+            if message_type == 'heartbeat':
+                if self.user and self.user.is_authenticated:
+                    await self.refresh_presence(time.time())
                 return
 
-            # 更新用户的最后活动时间
-            if (self.user and self.user.is_authenticated and
-                    self.design_id in active_sessions):
-                for collaborator in active_sessions[self.design_id]['collaborators']:
-                    if collaborator['id'] == str(self.user.id):
-                        collaborator['last_active'] = datetime.now(
-                        ).isoformat()
-                        break
+            # 光标移动交给聚合器合并，不逐条广播，也不逐条更新活跃时间
+            if message_type == 'cursor_move':
+                await publish_cursor(self.channel_layer, self.room_group_name, text_data_json)
+                return
+
+            # 编辑操作先应用到服务器文档，并附加序号；没有编辑权限时不应用、不转发
+            if message_type in DOCUMENT_OPERATIONS:
+                if not self.can_edit:
+                    await self._send_error('您没有编辑此设计的权限')
+                    return
+                seq = await self.session_store.apply_operation(self.design_id, text_data_json)
+                if seq is not None:
+                    text_data_json['seq'] = seq
+                    self.design_writer.schedule(self.design_id)
+
+            # 更新用户的最后活动时间（按间隔节流）
+            if self.user and self.user.is_authenticated:
+                await self._touch_activity()
 
             # 将消息发送到房间组（广播给所有连接的客户端）
             await self.channel_layer.group_send(
                 self.room_group_name,
-                {
-                    'type': 'collaboration_message',
-                    'message': text_data_json
-                }
+                broadcast_event(text_data_json)
             )
 
-            logger.info(f"消息已转发: {message_type}")
+            collab_log.event('message_relayed', self.design_id,
+                             type=message_type, seq=text_data_json.get('seq'))
+        except CompactProtocolError as e:
+            # 处理紧凑编码解析错误
+            logger.error(f"紧凑编码解析错误: {str(e)}")
+            await self.send(text_data=json.dumps({
+                'type': 'error',
+                'message': f'无效的紧凑编码数据: {str(e)}',
+                'timestamp': datetime.now().isoformat()
+            }))
         except json.JSONDecodeError as e:
             # 处理JSON解析错误
             logger.error(f"JSON解析错误: {str(e)}, 数据: {text_data[:100]}...")
@@ -604,16 +473,29 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
         处理从房间组接收到的协作消息并发送给客户端
 
         这个方法由channel_layer.group_send调用，用于将消息发送给特定的WebSocket连接。
+        发送端已通过 broadcast_event 编码好文本，这里直接转发，不再重复序列化。
+        使用紧凑子协议的连接收到支持的消息类型时，转换为二进制帧发送。
 
         参数:
-            event: 包含消息内容的事件对象
+            event: 包含消息内容的事件对象（text 为已编码文本，旧格式为 message 字典）
         """
         try:
-            # 从事件中获取消息
-            message = event['message']
+            if self.compact_codec is not None:
+                message = event.get('message')
+                message_type = event.get('message_type') or (message or {}).get('type')
+                if message_type in COMPACT_MESSAGE_TYPES:
+                    frame = self.compact_codec.encode(message or json.loads(event['text']))
+                    if frame is not None:
+                        await self.send(bytes_data=frame)
+                        return
+
+            # 优先使用发送端编码好的文本
+            text = event.get('text')
+            if text is None:
+                text = encode_message(event['message'])
 
             # 发送消息到WebSocket客户端
-            await self.send(text_data=json.dumps(message))
+            await self.send(text_data=text)
         except Exception as e:
             # 处理发送消息过程中的异常
             logger.error(f"发送消息时出错: {str(e)}", exc_info=True)
@@ -627,11 +509,161 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
             except Exception as send_error:
                 logger.error(f"发送错误消息失败: {str(send_error)}")
 
+    async def _reject(self, message, code):
+        """接受连接后发送错误消息并关闭（客户端可以读到拒绝原因）"""
+        await self.accept(self.subprotocol)
+        await self._send_error(message)
+        await self.close(code=code)
+
+    async def _send_error(self, message):
+        """发送错误消息"""
+        await self.send(text_data=json.dumps({
+            'type': 'error',
+            'message': message,
+            'timestamp': datetime.now().isoformat()
+        }))
+
+    async def _ensure_session(self):
+        """
+        获取或创建当前设计的会话，并从设计记录初始化会话的权威文档
+
+        只能在连接通过权限检查（self.authorized）之后调用。
+
+        返回:
+            dict: 会话快照
+        """
+        session, created = await self.session_store.get_or_create_session(self.design_id)
+        if created:
+            collab_log.event('session_created', self.design_id, session_id=session['id'])
+
+        if not await self.session_store.has_document(self.design_id):
+            document = await database_sync_to_async(load_design_document)(self.design_id)
+            await self.session_store.seed_document(self.design_id, document)
+        return session
+
+    async def _register_collaborator(self, color=None):
+        """
+        将当前认证用户登记到会话的协作者列表中
+
+        - 不存在时添加协作者，并在 owner/initiator 尚未设置时原子地占用
+        - 已存在时更新最后活动时间（传入 color 时同时更新颜色）
+
+        参数:
+            color: 用户颜色，为空时新协作者使用生成的颜色
+
+        返回:
+            tuple: (更新后的会话快照, 用户角色, 是否新加入)
+        """
+        user_id = str(self.user.id)
+        now = datetime.now().isoformat()
+        session = await self.session_store.get_session(self.design_id)
+        if session is None:
+            # 会话在连接后过期或已被最后一个协作者结束，重新创建
+            session = await self._ensure_session()
+
+        # 确定用户角色：不是通过链接加入且没有发起者，则设为发起者
+        user_role = 'collaborator'
+        if not self.is_via_link and not session['initiator']:
+            user_role = 'initiator'
+
+        is_new = await self.session_store.add_collaborator(self.design_id, {
+            'id': user_id,
+            'username': self.user.username,
+            'color': color or self._generate_color(),
+            'role': user_role,
+            'last_active': now,
+            'last_seen': time.time()
+        })
+
+        if is_new:
+            collab_log.event('collaborator_added', self.design_id,
+                             user=self.user.username, role=user_role)
+            # 如果是第一个加入的用户，设置为所有者
+            await self.session_store.claim_role(self.design_id, 'owner', user_id)
+            # 如果是发起者角色且没有设置发起者，则设置发起者
+            if user_role == 'initiator':
+                await self.session_store.claim_role(self.design_id, 'initiator', user_id)
+        else:
+            fields = {'last_active': now, 'last_seen': time.time()}
+            if color:
+                fields['color'] = color
+            await self.session_store.update_collaborator(self.design_id, user_id, **fields)
+
+        self._activity_written_at = time.monotonic()
+        session = await self.session_store.get_session(self.design_id) or session
+        return session, user_role, is_new
+
+    async def _touch_activity(self):
+        """更新最后活动时间，距上次写入不足 activity_interval 时跳过"""
+        if time.monotonic() - self._activity_written_at < get_activity_write_interval():
+            return
+        self._activity_written_at = time.monotonic()
+        await self.session_store.update_collaborator(
+            self.design_id, str(self.user.id),
+            last_active=datetime.now().isoformat(), last_seen=time.time())
+
+    async def refresh_presence(self, now):
+        """
+        刷新当前连接的在线状态（由 PresenceReaper 定期调用）
+
+        协作者已被移除（例如存储短暂不可用期间被判定为失效）但连接仍在时，重新登记。
+
+        参数:
+            now: 当前时间戳（秒）
+        """
+        updated = await self.session_store.update_collaborator(
+            self.design_id, str(self.user.id), last_seen=now)
+        if updated is None and await self.session_store.session_exists(self.design_id):
+            collab_log.event('collaborator_reregistered', self.design_id,
+                             user=self.user.username)
+            await self._register_collaborator()
+
+    def _decode_compact(self, data):
+        """
+        将紧凑编码的二进制帧转换为JSON格式的消息
+
+        发送者信息由服务器根据当前连接填写，客户端不需要在每一帧中携带。
+        """
+        if self.compact_codec is None:
+            raise CompactProtocolError('连接未协商紧凑编码子协议')
+        message = self.compact_codec.decode(data)
+        if self.user and self.user.is_authenticated:
+            message['senderId'] = str(self.user.id)
+            message['senderName'] = self.user.username
+        if 'timestamp' not in message:
+            message['timestamp'] = datetime.now().isoformat()
+        return message
+
+    async def _build_document_sync(self, last_seq):
+        """
+        根据客户端最后收到的序号构建文档同步数据
+
+        - 日志中仍有缺失的操作时，只返回这些操作（operations）
+        - 否则返回完整文档（obstacles / path 等字段，与 exportCourse 格式一致）
+
+        参数:
+            last_seq: 客户端最后收到的操作序号，-1 表示请求完整文档
+
+        返回:
+            dict: 合并到 sync_response.payload 中的数据
+        """
+        if last_seq >= 0:
+            operations = await self.session_store.get_operations_since(self.design_id, last_seq)
+            if operations is not None:
+                seq = operations[-1]['seq'] if operations else last_seq
+                return {'seq': seq, 'operations': operations}
+
+        document, seq = await self.session_store.get_document(self.design_id)
+        if document is None:
+            return {'seq': seq}
+        return dict(document, seq=seq)
+
     def _generate_color(self):
         """
         为用户生成随机颜色
 
-        使用用户ID的哈希值来确保同一用户始终获得相同的颜色。
+        使用用户ID的CRC32值来确保同一用户始终获得相同的颜色
+        （内置hash()在不同进程中的结果不同，多进程部署时颜色会不一致）。
 
         返回:
             str: 十六进制颜色代码
@@ -640,4 +672,85 @@ class CollaborationConsumer(AsyncWebsocketConsumer):
             '#FF6B6B', '#4ECDC4', '#45B7D1', '#FFA5A5', '#A5FFD6',
             '#FFC145', '#FF6B8B', '#845EC2', '#D65DB1', '#FF9671'
         ]
-        return colors[hash(str(self.user.id)) % len(colors)]
+        return colors[zlib.crc32(str(self.user.id).encode('utf-8')) % len(colors)]
+
+
+class OrderStatusConsumer(AsyncWebsocketConsumer):
+    """
+    订单支付状态推送
+
+    支付页面连接 ws/payment/orders/<order_id>/ 后立即收到订单当前状态，
+    之后订单状态变化时（支付宝异步通知或后台对账，见 order_reconciler）收到推送，
+    不需要轮询 order-status 接口。只有订单所属用户可以连接。
+    """
+
+    async def connect(self):
+        self.user = self.scope.get('user', None)
+        self.order_id = self.scope['url_route']['kwargs']['order_id']
+        if not self.user or not self.user.is_authenticated:
+            await self.close(code=4001)
+            return
+
+        # 先加入组再读取订单，避免读取之后、加入之前的状态变化丢失
+        self.group_name = order_group_name(self.order_id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        order = await database_sync_to_async(
+            MembershipOrder.objects.filter(order_id=self.order_id, user=self.user).first)()
+        if order is None:
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+            await self.close(code=4004)
+            return
+
+        await self.accept()
+        await self.order_status(order_status_event(order))
+
+    async def disconnect(self, close_code):
+        if hasattr(self, 'group_name'):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def order_status(self, event):
+        """转发订单状态"""
+        await self.send(text_data=json.dumps({
+            'type': 'order_status',
+            'order': event['order'],
+        }))
+
+
+class RenderJobConsumer(AsyncWebsocketConsumer):
+    """
+    渲染任务状态推送
+
+    下载 PDF/PNG 时 download_design 返回渲染任务后，导出页面连接 ws/render/jobs/<job_id>/，
+    立即收到任务当前状态，之后任务开始、完成或失败时收到推送（见 render_jobs），
+    完成时的消息中包含下载地址。只有任务的请求者和有权下载对应设计的用户可以连接。
+    """
+
+    async def connect(self):
+        self.user = self.scope.get('user', None)
+        self.job_id = self.scope['url_route']['kwargs']['job_id']
+        if not self.user or not self.user.is_authenticated:
+            await self.close(code=4001)
+            return
+
+        # 先加入组再读取任务，避免读取之后、加入之前的状态变化丢失
+        self.group_name = job_group_name(self.job_id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        job = await database_sync_to_async(visible_jobs(self.user).filter(job_id=self.job_id).first)()
+        if job is None:
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+            await self.close(code=4004)
+            return
+
+        await self.accept()
+        await self.render_status(await database_sync_to_async(job_status_event)(job))
+
+    async def disconnect(self, close_code):
+        if hasattr(self, 'group_name'):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def render_status(self, event):
+        """转发渲染任务状态"""
+        await self.send(text_data=json.dumps({
+            'type': 'render_status',
+            'job': event['job'],
+        }))
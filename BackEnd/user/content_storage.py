@@ -0,0 +1,243 @@
+"""
+按内容寻址的设计文件存储
+
+设计图片和设计文件原先按 UUID/时间戳命名，每次保存都写入新文件，旧文件从不删除，
+重复保存相同内容也会存多份。Design.image 和 Design.download 现在使用
+ContentAddressedStorage：
+- 文件按内容的 SHA-256 命名（blobs/<前两位>/<三四位>/<哈希>.<扩展名>），相同内容只存一份，
+  保存已存在的内容时不写文件
+- 每个文件在 StoredBlob 中有一条记录（大小、引用数、最后保存时间）
+- storage.delete() 不删除共享的文件，由 gc_blobs 命令统一清理：根据设计记录重新统计
+  引用数，删除没有引用且超过 CONTENT_STORAGE_GC_GRACE_PERIOD 未被保存的文件。
+  除文件字段外，按内容哈希引用文件的记录也计入引用：缩略图对应的原图（Design.image_hash）
+  和未完成的渲染任务的设计文件（RenderJob.source_hash），见 BLOB_DIGEST_REFERENCES。
+  引用数由 gc_blobs 根据文件字段重新计算，而不是在每次保存时增减，因为写回设计文档等
+  代码路径直接用 queryset.update() 修改文件字段
+- 文件名中的哈希就是内容哈希，缩略图和渲染缓存不需要再读取文件计算（见 blob_digest）
+
+历史文件（media/user_*）使用 migrate_design_files 命令迁移。
+"""
+
+import hashlib
+import logging
+import re
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+BLOB_DIR = 'blobs'
+BLOB_NAME_RE = re.compile(rf'^{BLOB_DIR}/[0-9a-f]{{2}}/[0-9a-f]{{2}}/(?P<digest>[0-9a-f]{{64}})(\.[a-z0-9]+)?$')
+EXTENSION_RE = re.compile(r'^[a-z0-9]{1,10}$')
+
+DEFAULT_GC_GRACE_PERIOD = 86400
+
+# 引用按内容寻址文件的字段: (应用.模型, 字段名)
+BLOB_REFERENCES = (
+    ('user.Design', 'image'),
+    ('user.Design', 'download'),
+)
+
+# 按内容哈希引用文件的字段: (应用.模型, 字段名, 过滤条件)
+BLOB_DIGEST_REFERENCES = (
+    ('user.Design', 'image_hash', {}),
+    ('user.RenderJob', 'source_hash', {'status__in': ('pending', 'running')}),
+)
+
+
+def blob_name(digest, filename=''):
+    """内容哈希对应的文件路径，保留原文件名的扩展名"""
+    ext = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    suffix = f'.{ext}' if EXTENSION_RE.match(ext) else ''
+    return f'{BLOB_DIR}/{digest[:2]}/{digest[2:4]}/{digest}{suffix}'
+
+
+def blob_digest(name):
+    """按内容寻址的文件路径中的哈希，其他路径返回 None"""
+    match = BLOB_NAME_RE.match(name or '')
+    return match.group('digest') if match else None
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """按内容 SHA-256 命名、相同内容只保存一份的文件存储"""
+
+    def save(self, name, content, max_length=None):
+        from .models import StoredBlob
+
+        if name is None:
+            name = content.name
+        digest = hashlib.sha256()
+        size = 0
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+            size += len(chunk)
+        if hasattr(content, 'seek'):
+            content.seek(0)
+
+        name = blob_name(digest.hexdigest(), name)
+        with transaction.atomic():
+            # 先更新记录再检查文件：更新会等待 gc 对同一记录的删除提交，之后文件被删除时重新写入。
+            # 最后保存时间用于 gc 的保护期，刚保存、还没有被设计记录引用的文件不会被清理
+            updated = StoredBlob.objects.filter(name=name).update(last_saved_at=timezone.now())
+            if not self.exists(name):
+                saved = self._save(self.get_available_name(name, max_length=max_length), content)
+                if saved != name:
+                    # 另一个请求同时写入了相同内容，保留先写入的文件
+                    super().delete(saved)
+            if not updated:
+                StoredBlob.objects.get_or_create(name=name, defaults={'digest': digest.hexdigest(), 'size': size})
+        return name
+
+    def delete(self, name):
+        # 文件可能被多条记录共用，由 gc_blobs 命令在没有引用时删除
+        if blob_digest(name):
+            return
+        super().delete(name)
+
+    def purge(self, name):
+        """删除文件（仅供 gc 使用）"""
+        super().delete(name)
+
+
+_storage = None
+
+
+def get_content_storage():
+    """获取按内容寻址的文件存储（单例，用作文件字段的 storage）"""
+    global _storage
+    if _storage is None:
+        _storage = ContentAddressedStorage()
+    return _storage
+
+
+def count_references():
+    """
+    统计各文件被引用的次数（文件字段和内容哈希的引用）
+
+    返回:
+        Counter: {文件路径: 引用数}
+    """
+    from django.apps import apps
+
+    from .models import StoredBlob
+
+    counts = Counter()
+    for model_name, field_name in BLOB_REFERENCES:
+        model = apps.get_model(model_name)
+        names = model.objects.filter(**{f'{field_name}__startswith': f'{BLOB_DIR}/'}).values_list(
+            field_name, flat=True)
+        counts.update(names.iterator(chunk_size=2000))
+
+    digests = Counter()
+    for model_name, field_name, filters in BLOB_DIGEST_REFERENCES:
+        model = apps.get_model(model_name)
+        values = model.objects.filter(**filters).exclude(**{field_name: ''}).values_list(field_name, flat=True)
+        digests.update(values.iterator(chunk_size=2000))
+    keys = list(digests)
+    for start in range(0, len(keys), 1000):
+        blobs = StoredBlob.objects.filter(digest__in=keys[start:start + 1000]).values_list('name', 'digest')
+        for name, digest in blobs:
+            counts[name] += digests[digest]
+    return counts
+
+
+def is_referenced(name):
+    """文件当前是否被任何记录引用（删除前再次确认）"""
+    from django.apps import apps
+
+    digest = blob_digest(name)
+    return (any(apps.get_model(model_name).objects.filter(**{field_name: name}).exists()
+                for model_name, field_name in BLOB_REFERENCES)
+            or any(apps.get_model(model_name).objects.filter(**filters, **{field_name: digest}).exists()
+                   for model_name, field_name, filters in BLOB_DIGEST_REFERENCES))
+
+
+def register_untracked_blobs(storage=None):
+    """
+    为存储中存在但没有记录的文件（写入文件后进程退出）补充记录
+
+    返回:
+        int: 补充的记录数
+    """
+    from .models import StoredBlob
+
+    storage = storage or get_content_storage()
+    if not storage.exists(BLOB_DIR):
+        return 0
+    names = []
+    for first in storage.listdir(BLOB_DIR)[0]:
+        for second in storage.listdir(f'{BLOB_DIR}/{first}')[0]:
+            prefix = f'{BLOB_DIR}/{first}/{second}'
+            names.extend(f'{prefix}/{filename}' for filename in storage.listdir(prefix)[1])
+
+    known = set()
+    for start in range(0, len(names), 1000):
+        known.update(StoredBlob.objects.filter(name__in=names[start:start + 1000]).values_list('name', flat=True))
+    missing = [StoredBlob(name=name, digest=blob_digest(name), size=storage.size(name))
+               for name in names if name not in known and blob_digest(name)]
+    StoredBlob.objects.bulk_create(missing, ignore_conflicts=True)
+    return len(missing)
+
+
+def collect_garbage(now=None, grace_period=None, dry_run=False):
+    """
+    重新统计引用数并删除没有引用的文件
+
+    参数:
+        now: 当前时间，默认 timezone.now()
+        grace_period: 保护期（秒），默认 CONTENT_STORAGE_GC_GRACE_PERIOD
+        dry_run: 只统计不删除
+
+    返回:
+        dict: {'blobs', 'referenced', 'deleted', 'freed_bytes'}
+    """
+    from .models import StoredBlob
+
+    now = now or timezone.now()
+    if grace_period is None:
+        grace_period = getattr(settings, 'CONTENT_STORAGE_GC_GRACE_PERIOD', DEFAULT_GC_GRACE_PERIOD)
+    storage = get_content_storage()
+
+    if not dry_run:
+        register_untracked_blobs(storage)
+    references = count_references()
+
+    counts = {'blobs': 0, 'referenced': 0, 'deleted': 0, 'freed_bytes': 0}
+    changed, unreferenced = [], []
+    for blob in StoredBlob.objects.only('id', 'name', 'size', 'ref_count', 'last_saved_at').iterator(chunk_size=2000):
+        counts['blobs'] += 1
+        ref_count = references.get(blob.name, 0)
+        if ref_count:
+            counts['referenced'] += 1
+        if blob.ref_count != ref_count:
+            blob.ref_count = ref_count
+            changed.append(blob)
+        if not ref_count and (now - blob.last_saved_at).total_seconds() >= grace_period:
+            unreferenced.append(blob)
+
+    if dry_run:
+        counts['deleted'] = len(unreferenced)
+        counts['freed_bytes'] = sum(blob.size for blob in unreferenced)
+        return counts
+
+    StoredBlob.objects.bulk_update(changed, ['ref_count'], batch_size=1000)
+    cutoff = now - timedelta(seconds=grace_period)
+    for blob in unreferenced:
+        with transaction.atomic():
+            # 锁定记录，与 ContentAddressedStorage.save() 互斥；统计之后可能有新的保存或引用
+            locked = StoredBlob.objects.select_for_update().filter(pk=blob.pk, last_saved_at__lte=cutoff).first()
+            if locked is None or is_referenced(blob.name):
+                continue
+            locked.delete()
+            storage.purge(blob.name)
+        counts['deleted'] += 1
+        counts['freed_bytes'] += blob.size
+    logger.info(f"清理内容寻址文件: {counts}")
+    return counts
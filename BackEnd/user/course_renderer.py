@@ -0,0 +1,546 @@
+"""
+设计图服务端渲染
+
+根据保存的设计JSON（与前端 courseStore.exportCourse() 导出的格式一致，坐标和尺寸
+单位为米）在服务端用 Pillow 绘制 PNG/PDF，不依赖浏览器：
+- 场地：按 fieldWidth × fieldHeight 等比缩放到纸张内，绘制 5 米网格和尺寸标注
+- 障碍物：横杆（SINGLE/DOUBLE/COMBINATION/自定义）、砖墙、利物浦、水障、装饰物，
+  按 rotation 绕内容中心旋转，与 CourseCanvas.vue 的布局一致；附带方向箭头和编号
+- 路线：与前端相同的分段规则（每 5 个点中第 2-4 段为直线，其余为增强控制点的三次贝塞尔曲线）
+
+输出按 A4 横向纸张和指定 DPI 计算像素尺寸；PDF 为嵌入位图的单页文档
+（Pillow 不支持矢量 PDF，项目也没有其他 PDF 依赖）。
+
+渲染结果按设计文件内容的 SHA-256、格式、DPI 和渲染器版本寻址保存在默认存储中
+（renders/<前两位>/<哈希>_<DPI>dpi_v<版本>.<扩展名>），相同的设计文件重复请求直接返回已有文件。
+
+配置（settings.py）：
+- DESIGN_RENDER_FONT: 绘制中文编号/文字使用的 TrueType 字体路径，未配置时使用 Pillow 默认字体
+- DESIGN_RENDER_MAX_DPI: 允许的最大 DPI
+"""
+
+import hashlib
+import io
+import json
+import logging
+import math
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+
+from .content_storage import blob_digest
+from .design_summary import serialize_document
+
+logger = logging.getLogger(__name__)
+
+# 渲染规则变化时递增，使已缓存的渲染结果失效
+RENDERER_VERSION = 1
+
+RENDER_DIR = 'renders'
+
+FORMATS = {
+    'png': ('PNG', 'png'),
+    'pdf': ('PDF', 'pdf'),
+}
+
+DEFAULT_DPI = 150
+DEFAULT_MAX_DPI = 600
+# A4 横向（毫米）
+PAGE_SIZE_MM = (297, 210)
+MARGIN_MM = 10
+HEADER_MM = 12
+
+# 超采样后缩小得到抗锯齿效果，像素数超过上限时不超采样，避免高 DPI 时占用过多内存
+SUPERSAMPLE = 2
+SUPERSAMPLE_MAX_PIXELS = 40_000_000
+
+PRIMARY_COLOR = '#3a6af8'
+FIELD_COLOR = '#f3f8ef'
+GRID_COLOR = '#dfe8d8'
+BORDER_COLOR = '#606266'
+TEXT_COLOR = '#303133'
+GRID_STEP = 5  # 网格间距（米）
+
+# 前端 .obstacle 的 padding 为 20 屏幕像素，位置是包含 padding 的左上角
+OBSTACLE_PADDING_PX = 20
+# 设计JSON中没有画布尺寸时假定的屏幕比例（像素/米）
+DEFAULT_SCREEN_SCALE = 10
+# 编号默认位置（米，相对障碍物位置）
+DEFAULT_NUMBER_POSITION = (0, -3)
+# 方向箭头超出障碍物内容的长度（米）
+ARROW_OVERHANG = 3
+
+
+class RenderError(Exception):
+    """设计JSON无法渲染"""
+
+
+def _color(value, default):
+    try:
+        return ImageColor.getrgb(value) if value else ImageColor.getrgb(default)
+    except (ValueError, AttributeError):
+        return ImageColor.getrgb(default)
+
+
+def _darker(rgb, amount=0.25):
+    return tuple(int(c * (1 - amount)) for c in rgb[:3])
+
+
+def _number(value, default=0.0):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return default
+    return value if math.isfinite(value) else default
+
+
+def _font(size):
+    path = getattr(settings, 'DESIGN_RENDER_FONT', None)
+    if path:
+        try:
+            return ImageFont.truetype(path, size)
+        except OSError:
+            logger.warning(f"无法加载渲染字体: {path}，使用默认字体")
+    return ImageFont.load_default(size=size)
+
+
+class _Shape:
+    """障碍物局部坐标系（米，原点为内容左上角）中的图形"""
+
+    __slots__ = ('kind', 'box', 'fill', 'outline', 'width', 'text')
+
+    def __init__(self, kind, box, fill=None, outline=None, width=0.0, text=None):
+        self.kind = kind
+        self.box = box
+        self.fill = fill
+        self.outline = outline
+        self.width = width
+        self.text = text
+
+
+def _pole_stack(poles, full_width=None):
+    """横杆纵向排列、水平居中，返回 (图形, 内容宽度, 内容高度)"""
+    poles = [pole for pole in poles or [] if isinstance(pole, dict)]
+    width = full_width if full_width is not None else max(
+        [_number(pole.get('width')) for pole in poles] or [0])
+    shapes, y = [], 0.0
+    for index, pole in enumerate(poles):
+        pole_width = width if full_width is not None else _number(pole.get('width'))
+        height = _number(pole.get('height'))
+        fill = _color(pole.get('color'), '#8B4513')
+        x = (width - pole_width) / 2
+        shapes.append(_Shape('rect', (x, y, x + pole_width, y + height), fill, _darker(fill), 0.05))
+        y += height
+        if index < len(poles) - 1:
+            y += _number(pole.get('spacing'))
+    return shapes, width, y
+
+
+def obstacle_shapes(obstacle):
+    """
+    障碍物在局部坐标系中的图形，布局与 CourseCanvas.vue 一致
+
+    自定义障碍物按携带的属性判断基础类型（砖墙/利物浦属性），否则按横杆绘制。
+
+    返回:
+        tuple: (图形列表, 内容宽度, 内容高度)
+    """
+    obstacle_type = obstacle.get('type')
+    poles = obstacle.get('poles') or []
+    wall = obstacle.get('wallProperties')
+    liverpool = obstacle.get('liverpoolProperties')
+
+    if obstacle_type == 'WALL' or (obstacle_type == 'CUSTOM' and isinstance(wall, dict)):
+        wall = wall or {}
+        width, height = _number(wall.get('width')), _number(wall.get('height'))
+        fill = _color(wall.get('color'), '#A0522D')
+        shapes = [_Shape('rect', (0, 0, width, height), fill, _darker(fill), 0.05)]
+        # 砖缝
+        for i in range(1, int(width / 0.5)):
+            shapes.append(_Shape('line', (i * 0.5, 0, i * 0.5, height), outline=_darker(fill, 0.4), width=0.02))
+        return shapes, width, height
+
+    if obstacle_type == 'LIVERPOOL' or (obstacle_type == 'CUSTOM' and isinstance(liverpool, dict)):
+        liverpool = liverpool or {}
+        first = poles[0] if poles and isinstance(poles[0], dict) else {}
+        width = _number(first.get('width'))
+        shapes, y = [], 0.0
+        if liverpool.get('hasRail'):
+            shapes, _, y = _pole_stack(poles, full_width=width)
+        water_width = _number(liverpool.get('width'))
+        water_depth = _number(liverpool.get('waterDepth'))
+        x = (width - water_width) / 2
+        shapes.append(_Shape('rect', (x, y, x + water_width, y + water_depth),
+                             _color(liverpool.get('waterColor'), '#4FC3F7')))
+        return shapes, max(width, water_width), y + water_depth
+
+    if obstacle_type == 'WATER':
+        water = obstacle.get('waterProperties') or {}
+        width, depth = _number(water.get('width')), _number(water.get('depth'))
+        return [_Shape('rect', (0, 0, width, depth), _color(water.get('color'), '#4FC3F7'),
+                       _color(water.get('borderColor'), '#0288D1'),
+                       _number(water.get('borderWidth')))], width, depth
+
+    if obstacle_type == 'DECORATION':
+        decoration = obstacle.get('decorationProperties') or {}
+        category = decoration.get('category')
+        if category == 'TREE':
+            radius = _number(decoration.get('foliageRadius'))
+            trunk_width = _number(decoration.get('trunkWidth'))
+            trunk_height = _number(decoration.get('trunkHeight'))
+            # 树冠在上、树干在下
+            width, height = max(radius * 2, trunk_width), radius * 2 + trunk_height
+            trunk_x = (width - trunk_width) / 2
+            foliage_x = (width - radius * 2) / 2
+            return [
+                _Shape('rect', (trunk_x, radius * 2, trunk_x + trunk_width, height),
+                       _color(decoration.get('color'), '#8B4513')),
+                _Shape('ellipse', (foliage_x, 0, foliage_x + radius * 2, radius * 2),
+                       _color(decoration.get('secondaryColor'), '#4CAF50')),
+            ], width, height
+        width, height = _number(decoration.get('width')), _number(decoration.get('height'))
+        if category == 'CUSTOM':
+            # 自定义图片不在服务端下载，绘制占位框
+            return [_Shape('rect', (0, 0, width, height), (240, 240, 240), (204, 204, 204), 0.05)], width, height
+        fill = _color(decoration.get('color'), '#FFFFFF')
+        shapes = [_Shape('rect', (0, 0, width, height), fill,
+                         _color(decoration.get('borderColor'), '#606266'),
+                         _number(decoration.get('borderWidth')))]
+        if decoration.get('text'):
+            shapes.append(_Shape('text', (width / 2, height / 2),
+                                 _color(decoration.get('textColor'), TEXT_COLOR), text=str(decoration['text'])))
+        return shapes, width, height
+
+    return _pole_stack(poles)
+
+
+def path_polyline(points, samples=24):
+    """
+    把路线点转换为折线（米），分段规则与 CourseCanvas.vue 的 pathSegments 一致
+
+    返回:
+        list: [[(x, y), ...], ...]，每段一条折线
+    """
+    def is_obstacle_line(index):
+        # 每 5 个点为一组，其中点 2-4 为障碍物连接线
+        return 1 <= (index - 1) % 5 <= 3
+
+    def enhanced(anchor, control):
+        # 前端把控制点到锚点的距离放大 2 倍，使曲线更陡峭
+        return (anchor[0] + (control[0] - anchor[0]) * 2, anchor[1] + (control[1] - anchor[1]) * 2)
+
+    def xy(point):
+        return (_number(point.get('x')), _number(point.get('y')))
+
+    points = [point for point in points or [] if isinstance(point, dict)]
+    lines = []
+    for i in range(1, len(points)):
+        previous, current = points[i - 1], points[i]
+        start, end = xy(previous), xy(current)
+        cp2, cp1 = previous.get('controlPoint2'), current.get('controlPoint1')
+        if is_obstacle_line(i) or is_obstacle_line(i - 1) or not (isinstance(cp2, dict) and isinstance(cp1, dict)):
+            lines.append([start, end])
+            continue
+        c1, c2 = enhanced(start, xy(cp2)), enhanced(end, xy(cp1))
+        line = []
+        for step in range(samples + 1):
+            t = step / samples
+            u = 1 - t
+            line.append((
+                u ** 3 * start[0] + 3 * u * u * t * c1[0] + 3 * u * t * t * c2[0] + t ** 3 * end[0],
+                u ** 3 * start[1] + 3 * u * u * t * c1[1] + 3 * u * t * t * c2[1] + t ** 3 * end[1],
+            ))
+        lines.append(line)
+    return lines
+
+
+class CourseRenderer:
+    """
+    把一份设计JSON绘制到位图上
+
+    参数:
+        course: 设计字典（exportCourse 格式）
+        dpi: 输出分辨率
+    """
+
+    def __init__(self, course, dpi=DEFAULT_DPI):
+        if not isinstance(course, dict):
+            raise RenderError('设计数据格式不正确')
+        self.course = course
+        self.dpi = dpi
+        self.field_width = _number(course.get('fieldWidth')) or 1
+        self.field_height = _number(course.get('fieldHeight')) or 1
+
+        page_px = [round(mm / 25.4 * dpi) for mm in PAGE_SIZE_MM]
+        self.factor = SUPERSAMPLE if page_px[0] * page_px[1] * SUPERSAMPLE ** 2 <= SUPERSAMPLE_MAX_PIXELS else 1
+        self.mm = dpi / 25.4 * self.factor
+        self.size = (page_px[0] * self.factor, page_px[1] * self.factor)
+
+        margin, header = MARGIN_MM * self.mm, HEADER_MM * self.mm
+        available = (self.size[0] - 2 * margin, self.size[1] - 2 * margin - header)
+        # 每米对应的像素
+        self.scale = min(available[0] / self.field_width, available[1] / self.field_height)
+        self.origin = (
+            (self.size[0] - self.field_width * self.scale) / 2,
+            margin + header + (available[1] - self.field_height * self.scale) / 2,
+        )
+
+        # 障碍物位置包含前端 20px 的 padding，按导出时的画布比例换算为米
+        viewport = course.get('viewportInfo') or {}
+        screen_scale = min(
+            _number(viewport.get('canvasWidth')) / self.field_width,
+            _number(viewport.get('canvasHeight')) / self.field_height,
+        ) if isinstance(viewport, dict) else 0
+        self.padding = OBSTACLE_PADDING_PX / (screen_scale or DEFAULT_SCREEN_SCALE)
+
+    def point(self, x, y):
+        """场地坐标（米）转换为像素坐标"""
+        return (self.origin[0] + x * self.scale, self.origin[1] + y * self.scale)
+
+    def px(self, meters, minimum=1):
+        return max(minimum, round(meters * self.scale))
+
+    def render(self):
+        """绘制并返回 RGB 图像"""
+        image = Image.new('RGB', self.size, 'white')
+        draw = ImageDraw.Draw(image)
+        self._draw_field(draw)
+        path = self.course.get('path')
+        show_path = isinstance(path, dict) and path.get('visible', True)
+        if show_path:
+            self._draw_path(draw, path)
+        for obstacle in self.course.get('obstacles') or []:
+            if isinstance(obstacle, dict):
+                self._draw_obstacle(draw, obstacle)
+        # 起点和终点标记绘制在障碍物之上
+        if show_path:
+            self._draw_path_markers(draw, path)
+        if self.factor > 1:
+            image = image.resize((self.size[0] // self.factor, self.size[1] // self.factor), Image.LANCZOS)
+        return image
+
+    def _draw_field(self, draw):
+        left, top = self.point(0, 0)
+        right, bottom = self.point(self.field_width, self.field_height)
+        draw.rectangle((left, top, right, bottom), fill=FIELD_COLOR)
+        line = max(1, round(0.2 * self.mm))
+        for x in range(GRID_STEP, int(self.field_width), GRID_STEP):
+            draw.line((self.point(x, 0), self.point(x, self.field_height)), fill=GRID_COLOR, width=line)
+        for y in range(GRID_STEP, int(self.field_height), GRID_STEP):
+            draw.line((self.point(0, y), self.point(self.field_width, y)), fill=GRID_COLOR, width=line)
+        draw.rectangle((left, top, right, bottom), outline=BORDER_COLOR, width=max(1, round(0.5 * self.mm)))
+
+        font = _font(round(4 * self.mm))
+        title = str(self.course.get('name') or '')
+        dimensions = f'{self.field_width:g}m x {self.field_height:g}m'
+        header_y = MARGIN_MM * self.mm
+        draw.text((left, header_y), title, fill=TEXT_COLOR, font=font)
+        draw.text((right, header_y), dimensions, fill=TEXT_COLOR, font=font, anchor='ra')
+
+    def _draw_path(self, draw, path):
+        color = ImageColor.getrgb(PRIMARY_COLOR)
+        width = max(1, round(0.5 * self.mm))
+        dash, gap = 2.5 * self.mm, 2.5 * self.mm
+        for line in path_polyline(path.get('points')):
+            self._dashed(draw, [self.point(x, y) for x, y in line], color, width, dash, gap)
+
+    def _draw_path_markers(self, draw, path):
+        color = ImageColor.getrgb(PRIMARY_COLOR)
+        radius = 2 * self.mm
+        font = _font(round(3 * self.mm))
+        for key, label in (('startPoint', 'S'), ('endPoint', 'F')):
+            point = path.get(key)
+            if not isinstance(point, dict):
+                continue
+            x, y = self.point(_number(point.get('x')), _number(point.get('y')))
+            draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill=color)
+            draw.text((x, y), label, fill='white', font=font, anchor='mm')
+
+    @staticmethod
+    def _dashed(draw, points, color, width, dash, gap):
+        """沿折线绘制虚线（与前端 stroke-dasharray 5,5 一致）"""
+        drawing, remaining = True, dash
+        for (x0, y0), (x1, y1) in zip(points, points[1:]):
+            length = math.hypot(x1 - x0, y1 - y0)
+            position = 0.0
+            while position < length:
+                step = min(remaining, length - position)
+                if drawing:
+                    t0, t1 = position / length, (position + step) / length
+                    draw.line(((x0 + (x1 - x0) * t0, y0 + (y1 - y0) * t0),
+                               (x0 + (x1 - x0) * t1, y0 + (y1 - y0) * t1)), fill=color, width=width)
+                position += step
+                remaining -= step
+                if remaining <= 0:
+                    drawing = not drawing
+                    remaining = dash if drawing else gap
+
+    def _draw_obstacle(self, draw, obstacle):
+        shapes, width, height = obstacle_shapes(obstacle)
+        position = obstacle.get('position') or {}
+        angle = math.radians(_number(obstacle.get('rotation')))
+        # 前端绕 .obstacle 元素中心旋转，内容在 padding 之内
+        center = (_number(position.get('x')) + self.padding + width / 2,
+                  _number(position.get('y')) + self.padding + height / 2)
+        cos, sin = math.cos(angle), math.sin(angle)
+
+        def transform(x, y):
+            dx, dy = x - width / 2, y - height / 2
+            return self.point(center[0] + dx * cos - dy * sin, center[1] + dx * sin + dy * cos)
+
+        if obstacle.get('type') != 'DECORATION' or (
+                (obstacle.get('decorationProperties') or {}).get('showDirectionArrow')):
+            self._draw_arrow(draw, transform, width, height)
+
+        for shape in shapes:
+            if shape.kind == 'rect':
+                x0, y0, x1, y1 = shape.box
+                polygon = [transform(x0, y0), transform(x1, y0), transform(x1, y1), transform(x0, y1)]
+                outline_width = self.px(shape.width, 0) if shape.outline else 0
+                draw.polygon(polygon, fill=shape.fill, outline=shape.outline if outline_width else None,
+                             width=outline_width or 1)
+            elif shape.kind == 'line':
+                x0, y0, x1, y1 = shape.box
+                draw.line((transform(x0, y0), transform(x1, y1)), fill=shape.outline, width=self.px(shape.width))
+            elif shape.kind == 'ellipse':
+                x0, y0, x1, y1 = shape.box
+                cx, cy = transform((x0 + x1) / 2, (y0 + y1) / 2)
+                r = (x1 - x0) / 2 * self.scale
+                draw.ellipse((cx - r, cy - r, cx + r, cy + r), fill=shape.fill)
+            elif shape.kind == 'text':
+                draw.text(transform(*shape.box), shape.text, fill=shape.fill,
+                          font=_font(max(8, round(0.6 * self.scale))), anchor='mm')
+
+        self._draw_numbers(draw, obstacle)
+
+    def _draw_arrow(self, draw, transform, width, height):
+        color = ImageColor.getrgb(PRIMARY_COLOR)
+        top = transform(width / 2, -ARROW_OVERHANG)
+        bottom = transform(width / 2, height + ARROW_OVERHANG)
+        draw.line((top, bottom), fill=color, width=max(1, round(0.3 * self.mm)))
+        head = 0.6
+        draw.polygon([
+            transform(width / 2 - head, height + ARROW_OVERHANG - head * 1.5),
+            transform(width / 2 + head, height + ARROW_OVERHANG - head * 1.5),
+            bottom,
+        ], fill=color)
+
+    def _draw_numbers(self, draw, obstacle):
+        position = obstacle.get('position') or {}
+        font = _font(round(3.5 * self.mm))
+        radius = 2.5 * self.mm
+        for pole in obstacle.get('poles') or []:
+            if not isinstance(pole, dict) or not pole.get('number'):
+                continue
+            offset = pole.get('numberPosition') or {}
+            x, y = self.point(
+                _number(position.get('x')) + _number(offset.get('x'), DEFAULT_NUMBER_POSITION[0]),
+                _number(position.get('y')) + _number(offset.get('y'), DEFAULT_NUMBER_POSITION[1]))
+            draw.ellipse((x - radius, y - radius, x + radius, y + radius),
+                         fill='white', outline=TEXT_COLOR, width=max(1, round(0.3 * self.mm)))
+            draw.text((x, y), str(pole['number']), fill=TEXT_COLOR, font=font, anchor='mm')
+
+
+def render_course(course, fmt='png', dpi=DEFAULT_DPI):
+    """
+    把设计字典渲染为 PNG/PDF
+
+    返回:
+        bytes: 文件内容
+    """
+    if fmt not in FORMATS:
+        raise RenderError(f'不支持的格式: {fmt}')
+    image = CourseRenderer(course, dpi).render()
+    buffer = io.BytesIO()
+    pil_format, _ = FORMATS[fmt]
+    if pil_format == 'PNG':
+        image.save(buffer, 'PNG', dpi=(dpi, dpi), optimize=False)
+    else:
+        image.save(buffer, 'PDF', resolution=dpi, title=str(course.get('name') or ''))
+    return buffer.getvalue()
+
+
+def validate_dpi(dpi):
+    """校验并返回 DPI，超出范围时抛出 RenderError"""
+    try:
+        dpi = int(dpi)
+    except (TypeError, ValueError):
+        raise RenderError('DPI 必须是整数')
+    max_dpi = getattr(settings, 'DESIGN_RENDER_MAX_DPI', DEFAULT_MAX_DPI)
+    if not 36 <= dpi <= max_dpi:
+        raise RenderError(f'DPI 必须在 36 到 {max_dpi} 之间')
+    return dpi
+
+
+def render_path(digest, fmt, dpi):
+    """渲染结果的存储路径（按设计文件内容、格式、DPI和渲染器版本寻址）"""
+    _, ext = FORMATS[fmt]
+    return f'{RENDER_DIR}/{digest[:2]}/{digest}_{dpi}dpi_v{RENDERER_VERSION}.{ext}'
+
+
+def read_design_file(design):
+    """
+    读取设计内容，有设计文档时使用文档的规范化序列化，否则读取设计文件
+
+    返回:
+        tuple: (内容, 内容的 SHA-256)
+    """
+    if design.document_hash:
+        return serialize_document(design.document), design.document_hash
+    if not design.download:
+        raise RenderError('该设计没有设计文件')
+    design.download.open('rb')
+    try:
+        content = design.download.read()
+    finally:
+        design.download.close()
+    return content, hashlib.sha256(content).hexdigest()
+
+
+def design_file_digest(design):
+    """设计内容的 SHA-256；有设计文档或文件按内容寻址保存时不需要读取文件"""
+    if design.document_hash:
+        return design.document_hash
+    if not design.download:
+        raise RenderError('该设计没有设计文件')
+    return blob_digest(design.download.name) or read_design_file(design)[1]
+
+
+def render_content(content, fmt, dpi):
+    """把设计文件内容渲染为 PNG/PDF 字节（纯计算，可以在子进程中执行）"""
+    try:
+        course = json.loads(content)
+    except ValueError:
+        raise RenderError('设计文件不是有效的JSON')
+    return render_course(course, fmt, dpi)
+
+
+def render_design(design, fmt='png', dpi=DEFAULT_DPI):
+    """
+    渲染设计文件并保存到存储，已渲染过相同内容时直接返回已有文件
+
+    参数:
+        design: Design 实例（需要有设计文件 download）
+        fmt: 'png' 或 'pdf'
+        dpi: 输出分辨率
+
+    返回:
+        tuple: (存储路径, 是否命中缓存)
+    """
+    if fmt not in FORMATS:
+        raise RenderError(f'不支持的格式: {fmt}')
+    dpi = validate_dpi(dpi)
+    content, digest = read_design_file(design)
+
+    storage = default_storage
+    path = render_path(digest, fmt, dpi)
+    if storage.exists(path):
+        return path, True
+
+    rendered = render_content(content, fmt, dpi)
+    # 并发请求同时渲染时 storage.save 会生成不同的文件名，返回实际保存的路径
+    path = storage.save(path, ContentFile(rendered))
+    logger.info(f"渲染设计 {design.pk}: {fmt} {dpi}dpi, {len(rendered)} 字节")
+    return path, False
@@ -0,0 +1,147 @@
+"""
+光标移动合并模块
+
+cursor_move 消息频率很高，逐条 group_send 会占用大部分 Redis 流量。
+本模块为每个房间维护一个进程内的聚合器：在一个时间窗口内，每个发送者只保留
+最新的一条光标位置，窗口结束时以一条 cursor_batch 消息广播给整个房间。
+
+配置（settings.py）：
+- COLLABORATION_CURSOR_WINDOW_MS: 合并窗口（毫秒）
+- COLLABORATION_CURSOR_MAX_FRAME_RATE: 每个房间每秒最多广播的 cursor_batch 帧数
+两者均为 0（默认）时不合并，逐条转发 cursor_move。cursor_batch 是新的消息类型，
+只有支持该类型的客户端才能显示合并后的光标，因此需要显式启用。
+"""
+
+import asyncio
+import logging
+from datetime import datetime
+
+from django.conf import settings
+
+from .message_encoding import broadcast_event
+
+logger = logging.getLogger('django.channels')
+
+DEFAULT_WINDOW_MS = 0
+DEFAULT_MAX_FRAME_RATE = 0
+
+# 进程内所有房间的聚合器，结构: {room_group_name: CursorAggregator}
+_aggregators = {}
+
+# 进程级计数器
+cursor_stats = {
+    'received': 0,  # 收到的 cursor_move 消息数
+    'merged': 0,    # 被同一窗口内更新的位置覆盖的消息数
+    'dropped': 0,   # 因时间戳过旧或广播失败而丢弃的消息数
+    'frames': 0,    # 广播的 cursor_batch 帧数
+}
+
+
+def get_cursor_settings():
+    """读取合并窗口（秒）和最小帧间隔（秒）"""
+    window_ms = getattr(settings, 'COLLABORATION_CURSOR_WINDOW_MS', DEFAULT_WINDOW_MS)
+    max_frame_rate = getattr(
+        settings, 'COLLABORATION_CURSOR_MAX_FRAME_RATE', DEFAULT_MAX_FRAME_RATE)
+    min_interval = 1.0 / max_frame_rate if max_frame_rate else 0
+    return window_ms / 1000.0, min_interval
+
+
+class CursorAggregator:
+    """
+    单个房间的光标位置聚合器
+
+    - add(): 记录发送者的最新光标位置，必要时安排一次刷新
+    - 刷新时将窗口内所有发送者的最新位置合并为一条 cursor_batch 消息广播
+    - 每次广播后进入冷却期，冷却期内的消息在冷却结束时一并广播，
+      冷却结束时没有新消息则释放聚合器
+    """
+
+    def __init__(self, channel_layer, room_group_name, window, min_interval):
+        self.channel_layer = channel_layer
+        self.room_group_name = room_group_name
+        self.window = window
+        self.min_interval = min_interval
+        # 结构: {sender_id: message}
+        self.pending = {}
+        self._flush_handle = None
+
+    def _schedule(self, delay):
+        self._flush_handle = asyncio.get_running_loop().call_later(
+            delay, lambda: asyncio.ensure_future(self.flush()))
+
+    def add(self, message):
+        """记录一条 cursor_move 消息"""
+        cursor_stats['received'] += 1
+        sender_id = str(message.get('senderId'))
+        previous = self.pending.get(sender_id)
+        if previous is not None:
+            # 客户端时间戳乱序时保留较新的位置
+            if str(message.get('timestamp', '')) < str(previous.get('timestamp', '')):
+                cursor_stats['dropped'] += 1
+                return
+            cursor_stats['merged'] += 1
+        self.pending[sender_id] = message
+
+        if self._flush_handle is None:
+            self._schedule(self.window)
+
+    async def flush(self):
+        """广播当前窗口内的光标位置"""
+        self._flush_handle = None
+        if not self.pending:
+            # 冷却期内没有新消息，释放聚合器
+            if _aggregators.get(self.room_group_name) is self:
+                del _aggregators[self.room_group_name]
+            return
+        pending, self.pending = self.pending, {}
+
+        cursors = [
+            {
+                'senderId': message.get('senderId'),
+                'senderName': message.get('senderName'),
+                'timestamp': message.get('timestamp'),
+                'payload': message.get('payload'),
+            }
+            for message in pending.values()
+        ]
+        try:
+            await self.channel_layer.group_send(
+                self.room_group_name,
+                broadcast_event({
+                    'type': 'cursor_batch',
+                    'senderId': 'server',
+                    'senderName': 'System',
+                    'timestamp': datetime.now().isoformat(),
+                    'payload': {'cursors': cursors}
+                })
+            )
+            cursor_stats['frames'] += 1
+        except Exception as e:
+            cursor_stats['dropped'] += len(cursors)
+            logger.error(f"广播光标批量消息失败: {str(e)}")
+
+        # 进入冷却期，保证帧间隔不小于 min_interval
+        self._schedule(max(self.window, self.min_interval))
+
+
+async def publish_cursor(channel_layer, room_group_name, message):
+    """
+    发布一条 cursor_move 消息
+
+    未启用合并时直接转发，否则交给房间的聚合器合并后批量广播。
+    """
+    window, min_interval = get_cursor_settings()
+    if window <= 0 and min_interval <= 0:
+        cursor_stats['received'] += 1
+        await channel_layer.group_send(
+            room_group_name,
+            broadcast_event(message)
+        )
+        return
+
+    aggregator = _aggregators.get(room_group_name)
+    if aggregator is None:
+        aggregator = CursorAggregator(channel_layer, room_group_name, window, min_interval)
+        _aggregators[room_group_name] = aggregator
+    aggregator.add(message)
+
@@ -0,0 +1,143 @@
+"""
+协作设计文档模块
+
+服务器为每个活跃的协作会话维护一份权威的设计文档，客户端发送的编辑操作
+（update_obstacle / add_obstacle / remove_obstacle / update_path）会被依次
+应用到文档上，并分配单调递增的序号，用于断线重连时的增量同步。
+
+文档结构与前端 courseStore.exportCourse() 导出的JSON一致：
+    {
+        'obstacles': [...],
+        'path': {...} 或 None,
+        # 其余顶层字段（name、fieldWidth、fieldHeight 等）原样保留
+    }
+
+为了便于在不同存储后端中按字段原子更新，运行时拆分为三部分：
+- obstacles: {obstacle_id: obstacle}
+- path: 路径字典或 None
+- meta: 其余顶层字段
+"""
+
+import json
+import logging
+
+logger = logging.getLogger('django.channels')
+
+# 会修改设计文档的消息类型
+DOCUMENT_OPERATIONS = (
+    'update_obstacle',
+    'add_obstacle',
+    'remove_obstacle',
+    'update_path',
+)
+
+
+def empty_document():
+    """返回空白的设计文档（拆分形式）"""
+    return {'obstacles': {}, 'path': None, 'meta': {}}
+
+
+def split_document(course):
+    """
+    将导出格式的设计JSON拆分为 obstacles / path / meta 三部分
+
+    参数:
+        course: 导出格式的设计字典
+
+    返回:
+        dict: 拆分后的文档
+    """
+    document = empty_document()
+    if not isinstance(course, dict):
+        return document
+    for obstacle in course.get('obstacles') or []:
+        if isinstance(obstacle, dict) and obstacle.get('id') is not None:
+            document['obstacles'][str(obstacle['id'])] = obstacle
+    document['path'] = course.get('path') or None
+    document['meta'] = {
+        key: value for key, value in course.items()
+        if key not in ('obstacles', 'path')
+    }
+    return document
+
+
+def merge_document(obstacles, path, meta):
+    """将拆分的文档合并回导出格式"""
+    course = dict(meta)
+    course['obstacles'] = list(obstacles)
+    if path:
+        course['path'] = path
+    return course
+
+
+def operation_target(message_type, payload):
+    """
+    获取操作作用的文档字段
+
+    返回:
+        tuple: ('obstacle', obstacle_id) 或 ('path', None)；无法识别时返回 (None, None)
+    """
+    if not isinstance(payload, dict):
+        return None, None
+    if message_type == 'add_obstacle':
+        obstacle_id = payload.get('id')
+    elif message_type in ('update_obstacle', 'remove_obstacle'):
+        obstacle_id = payload.get('obstacleId')
+    elif message_type == 'update_path':
+        return 'path', None
+    else:
+        return None, None
+    if obstacle_id is None:
+        return None, None
+    return 'obstacle', str(obstacle_id)
+
+
+def apply_to_target(message_type, payload, current):
+    """
+    将操作应用到目标字段的当前值上
+
+    参数:
+        message_type: 消息类型
+        payload: 消息负载
+        current: 目标字段当前值（障碍物字典、路径字典或 None）
+
+    返回:
+        目标字段的新值，None 表示删除该字段
+    """
+    if message_type == 'add_obstacle':
+        return dict(payload)
+    if message_type == 'remove_obstacle':
+        return None
+    if message_type == 'update_obstacle':
+        # 与前端 courseStore.updateObstacle 一致，按顶层字段浅合并
+        obstacle = dict(current) if current else {'id': payload['obstacleId']}
+        obstacle.update(payload.get('updates') or {})
+        return obstacle
+    if message_type == 'update_path':
+        path = dict(current) if current else {}
+        path.update(payload.get('updates') or {})
+        return path
+    return current
+
+
+def load_design_document(design_id):
+    """
+    读取设计的初始文档（同步方法，需在线程中调用）
+
+    优先使用数据库中的设计文档，还没有文档的历史设计读取设计文件。
+    设计不存在、没有文件或文件无法解析时返回空白文档。
+    """
+    from .models import Design
+    try:
+        design = Design.objects.only('id', 'document', 'document_hash', 'download').get(id=design_id)
+        if design.document_hash:
+            return split_document(design.document)
+        if not design.download:
+            return empty_document()
+        with design.download.open('rb') as f:
+            return split_document(json.load(f))
+    except (Design.DoesNotExist, ValueError):
+        return empty_document()
+    except Exception as e:
+        logger.error(f"读取设计文档失败: {design_id}, 错误: {str(e)}")
+        return empty_document()
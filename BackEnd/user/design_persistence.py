@@ -0,0 +1,170 @@
+"""
+设计文档写回模块（write-behind）
+
+协作会话中的编辑操作先应用到会话存储中的权威文档，再由本模块合并后写回
+Design 记录的设计文档和摘要字段并更新 update_time（download 文件在会话结束时生成，见 design_summary）：
+- 每个设计收到编辑后安排一次延迟写回，延迟期间的编辑合并到同一次写回中，
+  每秒上百次拖动也只会产生很少的数据库/文件写入
+- 最后一个协作者离开时立即写回，并按文档重新生成 download 文件
+- 会话存储中的文档记录已落库的序号 flushed_seq，写回前后进程崩溃时，
+  未落库的编辑仍保留在存储中（Redis），可由 flush_design_journals 命令恢复
+
+配置（settings.py）：
+- COLLABORATION_PERSIST_INTERVAL: 收到编辑后延迟写回的时间（秒）
+"""
+
+import asyncio
+import logging
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .design_summary import document_fields, materialize_design_file
+from .session_store import get_session_store
+
+logger = logging.getLogger('django.channels')
+
+DEFAULT_PERSIST_INTERVAL = 30
+
+# 进程级计数器
+persist_stats = {
+    'scheduled': 0,   # 安排的延迟写回次数
+    'coalesced': 0,   # 合并到已安排写回中的编辑数
+    'flushes': 0,     # 实际写回次数
+    'failures': 0,    # 写回失败次数
+}
+
+
+def save_design_document(design_id, document):
+    """
+    将设计文档写回设计记录（同步方法，需在线程中调用）
+
+    只更新 document 和摘要字段；download 文件在会话结束时由 write_design_file 生成。
+
+    返回:
+        bool: 是否写入；设计已删除时返回 False
+    """
+    from .models import Design
+
+    try:
+        updated = Design.objects.filter(id=design_id).update(
+            **document_fields(document), update_time=timezone.now())
+    except ValueError:
+        updated = 0
+    if not updated:
+        logger.warning(f"写回设计文档时设计不存在: {design_id}")
+        return False
+    return True
+
+
+def write_design_file(design_id):
+    """
+    按已写回的设计文档重新生成 download 文件（同步方法，需在线程中调用）
+
+    文件与文档一致时不写入；设计已删除时不处理。
+    """
+    from .models import Design
+
+    design = Design.objects.filter(id=design_id).only('download', 'document', 'document_hash').first()
+    if design is not None:
+        materialize_design_file(design)
+
+
+class DesignWriteBehind:
+    """
+    进程内的设计文档写回调度器
+
+    - schedule(): 记录一次已应用的编辑，interval 秒后写回
+    - flush(): 立即写回所有未落库的编辑
+    """
+
+    def __init__(self, store, interval=DEFAULT_PERSIST_INTERVAL):
+        self.store = store
+        self.interval = interval
+        # 结构: {design_id: TimerHandle}
+        self._timers = {}
+        # 结构: {design_id: [asyncio.Lock, 持有或等待锁的写回数]}，避免同一设计并发写回；
+        # 计数归零时才删除，保证等待中的写回和之后的写回使用同一把锁
+        self._locks = {}
+
+    def schedule(self, design_id):
+        """安排一次延迟写回，已有待执行的写回时合并到其中"""
+        if design_id in self._timers:
+            persist_stats['coalesced'] += 1
+            return
+        persist_stats['scheduled'] += 1
+        self._timers[design_id] = asyncio.get_running_loop().call_later(
+            self.interval, lambda: asyncio.ensure_future(self.flush(design_id)))
+
+    async def flush(self, design_id, close=False):
+        """
+        立即写回设计文档
+
+        参数:
+            design_id: 设计ID
+            close: 会话已结束，写回成功后生成设计文件，并从会话存储中清理文档
+
+        返回:
+            bool: 没有需要写回的内容或写回成功时返回 True
+        """
+        handle = self._timers.pop(design_id, None)
+        if handle is not None:
+            handle.cancel()
+
+        entry = self._locks.setdefault(design_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                document, seq, flushed_seq = await self.store.get_journal(design_id)
+                if document is not None and seq > flushed_seq:
+                    try:
+                        saved = await database_sync_to_async(save_design_document)(
+                            design_id, document)
+                    except Exception as e:
+                        persist_stats['failures'] += 1
+                        logger.error(f"写回设计文档失败: {design_id}, 错误: {str(e)}", exc_info=True)
+                        if not close:
+                            # 稍后重试；会话已结束时文档保留在存储中，由恢复命令处理
+                            self.schedule(design_id)
+                        return False
+                    # 设计已删除时同样标记为已落库，避免反复重试
+                    await self.store.mark_flushed(design_id, seq)
+                    if saved:
+                        persist_stats['flushes'] += 1
+                        logger.info(f"设计文档已写回: {design_id}, 序号: {flushed_seq} -> {seq}")
+                if close:
+                    try:
+                        await database_sync_to_async(write_design_file)(design_id)
+                    except Exception as e:
+                        # 文档已落库，下载设计时会再次尝试生成文件
+                        logger.error(f"生成设计文件失败: {design_id}, 错误: {str(e)}", exc_info=True)
+                    await self.store.discard_journal(design_id)
+                return True
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                self._locks.pop(design_id, None)
+
+
+_design_writer = None
+
+
+def get_design_writer():
+    """获取进程内的设计文档写回调度器（单例）"""
+    global _design_writer
+    if _design_writer is None:
+        _design_writer = DesignWriteBehind(
+            get_session_store(),
+            getattr(settings, 'COLLABORATION_PERSIST_INTERVAL', DEFAULT_PERSIST_INTERVAL))
+    return _design_writer
+
+
+@receiver(setting_changed)
+def reset_design_writer(setting, **kwargs):
+    """配置变化时重新创建写回调度器"""
+    global _design_writer
+    if setting in ('COLLABORATION_SESSION_STORE', 'COLLABORATION_PERSIST_INTERVAL'):
+        _design_writer = None
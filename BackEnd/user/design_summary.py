@@ -0,0 +1,239 @@
+"""
+设计文档与摘要字段
+
+设计内容原先只保存在上传的 download 文件中，后端要统计障碍物数量、场地尺寸等都需要
+打开文件。现在 Design 同时保存：
+- document: 规范化的设计JSON（与前端 exportCourse() 格式一致）
+- document_hash: 规范化序列化结果的 SHA-256
+- 摘要字段: obstacle_count / field_width / field_height / path_length / obstacle_types，
+  公开设计库的筛选和排序直接在 SQL 中完成
+
+document 是设计内容的权威来源，download 文件是按需生成的导出：
+- 上传设计文件时解析一次，写入文档和摘要，并把文件替换为规范化的导出
+- 协作编辑的延迟写回（design_persistence）只更新数据库，会话结束时才生成文件
+- 如果文件内容的哈希（按内容寻址的文件名，见 content_storage）与 document_hash
+  不一致，协作会话结束和下载设计（download_design）时按文档重新生成文件
+  （materialize_design_file）；列表等读取接口只返回已有文件的地址
+
+历史设计使用 index_designs 命令补充文档和摘要。
+"""
+
+import hashlib
+import json
+import logging
+import math
+from collections import Counter
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+
+from .content_storage import blob_digest
+
+logger = logging.getLogger(__name__)
+
+# 超过该大小的设计文件不解析（字节）
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+
+# 摘要字段，document 为空时的默认值
+SUMMARY_DEFAULTS = {
+    'obstacle_count': 0,
+    'field_width': None,
+    'field_height': None,
+    'path_length': None,
+    'obstacle_types': {},
+}
+SUMMARY_FIELDS = tuple(SUMMARY_DEFAULTS)
+
+
+class DesignDocumentError(Exception):
+    """设计文件无法解析"""
+
+
+def serialize_document(document):
+    """
+    规范化序列化，用于计算 document_hash 和生成导出文件
+
+    按键排序，使数据库 JSON 列（MySQL 会重排键顺序）读回的文档得到相同的结果。
+    """
+    return json.dumps(document, ensure_ascii=False, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+def _dimension(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if math.isfinite(value) and value > 0 else None
+
+
+def path_length(path):
+    """路线长度（米），按前端绘制的曲线计算；没有路线时返回 None"""
+    from .course_renderer import path_polyline
+
+    if not isinstance(path, dict) or len(path.get('points') or []) < 2:
+        return None
+    length = sum(math.dist(a, b) for line in path_polyline(path['points']) for a, b in zip(line, line[1:]))
+    return round(length, 2)
+
+
+def summarize(document):
+    """
+    从设计文档中提取摘要字段
+
+    返回:
+        dict: 与 SUMMARY_DEFAULTS 相同的键
+    """
+    obstacles = [obstacle for obstacle in document.get('obstacles') or [] if isinstance(obstacle, dict)]
+    return {
+        'obstacle_count': len(obstacles),
+        'field_width': _dimension(document.get('fieldWidth')),
+        'field_height': _dimension(document.get('fieldHeight')),
+        'path_length': path_length(document.get('path')),
+        'obstacle_types': dict(Counter(str(obstacle.get('type') or 'UNKNOWN') for obstacle in obstacles)),
+    }
+
+
+def document_fields(document):
+    """
+    设计文档对应的全部字段值（document、document_hash 和摘要），
+    可以直接用于 Design.objects.filter(...).update(**fields)
+    """
+    return {
+        'document': document,
+        'document_hash': hashlib.sha256(serialize_document(document)).hexdigest(),
+        **summarize(document),
+    }
+
+
+def parse_design_file(field_file):
+    """
+    直接从文件句柄解析设计JSON，超过 DESIGN_DOCUMENT_MAX_BYTES 的文件不解析
+
+    返回:
+        dict: 设计文档
+    """
+    max_bytes = getattr(settings, 'DESIGN_DOCUMENT_MAX_BYTES', DEFAULT_MAX_BYTES)
+    if field_file.size > max_bytes:
+        raise DesignDocumentError(f'设计文件超过 {max_bytes} 字节')
+    field_file.open('rb')
+    try:
+        document = json.load(field_file)
+    except ValueError:
+        raise DesignDocumentError('设计文件不是有效的JSON')
+    finally:
+        field_file.close()
+    if not isinstance(document, dict):
+        raise DesignDocumentError('设计文件格式不正确')
+    return document
+
+
+def index_design_file(design):
+    """
+    解析设计文件，保存文档和摘要，并把文件替换为规范化的导出
+
+    文件无法解析时清空文档和摘要、保留原文件，返回 False。
+    """
+    from .models import Design
+
+    if not design.download:
+        return False
+    try:
+        document = parse_design_file(design.download)
+    except DesignDocumentError as e:
+        logger.warning(f"设计文件无法解析: 设计 {design.pk}, {str(e)}")
+        fields = {'document': None, 'document_hash': '', **SUMMARY_DEFAULTS}
+        Design.objects.filter(pk=design.pk).update(**fields)
+        for name, value in fields.items():
+            setattr(design, name, value)
+        return False
+
+    fields = document_fields(document)
+    Design.objects.filter(pk=design.pk).update(**fields)
+    for name, value in fields.items():
+        setattr(design, name, value)
+    materialize_design_file(design)
+    return True
+
+
+def is_materialized(design):
+    """
+    设计文件是否与文档一致（没有文档的设计以文件为准）
+
+    只比较哈希，列表查询可以延迟加载 document 字段。
+    """
+    if not design.document_hash:
+        return True
+    return bool(design.download) and blob_digest(design.download.name) == design.document_hash
+
+
+def materialize_design_file(design):
+    """
+    设计文件与文档不一致时按文档重新生成
+
+    文件按内容寻址保存，相同文档只保存一份；只更新 download 字段，不修改 update_time。
+
+    返回:
+        bool: 是否生成了新文件
+    """
+    from .models import Design
+
+    if is_materialized(design):
+        return False
+    # 按内容寻址的存储只使用文件名中的扩展名
+    storage = Design._meta.get_field('download').storage
+    name = storage.save('design.json', ContentFile(serialize_document(design.document)))
+    Design.objects.filter(pk=design.pk).update(download=name)
+    design.download = name
+    return True
+
+
+# 公开设计库允许的排序（ordering 参数），默认按创建时间倒序
+SUMMARY_ORDERINGS = (
+    'obstacle_count', '-obstacle_count',
+    'path_length', '-path_length',
+    '-likes_count', '-downloads_count',
+)
+
+# 数值筛选参数: (参数名, 查询条件, 类型)
+SUMMARY_FILTERS = (
+    ('min_obstacles', 'obstacle_count__gte', int),
+    ('max_obstacles', 'obstacle_count__lte', int),
+    ('min_path_length', 'path_length__gte', float),
+    ('max_path_length', 'path_length__lte', float),
+    ('field_width', 'field_width', float),
+    ('field_height', 'field_height', float),
+)
+
+
+def filter_by_summary(queryset, params):
+    """
+    按摘要字段筛选设计
+
+    参数:
+        queryset: 设计查询集
+        params: 查询参数
+            - min_obstacles / max_obstacles: 障碍物数量范围
+            - min_path_length / max_path_length: 路线长度范围（米）
+            - field_width / field_height: 场地尺寸（米）
+            - obstacle_type: 包含的障碍物类型，多个用逗号分隔（需全部包含）
+            - ordering: SUMMARY_ORDERINGS 之一
+
+    返回:
+        tuple: (查询集, 排序字段或 None)，参数无效时抛出 ValueError
+    """
+    for param, lookup, cast in SUMMARY_FILTERS:
+        value = params.get(param)
+        if value in (None, ''):
+            continue
+        try:
+            queryset = queryset.filter(**{lookup: cast(value)})
+        except ValueError:
+            raise ValueError(f'参数 {param} 必须是数字')
+
+    for obstacle_type in filter(None, (params.get('obstacle_type') or '').split(',')):
+        queryset = queryset.filter(obstacle_types__has_key=obstacle_type.strip())
+
+    ordering = params.get('ordering') or None
+    if ordering is not None and ordering not in SUMMARY_ORDERINGS:
+        raise ValueError(f"不支持的排序，支持: {', '.join(SUMMARY_ORDERINGS)}")
+    return queryset, ordering
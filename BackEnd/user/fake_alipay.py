@@ -0,0 +1,128 @@
+"""
+本地模拟的支付宝网关
+
+实现支付流程用到的 AliPay 客户端方法（创建支付、查询订单、验签），交易状态保存在
+进程内存中，用于测试和本地开发时不访问支付宝沙箱完成整个支付流程。
+settings.ALIPAY_USE_FAKE_GATEWAY 为 True 时 get_alipay_client() 返回本模块的网关。
+
+示例:
+    gateway = get_fake_alipay_gateway()
+    gateway.pay(order.order_id)          # 模拟用户完成支付
+    gateway.close(order.order_id)        # 模拟交易超时关闭
+    gateway.fail_next(2)                 # 接下来两次查询抛出网络错误
+    data, sign = gateway.notify(order.order_id)   # 构造已签名的异步通知
+"""
+
+import threading
+from urllib.parse import urlencode
+
+# 模拟签名，verify() 只接受这个值
+FAKE_SIGNATURE = 'fake-alipay-signature'
+
+
+class FakeAlipayGatewayError(Exception):
+    """模拟的网关网络错误"""
+
+
+class FakeAlipayGateway:
+    """进程内的模拟支付宝网关"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._trades = {}
+        self._failures = 0
+        self._sequence = 0
+        # 查询次数，用于测试退避
+        self.queries = 0
+
+    def reset(self):
+        """清空所有交易和计数"""
+        with self._lock:
+            self._trades.clear()
+            self._failures = 0
+            self.queries = 0
+
+    def _trade(self, out_trade_no, total_amount=None):
+        trade = self._trades.get(out_trade_no)
+        if trade is None:
+            self._sequence += 1
+            trade = self._trades[out_trade_no] = {
+                'trade_no': f'2026{self._sequence:024d}',
+                'trade_status': 'WAIT_BUYER_PAY',
+                'total_amount': total_amount or '0.00',
+            }
+        return trade
+
+    # 以下为 AliPay 客户端中被调用的方法
+
+    def api_alipay_trade_page_pay(self, subject, out_trade_no, total_amount, **kwargs):
+        with self._lock:
+            self._trade(out_trade_no, str(total_amount))
+        return urlencode({'out_trade_no': out_trade_no, 'subject': subject,
+                          'total_amount': total_amount, 'fake': 'true'})
+
+    def api_alipay_trade_query(self, out_trade_no=None, trade_no=None):
+        with self._lock:
+            self.queries += 1
+            if self._failures:
+                self._failures -= 1
+                raise FakeAlipayGatewayError('模拟的支付宝网关超时')
+            trade = self._trades.get(out_trade_no)
+            if trade is None or (trade['trade_status'] == 'WAIT_BUYER_PAY' and not trade.get('scanned')):
+                # 用户还没有打开支付页面时，支付宝返回交易不存在
+                return {'code': '40004', 'msg': 'Business Failed',
+                        'sub_code': 'ACQ.TRADE_NOT_EXIST', 'sub_msg': '交易不存在',
+                        'out_trade_no': out_trade_no}
+            return {'code': '10000', 'msg': 'Success', 'out_trade_no': out_trade_no, **trade}
+
+    def verify(self, data, signature):
+        data.pop('sign_type', None)
+        return signature == FAKE_SIGNATURE
+
+    # 以下为测试使用的方法
+
+    def scan(self, out_trade_no):
+        """模拟用户打开支付页面（交易已创建但未支付）"""
+        with self._lock:
+            self._trade(out_trade_no)['scanned'] = True
+
+    def pay(self, out_trade_no):
+        """模拟用户完成支付，返回支付宝交易号"""
+        with self._lock:
+            trade = self._trade(out_trade_no)
+            trade['scanned'] = True
+            trade['trade_status'] = 'TRADE_SUCCESS'
+            return trade['trade_no']
+
+    def close(self, out_trade_no):
+        """模拟交易超时关闭"""
+        with self._lock:
+            trade = self._trade(out_trade_no)
+            trade['scanned'] = True
+            trade['trade_status'] = 'TRADE_CLOSED'
+
+    def fail_next(self, count=1):
+        """接下来 count 次查询抛出网络错误"""
+        with self._lock:
+            self._failures = count
+
+    def notify(self, out_trade_no):
+        """构造交易当前状态的异步通知，返回 (data, sign)"""
+        with self._lock:
+            trade = self._trade(out_trade_no)
+            data = {
+                'out_trade_no': out_trade_no,
+                'trade_no': trade['trade_no'],
+                'trade_status': trade['trade_status'],
+                'total_amount': trade['total_amount'],
+                'sign_type': 'RSA2',
+            }
+        return data, FAKE_SIGNATURE
+
+
+_gateway = FakeAlipayGateway()
+
+
+def get_fake_alipay_gateway():
+    """获取进程内的模拟支付宝网关（单例）"""
+    return _gateway
@@ -0,0 +1,83 @@
+"""
+日志处理器
+
+QueueFileHandler: 非阻塞的文件日志处理器。调用线程（例如 WebSocket 消费者所在的
+事件循环）只把日志记录放入队列，由后台线程格式化并写入文件；队列满时丢弃记录
+而不是阻塞调用方。
+
+在 settings.LOGGING 中使用：
+    'file': {
+        'class': 'user.log_handlers.QueueFileHandler',
+        'filename': ...,
+        'formatter': 'verbose',
+    }
+"""
+
+import atexit
+import copy
+import logging
+import queue
+from logging.handlers import QueueListener
+
+# 默认队列容量
+DEFAULT_QUEUE_SIZE = 10000
+
+
+class QueueFileHandler(logging.Handler):
+    """
+    把日志记录交给后台线程写入文件的处理器
+
+    不继承 logging.handlers.QueueHandler：dictConfig 对 QueueHandler 子类
+    要求单独配置 handlers，这里的目标处理器由本类自己创建。
+    """
+
+    def __init__(self, filename, encoding='utf-8', queue_size=DEFAULT_QUEUE_SIZE):
+        super().__init__()
+        self.queue = queue.Queue(queue_size)
+        self.target = logging.FileHandler(filename, encoding=encoding, delay=True)
+        self.listener = QueueListener(self.queue, self.target, respect_handler_level=True)
+        self.listener.start()
+        atexit.register(self._stop_listener)
+        # 因队列已满而丢弃的记录数
+        self.dropped = 0
+
+    def setFormatter(self, fmt):
+        # 格式化（时间、级别等）在后台线程中由目标处理器完成
+        self.target.setFormatter(fmt)
+
+    def setLevel(self, level):
+        super().setLevel(level)
+        self.target.setLevel(level)
+
+    def prepare(self, record):
+        """
+        只在调用线程中合并消息参数，完整的格式化交给后台线程
+
+        参数对象（如字典）在入队后可能被修改，因此这里先转换为字符串。
+        """
+        message = record.getMessage()
+        record = copy.copy(record)
+        record.msg = message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def _stop_listener(self):
+        # 停止后台线程并写完队列中剩余的记录，可以重复调用
+        if self.listener._thread is not None:
+            self.listener.stop()
+
+    def close(self):
+        self._stop_listener()
+        self.target.close()
+        super().close()
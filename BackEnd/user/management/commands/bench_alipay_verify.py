@@ -0,0 +1,131 @@
+"""
+支付宝异步通知验签吞吐量基准
+
+对比两种获取客户端方式下 verify_alipay_callback 的每秒验签次数：
+- rebuild: 每次调用都读取密钥文件并创建客户端（原先 get_alipay_client 的行为）
+- cached: 使用进程内缓存的客户端（当前 get_alipay_client）
+
+使用临时生成的RSA密钥对和模拟的交易通知，不需要真实的支付宝密钥，也不访问网络。
+
+用法:
+    python manage.py bench_alipay_verify
+    python manage.py bench_alipay_verify --iterations 2000 --json
+"""
+
+import json
+import os
+import tempfile
+import time
+from base64 import encodebytes
+
+from Crypto.Hash import SHA256
+from Crypto.PublicKey import RSA
+from Crypto.Signature import PKCS1_v1_5
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from user.utils import build_alipay_client, get_alipay_client, reset_alipay_client
+
+
+def notify_payload():
+    """模拟支付宝 trade_status_sync 异步通知的字段（不含 sign）"""
+    return {
+        'gmt_create': '2026-06-10 08:15:30',
+        'charset': 'utf-8',
+        'seller_email': 'merchant@example.com',
+        'subject': '年付-高级会员',
+        'buyer_id': '2088102177846880',
+        'invoice_amount': '200.00',
+        'notify_id': '2026061000222081530046880512345678',
+        'fund_bill_list': '[{"amount":"200.00","fundChannel":"ALIPAYACCOUNT"}]',
+        'notify_type': 'trade_status_sync',
+        'trade_status': 'TRADE_SUCCESS',
+        'receipt_amount': '200.00',
+        'app_id': '9021000144617885',
+        'buyer_pay_amount': '200.00',
+        'sign_type': 'RSA2',
+        'seller_id': '2088102177296610',
+        'gmt_payment': '2026-06-10 08:15:35',
+        'notify_time': '2026-06-10 08:15:36',
+        'version': '1.0',
+        'out_trade_no': 'MO20260610081530123456',
+        'total_amount': '200.00',
+        'trade_no': '2026061022001446880501234567',
+        'auth_app_id': '9021000144617885',
+        'buyer_logon_id': 'abc***@example.com',
+        'point_amount': '0.00',
+    }
+
+
+def sign_payload(private_key, data):
+    """按支付宝的规则（除 sign/sign_type 外按键排序拼接）计算 RSA2 签名"""
+    message = '&'.join(f'{k}={v}' for k, v in sorted(data.items()) if k != 'sign_type')
+    signature = PKCS1_v1_5.new(private_key).sign(SHA256.new(message.encode()))
+    return encodebytes(signature).decode().replace('\n', '')
+
+
+class Command(BaseCommand):
+    help = '测量支付宝异步通知验签的吞吐量（每次创建客户端 vs 进程内缓存的客户端）'
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=500,
+                            help='每种方式验签的次数，默认 500')
+        parser.add_argument('--json', action='store_true',
+                            help='以JSON格式输出结果')
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        if iterations <= 0:
+            raise CommandError('--iterations 必须大于 0')
+
+        app_key = RSA.generate(2048)
+        alipay_key = RSA.generate(2048)
+        data = notify_payload()
+        signature = sign_payload(alipay_key, data)
+
+        with tempfile.TemporaryDirectory() as key_dir:
+            private_path = os.path.join(key_dir, 'app_private_key.pem')
+            public_path = os.path.join(key_dir, 'alipay_public_key.pem')
+            with open(private_path, 'wb') as f:
+                f.write(app_key.export_key())
+            with open(public_path, 'wb') as f:
+                f.write(alipay_key.publickey().export_key())
+
+            with override_settings(ALIPAY_APP_PRIVATE_KEY_PATH=private_path,
+                                   ALIPAY_ALIPAY_PUBLIC_KEY_PATH=public_path):
+                reset_alipay_client()
+                try:
+                    results = [
+                        self._measure('rebuild', build_alipay_client, data, signature, iterations),
+                        self._measure('cached', get_alipay_client, data, signature, iterations),
+                    ]
+                finally:
+                    reset_alipay_client()
+
+        speedup = round(results[1]['per_second'] / results[0]['per_second'], 2)
+        if options['json']:
+            self.stdout.write(json.dumps({'results': results, 'speedup': speedup}, indent=2))
+            return
+
+        self.stdout.write(f"{'方式':<10} {'次数':>8} {'每秒验签':>10} {'单次(ms)':>10}")
+        for row in results:
+            self.stdout.write(
+                f"{row['mode']:<10} {row['iterations']:>8} {row['per_second']:>10} "
+                f"{row['ms_per_call']:>10}")
+        self.stdout.write(f'加速比: {speedup}x')
+
+    @staticmethod
+    def _measure(mode, get_client, data, signature, iterations):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            # verify 会修改传入的字典（移除 sign_type），每次使用副本
+            if not get_client().verify(dict(data), signature):
+                raise CommandError(f'{mode}: 验签失败')
+        elapsed = time.perf_counter() - start
+        return {
+            'mode': mode,
+            'iterations': iterations,
+            'per_second': round(iterations / elapsed, 1),
+            'ms_per_call': round(elapsed * 1000 / iterations, 3),
+        }
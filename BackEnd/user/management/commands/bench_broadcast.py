@@ -0,0 +1,120 @@
+"""
+协作广播序列化微基准
+
+对比两种广播路径下每条消息的CPU耗时随房间人数的变化：
+- legacy: 每个接收端各自 json.dumps(message)（旧的 collaboration_message 行为）
+- encode_once: 发送端 encode_message 一次，接收端直接转发文本
+
+用法:
+    python manage.py bench_broadcast
+    python manage.py bench_broadcast --sizes 1 4 16 64 --iterations 2000 --json
+"""
+
+import json
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+
+from user.message_encoding import encode_message, orjson
+
+
+def _collaborators(count):
+    return [
+        {
+            'id': str(i),
+            'username': f'user{i}',
+            'color': '#FF6B6B',
+            'role': 'initiator' if i == 0 else 'collaborator',
+            'last_active': datetime.now().isoformat(),
+        }
+        for i in range(count)
+    ]
+
+
+def sample_messages(room_size):
+    """构建典型的协作消息"""
+    now = datetime.now().isoformat()
+    return {
+        'cursor_move': {
+            'type': 'cursor_move', 'senderId': '1', 'senderName': 'user1',
+            'sessionId': 'session', 'timestamp': now,
+            'payload': {'x': 312.5, 'y': 148.25},
+        },
+        'update_obstacle': {
+            'type': 'update_obstacle', 'senderId': '1', 'senderName': 'user1',
+            'sessionId': 'session', 'timestamp': now, 'server_timestamp': now, 'seq': 42,
+            'payload': {
+                'obstacleId': 'obstacle-1',
+                'updates': {
+                    'position': {'x': 320.0, 'y': 180.0},
+                    'rotation': 45,
+                    'poles': [{'width': 20, 'height': 120, 'color': '#FF0000'}] * 3,
+                },
+            },
+        },
+        'session_update': {
+            'type': 'session_update', 'senderId': 'server', 'senderName': 'System',
+            'sessionId': 'session', 'timestamp': now,
+            'payload': {'session': {
+                'id': 'session', 'design_id': '1', 'owner': '0', 'initiator': '0',
+                'created_at': now, 'collaborators': _collaborators(room_size),
+            }},
+        },
+    }
+
+
+class Command(BaseCommand):
+    help = '测量协作广播每条消息的序列化CPU耗时与房间人数的关系'
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1, 2, 6, 16, 64],
+                            help='房间人数列表')
+        parser.add_argument('--iterations', type=int, default=1000,
+                            help='每个组合的消息条数')
+        parser.add_argument('--json', action='store_true',
+                            help='以JSON格式输出结果')
+
+    def handle(self, *args, **options):
+        results = []
+        for room_size in options['sizes']:
+            for name, message in sample_messages(room_size).items():
+                legacy = self._measure(
+                    lambda: [json.dumps(message) for _ in range(room_size)],
+                    options['iterations'])
+                encode_once = self._measure(
+                    lambda: [text for text in [encode_message(message)] * room_size],
+                    options['iterations'])
+                results.append({
+                    'room_size': room_size,
+                    'message': name,
+                    'bytes': len(encode_message(message).encode('utf-8')),
+                    'legacy_us': round(legacy, 2),
+                    'encode_once_us': round(encode_once, 2),
+                    'speedup': round(legacy / encode_once, 2) if encode_once else None,
+                })
+
+        if options['json']:
+            self.stdout.write(json.dumps({
+                'encoder': 'orjson' if orjson is not None else 'json',
+                'iterations': options['iterations'],
+                'results': results,
+            }, indent=2))
+            return
+
+        self.stdout.write(f"编码器: {'orjson' if orjson is not None else 'json'}")
+        self.stdout.write(
+            f"{'人数':>6} {'消息类型':<16} {'字节':>7} {'legacy(us)':>12} {'encode_once(us)':>16} {'加速比':>8}")
+        for row in results:
+            self.stdout.write(
+                f"{row['room_size']:>6} {row['message']:<16} {row['bytes']:>7} "
+                f"{row['legacy_us']:>12.2f} {row['encode_once_us']:>16.2f} {row['speedup']:>8}")
+
+    @staticmethod
+    def _measure(func, iterations):
+        """返回每条消息的平均CPU耗时（微秒）"""
+        start = time.process_time()
+        for _ in range(iterations):
+            func()
+        return (time.process_time() - start) / iterations * 1e6
@@ -0,0 +1,294 @@
+"""
+协作WebSocket负载测试
+
+在当前进程内运行 ws/collaboration/<design_id>/ 的ASGI应用（JWT中间件 + 路由），
+使用内存 channel layer、内存会话存储和生成的JWT，模拟大量房间和成员同时协作：
+- 每个客户端按给定的速率和比例发送 cursor_move / update_obstacle / sync_request
+- 记录每条广播从发送到各接收端收到的扇出延迟（cursor_move 包含合并窗口）
+- 记录 sync_request 到 sync_response 的往返延迟
+
+结果为JSON（p50/p99 延迟、每秒消息数、每个连接占用的内存），便于在不同提交间对比。
+测试数据写入独立的测试数据库，结束后删除（--keepdb 保留）。
+
+用法:
+    python manage.py bench_collaboration
+    python manage.py bench_collaboration --rooms 100 --members 20 --duration 10 --output bench.json
+"""
+
+import asyncio
+import json
+import logging
+import random
+import tempfile
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings, setup_databases, teardown_databases
+
+DEFAULT_MIX = 'cursor_move=0.8,update_obstacle=0.15,sync_request=0.05'
+
+
+def parse_mix(value):
+    """解析 'cursor_move=0.8,update_obstacle=0.15' 形式的消息比例"""
+    mix = {}
+    for item in value.split(','):
+        name, _, weight = item.partition('=')
+        if name.strip() not in ('cursor_move', 'update_obstacle', 'sync_request'):
+            raise CommandError(f'不支持的消息类型: {name}')
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def percentile(values, fraction):
+    """返回已排序列表的分位数"""
+    if not values:
+        return None
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+def create_fixtures(rooms, members):
+    """创建房间数个设计和 members 个高级会员用户，返回 (用户列表, 设计ID列表)"""
+    from django.contrib.auth.models import User
+    from user.models import Design, MembershipPlan, UserProfile
+
+    plan, _ = MembershipPlan.objects.get_or_create(
+        code='premium', defaults={'name': '高级会员'})
+    plan.name = '高级会员'
+    plan.save()
+
+    users = []
+    for index in range(members):
+        user, _ = User.objects.get_or_create(username=f'bench_user_{index}')
+        UserProfile.objects.update_or_create(
+            user=user, defaults={'membership_plan': plan, 'is_premium': True})
+        users.append(user)
+
+    design_ids = [
+        Design.objects.create(
+            title=f'bench_{index}', author=users[0], image='bench.png', is_shared=True).id
+        for index in range(rooms)
+    ]
+    return users, design_ids
+
+
+class Client:
+    """一个模拟的协作客户端"""
+
+    def __init__(self, communicator, user_id, design_id, results):
+        self.communicator = communicator
+        self.user_id = str(user_id)
+        self.design_id = design_id
+        self.results = results
+        self.pending_syncs = []
+
+    async def reader(self):
+        """持续读取服务器消息并记录延迟"""
+        while True:
+            output = await self.communicator.receive_output(timeout=3600)
+            if output.get('type') == 'websocket.close':
+                return
+            text = output.get('text')
+            if text is None:
+                continue
+            now = time.perf_counter()
+            self.results['received'] += 1
+            message = json.loads(text)
+            message_type = message.get('type')
+            if message_type == 'update_obstacle' and 'bench_sent' in message:
+                self.results['latency']['update_obstacle'].append(now - message['bench_sent'])
+            elif message_type == 'cursor_move':
+                sent = (message.get('payload') or {}).get('t')
+                if sent is not None:
+                    self.results['latency']['cursor_move'].append(now - sent)
+            elif message_type == 'cursor_batch':
+                for cursor in message['payload']['cursors']:
+                    sent = (cursor.get('payload') or {}).get('t')
+                    if sent is not None:
+                        self.results['latency']['cursor_move'].append(now - sent)
+            elif message_type == 'sync_response' and self.pending_syncs:
+                self.results['latency']['sync_request'].append(now - self.pending_syncs.pop(0))
+            elif message_type == 'error':
+                self.results['errors'] += 1
+
+    async def writer(self, mix, rate, duration, obstacles):
+        """按速率发送随机类型的消息"""
+        names = list(mix)
+        weights = [mix[name] for name in names]
+        interval = 1.0 / rate
+        deadline = time.perf_counter() + duration
+        # 错开各客户端的起始时间
+        await asyncio.sleep(random.random() * interval)
+        while time.perf_counter() < deadline:
+            message_type = random.choices(names, weights)[0]
+            now = time.perf_counter()
+            if message_type == 'cursor_move':
+                message = {
+                    'type': 'cursor_move',
+                    'senderId': self.user_id,
+                    'timestamp': f'{now:.6f}',
+                    'payload': {'x': random.uniform(0, 800), 'y': random.uniform(0, 600), 't': now},
+                }
+            elif message_type == 'update_obstacle':
+                message = {
+                    'type': 'update_obstacle',
+                    'senderId': self.user_id,
+                    'bench_sent': now,
+                    'payload': {
+                        'obstacleId': f'obstacle-{random.randrange(obstacles)}',
+                        'updates': {'position': {'x': random.uniform(0, 800),
+                                                 'y': random.uniform(0, 600)}},
+                    },
+                }
+            else:
+                message = {'type': 'sync_request', 'senderId': self.user_id, 'payload': {}}
+                self.pending_syncs.append(now)
+            await self.communicator.send_to(text_data=json.dumps(message))
+            self.results['sent'] += 1
+            await asyncio.sleep(interval)
+
+
+class Command(BaseCommand):
+    help = '在进程内对协作WebSocket进行负载测试，输出延迟、吞吐量和内存占用'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, default=20, help='房间（设计）数')
+        parser.add_argument('--members', type=int, default=10, help='每个房间的成员数')
+        parser.add_argument('--duration', type=float, default=10, help='发送阶段持续时间（秒）')
+        parser.add_argument('--rate', type=float, default=5, help='每个客户端每秒发送的消息数')
+        parser.add_argument('--mix', default=DEFAULT_MIX, help=f'消息比例，默认 {DEFAULT_MIX}')
+        parser.add_argument('--obstacles', type=int, default=20, help='每个房间的障碍物数')
+        parser.add_argument('--capacity', type=int, default=10000,
+                            help='内存 channel layer 每个通道的容量')
+        parser.add_argument('--settle', type=float, default=2, help='发送结束后等待消息送达的时间（秒）')
+        parser.add_argument('--seed', type=int, default=None, help='随机数种子')
+        parser.add_argument('--output', help='将JSON结果写入文件')
+        parser.add_argument('--keepdb', action='store_true', help='保留测试数据库')
+
+    def handle(self, *args, **options):
+        mix = parse_mix(options['mix'])
+        if options['seed'] is not None:
+            random.seed(options['seed'])
+
+        # 逐条消息的 INFO 日志会主导测试结果，测试期间只保留警告以上
+        channels_logger = logging.getLogger('django.channels')
+        old_level = channels_logger.level
+        channels_logger.setLevel(logging.WARNING)
+
+        old_config = setup_databases(verbosity=0, interactive=False, keepdb=options['keepdb'])
+        try:
+            with tempfile.TemporaryDirectory() as media_root, override_settings(
+                CHANNEL_LAYERS={'default': {
+                    'BACKEND': 'channels.layers.InMemoryChannelLayer',
+                    'CONFIG': {'capacity': options['capacity']},
+                }},
+                COLLABORATION_SESSION_STORE={'BACKEND': 'user.session_store.InMemorySessionStore'},
+                CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                MEDIA_ROOT=media_root,
+            ):
+                users, design_ids = create_fixtures(options['rooms'], options['members'])
+                report = asyncio.run(self._run(users, design_ids, mix, options))
+        finally:
+            teardown_databases(old_config, verbosity=0, keepdb=options['keepdb'])
+            channels_logger.setLevel(old_level)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        self.stdout.write(output)
+
+    async def _run(self, users, design_ids, mix, options):
+        from channels.routing import URLRouter
+        from channels.testing import WebsocketCommunicator
+        from rest_framework_simplejwt.tokens import AccessToken
+
+        import user.routing
+        from user.middleware import JWTAuthMiddleware
+
+        application = JWTAuthMiddleware(URLRouter(user.routing.websocket_urlpatterns))
+        tokens = [str(AccessToken.for_user(user)) for user in users]
+        results = {
+            'sent': 0,
+            'received': 0,
+            'errors': 0,
+            'latency': {name: [] for name in ('cursor_move', 'update_obstacle', 'sync_request')},
+        }
+
+        async def open_client(design_id, index):
+            # 第一个成员是设计作者，其余成员通过链接加入
+            query = f'token={tokens[index]}' + ('&via_link=true' if index else '')
+            communicator = WebsocketCommunicator(
+                application, f'/ws/collaboration/{design_id}/?{query}')
+            connected, _ = await communicator.connect(timeout=30)
+            if not connected:
+                raise CommandError(f'连接失败: 设计 {design_id}, 成员 {index}')
+            return Client(communicator, users[index].id, design_id, results)
+
+        # 连接阶段：每个房间先连接作者，再并发连接其余成员
+        tracemalloc.start()
+        memory_before = tracemalloc.get_traced_memory()[0]
+        connect_start = time.perf_counter()
+        owners = await asyncio.gather(*(open_client(d, 0) for d in design_ids))
+        members = await asyncio.gather(*(
+            open_client(d, index)
+            for d in design_ids for index in range(1, len(users))
+        ))
+        connect_seconds = time.perf_counter() - connect_start
+        memory_per_connection = (tracemalloc.get_traced_memory()[0] - memory_before) / (
+            len(owners) + len(members))
+        tracemalloc.stop()
+        clients = owners + members
+
+        # 发送阶段
+        readers = [asyncio.ensure_future(client.reader()) for client in clients]
+        cpu_start = time.process_time()
+        send_start = time.perf_counter()
+        await asyncio.gather(*(
+            client.writer(mix, options['rate'], options['duration'], options['obstacles'])
+            for client in clients
+        ))
+        send_seconds = time.perf_counter() - send_start
+        await asyncio.sleep(options['settle'])
+        wall_seconds = time.perf_counter() - send_start
+        cpu_seconds = time.process_time() - cpu_start
+
+        for reader in readers:
+            reader.cancel()
+        await asyncio.gather(*readers, return_exceptions=True)
+        await asyncio.gather(*(client.communicator.disconnect() for client in clients),
+                             return_exceptions=True)
+
+        latency = {}
+        for name, values in results['latency'].items():
+            values.sort()
+            latency[name] = {
+                'count': len(values),
+                'p50_ms': round(percentile(values, 0.5) * 1000, 3) if values else None,
+                'p99_ms': round(percentile(values, 0.99) * 1000, 3) if values else None,
+            }
+
+        return {
+            'config': {
+                'rooms': len(design_ids),
+                'members': len(users),
+                'connections': len(clients),
+                'duration': options['duration'],
+                'rate': options['rate'],
+                'mix': mix,
+            },
+            'connect': {
+                'seconds': round(connect_seconds, 3),
+                'memory_per_connection_bytes': round(memory_per_connection),
+            },
+            'messages': {
+                'sent': results['sent'],
+                'received': results['received'],
+                'errors': results['errors'],
+                'sent_per_second': round(results['sent'] / send_seconds, 1),
+                'received_per_second': round(results['received'] / wall_seconds, 1),
+            },
+            'cpu_seconds': round(cpu_seconds, 3),
+            'latency': latency,
+        }
@@ -0,0 +1,139 @@
+"""
+协作消息线上字节数基准
+
+对比典型编辑操作在两种编码下每条消息占用的字节数：
+- json: 服务器广播给JSON客户端的文本帧（含 server_timestamp、seq）
+- compact_first: 紧凑子协议下的首条消息（附带协作者和障碍物ID的定义）
+- compact: 紧凑子协议下的后续消息（使用索引，只发送变化的字段）
+
+用法:
+    python manage.py bench_wire_format
+    python manage.py bench_wire_format --json
+"""
+
+import copy
+import json
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+
+from user.compact_protocol import CompactCodec
+from user.message_encoding import encode_message
+
+
+def _obstacle():
+    return {
+        'id': 'obstacle-1718000000000-k3j9x',
+        'type': 'SINGLE',
+        'position': {'x': 412.5, 'y': 236.75},
+        'rotation': 90,
+        'poles': [
+            {'height': 10, 'width': 120, 'color': '#8B4513'},
+        ],
+        'number': '3',
+        'numberPosition': {'x': 0, 'y': -30},
+    }
+
+
+def _message(message_type, payload, seq=None):
+    now = datetime.now().isoformat()
+    message = {
+        'type': message_type,
+        'senderId': '12',
+        'senderName': 'course_designer',
+        'sessionId': 'session_1_1718000000',
+        'timestamp': '2026-06-10T08:15:30.123Z',
+        'payload': payload,
+        'server_timestamp': now,
+    }
+    if seq is not None:
+        message['seq'] = seq
+    return message
+
+
+def typical_edits():
+    """
+    构建典型的编辑操作序列，结构: [(名称, [消息, ...])]
+
+    每个序列中第一条消息用于测量首条消息的字节数，最后一条测量后续消息的字节数。
+    """
+    obstacle = _obstacle()
+    obstacle_id = obstacle['id']
+
+    moved = []
+    for step in range(3):
+        moved.append(_message('update_obstacle', {
+            'obstacleId': obstacle_id,
+            'updates': {'position': {'x': 412.5 + step * 7.25, 'y': 236.75 + step * 3.5}},
+        }, seq=10 + step))
+
+    # 属性面板发送整个障碍物对象，其中只有 rotation 发生了变化
+    rotated = []
+    for step in range(3):
+        updates = copy.deepcopy(obstacle)
+        del updates['id']
+        updates['rotation'] = 90 + step * 15
+        rotated.append(_message('update_obstacle', {
+            'obstacleId': obstacle_id, 'updates': updates}, seq=20 + step))
+
+    added = [
+        _message('add_obstacle', dict(_obstacle(), id=f'obstacle-17180000000{step:02d}-k3j9x'),
+                 seq=30 + step)
+        for step in range(2)
+    ]
+
+    path = [
+        _message('update_path', {
+            'pathId': 'path-1',
+            'updates': {'startPoint': {'x': 80 + step, 'y': 600, 'rotation': 0}},
+        }, seq=40 + step)
+        for step in range(2)
+    ]
+
+    cursor = [
+        _message('cursor_move', {'x': 300 + step, 'y': 200.5})
+        for step in range(2)
+    ]
+
+    return [
+        ('move_obstacle', moved),
+        ('rotate_full_object', rotated),
+        ('add_obstacle', added),
+        ('update_path', path),
+        ('cursor_move', cursor),
+    ]
+
+
+class Command(BaseCommand):
+    help = '测量典型编辑操作在JSON和紧凑子协议下的线上字节数'
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--json', action='store_true',
+                            help='以JSON格式输出结果')
+
+    def handle(self, *args, **options):
+        results = []
+        for name, messages in typical_edits():
+            codec = CompactCodec()
+            frames = [codec.encode(message) for message in messages]
+            json_bytes = len(encode_message(messages[-1]).encode('utf-8'))
+            compact_bytes = len(frames[-1])
+            results.append({
+                'edit': name,
+                'json': json_bytes,
+                'compact_first': len(frames[0]),
+                'compact': compact_bytes,
+                'ratio': round(json_bytes / compact_bytes, 2),
+            })
+
+        if options['json']:
+            self.stdout.write(json.dumps({'results': results}, indent=2))
+            return
+
+        self.stdout.write(
+            f"{'编辑操作':<20} {'json':>7} {'compact首条':>12} {'compact':>9} {'压缩比':>8}")
+        for row in results:
+            self.stdout.write(
+                f"{row['edit']:<20} {row['json']:>7} {row['compact_first']:>12} "
+                f"{row['compact']:>9} {row['ratio']:>8}")
@@ -0,0 +1,37 @@
+"""
+打开或关闭协作会话的调试日志
+
+调试开关打开后，该会话的完整消息体、同步响应和协作者列表会输出到
+django.channels 日志；其他会话仍只记录采样后的事件。开关保存在缓存中，
+所有 Daphne 进程在 DEBUG_FLAG_REFRESH 秒内生效，到期后自动关闭。
+
+用法:
+    python manage.py collaboration_debug <design_id>
+    python manage.py collaboration_debug <design_id> --ttl 600
+    python manage.py collaboration_debug <design_id> --off
+"""
+
+from django.core.management.base import BaseCommand
+
+from user.collaboration_log import DEFAULT_DEBUG_TTL, DEBUG_FLAG_REFRESH, set_session_debug
+
+
+class Command(BaseCommand):
+    help = '打开或关闭某个协作会话的调试日志（完整消息体）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('design_id', help='设计ID')
+        parser.add_argument('--off', action='store_true', help='关闭调试日志')
+        parser.add_argument('--ttl', type=int, default=DEFAULT_DEBUG_TTL,
+                            help=f'调试开关有效期（秒），默认 {DEFAULT_DEBUG_TTL}')
+
+    def handle(self, *args, **options):
+        design_id = options['design_id']
+        if options['off']:
+            set_session_debug(design_id, enabled=False)
+            self.stdout.write(self.style.SUCCESS(f'已关闭调试日志: {design_id}'))
+            return
+        set_session_debug(design_id, ttl=options['ttl'])
+        self.stdout.write(self.style.SUCCESS(
+            f'已打开调试日志: {design_id}，{options["ttl"]} 秒后自动关闭'
+            f'（各进程最多 {DEBUG_FLAG_REFRESH} 秒后生效）'))
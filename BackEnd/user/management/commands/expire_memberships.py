@@ -0,0 +1,53 @@
+"""
+批量处理已到期的会员
+
+接口只计算当前有效的会员状态，不再在读请求中写资料（见 user.membership），
+本命令把已到期的资料批量推进到新状态：激活待生效的会员计划，或回到免费计划。
+建议通过定时任务每分钟执行一次；上一次执行尚未结束时（通过缓存加锁判断）直接跳过。
+
+用法:
+    python manage.py expire_memberships
+    python manage.py expire_memberships --chunk-size 200
+    python manage.py expire_memberships --dry-run
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from user.membership import DEFAULT_TRANSITION_CHUNK_SIZE, apply_membership_transitions
+from user.utils import get_shared_cache
+
+LOCK_KEY = 'expire_memberships:lock'
+
+# 锁的最长持有时间（秒），进程异常退出时锁会在此之后自动释放
+LOCK_TIMEOUT = 300
+
+
+class Command(BaseCommand):
+    help = '批量处理已到期的会员：激活待生效计划或回到免费计划'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_TRANSITION_CHUNK_SIZE,
+                            help=f'每批处理的资料数，默认 {DEFAULT_TRANSITION_CHUNK_SIZE}')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='只统计将要处理的资料数，不修改数据库')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] <= 0:
+            raise CommandError('--chunk-size 必须大于 0')
+
+        if options['dry_run']:
+            counts = apply_membership_transitions(dry_run=True)
+            self.stdout.write(
+                f"将激活待生效计划: {counts['promoted']}，将回到免费计划: {counts['expired']}")
+            return
+
+        cache = get_shared_cache()
+        if not cache.add(LOCK_KEY, 1, LOCK_TIMEOUT):
+            self.stdout.write(self.style.WARNING('上一次执行尚未结束，跳过'))
+            return
+        try:
+            counts = apply_membership_transitions(chunk_size=options['chunk_size'])
+        finally:
+            cache.delete(LOCK_KEY)
+        self.stdout.write(self.style.SUCCESS(
+            f"激活待生效计划: {counts['promoted']}，回到免费计划: {counts['expired']}"))
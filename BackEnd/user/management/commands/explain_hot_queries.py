@@ -0,0 +1,184 @@
+"""
+检查热点查询的执行计划
+
+对 user/views.py 和 feedback/views.py 中的热点查询集执行 EXPLAIN，
+发现全表扫描时命令失败（退出码非 0），可以放在部署流程或 CI 中，
+防止新增的查询或删除的索引让热点接口退化为全表扫描。
+
+MySQL 的优化器会根据表的数据量选择执行计划，表很小时即使有索引也可能选择全表扫描，
+因此应在数据量接近生产的数据库（例如预发布环境）上执行，并先执行 ANALYZE TABLE。
+
+SQLite 不会对 Django 生成的裸布尔条件（WHERE "is_shared"）使用索引，
+在 SQLite 上检查时按 MySQL 后端的写法改写为 "is_shared" = 1 后再执行 EXPLAIN。
+
+用法:
+    python manage.py explain_hot_queries
+    python manage.py explain_hot_queries --verbose
+    python manage.py explain_hot_queries --database replica
+"""
+
+import json
+import re
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, models
+from django.db.models import Count
+from django.utils import timezone
+
+from feedback.metrics import ORDER_METRICS, USER_METRICS, paid_orders
+from feedback.models import DashboardMetric, Feedback
+from feedback.timeseries import add_months, grouped_queryset, month_start, period_buckets
+from user.models import CustomObstacle, Design, DesignLike, MembershipOrder, UserProfile
+
+
+def hot_queries(user_id, now):
+    """
+    返回热点查询列表: [(名称, 查询集, 允许全表扫描的原因或 None)]
+
+    查询条件与视图中的写法保持一致，参数使用示例值；仪表盘趋势直接使用
+    feedback.metrics 中的分组查询。
+    """
+    today = timezone.localdate(now)
+    current = month_start(today)
+    first = add_months(current, -5)
+    closed_months = period_buckets('month', first, current)
+    return [
+        # user/views.py
+        ('DesignViewSet.shared_designs',
+         Design.objects.filter(is_shared=True).order_by('-create_time', '-id')[:9], None),
+        ('DesignViewSet.my_designs',
+         Design.objects.filter(author_id=user_id)[:9], None),
+        ('DesignViewSet.create 存储限制计数',
+         Design.objects.filter(author_id=user_id), None),
+        ('DesignSerializer.get_is_liked',
+         DesignLike.objects.filter(design_id=1, user_id=user_id), None),
+        ('CustomObstacleViewSet.list',
+         CustomObstacle.objects.filter(user_id=user_id).order_by('-created_at'), None),
+        ('CustomObstacleViewSet.get_shared_obstacles',
+         CustomObstacle.objects.filter(is_shared=True).exclude(user_id=user_id)
+         .order_by('-created_at', '-id')[:10], None),
+        ('get_user_orders',
+         MembershipOrder.objects.filter(user_id=user_id).order_by('-created_at')[:10], None),
+        ('get_order_status',
+         MembershipOrder.objects.filter(order_id='0', user_id=user_id), None),
+        # feedback/views.py
+        ('FeedbackViewSet.list',
+         Feedback.objects.all()[:9], None),
+        # FeedbackIndexView 趋势（feedback.metrics.get_monthly_series）
+        ('get_monthly_series 月度汇总',
+         DashboardMetric.objects.filter(period='month', bucket__gte=first, bucket__lt=current), None),
+        ('current_month_metrics 当月每日汇总',
+         DashboardMetric.objects.filter(period='day', bucket__gte=current, bucket__lt=today), None),
+        ('aggregate_buckets 订单（补齐月度汇总）',
+         grouped_queryset(paid_orders(), 'payment_time', 'month', closed_months, **ORDER_METRICS), None),
+        ('aggregate_buckets 订单（当天）',
+         grouped_queryset(paid_orders(), 'payment_time', 'day', [today], **ORDER_METRICS), None),
+        ('current_month_metrics 当月新增会员',
+         grouped_queryset(paid_orders(), 'payment_time', 'month', [current],
+                          new_premium_users=ORDER_METRICS['new_premium_users']), None),
+        ('aggregate_buckets 新增用户',
+         grouped_queryset(User.objects.all(), 'date_joined', 'day', [today], **USER_METRICS),
+         'auth_user 由 django.contrib.auth 管理，date_joined 没有索引'),
+        # FeedbackIndexView 其他数据
+        ('FeedbackIndexView 当前会员数',
+         UserProfile.objects.filter(is_premium=True, premium_expire_date__gt=now), None),
+        ('FeedbackIndexView 会员计划分布',
+         UserProfile.objects.filter(membership_plan__isnull=False, premium_expire_date__gt=now)
+         .values('membership_plan__name').annotate(value=Count('id'))
+         .order_by('membership_plan__monthly_price'),
+         '按会员计划分组统计有效会员，条件不含 is_premium，无法使用 profile_premium_expire_idx'),
+        ('FeedbackIndexView 支付渠道分布',
+         paid_orders().values('payment_channel').annotate(count=Count('id')), None),
+        ('FeedbackIndexView 最近订单',
+         MembershipOrder.objects.select_related('user').order_by('-created_at')[:10], None),
+        ('FeedbackIndexView 总用户数',
+         User.objects.all(), '统计全部用户'),
+    ]
+
+
+# SQLite: "SCAN user_design" 为全表扫描，"SCAN ... USING INDEX" 为索引扫描
+SQLITE_SCAN = re.compile(r'\bSCAN (?:TABLE )?(\w+)(?P<index> USING (?:COVERING )?INDEX)?')
+
+
+def _sqlite_explain(queryset):
+    """将裸布尔条件改写为 = 1 后执行 EXPLAIN QUERY PLAN"""
+    sql, params = queryset.query.sql_with_params()
+    select, where, rest = sql.partition(' WHERE ')
+    if where:
+        meta = queryset.model._meta
+        for field in meta.concrete_fields:
+            if isinstance(field, models.BooleanField):
+                column = re.escape(f'"{meta.db_table}"."{field.column}"')
+                rest = re.sub(column + r'(?!\s*(?:=|IS\b|IN\b))', r'\g<0> = 1', rest)
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + select + where + rest, params)
+        return '\n'.join(' '.join(str(value) for value in row) for row in cursor.fetchall())
+
+
+def _walk(node):
+    """遍历 JSON 执行计划中的所有字典"""
+    if isinstance(node, dict):
+        yield node
+        for value in node.values():
+            yield from _walk(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from _walk(value)
+
+
+def full_table_scans(queryset, vendor):
+    """
+    返回 (执行计划, 被全表扫描的表名列表)
+
+    参数:
+        queryset: 查询集
+        vendor: 数据库类型（connection.vendor）
+    """
+    if vendor == 'mysql':
+        plan = queryset.explain(format='JSON')
+        tables = [node.get('table_name') for node in _walk(json.loads(plan))
+                  if node.get('access_type') == 'ALL']
+    elif vendor == 'postgresql':
+        plan = queryset.explain(format='JSON')
+        tables = [node.get('Relation Name') for node in _walk(json.loads(plan))
+                  if node.get('Node Type') == 'Seq Scan']
+    elif vendor == 'sqlite':
+        plan = _sqlite_explain(queryset)
+        tables = [match.group(1) for match in SQLITE_SCAN.finditer(plan)
+                  if not match.group('index')]
+    else:
+        raise CommandError(f'不支持的数据库类型: {vendor}')
+    return plan, tables
+
+
+class Command(BaseCommand):
+    help = '对热点查询执行 EXPLAIN，存在全表扫描时失败'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default', help='数据库别名')
+        parser.add_argument('--verbose', action='store_true', help='输出完整的执行计划')
+
+    def handle(self, *args, **options):
+        database = options['database']
+        vendor = connections[database].vendor
+        user_id = User.objects.using(database).values_list('id', flat=True).first() or 1
+
+        failures = []
+        for name, queryset, allowed in hot_queries(user_id, timezone.now()):
+            plan, tables = full_table_scans(queryset.using(database), vendor)
+            if not tables:
+                self.stdout.write(self.style.SUCCESS(f'[OK]   {name}'))
+            elif allowed:
+                self.stdout.write(self.style.WARNING(
+                    f'[SKIP] {name}: 全表扫描 {", ".join(tables)}（{allowed}）'))
+            else:
+                failures.append(name)
+                self.stdout.write(self.style.ERROR(f'[SCAN] {name}: 全表扫描 {", ".join(tables)}'))
+            if options['verbose'] or (tables and not allowed):
+                self.stdout.write(f'       {queryset.query}')
+                self.stdout.write('\n'.join(f'       {line}' for line in plan.splitlines()))
+
+        if failures:
+            raise CommandError(f'{len(failures)} 个热点查询存在全表扫描: {", ".join(failures)}')
+        self.stdout.write(self.style.SUCCESS('所有热点查询均使用索引'))
@@ -0,0 +1,57 @@
+"""
+写回会话存储中未落库的协作编辑
+
+协作编辑由 design_persistence 模块延迟写回设计记录。Daphne 进程在写回前
+崩溃时，未落库的编辑仍保留在会话存储中，本命令将其写回并清理已结束的会话文档。
+建议通过定时任务每隔几分钟执行一次。
+
+用法:
+    python manage.py flush_design_journals
+    python manage.py flush_design_journals --dry-run
+"""
+
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from user.design_persistence import DesignWriteBehind
+from user.session_store import get_session_store
+
+
+class Command(BaseCommand):
+    help = '将会话存储中未落库的协作编辑写回设计记录'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='只列出需要写回的设计，不执行写回')
+
+    def handle(self, *args, **options):
+        flushed, failed, pending = asyncio.run(self._run(options['dry_run']))
+        if options['dry_run']:
+            self.stdout.write(f'需要写回的设计: {len(pending)} {pending}')
+            return
+        self.stdout.write(self.style.SUCCESS(f'写回完成: {flushed} 个设计'))
+        if failed:
+            self.stdout.write(self.style.ERROR(f'写回失败: {failed}'))
+
+    @staticmethod
+    async def _run(dry_run):
+        store = get_session_store()
+        writer = DesignWriteBehind(store)
+        flushed, failed, pending = 0, [], []
+        for design_id in await store.list_journals():
+            _, seq, flushed_seq = await store.get_journal(design_id)
+            closed = not await store.session_exists(design_id)
+            if seq <= flushed_seq:
+                # 已全部落库，只清理会话已结束的文档
+                if closed and not dry_run:
+                    await store.discard_journal(design_id)
+                continue
+            pending.append(design_id)
+            if dry_run:
+                continue
+            if await writer.flush(design_id, close=closed):
+                flushed += 1
+            else:
+                failed.append(design_id)
+        return flushed, failed, pending
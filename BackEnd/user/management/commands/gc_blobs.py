@@ -0,0 +1,35 @@
+"""
+清理没有引用的设计文件
+
+根据设计记录（文件字段、缩略图对应的原图）和未完成的渲染任务重新统计按内容寻址
+保存的文件（见 user.content_storage）的引用数，删除没有引用、且超过保护期没有被保存过的文件。可以通过定时任务每天执行一次。
+
+用法:
+    python manage.py gc_blobs
+    python manage.py gc_blobs --dry-run
+    python manage.py gc_blobs --grace-period 3600
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from user.content_storage import collect_garbage
+
+
+class Command(BaseCommand):
+    help = '清理没有引用的设计文件'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='只统计可以清理的文件，不删除')
+        parser.add_argument('--grace-period', type=int, default=None,
+                            help='保护期（秒），默认 CONTENT_STORAGE_GC_GRACE_PERIOD')
+
+    def handle(self, *args, **options):
+        if options['grace_period'] is not None and options['grace_period'] < 0:
+            raise CommandError('--grace-period 不能小于 0')
+
+        counts = collect_garbage(grace_period=options['grace_period'], dry_run=options['dry_run'])
+        action = '可清理' if options['dry_run'] else '已清理'
+        self.stdout.write(self.style.SUCCESS(
+            f"共 {counts['blobs']} 个文件，被引用 {counts['referenced']} 个，"
+            f"{action} {counts['deleted']} 个（{counts['freed_bytes'] / 1024 / 1024:.1f} MB）"))
@@ -0,0 +1,41 @@
+"""
+批量生成设计图片缩略图
+
+默认只处理还没有缩略图的设计（image_hash 为空，例如上线前上传的设计）；
+修改 DESIGN_IMAGE_RENDITIONS 的尺寸后使用 --all 为所有设计生成新尺寸，已存在的文件不会重复生成。
+
+用法:
+    python manage.py generate_design_renditions
+    python manage.py generate_design_renditions --all
+"""
+
+from django.core.management.base import BaseCommand
+
+from user.models import Design
+from user.renditions import ensure_renditions
+
+
+class Command(BaseCommand):
+    help = '为设计图片生成缩略图'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='检查所有设计（修改缩略图尺寸后使用），默认只处理没有缩略图的设计')
+
+    def handle(self, *args, **options):
+        designs = Design.objects.exclude(image='').order_by('id')
+        if not options['all']:
+            designs = designs.filter(image_hash='')
+
+        generated, failed = 0, []
+        for design in designs.only('id', 'image', 'image_hash').iterator(chunk_size=200):
+            try:
+                ensure_renditions(design)
+                generated += 1
+            except Exception as e:
+                failed.append(design.id)
+                self.stderr.write(f'设计 {design.id} 生成失败: {str(e)}')
+
+        self.stdout.write(self.style.SUCCESS(f'处理完成: {generated} 个设计'))
+        if failed:
+            self.stdout.write(self.style.ERROR(f'生成失败: {failed}'))
@@ -0,0 +1,44 @@
+"""
+为设计补充设计文档和摘要字段
+
+解析设计文件，把规范化的设计文档和摘要（障碍物数量、场地尺寸、路线长度、障碍物类型）
+保存到设计记录中（见 user.design_summary）。默认只处理还没有文档的设计（上线前保存的设计）；
+修改摘要规则后使用 --all 重新生成所有设计的摘要。
+
+用法:
+    python manage.py index_designs
+    python manage.py index_designs --all
+"""
+
+from django.core.management.base import BaseCommand
+
+from user.design_summary import document_fields, index_design_file
+from user.models import Design
+
+
+class Command(BaseCommand):
+    help = '解析设计文件，保存设计文档和摘要'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='重新生成所有设计的摘要，默认只处理没有设计文档的设计')
+
+    def handle(self, *args, **options):
+        indexed, failed = 0, []
+
+        if options['all']:
+            # 已有文档的设计直接按文档重新计算摘要，不读取文件
+            for design in Design.objects.exclude(document_hash='').only('id', 'document').iterator(chunk_size=200):
+                Design.objects.filter(pk=design.pk).update(**document_fields(design.document))
+                indexed += 1
+
+        designs = Design.objects.filter(document_hash='').exclude(download='').exclude(download=None)
+        for design in designs.only('id', 'download', 'document_hash').order_by('id').iterator(chunk_size=200):
+            if index_design_file(design):
+                indexed += 1
+            else:
+                failed.append(design.id)
+
+        self.stdout.write(self.style.SUCCESS(f'处理完成: {indexed} 个设计'))
+        if failed:
+            self.stdout.write(self.style.ERROR(f'设计文件无法解析: {failed}'))
@@ -0,0 +1,97 @@
+"""
+把历史设计文件迁移到按内容寻址的存储
+
+设计图片和设计文件原先保存在 media/user_<id>/ 下，每次保存一个新文件。本命令读取设计记录
+引用的历史文件，按内容哈希保存到 blobs/（相同内容只保存一份）并更新记录。
+指定 --delete-originals 时，迁移完成后删除 user_* 目录下所有没有被设计记录引用的文件
+（已迁移的原文件和从未被清理的旧版本）。
+
+用法:
+    python manage.py migrate_design_files --dry-run
+    python manage.py migrate_design_files
+    python manage.py migrate_design_files --delete-originals
+"""
+
+import hashlib
+
+from django.core.files import File
+from django.core.management.base import BaseCommand
+
+from user.content_storage import blob_digest, get_content_storage, is_referenced
+from user.models import Design
+
+LEGACY_PREFIX = 'user_'
+FIELDS = ('image', 'download')
+
+
+def _walk(storage, path):
+    directories, files = storage.listdir(path)
+    for filename in files:
+        yield f'{path}/{filename}'
+    for directory in directories:
+        yield from _walk(storage, f'{path}/{directory}')
+
+
+class Command(BaseCommand):
+    help = '把历史设计文件迁移到按内容寻址的存储'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='只统计迁移后节省的空间，不修改')
+        parser.add_argument('--delete-originals', action='store_true',
+                            help='删除 user_* 目录下没有被设计记录引用的文件')
+
+    def handle(self, *args, **options):
+        storage = get_content_storage()
+        dry_run = options['dry_run']
+
+        migrated, legacy_bytes, missing = 0, 0, []
+        digests = {}
+        for design in Design.objects.only('id', *FIELDS).order_by('id').iterator(chunk_size=200):
+            updates = {}
+            for field in FIELDS:
+                name = getattr(design, field).name
+                if not name or blob_digest(name):
+                    continue
+                if not storage.exists(name):
+                    missing.append(f'{design.id}:{field}')
+                    continue
+                with storage.open(name, 'rb') as f:
+                    if dry_run:
+                        digest = hashlib.sha256()
+                        for chunk in f.chunks():
+                            digest.update(chunk)
+                        digests[digest.hexdigest()] = storage.size(name)
+                    else:
+                        updates[field] = storage.save(name, File(f, name=name))
+                        digests[blob_digest(updates[field])] = storage.size(updates[field])
+                legacy_bytes += storage.size(name)
+                migrated += 1
+            if updates:
+                Design.objects.filter(pk=design.pk).update(**updates)
+
+        action = '待迁移' if dry_run else '已迁移'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} {migrated} 个文件（{legacy_bytes / 1024 / 1024:.1f} MB），'
+            f'去重后 {len(digests)} 个（{sum(digests.values()) / 1024 / 1024:.1f} MB）'))
+        if missing:
+            self.stdout.write(self.style.WARNING(f'文件不存在: {missing}'))
+
+        if options['delete_originals']:
+            self._delete_originals(storage, dry_run)
+
+    def _delete_originals(self, storage, dry_run):
+        count, size = 0, 0
+        directories = [d for d in storage.listdir('')[0] if d.startswith(LEGACY_PREFIX)] if storage.exists('') else []
+        for directory in directories:
+            for name in _walk(storage, directory):
+                # 试运行时记录还没有更新，只统计没有被引用的文件
+                if is_referenced(name):
+                    continue
+                count += 1
+                size += storage.size(name)
+                if not dry_run:
+                    storage.delete(name)
+        action = '可删除' if dry_run else '已删除'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action}没有引用的历史文件 {count} 个（{size / 1024 / 1024:.1f} MB）'))
@@ -0,0 +1,63 @@
+"""
+查询待支付订单的支付宝交易状态
+
+支付结果主要由支付宝异步通知更新；本命令补充处理通知丢失或延迟的订单：
+分批查询到了查询时间的待支付订单，支付成功的更新订单和会员状态，交易关闭的取消订单，
+仍未支付的按指数退避安排下次查询（见 user.order_reconciler）。
+
+可以通过定时任务每分钟执行一次，也可以用 --loop 常驻运行（新订单创建后几秒即开始查询）。
+
+用法:
+    python manage.py reconcile_orders
+    python manage.py reconcile_orders --loop
+    python manage.py reconcile_orders --loop --interval 5 --batch-size 100
+"""
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from user.order_reconciler import DEFAULT_BATCH_SIZE, reconcile_pending_orders
+
+DEFAULT_INTERVAL = 2
+
+
+class Command(BaseCommand):
+    help = '查询待支付订单的支付宝交易状态并更新订单和会员'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help='常驻运行，每隔 --interval 秒查询一批')
+        parser.add_argument('--interval', type=float,
+                            default=getattr(settings, 'ORDER_RECONCILE_INTERVAL', DEFAULT_INTERVAL),
+                            help='常驻运行时每轮之间的间隔（秒）')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='每批查询的订单数，默认 ORDER_RECONCILE_BATCH_SIZE')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] is not None and options['batch_size'] <= 0:
+            raise CommandError('--batch-size 必须大于 0')
+
+        if not options['loop']:
+            self._report(reconcile_pending_orders(batch_size=options['batch_size']))
+            return
+
+        batch_size = options['batch_size'] or getattr(
+            settings, 'ORDER_RECONCILE_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+        self.stdout.write(f"开始查询待支付订单，间隔 {options['interval']} 秒，按 Ctrl+C 停止")
+        try:
+            while True:
+                counts = reconcile_pending_orders(batch_size=batch_size)
+                if counts['checked']:
+                    self._report(counts)
+                # 一批查满时说明还有到期的订单，立即查询下一批
+                if counts['checked'] < batch_size:
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write('已停止')
+
+    def _report(self, counts):
+        self.stdout.write(self.style.SUCCESS(
+            f"查询 {counts['checked']} 个订单: 已支付 {counts['paid']}，已关闭 {counts['closed']}，"
+            f"未支付 {counts['pending']}，查询失败 {counts['failed']}"))
@@ -0,0 +1,58 @@
+"""
+在服务端渲染设计图
+
+根据设计文件（JSON）生成 PNG/PDF，用于管理员预览、离线打印或在修改渲染规则后预先生成。
+默认保存到存储的渲染缓存中（与下载接口共用），指定 --output 时写入本地文件。
+
+用法:
+    python manage.py render_design 12
+    python manage.py render_design 12 --format pdf --dpi 300
+    python manage.py render_design 12 --format png --output /tmp/design-12.png
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from user.course_renderer import (
+    DEFAULT_DPI, FORMATS, RenderError, read_design_file, render_content, render_design, validate_dpi)
+from user.models import Design
+
+
+class Command(BaseCommand):
+    help = '根据设计文件渲染 PNG/PDF'
+
+    def add_arguments(self, parser):
+        parser.add_argument('design_ids', nargs='+', type=int, help='设计ID')
+        parser.add_argument('--format', choices=sorted(FORMATS), default='png', help='输出格式')
+        parser.add_argument('--dpi', type=int, default=DEFAULT_DPI, help='输出分辨率')
+        parser.add_argument('--output', help='写入本地文件（只能指定一个设计）')
+
+    def handle(self, *args, **options):
+        if options['output'] and len(options['design_ids']) > 1:
+            raise CommandError('--output 只能和一个设计ID一起使用')
+
+        failed = []
+        for design_id in options['design_ids']:
+            try:
+                design = Design.objects.get(pk=design_id)
+                if options['output']:
+                    self._write(design, options)
+                    continue
+                path, cached = render_design(design, options['format'], options['dpi'])
+                self.stdout.write(self.style.SUCCESS(
+                    f"设计 {design_id}: {path}{'（已存在）' if cached else ''}"))
+            except Design.DoesNotExist:
+                failed.append(design_id)
+                self.stderr.write(f'设计 {design_id} 不存在')
+            except RenderError as e:
+                failed.append(design_id)
+                self.stderr.write(f'设计 {design_id} 渲染失败: {str(e)}')
+
+        if failed:
+            raise CommandError(f'渲染失败: {failed}')
+
+    def _write(self, design, options):
+        dpi = validate_dpi(options['dpi'])
+        content, _ = read_design_file(design)
+        with open(options['output'], 'wb') as f:
+            f.write(render_content(content, options['format'], dpi))
+        self.stdout.write(self.style.SUCCESS(f"设计 {design.pk}: 已写入 {options['output']}"))
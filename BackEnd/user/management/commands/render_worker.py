@@ -0,0 +1,66 @@
+"""
+执行设计图渲染任务
+
+download_design 请求尚未渲染的 PDF/PNG 时创建渲染任务（见 user.render_jobs），
+本命令领取任务并在进程池中渲染，完成后推送给等待的 WebSocket 连接。
+可以在多台机器上同时运行多个 worker。
+
+用法:
+    python manage.py render_worker
+    python manage.py render_worker --processes 4
+    python manage.py render_worker --once
+"""
+
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from user.render_jobs import DEFAULT_PROCESSES, RenderWorker, process_render_jobs
+
+DEFAULT_INTERVAL = 1
+
+
+class Command(BaseCommand):
+    help = '在进程池中执行设计图渲染任务'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int,
+                            default=getattr(settings, 'RENDER_WORKER_PROCESSES', DEFAULT_PROCESSES),
+                            help='渲染进程数，默认 RENDER_WORKER_PROCESSES')
+        parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL,
+                            help='没有任务时查询新任务的间隔（秒）')
+        parser.add_argument('--once', action='store_true',
+                            help='只领取一批任务，全部完成后退出')
+
+    def handle(self, *args, **options):
+        processes = options['processes']
+        if processes <= 0:
+            raise CommandError('--processes 必须大于 0')
+        # 子进程初始化 Django（spawn/forkserver 启动方式下渲染需要读取 settings）
+        executor_factory = partial(ProcessPoolExecutor, max_workers=processes, initializer=django.setup)
+
+        if options['once']:
+            count = process_render_jobs(executor_factory, processes)
+            self.stdout.write(self.style.SUCCESS(f'处理完成: {count} 个任务'))
+            return
+
+        worker = RenderWorker(executor_factory, processes)
+        self.stdout.write(f'开始执行渲染任务，{processes} 个进程，按 Ctrl+C 停止')
+        try:
+            while True:
+                worker.fill()
+                if worker.running:
+                    # 有任务完成后立即补充新任务，没有完成时也按间隔领取新任务补满进程
+                    worker.wait(timeout=options['interval'])
+                else:
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write('正在等待执行中的任务完成...')
+            worker.drain()
+            self.stdout.write('已停止')
+        finally:
+            worker.shutdown()
@@ -0,0 +1,315 @@
+"""
+会员状态计算模块
+
+会员到期和待生效计划的激活原先由 check_and_update_membership 在登录、创建设计、
+check_premium、my_profile 等接口中"读取-修改-保存"完成，前端轮询 check_premium
+时每次请求都可能写数据库。本模块把两部分分开：
+
+- 读路径：get_membership() 根据资料中保存的状态实时计算当前有效的会员状态
+  （到期后激活待生效计划，或回到免费计划），不写数据库；结果缓存在本次请求的
+  user 对象上，同一请求内多次调用只查询一次
+- 写路径：apply_membership_transitions() 由定时任务调用，每种状态变化执行一条
+  UPDATE，把已到期的资料批量推进到新状态；支付回调等需要修改资料的地方先用
+  MembershipStatus.apply_to() 把有效状态写入资料再修改
+"""
+
+import logging
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .access_cache import invalidate_user_access
+from .models import MembershipPlan, UserProfile
+from .plan_registry import get_plan_registry
+
+logger = logging.getLogger(__name__)
+
+# 免费用户的默认存储限制（设计数量）
+FREE_STORAGE_LIMIT = 5
+
+FREE_PLAN_DEFAULTS = {
+    'name': '免费用户',
+    'monthly_price': 0,
+    'yearly_price': 0,
+    'storage_limit': FREE_STORAGE_LIMIT,
+    'custom_obstacle_limit': 10,
+    'description': '免费用户计划，限制存储5个设计',
+}
+
+# 批量处理到期会员时每批的资料数
+DEFAULT_TRANSITION_CHUNK_SIZE = 500
+
+# 缓存在 user 对象上的属性名
+_CACHE_ATTR = '_membership_status'
+
+
+def get_free_plan():
+    """获取免费计划（只读），不存在时返回 None"""
+    return get_plan_registry().by_code('free')
+
+
+class MembershipStatus:
+    """
+    用户当前有效的会员状态
+
+    属性与 UserProfile 中的会员字段同名，另有:
+        transition: 相对于已保存状态的变化，None / 'promoted'（激活待生效计划）/
+                    'expired'（回到免费计划）
+    """
+
+    __slots__ = ('profile', 'is_premium', 'premium_expire_date', 'membership_plan',
+                 'storage_limit', 'pending_membership_plan', 'pending_membership_start_date',
+                 'pending_membership_expire_date', 'transition', 'now')
+
+    def __init__(self, profile, now):
+        self.profile = profile
+        self.now = now
+        self.transition = None
+        if profile is None:
+            self.is_premium = False
+            self.premium_expire_date = None
+            self.membership_plan = None
+            self.storage_limit = FREE_STORAGE_LIMIT
+            self.pending_membership_plan = None
+            self.pending_membership_start_date = None
+            self.pending_membership_expire_date = None
+            return
+        for name in ('is_premium', 'premium_expire_date', 'membership_plan', 'storage_limit',
+                     'pending_membership_plan', 'pending_membership_start_date',
+                     'pending_membership_expire_date'):
+            setattr(self, name, getattr(profile, name))
+        self._advance()
+
+    def _expired(self):
+        return (self.is_premium and self.premium_expire_date is not None
+                and self.premium_expire_date <= self.now)
+
+    def _advance(self):
+        """与 apply_membership_transitions 的顺序一致：先激活待生效计划，仍已到期则回到免费计划"""
+        if self._expired() and self.pending_membership_plan is not None:
+            self.membership_plan = self.pending_membership_plan
+            self.premium_expire_date = self.pending_membership_expire_date
+            if self.membership_plan.storage_limit:
+                self.storage_limit = self.membership_plan.storage_limit
+            self.pending_membership_plan = None
+            self.pending_membership_start_date = None
+            self.pending_membership_expire_date = None
+            self.transition = 'promoted'
+        if self._expired():
+            self.is_premium = False
+            self.membership_plan = get_free_plan()
+            self.storage_limit = FREE_STORAGE_LIMIT
+            self.transition = 'expired'
+
+    def is_premium_active(self):
+        """会员是否有效"""
+        return (self.is_premium and self.premium_expire_date is not None
+                and self.premium_expire_date > self.now)
+
+    def get_storage_limit(self):
+        """获取存储限制，与 UserProfile.get_storage_limit 一致"""
+        if self.is_premium_active() and self.membership_plan:
+            return self.membership_plan.storage_limit
+        return FREE_STORAGE_LIMIT
+
+    def get_custom_obstacle_limit(self):
+        """自定义障碍物数量限制，None 表示无限制"""
+        if self.membership_plan:
+            return self.membership_plan.custom_obstacle_limit
+        return FREE_PLAN_DEFAULTS['custom_obstacle_limit']
+
+    def apply_to(self, profile):
+        """把有效状态写入资料对象（不保存），用于修改资料之前"""
+        for name in ('is_premium', 'premium_expire_date', 'membership_plan', 'storage_limit',
+                     'pending_membership_plan', 'pending_membership_start_date',
+                     'pending_membership_expire_date'):
+            setattr(profile, name, getattr(self, name))
+        return profile
+
+
+def evaluate_membership(profile, now=None):
+    """根据资料计算当前有效的会员状态（不写数据库）"""
+    return MembershipStatus(profile, now or timezone.now())
+
+
+def get_membership(user):
+    """
+    获取用户当前有效的会员状态，同一个 user 对象（即同一请求）只计算一次
+
+    用户没有资料时按免费用户处理，不会创建资料。
+    """
+    status = getattr(user, _CACHE_ATTR, None)
+    if status is None:
+        profile = UserProfile.objects.select_related(
+            'membership_plan', 'pending_membership_plan').filter(user_id=user.pk).first()
+        status = evaluate_membership(profile)
+        setattr(user, _CACHE_ATTR, status)
+    return status
+
+
+def forget_membership(user):
+    """资料被修改后清除 user 对象上缓存的会员状态"""
+    if hasattr(user, _CACHE_ATTR):
+        delattr(user, _CACHE_ATTR)
+
+
+def update_user_membership(user, order):
+    """更新用户会员状态"""
+    # 获取用户资料，先把已到期的会员状态（待生效计划、回到免费计划）写入资料
+    profile = user.profile
+    evaluate_membership(profile).apply_to(profile)
+
+    # 获取当前时间
+    now = timezone.now()
+
+    # 会员计划等级映射（数字越大等级越高）
+    plan_level = {
+        'standard': 1,
+        'premium': 2,
+        # 未来可能添加的其他计划
+    }
+
+    # 设置会员到期时间
+    if order.billing_cycle == 'month':
+        duration = timedelta(days=30)
+    else:  # year
+        duration = timedelta(days=365)
+
+    # 判断是否已经是会员
+    if profile.is_premium_active():
+        current_plan_code = profile.membership_plan.code if profile.membership_plan else 'free'
+        new_plan_code = order.membership_plan.code if order.membership_plan else 'free'
+
+        # 获取当前和新计划的等级
+        current_level = plan_level.get(current_plan_code, 0)
+        new_level = plan_level.get(new_plan_code, 0)
+
+        # 1. 升级会员（立即生效，重置到期时间）
+        if new_level > current_level:
+            logger.info(
+                f"用户 {user.username} 升级会员: {current_plan_code} -> {new_plan_code}")
+            profile.membership_plan = order.membership_plan
+            profile.premium_expire_date = now + duration
+
+        # 2. 同等级续费（延长到期时间）
+        elif new_level == current_level:
+            logger.info(f"用户 {user.username} 续费相同等级会员: {current_plan_code}")
+            # 从当前到期时间起延长
+            if profile.premium_expire_date and profile.premium_expire_date > now:
+                profile.premium_expire_date = profile.premium_expire_date + duration
+            else:
+                profile.premium_expire_date = now + duration
+
+        # 3. 降级会员（当前会员到期后生效）
+        else:
+            logger.info(
+                f"用户 {user.username} 降级会员: {current_plan_code} -> {new_plan_code}，将在当前会员到期后生效")
+
+            # 创建会员变更记录(可选，如果需要记录变更历史)
+            # MembershipChangeLog.objects.create(...)
+
+            # 存储降级信息，但暂不更新当前会员
+            profile.pending_membership_plan = order.membership_plan
+            profile.pending_membership_start_date = profile.premium_expire_date
+            profile.pending_membership_expire_date = profile.premium_expire_date + duration
+
+            # 注意：此处不修改当前会员计划和到期时间
+            # 需要添加一个定时任务或登录检查来处理会员到期后的降级
+    else:
+        # 用户之前不是会员，直接激活
+        logger.info(f"用户 {user.username} 首次开通会员: {order.membership_plan.name}")
+        profile.membership_plan = order.membership_plan
+        profile.premium_expire_date = now + duration
+        profile.is_premium = True
+
+    # 更新存储限制
+    if order.membership_plan:
+        # 如果是降级但还没生效，不降低存储限制
+        if not hasattr(profile, 'pending_membership_plan') or profile.pending_membership_plan is None:
+            profile.storage_limit = order.membership_plan.storage_limit
+
+    # 保存更改
+    profile.save()
+    forget_membership(user)
+
+    logger.info(
+        f"用户 {user.username} 的会员状态已更新，当前会员类型：{profile.membership_plan.name if profile.membership_plan else '无'}")
+
+    # 返回更新后的用户资料
+    return profile
+
+
+def expired_profiles(now):
+    """已到期但仍标记为会员的资料（使用 (is_premium, premium_expire_date) 索引）"""
+    return UserProfile.objects.filter(is_premium=True, premium_expire_date__lte=now)
+
+
+def apply_membership_transitions(now=None, chunk_size=DEFAULT_TRANSITION_CHUNK_SIZE, dry_run=False):
+    """
+    批量推进已到期的会员状态
+
+    先用一条查询（走 (is_premium, premium_expire_date) 索引）取出所有已到期资料的ID，
+    再按 chunk_size 分批，每批每种变化一条 UPDATE（WHERE id IN (...)），
+    避免大批量到期时长时间锁表：
+    1. promoted: 有待生效计划的资料激活该计划
+    2. expired: 仍已到期（没有待生效计划，或待生效计划也已到期）的资料回到免费计划
+
+    UPDATE 仍带有到期条件，重复执行或与支付回调并发时不会重复处理。
+    批量 UPDATE 不触发 post_save 信号，因此由这里清理受影响用户的协作权限缓存。
+
+    参数:
+        now: 判断到期的时间，默认当前时间
+        chunk_size: 每批处理的资料数
+        dry_run: 只统计将要处理的资料数，不修改数据库
+
+    返回:
+        dict: {'promoted': 行数, 'expired': 行数}
+    """
+    now = now or timezone.now()
+    rows = list(expired_profiles(now).order_by().values_list(
+        'id', 'user_id', 'pending_membership_plan_id', 'pending_membership_expire_date'))
+
+    if dry_run:
+        promoted = [row for row in rows if row[2] is not None]
+        still_expired = [row for row in promoted if row[3] is None or row[3] <= now]
+        return {'promoted': len(promoted),
+                'expired': len(rows) - len(promoted) + len(still_expired)}
+
+    counts = {'promoted': 0, 'expired': 0}
+    if not rows:
+        return counts
+
+    pending_storage_limit = Subquery(MembershipPlan.objects.filter(
+        pk=OuterRef('pending_membership_plan_id'), storage_limit__gt=0).values('storage_limit')[:1])
+    free_plan, _ = MembershipPlan.objects.get_or_create(code='free', defaults=FREE_PLAN_DEFAULTS)
+
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        ids = [row[0] for row in chunk]
+        with transaction.atomic():
+            # MySQL 按顺序执行 SET 子句，后面的表达式会读到前面赋的新值，
+            # 因此先读取待生效字段，最后再清空
+            counts['promoted'] += expired_profiles(now).filter(
+                id__in=ids, pending_membership_plan__isnull=False).update(
+                membership_plan=F('pending_membership_plan'),
+                premium_expire_date=F('pending_membership_expire_date'),
+                storage_limit=Coalesce(pending_storage_limit, F('storage_limit')),
+                pending_membership_plan=None,
+                pending_membership_start_date=None,
+                pending_membership_expire_date=None,
+            )
+            counts['expired'] += expired_profiles(now).filter(
+                id__in=ids, pending_membership_plan__isnull=True).update(
+                is_premium=False,
+                membership_plan=free_plan,
+                storage_limit=FREE_STORAGE_LIMIT,
+            )
+        for row in chunk:
+            invalidate_user_access(row[1])
+
+    logger.info(f"会员状态批量更新: 到期资料 {len(rows)}，激活待生效计划 {counts['promoted']}，"
+                f"回到免费计划 {counts['expired']}")
+    return counts
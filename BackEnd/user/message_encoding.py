@@ -0,0 +1,48 @@
+"""
+协作消息编码模块
+
+广播消息在发送端只序列化一次，编码后的文本通过 channel layer 传递，
+各接收端的 collaboration_message 直接转发，不再逐个 json.dumps。
+
+安装了 orjson 时优先使用 orjson 编码（可选依赖），否则回退到标准库 json。
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - 可选依赖
+    orjson = None
+
+
+def encode_message(message):
+    """
+    将消息字典编码为WebSocket文本帧
+
+    参数:
+        message: 消息字典
+
+    返回:
+        str: JSON文本
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(message).decode('utf-8')
+        except TypeError:
+            # orjson 不支持的类型（如非字符串键）回退到标准库
+            pass
+    return json.dumps(message)
+
+
+def broadcast_event(message):
+    """
+    构建 group_send 使用的事件，消息在此处一次性编码
+
+    接收端通过 event['text'] 直接转发；旧格式的 event['message'] 仍然兼容。
+    message_type 供使用紧凑子协议的接收端判断是否需要转换，无需解析文本。
+    """
+    return {
+        'type': 'collaboration_message',
+        'text': encode_message(message),
+        'message_type': message.get('type')
+    }
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.3 on 2026-10-17 01:43
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0016_membershipplan_custom_obstacle_limit'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customobstacle',
+            index=models.Index(fields=['is_shared', 'created_at', 'id'], name='obstacle_shared_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='design',
+            index=models.Index(fields=['is_shared', 'create_time', 'id'], name='design_shared_created_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.1.3 on 2026-10-17 01:43
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0017_shared_keyset_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='design',
+            index=models.Index(fields=['author', 'create_time'], name='design_author_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='membershiporder',
+            index=models.Index(fields=['user', 'created_at'], name='order_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='membershiporder',
+            index=models.Index(fields=['status', 'payment_time'], name='order_status_paid_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='membershiporder',
+            index=models.Index(fields=['created_at'], name='order_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userprofile',
+            index=models.Index(fields=['is_premium', 'premium_expire_date'], name='profile_premium_expire_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.1.3 on 2026-10-17 01:57
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def schedule_pending_orders(apps, schema_editor):
+    """已有的待支付订单在 ORDER_RECONCILE_MAX_AGE 内的，立即进入查询队列"""
+    MembershipOrder = apps.get_model('user', 'MembershipOrder')
+    now = timezone.now()
+    # 默认值与 user.order_reconciler.DEFAULT_MAX_AGE 一致
+    max_age = timedelta(seconds=getattr(settings, 'ORDER_RECONCILE_MAX_AGE', 86400))
+    MembershipOrder.objects.filter(
+        status='pending', next_check_at__isnull=True, created_at__gte=now - max_age
+    ).update(next_check_at=now)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0018_hot_path_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='membershiporder',
+            name='check_attempts',
+            field=models.PositiveIntegerField(default=0, verbose_name='支付状态查询次数'),
+        ),
+        migrations.AddField(
+            model_name='membershiporder',
+            name='next_check_at',
+            field=models.DateTimeField(blank=True, help_text='由 reconcile_orders 命令向支付宝查询待支付订单，为空表示不再查询', null=True, verbose_name='下次查询支付状态时间'),
+        ),
+        migrations.AddIndex(
+            model_name='membershiporder',
+            index=models.Index(fields=['status', 'next_check_at'], name='order_reconcile_idx'),
+        ),
+        migrations.RunPython(schedule_pending_orders, migrations.RunPython.noop),
+    ]
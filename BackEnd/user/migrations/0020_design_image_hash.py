@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2026-10-17 02:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0019_order_reconcile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='design',
+            name='image_hash',
+            field=models.CharField(blank=True, default='', max_length=64, verbose_name='图片内容哈希'),
+        ),
+    ]
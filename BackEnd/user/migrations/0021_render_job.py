@@ -0,0 +1,42 @@
+# Generated by Django 5.1.3 on 2026-10-17 02:08
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0020_design_image_hash'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RenderJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('job_id', models.UUIDField(default=uuid.uuid4, editable=False, unique=True, verbose_name='任务ID')),
+                ('file_format', models.CharField(choices=[('png', 'PNG'), ('pdf', 'PDF')], max_length=10, verbose_name='文件格式')),
+                ('dpi', models.PositiveIntegerField(verbose_name='DPI')),
+                ('source_hash', models.CharField(help_text='设计文件内容的 SHA-256，相同内容、格式和 DPI 的未完成任务只保留一个', max_length=64, verbose_name='设计文件哈希')),
+                ('status', models.CharField(choices=[('pending', '等待中'), ('running', '渲染中'), ('done', '已完成'), ('failed', '失败')], default='pending', max_length=20, verbose_name='状态')),
+                ('result', models.CharField(blank=True, default='', max_length=255, verbose_name='结果文件')),
+                ('error', models.TextField(blank=True, default='', verbose_name='错误信息')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='执行次数')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='开始时间')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='完成时间')),
+                ('design', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='render_jobs', to='user.design', verbose_name='设计')),
+                ('requested_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='render_jobs', to=settings.AUTH_USER_MODEL, verbose_name='请求用户')),
+            ],
+            options={
+                'verbose_name': '渲染任务',
+                'verbose_name_plural': '渲染任务',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'created_at'], name='render_job_queue_idx'), models.Index(fields=['source_hash', 'file_format', 'dpi', 'status'], name='render_job_dedupe_idx')],
+            },
+        ),
+    ]
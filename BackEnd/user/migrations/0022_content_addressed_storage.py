@@ -0,0 +1,42 @@
+# Generated by Django 5.1.3 on 2026-10-17 02:10
+
+import django.utils.timezone
+import user.content_storage
+import user.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0021_render_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='文件路径')),
+                ('digest', models.CharField(db_index=True, max_length=64, verbose_name='内容哈希')),
+                ('size', models.PositiveBigIntegerField(verbose_name='文件大小')),
+                ('ref_count', models.PositiveIntegerField(default=0, help_text='上次 gc_blobs 统计的引用该文件的记录数', verbose_name='引用数')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('last_saved_at', models.DateTimeField(default=django.utils.timezone.now, help_text='最后一次保存该内容的时间，保护期内没有引用也不会被清理', verbose_name='最后保存时间')),
+            ],
+            options={
+                'verbose_name': '存储文件',
+                'verbose_name_plural': '存储文件',
+            },
+        ),
+        migrations.AlterField(
+            model_name='design',
+            name='download',
+            field=models.FileField(blank=True, null=True, storage=user.content_storage.get_content_storage, upload_to=user.models.user_design_file_path, verbose_name='设计图文件'),
+        ),
+        migrations.AlterField(
+            model_name='design',
+            name='image',
+            field=models.ImageField(storage=user.content_storage.get_content_storage, upload_to=user.models.user_design_image_path, verbose_name='设计图图片'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.1.3 on 2026-10-17 02:13
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0022_content_addressed_storage'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='design',
+            name='document',
+            field=models.JSONField(blank=True, null=True, verbose_name='设计文档'),
+        ),
+        migrations.AddField(
+            model_name='design',
+            name='document_hash',
+            field=models.CharField(blank=True, default='', max_length=64, verbose_name='设计文档哈希'),
+        ),
+        migrations.AddField(
+            model_name='design',
+            name='field_height',
+            field=models.FloatField(blank=True, null=True, verbose_name='场地长度（米）'),
+        ),
+        migrations.AddField(
+            model_name='design',
+            name='field_width',
+            field=models.FloatField(blank=True, null=True, verbose_name='场地宽度（米）'),
+        ),
+        migrations.AddField(
+            model_name='design',
+            name='obstacle_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='障碍物数量'),
+        ),
+        migrations.AddField(
+            model_name='design',
+            name='obstacle_types',
+            field=models.JSONField(blank=True, default=dict, help_text='{障碍物类型: 数量}', verbose_name='障碍物类型统计'),
+        ),
+        migrations.AddField(
+            model_name='design',
+            name='path_length',
+            field=models.FloatField(blank=True, null=True, verbose_name='路线长度（米）'),
+        ),
+        migrations.AddIndex(
+            model_name='design',
+            index=models.Index(fields=['is_shared', 'obstacle_count'], name='design_shared_obstacles_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='design',
+            index=models.Index(fields=['is_shared', 'path_length'], name='design_shared_path_idx'),
+        ),
+    ]
@@ -4,6 +4,7 @@ import os
 import uuid
 from django.utils import timezone
 from datetime import datetime, timedelta
+from .content_storage import get_content_storage
 
 
 def get_file_path(instance, filename, base_path):
@@ -64,10 +65,19 @@ def user_design_file_path(instance, filename):
 
 class Design(models.Model):
     title = models.CharField(max_length=100, verbose_name='设计图标题')
+    # 设计图片和设计文件按内容寻址保存（见 user.content_storage），upload_to 只提供扩展名
     image = models.ImageField(
         upload_to=user_design_image_path,
+        storage=get_content_storage,
         verbose_name='设计图图片'
     )
+    # 缩略图按图片内容寻址（见 user.renditions），为空表示缩略图尚未生成
+    image_hash = models.CharField(
+        max_length=64,
+        blank=True,
+        default='',
+        verbose_name='图片内容哈希'
+    )
     create_time = models.DateTimeField(
         auto_now_add=True,
         verbose_name='创建时间'
@@ -83,10 +93,48 @@ class Design(models.Model):
     )
     download = models.FileField(
         upload_to=user_design_file_path,
+        storage=get_content_storage,
         verbose_name='设计图文件',
         blank=True,
         null=True
     )
+    # 设计文档（权威内容，download 文件按需由文档生成）和从文档提取的摘要，见 user.design_summary
+    document = models.JSONField(
+        blank=True,
+        null=True,
+        verbose_name='设计文档'
+    )
+    document_hash = models.CharField(
+        max_length=64,
+        blank=True,
+        default='',
+        verbose_name='设计文档哈希'
+    )
+    obstacle_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='障碍物数量'
+    )
+    field_width = models.FloatField(
+        blank=True,
+        null=True,
+        verbose_name='场地宽度（米）'
+    )
+    field_height = models.FloatField(
+        blank=True,
+        null=True,
+        verbose_name='场地长度（米）'
+    )
+    path_length = models.FloatField(
+        blank=True,
+        null=True,
+        verbose_name='路线长度（米）'
+    )
+    obstacle_types = models.JSONField(
+        default=dict,
+        blank=True,
+        verbose_name='障碍物类型统计',
+        help_text='{障碍物类型: 数量}'
+    )
     # 添加分享状态字段
     is_shared = models.BooleanField(
         default=False,
@@ -116,6 +164,15 @@ class Design(models.Model):
         verbose_name = '设计图'
         verbose_name_plural = '设计图'
         ordering = ['-create_time']  # 按创建时间倒序排列
+        indexes = [
+            # 公开设计库的键集分页：WHERE is_shared ORDER BY create_time, id
+            models.Index(fields=['is_shared', 'create_time', 'id'], name='design_shared_created_idx'),
+            # 我的设计：WHERE author_id ORDER BY create_time
+            models.Index(fields=['author', 'create_time'], name='design_author_created_idx'),
+            # 公开设计库按障碍物数量、路线长度筛选和排序
+            models.Index(fields=['is_shared', 'obstacle_count'], name='design_shared_obstacles_idx'),
+            models.Index(fields=['is_shared', 'path_length'], name='design_shared_path_idx'),
+        ]
 
 
 # 添加点赞记录模型
@@ -322,6 +379,10 @@ class UserProfile(models.Model):
     class Meta:
         verbose_name = '用户资料'
         verbose_name_plural = '用户资料'
+        indexes = [
+            # 会员统计：WHERE is_premium AND premium_expire_date > ?
+            models.Index(fields=['is_premium', 'premium_expire_date'], name='profile_premium_expire_idx'),
+        ]
 
 
 class CustomObstacle(models.Model):
@@ -361,6 +422,10 @@ class CustomObstacle(models.Model):
         ordering = ['-created_at']
         # 确保同一用户不能创建同名障碍物
         unique_together = ('user', 'name')
+        indexes = [
+            # 共享障碍物列表的键集分页：WHERE is_shared ORDER BY created_at, id
+            models.Index(fields=['is_shared', 'created_at', 'id'], name='obstacle_shared_created_idx'),
+        ]
 
 
 # 会员订单模型
@@ -438,6 +503,16 @@ class MembershipOrder(models.Model):
         null=True,
         verbose_name='支付时间'
     )
+    next_check_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name='下次查询支付状态时间',
+        help_text='由 reconcile_orders 命令向支付宝查询待支付订单，为空表示不再查询'
+    )
+    check_attempts = models.PositiveIntegerField(
+        default=0,
+        verbose_name='支付状态查询次数'
+    )
     created_at = models.DateTimeField(
         auto_now_add=True,
         verbose_name='创建时间'
@@ -451,6 +526,16 @@ class MembershipOrder(models.Model):
         verbose_name = '会员订单'
         verbose_name_plural = '会员订单'
         ordering = ['-created_at']
+        indexes = [
+            # 我的订单：WHERE user_id ORDER BY created_at
+            models.Index(fields=['user', 'created_at'], name='order_user_created_idx'),
+            # 收入统计：WHERE status = 'paid' AND payment_time BETWEEN ? AND ?
+            models.Index(fields=['status', 'payment_time'], name='order_status_paid_idx'),
+            # 管理后台最近订单：ORDER BY created_at LIMIT 10
+            models.Index(fields=['created_at'], name='order_created_idx'),
+            # 支付状态对账：WHERE status = 'pending' AND next_check_at <= ?
+            models.Index(fields=['status', 'next_check_at'], name='order_reconcile_idx'),
+        ]
 
     def __str__(self):
         return f"{self.order_id} - {self.user.username} - {self.amount}元"
@@ -464,3 +549,135 @@ class MembershipOrder(models.Model):
             order_id = f"ECD{now.strftime('%Y%m%d%H%M%S')}{random.randint(1000, 9999)}"
             self.order_id = order_id
         super().save(*args, **kwargs)
+
+
+class RenderJob(models.Model):
+    """设计图渲染任务，由 render_worker 命令在进程池中执行（见 user.render_jobs）"""
+    STATUS_CHOICES = (
+        ('pending', '等待中'),
+        ('running', '渲染中'),
+        ('done', '已完成'),
+        ('failed', '失败'),
+    )
+
+    FORMAT_CHOICES = (
+        ('png', 'PNG'),
+        ('pdf', 'PDF'),
+    )
+
+    job_id = models.UUIDField(
+        default=uuid.uuid4,
+        unique=True,
+        editable=False,
+        verbose_name='任务ID'
+    )
+    design = models.ForeignKey(
+        Design,
+        on_delete=models.CASCADE,
+        related_name='render_jobs',
+        verbose_name='设计'
+    )
+    requested_by = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='render_jobs',
+        verbose_name='请求用户'
+    )
+    file_format = models.CharField(
+        max_length=10,
+        choices=FORMAT_CHOICES,
+        verbose_name='文件格式'
+    )
+    dpi = models.PositiveIntegerField(verbose_name='DPI')
+    source_hash = models.CharField(
+        max_length=64,
+        verbose_name='设计文件哈希',
+        help_text='设计文件内容的 SHA-256，相同内容、格式和 DPI 的未完成任务只保留一个'
+    )
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default='pending',
+        verbose_name='状态'
+    )
+    result = models.CharField(
+        max_length=255,
+        blank=True,
+        default='',
+        verbose_name='结果文件'
+    )
+    error = models.TextField(
+        blank=True,
+        default='',
+        verbose_name='错误信息'
+    )
+    attempts = models.PositiveIntegerField(
+        default=0,
+        verbose_name='执行次数'
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='创建时间'
+    )
+    started_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name='开始时间'
+    )
+    finished_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name='完成时间'
+    )
+
+    class Meta:
+        verbose_name = '渲染任务'
+        verbose_name_plural = '渲染任务'
+        ordering = ['-created_at']
+        indexes = [
+            # 领取任务：WHERE status IN ('pending', 'running') ORDER BY created_at
+            models.Index(fields=['status', 'created_at'], name='render_job_queue_idx'),
+            # 合并相同任务：WHERE source_hash = ? AND file_format = ? AND dpi = ? AND status IN (...)
+            models.Index(fields=['source_hash', 'file_format', 'dpi', 'status'], name='render_job_dedupe_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.job_id} - {self.design_id} - {self.file_format} {self.dpi}dpi - {self.status}"
+
+
+class StoredBlob(models.Model):
+    """按内容寻址保存的文件（见 user.content_storage），引用数由 gc_blobs 命令统计"""
+    name = models.CharField(
+        max_length=255,
+        unique=True,
+        verbose_name='文件路径'
+    )
+    digest = models.CharField(
+        max_length=64,
+        db_index=True,
+        verbose_name='内容哈希'
+    )
+    size = models.PositiveBigIntegerField(verbose_name='文件大小')
+    ref_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='引用数',
+        help_text='上次 gc_blobs 统计的引用该文件的记录数'
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='创建时间'
+    )
+    last_saved_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name='最后保存时间',
+        help_text='最后一次保存该内容的时间，保护期内没有引用也不会被清理'
+    )
+
+    class Meta:
+        verbose_name = '存储文件'
+        verbose_name_plural = '存储文件'
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count})"
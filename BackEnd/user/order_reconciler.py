@@ -0,0 +1,200 @@
+"""
+会员订单支付状态对账
+
+get_order_status 原先在订单未支付时同步调用支付宝查询接口，前端轮询该接口，
+每次请求最多占用一个工作线程 15 秒（AliPayConfig 超时时间）。现在：
+- 接口只读取本地订单状态
+- reconcile_orders 命令在后台分批查询待支付订单，查询间隔按次数指数增长
+  （ORDER_RECONCILE_BASE_DELAY 起，最大 ORDER_RECONCILE_MAX_DELAY），
+  创建超过 ORDER_RECONCILE_MAX_AGE 仍未支付的订单不再查询
+- 支付宝异步通知和对账都通过 mark_order_paid() 处理支付成功，使用行锁保证只处理一次
+- 订单状态变化时推送给正在等待的 WebSocket 连接（见 consumers.OrderStatusConsumer）
+
+配置（settings.py）：
+- ORDER_RECONCILE_BATCH_SIZE / ORDER_RECONCILE_CONCURRENCY
+- ORDER_RECONCILE_BASE_DELAY / ORDER_RECONCILE_MAX_DELAY / ORDER_RECONCILE_MAX_AGE
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .membership import update_user_membership
+from .models import MembershipOrder
+from .utils import query_alipay_order
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_CONCURRENCY = 4
+DEFAULT_BASE_DELAY = 5
+DEFAULT_MAX_DELAY = 300
+DEFAULT_MAX_AGE = 86400
+
+# 支付宝中表示支付成功的交易状态
+PAID_TRADE_STATUSES = ('TRADE_SUCCESS', 'TRADE_FINISHED')
+
+# 进程级统计
+reconciler_stats = {
+    'checked': 0,
+    'paid': 0,
+    'closed': 0,
+    'failed': 0,
+}
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def order_group_name(order_id):
+    """订单状态推送使用的 channel 组名称"""
+    return f'payment_order_{order_id}'
+
+
+def order_status_event(order):
+    """推送给客户端的订单状态"""
+    return {
+        'type': 'order.status',
+        'order': {
+            'order_id': order.order_id,
+            'status': order.status,
+            'status_display': order.get_status_display(),
+            'trade_no': order.trade_no,
+            'payment_time': order.payment_time.isoformat() if order.payment_time else None,
+        },
+    }
+
+
+def notify_order_status(order):
+    """把订单状态推送给正在等待该订单的 WebSocket 连接，推送失败不影响订单处理"""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    try:
+        async_to_sync(channel_layer.group_send)(
+            order_group_name(order.order_id), order_status_event(order))
+    except Exception as e:
+        logger.error(f"推送订单状态失败: {order.order_id}, 错误: {str(e)}")
+
+
+def check_delay(attempts):
+    """第 attempts 次查询之后的等待时间"""
+    base = _setting('ORDER_RECONCILE_BASE_DELAY', DEFAULT_BASE_DELAY)
+    delay = min(base * 2 ** max(attempts - 1, 0), _setting('ORDER_RECONCILE_MAX_DELAY', DEFAULT_MAX_DELAY))
+    return timedelta(seconds=delay)
+
+
+def schedule_first_check(order, now=None):
+    """新订单等待一个基础间隔后开始查询（不保存）"""
+    order.check_attempts = 0
+    order.next_check_at = (now or timezone.now()) + check_delay(0)
+
+
+def mark_order_paid(order_id, trade_no):
+    """
+    把订单标记为已支付并更新会员状态
+
+    支付宝异步通知和对账可能同时处理同一订单，锁定订单行后再检查状态，只处理一次。
+
+    返回:
+        本次标记为已支付的订单；订单不存在或已经处理过时返回 None
+    """
+    with transaction.atomic():
+        order = MembershipOrder.objects.select_for_update().filter(order_id=order_id).first()
+        if order is None or order.status == 'paid':
+            return None
+        order.status = 'paid'
+        order.trade_no = trade_no
+        order.payment_time = timezone.now()
+        order.next_check_at = None
+        order.save()
+        update_user_membership(order.user, order)
+
+    logger.info(f"订单 {order_id} 支付成功，交易号: {trade_no}")
+    notify_order_status(order)
+    return order
+
+
+def mark_order_closed(order_id):
+    """支付宝交易已关闭的待支付订单标记为已取消，返回是否更新"""
+    updated = MembershipOrder.objects.filter(order_id=order_id, status='pending').update(
+        status='canceled', next_check_at=None, updated_at=timezone.now())
+    if updated:
+        logger.info(f"订单 {order_id} 的支付宝交易已关闭")
+        notify_order_status(MembershipOrder.objects.get(order_id=order_id))
+    return bool(updated)
+
+
+def _query(query, order_id):
+    try:
+        return query(order_id), None
+    except Exception as e:
+        return None, e
+
+
+def reconcile_pending_orders(now=None, batch_size=None, query=None):
+    """
+    查询一批到了查询时间的待支付订单并更新状态
+
+    参数:
+        now: 当前时间，默认 timezone.now()
+        batch_size: 本批最多查询的订单数，默认 ORDER_RECONCILE_BATCH_SIZE
+        query: 查询函数 query(order_id) -> 支付宝查询结果，默认 query_alipay_order
+
+    返回:
+        dict: {'checked', 'paid', 'closed', 'pending', 'failed'}
+    """
+    now = now or timezone.now()
+    batch_size = batch_size or _setting('ORDER_RECONCILE_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+    query = query or query_alipay_order
+    max_age = timedelta(seconds=_setting('ORDER_RECONCILE_MAX_AGE', DEFAULT_MAX_AGE))
+
+    counts = {'checked': 0, 'paid': 0, 'closed': 0, 'pending': 0, 'failed': 0}
+    orders = list(MembershipOrder.objects.filter(
+        status='pending', next_check_at__lte=now).order_by('next_check_at')[:batch_size])
+    if not orders:
+        return counts
+
+    # 网关查询是网络等待，并发执行；数据库更新在当前线程中完成
+    concurrency = _setting('ORDER_RECONCILE_CONCURRENCY', DEFAULT_CONCURRENCY)
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(orders)))) as pool:
+        results = list(pool.map(lambda order: _query(query, order.order_id), orders))
+
+    backoff = []
+    for order, (result, error) in zip(orders, results):
+        counts['checked'] += 1
+        trade_status = result.get('trade_status') if result else None
+        if error is not None:
+            counts['failed'] += 1
+            logger.warning(f"查询支付宝订单状态失败: {order.order_id}, 错误: {str(error)}")
+        elif trade_status in PAID_TRADE_STATUSES:
+            if mark_order_paid(order.order_id, result.get('trade_no')):
+                counts['paid'] += 1
+            continue
+        elif trade_status == 'TRADE_CLOSED':
+            if mark_order_closed(order.order_id):
+                counts['closed'] += 1
+            continue
+        else:
+            # WAIT_BUYER_PAY，或用户还没有打开支付页面（ACQ.TRADE_NOT_EXIST）
+            counts['pending'] += 1
+
+        order.check_attempts += 1
+        next_check_at = now + check_delay(order.check_attempts)
+        # 超过最长查询时间后不再查询，之后仍可由异步通知更新
+        order.next_check_at = next_check_at if next_check_at <= order.created_at + max_age else None
+        backoff.append(order)
+
+    if backoff:
+        MembershipOrder.objects.bulk_update(backoff, ['check_attempts', 'next_check_at'])
+
+    for key in ('checked', 'paid', 'closed', 'failed'):
+        reconciler_stats[key] += counts[key]
+    return counts
@@ -0,0 +1,139 @@
+"""
+键集（游标）分页
+
+公开设计库和共享障碍物列表使用页码分页时，每次请求都要执行 COUNT(*)，
+并用 OFFSET 跳过前面的记录，页数越深越慢。键集分页按 (创建时间, id) 定位：
+    WHERE (created, id) < (上一页最后一条的 created, id)
+    ORDER BY created DESC, id DESC LIMIT page_size + 1
+配合 (is_shared, 创建时间, id) 组合索引，任意深度的页面代价与第一页相同。
+
+只支持向后翻页（"加载更多"），总数默认不返回，传 with_count=true 时才统计。
+
+使用方式（按需启用，默认仍为页码分页）：
+    GET /user/designs/shared/?pagination=cursor
+    GET /user/designs/shared/?pagination=cursor&cursor=<next中的游标>
+"""
+
+import base64
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+# 启用键集分页的查询参数：?pagination=cursor
+PAGINATION_QUERY_PARAM = 'pagination'
+CURSOR_PAGINATION = 'cursor'
+
+
+def use_cursor_pagination(request):
+    """请求是否选择了键集分页"""
+    return request.query_params.get(PAGINATION_QUERY_PARAM) == CURSOR_PAGINATION
+
+
+class KeysetPagination(BasePagination):
+    """
+    按 (ordering_field, id) 分页的键集分页器
+
+    ordering_field 前加 '-' 表示倒序（最新的在前）。
+    """
+    ordering_field = '-create_time'
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    count_query_param = 'with_count'
+    invalid_cursor_message = '无效的游标'
+
+    def __init__(self, ordering_field=None, page_size=None):
+        if ordering_field is not None:
+            self.ordering_field = ordering_field
+        if page_size is not None:
+            self.page_size = page_size
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def encode_cursor(self, value, pk):
+        data = json.dumps([value.isoformat(), pk], separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode('ascii')).decode('ascii').rstrip('=')
+
+    def decode_cursor(self, request):
+        """解析游标，返回 (时间, id)，没有游标时返回 None"""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            padding = '=' * (-len(encoded) % 4)
+            value, pk = json.loads(base64.urlsafe_b64decode(encoded + padding))
+            value = parse_datetime(value)
+            pk = int(pk)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if value is None:
+            raise NotFound(self.invalid_cursor_message)
+        return value, pk
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        field = self.ordering_field.lstrip('-')
+        descending = self.ordering_field.startswith('-')
+
+        self.count = None
+        if request.query_params.get(self.count_query_param) in ('1', 'true'):
+            self.count = queryset.count()
+
+        queryset = queryset.order_by(self.ordering_field, '-id' if descending else 'id')
+        position = self.decode_cursor(request)
+        if position is not None:
+            value, pk = position
+            lookup = 'lt' if descending else 'gt'
+            queryset = queryset.filter(
+                Q(**{f'{field}__{lookup}': value}) | Q(**{field: value, f'id__{lookup}': pk}))
+
+        # 多取一条判断是否还有下一页
+        results = list(queryset[:self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        self.next_cursor = None
+        if self.has_next:
+            last = self.page[-1]
+            self.next_cursor = self.encode_cursor(getattr(last, field), last.pk)
+        return self.page
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.count_query_param)
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        response = {
+            'next': self.get_next_link(),
+            'results': data,
+        }
+        if self.count is not None:
+            response['count'] = self.count
+        return Response(response)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'count': {'type': 'integer'},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,131 @@
+"""
+会员计划目录缓存
+
+会员计划很少变化，但 my_profile、创建订单等接口每次请求都要查询：my_profile 查询所有
+已激活计划，CreateMembershipOrderSerializer 和 create_membership_order 对同一个计划
+各查询一次。本模块在进程内缓存整个计划目录，稳定状态下查找计划不需要查询数据库。
+
+缓存失效：
+- 共享缓存中保存计划目录的版本号，MembershipPlan 保存或删除时换成新的版本号（见 user.signals）
+- 版本号是随机生成、不会重复的标记而不是计数器：版本号被淘汰或缓存被清空后重新
+  生成的版本号不会与进程内快照记录的旧版本号相同，快照一定会重新加载
+- 每次读取时比较版本号，与进程内快照的版本不一致即重新加载，
+  因此多个进程（Daphne、Gunicorn、定时任务）都能看到后台修改的计划
+- 共享缓存不可用时不使用快照，直接查询数据库
+
+进程内快照中的 MembershipPlan 对象由多个请求共享，只能读取，不能修改后保存。
+"""
+
+import logging
+import uuid
+
+from .utils import get_shared_cache
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'membership_plans:version'
+
+
+def _new_version():
+    """生成新的版本号（不会与之前的版本号重复）"""
+    return uuid.uuid4().hex
+
+
+def _current_version():
+    """读取共享缓存中的版本号，不存在时初始化；缓存不可用时返回 None"""
+    cache = get_shared_cache()
+    try:
+        version = cache.get(VERSION_KEY)
+        if version is None:
+            # 多个进程同时初始化时只有一个写入成功，再读取一次以使用同一个版本号
+            cache.add(VERSION_KEY, _new_version(), None)
+            version = cache.get(VERSION_KEY)
+        return version
+    except Exception as e:
+        logger.error(f"读取会员计划版本失败: {str(e)}")
+        return None
+
+
+def plan_data(plan):
+    """会员计划在接口中返回的基本字段"""
+    return {
+        'id': plan.id,
+        'name': plan.name,
+        'code': plan.code,
+        'monthly_price': float(plan.monthly_price),
+        'yearly_price': float(plan.yearly_price),
+        'storage_limit': plan.storage_limit,
+    }
+
+
+class _Snapshot:
+    """某个版本的计划目录，创建后不再修改"""
+
+    __slots__ = ('version', 'by_id', 'by_code', 'active', 'active_data')
+
+    def __init__(self, version, plans):
+        self.version = version
+        self.by_id = {plan.id: plan for plan in plans}
+        self.by_code = {plan.code: plan for plan in plans}
+        # 按模型默认排序（monthly_price）排列
+        self.active = tuple(plan for plan in plans if plan.is_active)
+        self.active_data = tuple(
+            {**plan_data(plan), 'description': plan.description} for plan in self.active)
+
+
+class PlanRegistry:
+    """进程内的会员计划目录"""
+
+    def __init__(self):
+        self._snapshot = None
+
+    def _load(self):
+        from .models import MembershipPlan
+
+        version = _current_version()
+        snapshot = self._snapshot
+        if snapshot is not None and version is not None and snapshot.version == version:
+            return snapshot
+        # 先读版本号再加载：加载期间计划被修改时，快照记录的是旧版本号，下次读取会重新加载
+        snapshot = _Snapshot(version, list(MembershipPlan.objects.all()))
+        if version is not None:
+            self._snapshot = snapshot
+        return snapshot
+
+    def get(self, plan_id, active_only=False):
+        """按ID查找计划，不存在（或 active_only 时未激活）返回 None"""
+        try:
+            plan = self._load().by_id.get(int(plan_id))
+        except (TypeError, ValueError):
+            return None
+        if plan is None or (active_only and not plan.is_active):
+            return None
+        return plan
+
+    def by_code(self, code):
+        """按计划代码查找计划，不存在返回 None"""
+        return self._load().by_code.get(code)
+
+    def active_plans(self):
+        """所有已激活的计划"""
+        return self._load().active
+
+    def active_plan_data(self):
+        """所有已激活计划的接口数据（含描述），返回的字典不能修改"""
+        return self._load().active_data
+
+    def invalidate(self):
+        """丢弃进程内快照，并更换共享缓存中的版本号使其他进程重新加载"""
+        self._snapshot = None
+        try:
+            get_shared_cache().set(VERSION_KEY, _new_version(), None)
+        except Exception as e:
+            logger.error(f"更新会员计划版本失败: {str(e)}")
+
+
+_registry = PlanRegistry()
+
+
+def get_plan_registry():
+    """获取进程内的会员计划目录"""
+    return _registry
@@ -0,0 +1,176 @@
+"""
+协作在线状态模块
+
+连接没有正常断开时（例如 Daphne 进程崩溃或重启），disconnect 不会执行，
+协作者会一直留在会话中，会话也不会被清理。本模块为每个工作进程启动一个后台任务：
+- 心跳：定期为本进程的每个连接刷新协作者的 last_seen（时间戳，秒）
+- 清理：移除 last_seen 超过 timeout 的协作者并广播 leave，没有剩余协作者时
+  删除会话并写回设计文档
+
+每轮只清理本进程有连接的房间（失效的协作者通常和在线用户在同一个会话中），
+每 FULL_SWEEP_EVERY 轮扫描一次存储中的所有会话，处理已经没有在线连接的会话。
+
+另外，消息处理时对 last_active 的写入按 activity_interval 节流，
+不再每条消息都写一次存储。
+
+配置（settings.py）：
+- COLLABORATION_PRESENCE_INTERVAL: 心跳和清理的间隔（秒）
+- COLLABORATION_PRESENCE_TIMEOUT: 协作者失效时间（秒），应为间隔的数倍
+- COLLABORATION_ACTIVITY_WRITE_INTERVAL: last_active 的最小写入间隔（秒）
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from .design_persistence import get_design_writer
+from .message_encoding import broadcast_event
+from .session_store import get_session_store
+
+logger = logging.getLogger('django.channels')
+
+DEFAULT_PRESENCE_INTERVAL = 30
+DEFAULT_PRESENCE_TIMEOUT = 90
+DEFAULT_ACTIVITY_WRITE_INTERVAL = 5
+
+# 每隔多少轮扫描一次存储中的所有会话
+FULL_SWEEP_EVERY = 10
+
+# 进程级计数器
+presence_stats = {
+    'sweeps': 0,           # 清理轮数
+    'heartbeats': 0,       # 刷新的连接数
+    'expired': 0,          # 移除的失效协作者数
+    'sessions_closed': 0,  # 因协作者全部失效而删除的会话数
+}
+
+
+def get_activity_write_interval():
+    """last_active 的最小写入间隔（秒）"""
+    return getattr(settings, 'COLLABORATION_ACTIVITY_WRITE_INTERVAL',
+                   DEFAULT_ACTIVITY_WRITE_INTERVAL)
+
+
+class PresenceReaper:
+    """
+    单个工作进程的心跳和清理任务
+
+    - register()/unregister(): 登记/注销本进程的协作连接，首次登记时启动后台任务
+    - sweep(): 执行一轮心跳和清理
+    """
+
+    def __init__(self, store, interval=DEFAULT_PRESENCE_INTERVAL,
+                 timeout=DEFAULT_PRESENCE_TIMEOUT):
+        self.store = store
+        self.interval = interval
+        self.timeout = timeout
+        self._consumers = set()
+        self._task = None
+        self._rounds = 0
+
+    def register(self, consumer):
+        """登记一个已加入会话的连接"""
+        self._consumers.add(consumer)
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._task = loop.create_task(self._run())
+
+    def unregister(self, consumer):
+        """注销连接"""
+        self._consumers.discard(consumer)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"协作在线状态清理失败: {str(e)}", exc_info=True)
+
+    async def sweep(self, full=None):
+        """
+        执行一轮心跳和清理
+
+        参数:
+            full: 是否扫描存储中的所有会话，默认每 FULL_SWEEP_EVERY 轮一次
+        """
+        self._rounds += 1
+        presence_stats['sweeps'] += 1
+        if full is None:
+            full = self._rounds % FULL_SWEEP_EVERY == 0
+
+        now = time.time()
+        design_ids = set()
+        for consumer in list(self._consumers):
+            design_ids.add(consumer.design_id)
+            try:
+                await consumer.refresh_presence(now)
+                presence_stats['heartbeats'] += 1
+            except Exception as e:
+                logger.error(f"刷新协作者在线状态失败: {consumer.design_id}, 错误: {str(e)}")
+
+        if full:
+            design_ids.update(await self.store.list_sessions())
+
+        cutoff = now - self.timeout
+        for design_id in design_ids:
+            await self._expire(design_id, cutoff)
+
+    async def _expire(self, design_id, cutoff):
+        session, removed = await self.store.expire_collaborators(design_id, cutoff)
+        if not removed:
+            return
+        presence_stats['expired'] += len(removed)
+        logger.info(
+            f"移除失效协作者: {design_id}, {[c.get('username') for c in removed]}")
+
+        # 房间组名称与 CollaborationConsumer 一致
+        channel_layer = get_channel_layer()
+        for collaborator in removed:
+            await channel_layer.group_send(
+                f'collaboration_{design_id}',
+                broadcast_event({
+                    'type': 'leave',
+                    'senderId': collaborator.get('id'),
+                    'senderName': collaborator.get('username'),
+                    'sessionId': session['id'],
+                    'timestamp': datetime.now().isoformat(),
+                    'payload': {
+                        'session': session
+                    }
+                })
+            )
+
+        if not session['collaborators']:
+            presence_stats['sessions_closed'] += 1
+            logger.info(f"协作者全部失效，会话已清理: {design_id}")
+            await get_design_writer().flush(design_id, close=True)
+
+
+_presence_reaper = None
+
+
+def get_presence_reaper():
+    """获取进程内的心跳和清理任务（单例）"""
+    global _presence_reaper
+    if _presence_reaper is None:
+        _presence_reaper = PresenceReaper(
+            get_session_store(),
+            getattr(settings, 'COLLABORATION_PRESENCE_INTERVAL', DEFAULT_PRESENCE_INTERVAL),
+            getattr(settings, 'COLLABORATION_PRESENCE_TIMEOUT', DEFAULT_PRESENCE_TIMEOUT))
+    return _presence_reaper
+
+
+@receiver(setting_changed)
+def reset_presence_reaper(setting, **kwargs):
+    """配置变化时重新创建心跳和清理任务"""
+    global _presence_reaper
+    if setting in ('COLLABORATION_SESSION_STORE', 'COLLABORATION_PRESENCE_INTERVAL',
+                   'COLLABORATION_PRESENCE_TIMEOUT'):
+        _presence_reaper = None
@@ -0,0 +1,329 @@
+"""
+设计图渲染任务队列
+
+高 DPI 的 PNG/PDF 渲染（见 course_renderer）是 CPU 密集的计算，不在请求线程中执行：
+- download_design 在渲染结果已存在时直接返回文件地址，否则通过 request_render()
+  创建 RenderJob 并返回 202，相同设计文件内容、格式和 DPI 的未完成任务只保留一个
+- render_worker 命令领取任务，在 ProcessPoolExecutor 中渲染，结果按内容寻址保存到存储
+- 任务状态变化时推送给 ws/render/jobs/<job_id>/ 的连接（见 consumers.RenderJobConsumer），
+  也可以通过 api/render-jobs/<job_id>/ 查询；只有任务的请求者和有权下载对应设计的用户
+  （设计作者，或设计已分享）可以查看任务（见 visible_jobs）
+
+领取任务使用条件更新（status 和 attempts 不变时才更新），多个 worker 可以同时运行。
+执行超过 RENDER_JOB_TIMEOUT 仍未完成的任务（worker 退出或崩溃）会被重新领取，
+执行 RENDER_JOB_MAX_ATTEMPTS 次仍未完成的任务标记为失败。
+
+配置（settings.py）：
+- RENDER_WORKER_PROCESSES: 渲染进程数
+- RENDER_JOB_TIMEOUT / RENDER_JOB_MAX_ATTEMPTS
+"""
+
+import logging
+from concurrent.futures import FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models import Q
+from django.utils import timezone
+
+from .course_renderer import (
+    FORMATS, RenderError, design_file_digest, read_design_file, render_content, render_path, validate_dpi)
+from .models import RenderJob
+from .utils import get_absolute_media_url
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROCESSES = 2
+DEFAULT_TIMEOUT = 300
+DEFAULT_MAX_ATTEMPTS = 3
+
+# 未完成的任务状态
+ACTIVE_STATUSES = ('pending', 'running')
+
+# 进程级统计
+render_job_stats = {
+    'created': 0,
+    'deduplicated': 0,
+    'done': 0,
+    'failed': 0,
+}
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _storage():
+    # 渲染结果保存在默认存储中（设计文件使用按内容寻址的存储）
+    return default_storage
+
+
+def job_group_name(job_id):
+    """渲染任务状态推送使用的 channel 组名称"""
+    return f'render_job_{job_id}'
+
+
+def visible_jobs(user):
+    """
+    用户可以查看的渲染任务：自己请求的任务，以及自己的或已分享的设计的任务
+
+    渲染结果是设计的导出，权限与 download_design 一致。
+    """
+    return RenderJob.objects.filter(
+        Q(requested_by=user) | Q(design__author=user) | Q(design__is_shared=True))
+
+
+def job_data(job):
+    """渲染任务的状态信息"""
+    return {
+        'job_id': str(job.job_id),
+        'design_id': job.design_id,
+        'status': job.status,
+        'status_display': job.get_status_display(),
+        'file_format': job.file_format,
+        'dpi': job.dpi,
+        'download_url': get_absolute_media_url(_storage().url(job.result)) if job.status == 'done' else None,
+        'error': job.error or None,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+def job_status_event(job):
+    """推送给客户端的渲染任务状态"""
+    return {'type': 'render.status', 'job': job_data(job)}
+
+
+def notify_job_status(job):
+    """把任务状态推送给正在等待该任务的 WebSocket 连接，推送失败不影响任务处理"""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    try:
+        async_to_sync(channel_layer.group_send)(job_group_name(job.job_id), job_status_event(job))
+    except Exception as e:
+        logger.error(f"推送渲染任务状态失败: {job.job_id}, 错误: {str(e)}")
+
+
+def request_render(design, fmt, dpi, user=None):
+    """
+    获取设计的渲染结果，不存在时创建渲染任务
+
+    参数:
+        design: Design 实例
+        fmt: 'png' 或 'pdf'
+        dpi: 输出分辨率
+        user: 请求的用户
+
+    返回:
+        tuple: (存储路径, None) 渲染结果已存在；(None, RenderJob) 需要等待任务完成
+    """
+    if fmt not in FORMATS:
+        raise RenderError(f'不支持的格式: {fmt}')
+    dpi = validate_dpi(dpi)
+    digest = design_file_digest(design)
+
+    path = render_path(digest, fmt, dpi)
+    if _storage().exists(path):
+        return path, None
+
+    # 两个请求同时到达时可能各创建一个任务，结果按内容寻址，后完成的任务直接复用文件；
+    # 只合并到用户可以查看的任务，否则返回的任务ID用户无法查询
+    jobs = visible_jobs(user) if user and user.is_authenticated else RenderJob.objects.filter(design=design)
+    job = jobs.filter(
+        source_hash=digest, file_format=fmt, dpi=dpi, status__in=ACTIVE_STATUSES).first()
+    if job is not None:
+        render_job_stats['deduplicated'] += 1
+        return None, job
+
+    job = RenderJob.objects.create(
+        design=design, requested_by=user if user and user.is_authenticated else None,
+        file_format=fmt, dpi=dpi, source_hash=digest)
+    render_job_stats['created'] += 1
+    return None, job
+
+
+def _finish(job, **fields):
+    """更新本次执行的任务状态；任务已被其他 worker 重新领取时不更新，返回是否更新"""
+    fields['finished_at'] = timezone.now()
+    updated = RenderJob.objects.filter(
+        pk=job.pk, status='running', attempts=job.attempts).update(**fields)
+    if not updated:
+        return False
+    for name, value in fields.items():
+        setattr(job, name, value)
+    render_job_stats[fields['status']] += 1
+    notify_job_status(job)
+    return True
+
+
+def claim_jobs(limit, now=None):
+    """
+    领取最多 limit 个待执行的任务（包括执行超时的任务）并标记为渲染中
+
+    返回:
+        list: 领取到的 RenderJob
+    """
+    now = now or timezone.now()
+    stale_before = now - timedelta(seconds=_setting('RENDER_JOB_TIMEOUT', DEFAULT_TIMEOUT))
+    max_attempts = _setting('RENDER_JOB_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS)
+
+    candidates = RenderJob.objects.filter(
+        Q(status='pending') | Q(status='running', started_at__lt=stale_before)
+    ).order_by('created_at').values_list('pk', 'status', 'attempts')[:limit * 2]
+
+    claimed = []
+    for pk, current_status, attempts in candidates:
+        if len(claimed) >= limit:
+            break
+        if attempts >= max_attempts:
+            # 多次领取都没有完成（worker 崩溃或渲染超时）
+            if RenderJob.objects.filter(pk=pk, status=current_status, attempts=attempts).update(
+                    status='failed', error='渲染超时', finished_at=now):
+                render_job_stats['failed'] += 1
+                notify_job_status(RenderJob.objects.get(pk=pk))
+            continue
+        if RenderJob.objects.filter(pk=pk, status=current_status, attempts=attempts).update(
+                status='running', started_at=now, attempts=attempts + 1):
+            claimed.append(pk)
+
+    jobs = list(RenderJob.objects.select_related('design').filter(pk__in=claimed).order_by('created_at'))
+    for job in jobs:
+        notify_job_status(job)
+    return jobs
+
+
+def _prepare(job):
+    """
+    读取任务的设计文件
+
+    返回:
+        tuple: (存储路径, 设计文件内容)；结果已存在时内容为 None
+    """
+    content, digest = read_design_file(job.design)
+    path = render_path(digest, job.file_format, job.dpi)
+    if _storage().exists(path):
+        return path, None
+    return path, content
+
+
+def _complete(job, path, rendered):
+    if not _storage().exists(path):
+        path = _storage().save(path, ContentFile(rendered))
+    if _finish(job, status='done', result=path, error=''):
+        logger.info(f"渲染任务完成: {job.job_id}, 设计 {job.design_id}, "
+                    f"{job.file_format} {job.dpi}dpi, {len(rendered)} 字节")
+
+
+def _fail(job, error):
+    if isinstance(error, RenderError):
+        # 设计文件本身的问题，重试也不会成功
+        _finish(job, status='failed', error=str(error))
+        return
+    logger.error(f"渲染任务失败: {job.job_id}, 第 {job.attempts} 次, 错误: {str(error)}")
+    if job.attempts >= _setting('RENDER_JOB_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS):
+        _finish(job, status='failed', error='渲染失败')
+    else:
+        # 放回队列重试
+        RenderJob.objects.filter(pk=job.pk, status='running', attempts=job.attempts).update(
+            status='pending', started_at=None)
+
+
+class RenderWorker:
+    """
+    领取渲染任务并在进程池中执行
+
+    渲染进程崩溃（例如内存不足被终止）后进程池不可再用，执行中的任务放回队列，
+    下次领取前重新创建进程池。
+
+    参数:
+        executor_factory: 创建 Executor 的函数，None 时在当前进程中渲染
+        processes: 同时执行的任务数，默认 RENDER_WORKER_PROCESSES
+    """
+
+    def __init__(self, executor_factory=None, processes=None):
+        self.executor_factory = executor_factory
+        self.executor = executor_factory() if executor_factory else None
+        self.processes = processes or _setting('RENDER_WORKER_PROCESSES', DEFAULT_PROCESSES)
+        self.running = {}
+        self.broken = False
+
+    def _start(self, job):
+        try:
+            path, content = _prepare(job)
+        except Exception as e:
+            _fail(job, e)
+            return
+        if content is None:
+            # 其他任务或 render_design 命令已经渲染过相同内容
+            _finish(job, status='done', result=path, error='')
+            return
+        if self.executor is None:
+            try:
+                _complete(job, path, render_content(content, job.file_format, job.dpi))
+            except Exception as e:
+                _fail(job, e)
+            return
+        future = self.executor.submit(render_content, content, job.file_format, job.dpi)
+        self.running[future] = (job, path)
+
+    def _collect(self, futures):
+        for future in futures:
+            job, path = self.running.pop(future)
+            try:
+                _complete(job, path, future.result())
+            except Exception as e:
+                self.broken = self.broken or isinstance(e, BrokenProcessPool)
+                _fail(job, e)
+
+    def fill(self):
+        """领取任务补满空闲的进程，返回领取的任务数"""
+        if self.broken and not self.running:
+            logger.warning("渲染进程池已损坏，重新创建")
+            self.executor.shutdown(wait=False)
+            self.executor = self.executor_factory()
+            self.broken = False
+        free = self.processes - len(self.running)
+        if free <= 0:
+            return 0
+        jobs = claim_jobs(free)
+        for job in jobs:
+            self._start(job)
+        return len(jobs)
+
+    def wait(self, timeout=None):
+        """等待至少一个任务完成（或超时）并保存结果"""
+        if not self.running:
+            return
+        done, _ = wait(list(self.running), timeout=timeout, return_when=FIRST_COMPLETED)
+        self._collect(done)
+
+    def drain(self):
+        """等待所有执行中的任务完成"""
+        while self.running:
+            self.wait()
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+
+
+def process_render_jobs(executor_factory=None, limit=None):
+    """
+    领取一批任务并等待全部完成
+
+    返回:
+        int: 处理的任务数
+    """
+    worker = RenderWorker(executor_factory, limit)
+    try:
+        count = worker.fill()
+        worker.drain()
+    finally:
+        worker.shutdown()
+    return count
@@ -0,0 +1,169 @@
+"""
+设计图片缩略图
+
+Design.image 是浏览器上传的画布导出图，通常是原始分辨率的 PNG，公开设计库每页
+都要下载数 MB 的原图。本模块用 Pillow 为设计图片生成固定尺寸的缩略图（WebP，
+不支持时使用 JPEG）：
+- thumbnail: 列表卡片使用的小图
+- preview: 详情预览使用的中图
+
+缩略图按原图内容的 SHA-256 寻址，保存在默认存储中（renditions/<前两位>/<哈希>_<宽>x<高>.<扩展名>），
+内容相同的图片共用同一组文件，生成是幂等的。上传或更换图片时生成缩略图并把哈希
+保存到 Design.image_hash；没有哈希的已分享设计（历史数据、生成失败）的缩略图地址指向
+designs/<id>/renditions/<name>/ 接口，登录用户首次访问时生成后重定向到文件；
+未分享的设计直接使用原图地址。
+历史数据可以用 generate_design_renditions 命令批量生成。
+
+配置（settings.py）：
+- DESIGN_IMAGE_RENDITIONS: {名称: (最大宽度, 最大高度)}
+- DESIGN_IMAGE_RENDITION_FORMAT: 'WEBP' 或 'JPEG'
+- DESIGN_IMAGE_RENDITION_QUALITY: 压缩质量
+"""
+
+import hashlib
+import io
+import logging
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from PIL import Image, ImageOps, features
+
+from .content_storage import blob_digest
+from .utils import get_absolute_media_url
+
+logger = logging.getLogger(__name__)
+
+RENDITION_DIR = 'renditions'
+
+DEFAULT_RENDITIONS = {
+    'thumbnail': (320, 240),
+    'preview': (1024, 768),
+}
+DEFAULT_FORMAT = 'WEBP'
+DEFAULT_QUALITY = 80
+
+# 透明背景合成到白色画布上（JPEG 不支持透明，WebP 去掉透明通道后体积更小）
+BACKGROUND = (255, 255, 255)
+
+
+def get_renditions():
+    """配置的缩略图尺寸 {名称: (宽, 高)}"""
+    return getattr(settings, 'DESIGN_IMAGE_RENDITIONS', DEFAULT_RENDITIONS)
+
+
+def rendition_format():
+    """缩略图的 (Pillow 格式, 扩展名)，Pillow 未编译 WebP 支持时使用 JPEG"""
+    fmt = getattr(settings, 'DESIGN_IMAGE_RENDITION_FORMAT', DEFAULT_FORMAT).upper()
+    if fmt == 'WEBP' and features.check('webp'):
+        return 'WEBP', 'webp'
+    return 'JPEG', 'jpg'
+
+
+def rendition_path(digest, size):
+    """内容寻址的缩略图路径"""
+    width, height = size
+    _, ext = rendition_format()
+    return f'{RENDITION_DIR}/{digest[:2]}/{digest}_{width}x{height}.{ext}'
+
+
+def file_digest(field_file):
+    """上传文件内容的 SHA-256；按内容寻址保存的文件直接取文件名中的哈希，否则分块计算"""
+    digest = blob_digest(field_file.name)
+    if digest:
+        return digest
+    digest = hashlib.sha256()
+    field_file.open('rb')
+    try:
+        for chunk in field_file.chunks():
+            digest.update(chunk)
+    finally:
+        field_file.close()
+    return digest.hexdigest()
+
+
+def _flatten(image):
+    """转换为 RGB，透明部分合成到白色背景上"""
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, BACKGROUND)
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def render(image, size):
+    """把图片缩小到 size 以内（保持比例，不放大），返回编码后的字节"""
+    fmt, _ = rendition_format()
+    image = image.copy()
+    # reducing_gap 先用整数倍快速缩小，再用 LANCZOS 精确缩放，大图时明显更快
+    image.thumbnail(size, Image.LANCZOS, reducing_gap=3.0)
+    buffer = io.BytesIO()
+    image.save(buffer, fmt, quality=getattr(
+        settings, 'DESIGN_IMAGE_RENDITION_QUALITY', DEFAULT_QUALITY), method=4)
+    return buffer.getvalue()
+
+
+def ensure_renditions(design):
+    """
+    为设计图片生成缺失的缩略图，并保存图片哈希
+
+    原图只解码一次，按尺寸从大到小依次缩小，小图由上一级缩略图生成。
+
+    返回:
+        str: 图片内容哈希；设计没有图片时返回空字符串
+    """
+    from .models import Design
+
+    if not design.image:
+        return ''
+    storage = default_storage
+    digest = file_digest(design.image)
+
+    missing = [size for size in sorted(set(get_renditions().values()), reverse=True)
+               if not storage.exists(rendition_path(digest, size))]
+    if missing:
+        design.image.open('rb')
+        try:
+            with Image.open(design.image) as original:
+                image = _flatten(ImageOps.exif_transpose(original))
+        finally:
+            design.image.close()
+        for size in missing:
+            content = render(image, size)
+            storage.save(rendition_path(digest, size), ContentFile(content))
+            image.thumbnail(size, Image.LANCZOS, reducing_gap=3.0)
+        logger.info(f"生成设计缩略图: 设计 {design.pk}, {len(missing)} 个尺寸")
+
+    if design.image_hash != digest:
+        design.image_hash = digest
+        Design.objects.filter(pk=design.pk).update(image_hash=digest)
+    return digest
+
+
+def generate_renditions(design):
+    """上传图片后生成缩略图，失败时只记录日志（缩略图地址会回退到按需生成的接口）"""
+    try:
+        return ensure_renditions(design)
+    except Exception as e:
+        logger.error(f"生成设计缩略图失败: 设计 {design.pk}, 错误: {str(e)}")
+        return ''
+
+
+def rendition_url(design, name):
+    """
+    设计某个缩略图的完整URL
+
+    已有图片哈希时直接返回媒体文件地址（不访问存储）；否则已分享的设计返回按需生成的
+    接口地址，未分享的设计返回原图地址（接口只允许访问已分享的设计或作者本人，
+    列表中的图片请求不带登录信息）。
+    """
+    if not design.image or name not in get_renditions():
+        return None
+    if design.image_hash:
+        path = rendition_path(design.image_hash, get_renditions()[name])
+        return get_absolute_media_url(default_storage.url(path))
+    if not design.is_shared:
+        return get_absolute_media_url(design.image.url)
+    return get_absolute_media_url(reverse('design-rendition', kwargs={'pk': design.pk, 'name': name}))
@@ -4,4 +4,8 @@ from . import consumers
 websocket_urlpatterns = [
     re_path(r'ws/collaboration/(?P<design_id>[\w-]+)/$',
             consumers.CollaborationConsumer.as_asgi()),
+    re_path(r'ws/payment/orders/(?P<order_id>[\w-]+)/$',
+            consumers.OrderStatusConsumer.as_asgi()),
+    re_path(r'ws/render/jobs/(?P<job_id>[0-9a-f-]+)/$',
+            consumers.RenderJobConsumer.as_asgi()),
 ]
@@ -3,6 +3,10 @@ from django.contrib.auth.models import User
 from django.contrib.auth.password_validation import validate_password
 from .models import Design, DesignLike, UserProfile, MembershipPlan, CustomObstacle, MembershipOrder
 from .utils import get_absolute_media_url
+from .membership import get_membership
+from .plan_registry import get_plan_registry
+from .renditions import rendition_url
+from .design_summary import SUMMARY_FIELDS
 
 
 class UserRegisterSerializer(serializers.ModelSerializer):
@@ -92,9 +96,8 @@ class UserRegisterSerializer(serializers.ModelSerializer):
             user.save()
 
         # 获取免费会员计划
-        try:
-            free_plan = MembershipPlan.objects.get(code='free')
-        except MembershipPlan.DoesNotExist:
+        free_plan = get_plan_registry().by_code('free')
+        if free_plan is None:
             # 如果免费计划不存在，创建一个
             free_plan = MembershipPlan.objects.create(
                 name='免费用户',
@@ -163,13 +166,16 @@ class DesignSerializer(serializers.ModelSerializer):
     author_username = serializers.SerializerMethodField()
     is_liked = serializers.SerializerMethodField()
     image_url = serializers.SerializerMethodField()
+    thumbnail_url = serializers.SerializerMethodField()
+    preview_url = serializers.SerializerMethodField()
     download_url = serializers.SerializerMethodField()
 
     class Meta:
         model = Design
-        fields = '__all__'
-        read_only_fields = ('author', 'create_time',
-                            'update_time', 'likes_count', 'downloads_count')
+        # 设计文档通过 download 文件上传和下载
+        exclude = ('document',)
+        read_only_fields = ('author', 'create_time', 'update_time', 'likes_count',
+                            'downloads_count', 'image_hash', 'document_hash') + SUMMARY_FIELDS
 
     def get_author_username(self, obj):
         """获取作者用户名"""
@@ -179,6 +185,9 @@ class DesignSerializer(serializers.ModelSerializer):
         """当前用户是否已点赞"""
         request = self.context.get('request')
         if request and request.user.is_authenticated:
+            # 查询集已标注时（DesignViewSet.with_list_annotations）直接使用标注结果
+            if hasattr(obj, 'user_has_liked'):
+                return obj.user_has_liked
             return DesignLike.objects.filter(design=obj, user=request.user).exists()
         return False
 
@@ -188,8 +197,16 @@ class DesignSerializer(serializers.ModelSerializer):
             return get_absolute_media_url(obj.image.url)
         return None
 
+    def get_thumbnail_url(self, obj):
+        """列表使用的缩略图URL"""
+        return rendition_url(obj, 'thumbnail')
+
+    def get_preview_url(self, obj):
+        """预览使用的中等尺寸图片URL"""
+        return rendition_url(obj, 'preview')
+
     def get_download_url(self, obj):
-        """获取正确的下载URL"""
+        """获取正确的下载URL（协作编辑后的设计文件在会话结束或下载时重新生成）"""
         if obj.download:
             return get_absolute_media_url(obj.download.url)
         return None
@@ -208,12 +225,14 @@ class DesignListSerializer(serializers.ModelSerializer):
     author_username = serializers.SerializerMethodField()
     is_liked = serializers.SerializerMethodField()
     image_url = serializers.SerializerMethodField()
+    thumbnail_url = serializers.SerializerMethodField()
+    preview_url = serializers.SerializerMethodField()
 
     class Meta:
         model = Design
-        fields = ('id', 'title', 'image', 'image_url', 'create_time', 'update_time',
-                  'author', 'author_username', 'likes_count', 'downloads_count',
-                  'is_shared', 'description', 'is_liked')
+        fields = ('id', 'title', 'image', 'image_url', 'thumbnail_url', 'preview_url',
+                  'create_time', 'update_time', 'author', 'author_username', 'likes_count',
+                  'downloads_count', 'is_shared', 'description', 'is_liked') + SUMMARY_FIELDS
         read_only_fields = fields
 
     def get_author_username(self, obj):
@@ -224,6 +243,9 @@ class DesignListSerializer(serializers.ModelSerializer):
         """当前用户是否已点赞"""
         request = self.context.get('request')
         if request and request.user.is_authenticated:
+            # 查询集已标注时（DesignViewSet.with_list_annotations）直接使用标注结果
+            if hasattr(obj, 'user_has_liked'):
+                return obj.user_has_liked
             return DesignLike.objects.filter(design=obj, user=request.user).exists()
         return False
 
@@ -233,6 +255,14 @@ class DesignListSerializer(serializers.ModelSerializer):
             return get_absolute_media_url(obj.image.url)
         return None
 
+    def get_thumbnail_url(self, obj):
+        """列表使用的缩略图URL"""
+        return rendition_url(obj, 'thumbnail')
+
+    def get_preview_url(self, obj):
+        """预览使用的中等尺寸图片URL"""
+        return rendition_url(obj, 'preview')
+
     def to_representation(self, instance):
         """重写序列化方法，确保使用正确的URL"""
         ret = super().to_representation(instance)
@@ -351,8 +381,9 @@ class CustomObstacleSerializer(serializers.ModelSerializer):
         user = self.context['request'].user
         # 从会员计划中获取自定义障碍物数量限制
         max_obstacles = 10  # 默认限制（免费用户）
-        if hasattr(user, 'profile') and user.profile.membership_plan:
-            plan_limit = user.profile.membership_plan.custom_obstacle_limit
+        membership = get_membership(user)
+        if membership.membership_plan:
+            plan_limit = membership.get_custom_obstacle_limit()
             if plan_limit is not None:
                 max_obstacles = plan_limit
             # null 表示无限制，不检查
@@ -412,15 +443,14 @@ class CreateMembershipOrderSerializer(serializers.Serializer):
         choices=['month', 'year'], required=True)
 
     def validate_plan_id(self, value):
-        try:
-            plan = MembershipPlan.objects.get(id=value, is_active=True)
-            return value
-        except MembershipPlan.DoesNotExist:
+        if get_plan_registry().get(value, active_only=True) is None:
             raise serializers.ValidationError("指定的会员计划不存在或已停用")
+        return value
 
     def validate(self, data):
-        # 获取计划
-        plan = MembershipPlan.objects.get(id=data['plan_id'])
+        # 获取计划（从计划目录缓存读取，不查询数据库）
+        plan = get_plan_registry().get(data['plan_id'])
+        data['plan'] = plan
         # 根据计费周期获取价格
         if data['billing_cycle'] == 'month':
             data['amount'] = plan.monthly_price
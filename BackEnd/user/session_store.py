@@ -0,0 +1,875 @@
+"""
+协作会话存储模块
+
+为 CollaborationConsumer 提供可插拔的会话状态存储后端，取代原先进程内的
+全局 active_sessions 字典，使多个 Daphne 进程可以共享同一份协作者列表。
+
+提供两种后端：
+- InMemorySessionStore: 进程内存储，用于测试和单进程开发环境
+- RedisSessionStore: 基于 CHANNEL_LAYERS 中已配置的 Redis，按设计ID分片，
+  每个会话使用两个哈希（会话元数据 / 协作者），所有写操作原子执行并刷新TTL
+
+除协作者信息外，存储中还保存会话的权威设计文档和带序号的操作日志，
+详见 design_document 模块。
+
+设计文档同时作为尚未写回数据库的编辑日志：文档记录已落库的序号
+flushed_seq，最后一个协作者离开时，如果仍有未落库的编辑，文档会在会话删除后
+继续保留 journal_ttl 秒，直到 design_persistence 模块将其写回设计记录。
+
+通过 settings.COLLABORATION_SESSION_STORE 配置：
+    COLLABORATION_SESSION_STORE = {
+        'BACKEND': 'user.session_store.RedisSessionStore',
+        'OPTIONS': {'ttl': 7200, 'max_operations': 1000, 'journal_ttl': 604800},
+    }
+"""
+
+import binascii
+import json
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .design_document import apply_to_target, merge_document, operation_target
+
+# 默认会话过期时间（秒），每次写操作都会刷新
+DEFAULT_SESSION_TTL = 60 * 60 * 2
+
+# 默认保留的操作日志条数，超出后断线重连的客户端需要全量同步
+DEFAULT_MAX_OPERATIONS = 1000
+
+# 会话结束后未落库的设计文档默认保留时间（秒）
+DEFAULT_JOURNAL_TTL = 60 * 60 * 24 * 7
+
+
+def _new_session_meta(design_id):
+    """构建新会话的元数据"""
+    return {
+        'id': str(uuid.uuid4()),
+        'design_id': design_id,
+        'owner': None,
+        'initiator': None,
+        'created_at': datetime.now().isoformat(),
+    }
+
+
+def _build_session(meta, collaborators):
+    """将元数据和协作者组装为与前端协议一致的会话字典"""
+    return {
+        'id': meta.get('id'),
+        'design_id': meta.get('design_id'),
+        'collaborators': list(collaborators),
+        'owner': meta.get('owner') or None,
+        'initiator': meta.get('initiator') or None,
+        'created_at': meta.get('created_at'),
+    }
+
+
+class BaseSessionStore:
+    """
+    会话存储后端基类
+
+    所有方法均为协程，session 字典结构与原 active_sessions[design_id] 保持一致：
+    {id, design_id, collaborators, owner, initiator, created_at}
+    """
+
+    def __init__(self, ttl=DEFAULT_SESSION_TTL, max_operations=DEFAULT_MAX_OPERATIONS,
+                 journal_ttl=DEFAULT_JOURNAL_TTL, **options):
+        self.ttl = int(ttl)
+        self.max_operations = int(max_operations)
+        self.journal_ttl = int(journal_ttl)
+
+    async def get_session(self, design_id):
+        """获取会话快照，不存在时返回 None"""
+        raise NotImplementedError
+
+    async def session_exists(self, design_id):
+        """会话是否存在"""
+        raise NotImplementedError
+
+    async def get_or_create_session(self, design_id):
+        """获取会话，不存在时原子创建，返回 (session, created)"""
+        raise NotImplementedError
+
+    async def claim_role(self, design_id, role, user_id):
+        """仅在 owner/initiator 尚未设置时写入，返回是否写入成功"""
+        raise NotImplementedError
+
+    async def get_collaborator(self, design_id, user_id):
+        """获取单个协作者，不存在时返回 None"""
+        raise NotImplementedError
+
+    async def add_collaborator(self, design_id, collaborator):
+        """添加协作者（已存在时不覆盖），返回是否新增"""
+        raise NotImplementedError
+
+    async def update_collaborator(self, design_id, user_id, **fields):
+        """更新协作者字段，返回更新后的协作者，不存在时返回 None"""
+        raise NotImplementedError
+
+    async def remove_collaborator(self, design_id, user_id):
+        """
+        移除协作者，返回移除后的会话快照
+
+        如果移除后没有剩余协作者，会话会被同时删除（返回的快照中 collaborators 为空），
+        但仍有未落库编辑的设计文档会保留 journal_ttl 秒。会话不存在时返回 None。
+        """
+        raise NotImplementedError
+
+    async def expire_collaborators(self, design_id, cutoff):
+        """
+        移除 last_seen 早于 cutoff 的协作者（连接已失效但没有正常断开）
+
+        没有剩余协作者时的处理与 remove_collaborator 相同。
+
+        参数:
+            cutoff: 时间戳（秒），last_seen 缺失的协作者视为已失效
+
+        返回:
+            tuple: (移除后的会话快照, 被移除的协作者列表)；会话不存在时返回 (None, [])
+        """
+        raise NotImplementedError
+
+    async def list_sessions(self):
+        """返回所有活跃会话的设计ID（用于后台清理任务）"""
+        raise NotImplementedError
+
+    async def delete_session(self, design_id):
+        """删除会话"""
+        raise NotImplementedError
+
+    async def has_document(self, design_id):
+        """会话的设计文档是否已初始化"""
+        raise NotImplementedError
+
+    async def seed_document(self, design_id, document):
+        """
+        初始化会话的设计文档（仅在尚未初始化时写入），返回是否写入
+
+        参数:
+            document: design_document.split_document() 返回的拆分文档
+        """
+        raise NotImplementedError
+
+    async def apply_operation(self, design_id, message):
+        """
+        将编辑消息应用到设计文档并追加到操作日志
+
+        返回:
+            int: 分配给该操作的序号；消息无法识别时返回 None
+        """
+        raise NotImplementedError
+
+    async def get_document(self, design_id):
+        """
+        获取导出格式的设计文档
+
+        返回:
+            tuple: (文档字典, 当前序号)；文档未初始化时返回 (None, 0)
+        """
+        raise NotImplementedError
+
+    async def get_operations_since(self, design_id, seq):
+        """
+        获取序号大于 seq 的所有操作
+
+        返回:
+            list: 按序号排列的操作消息；日志中已缺失所需操作或序号无效时返回 None
+        """
+        raise NotImplementedError
+
+    async def get_journal(self, design_id):
+        """
+        获取设计文档及其落库状态
+
+        返回:
+            tuple: (导出格式的文档, 当前序号, 已落库的序号)；没有文档时返回 (None, 0, 0)
+        """
+        raise NotImplementedError
+
+    async def mark_flushed(self, design_id, seq):
+        """记录已写回数据库的序号（只会增大），文档不存在时返回 False"""
+        raise NotImplementedError
+
+    async def discard_journal(self, design_id):
+        """
+        会话已结束且文档已全部落库时删除文档，返回是否删除
+
+        会话仍存在或还有未落库的编辑时不做任何操作。
+        """
+        raise NotImplementedError
+
+    async def list_journals(self):
+        """返回所有存有设计文档（包括会话已结束的）的设计ID"""
+        raise NotImplementedError
+
+
+class InMemorySessionStore(BaseSessionStore):
+    """进程内会话存储，用于测试和单进程部署"""
+
+    def __init__(self, ttl=DEFAULT_SESSION_TTL, max_operations=DEFAULT_MAX_OPERATIONS, **options):
+        super().__init__(ttl=ttl, max_operations=max_operations, **options)
+        # 结构: {design_id: {'meta': {...}, 'collaborators': {user_id: {...}},
+        #                    'document': {...} 或 None, 'seq': int, 'flushed_seq': int,
+        #                    'operations': deque, 'expires_at': float}}
+        self._sessions = {}
+        # 会话结束后保留的未落库文档，
+        # 结构: {design_id: {'document': {...}, 'seq': int, 'flushed_seq': int, 'expires_at': float}}
+        self._journals = {}
+
+    def _get(self, design_id):
+        entry = self._sessions.get(design_id)
+        if entry is None:
+            return None
+        if entry['expires_at'] <= time.monotonic():
+            del self._sessions[design_id]
+            return None
+        return entry
+
+    def _touch(self, entry):
+        entry['expires_at'] = time.monotonic() + self.ttl
+
+    def _get_retained(self, design_id):
+        journal = self._journals.get(design_id)
+        if journal is not None and journal['expires_at'] <= time.monotonic():
+            del self._journals[design_id]
+            return None
+        return journal
+
+    def _get_journal_entry(self, design_id):
+        """获取持有设计文档的条目：活跃会话优先，其次是会话结束后保留的文档"""
+        return self._get(design_id) or self._get_retained(design_id)
+
+    def _snapshot(self, entry):
+        return _build_session(
+            entry['meta'],
+            (dict(c) for c in entry['collaborators'].values())
+        )
+
+    async def get_session(self, design_id):
+        entry = self._get(design_id)
+        return self._snapshot(entry) if entry else None
+
+    async def session_exists(self, design_id):
+        return self._get(design_id) is not None
+
+    async def get_or_create_session(self, design_id):
+        entry = self._get(design_id)
+        created = entry is None
+        if created:
+            entry = {
+                'meta': _new_session_meta(design_id),
+                'collaborators': {},
+                'document': None,
+                'seq': 0,
+                'flushed_seq': 0,
+                'operations': deque(maxlen=self.max_operations),
+            }
+            # 接续上一个会话尚未落库的文档
+            journal = self._get_retained(design_id)
+            if journal is not None:
+                del self._journals[design_id]
+                entry.update(document=journal['document'], seq=journal['seq'],
+                             flushed_seq=journal['flushed_seq'])
+            self._sessions[design_id] = entry
+        self._touch(entry)
+        return self._snapshot(entry), created
+
+    async def claim_role(self, design_id, role, user_id):
+        entry = self._get(design_id)
+        if entry is None or entry['meta'].get(role):
+            return False
+        entry['meta'][role] = user_id
+        self._touch(entry)
+        return True
+
+    async def get_collaborator(self, design_id, user_id):
+        entry = self._get(design_id)
+        if entry is None:
+            return None
+        collaborator = entry['collaborators'].get(user_id)
+        return dict(collaborator) if collaborator else None
+
+    async def add_collaborator(self, design_id, collaborator):
+        entry = self._get(design_id)
+        if entry is None or collaborator['id'] in entry['collaborators']:
+            return False
+        entry['collaborators'][collaborator['id']] = dict(collaborator)
+        self._touch(entry)
+        return True
+
+    async def update_collaborator(self, design_id, user_id, **fields):
+        entry = self._get(design_id)
+        if entry is None or user_id not in entry['collaborators']:
+            return None
+        entry['collaborators'][user_id].update(fields)
+        self._touch(entry)
+        return dict(entry['collaborators'][user_id])
+
+    def _close_if_empty(self, design_id, entry):
+        """没有剩余协作者时删除会话，保留未落库的文档"""
+        if entry['collaborators']:
+            return
+        del self._sessions[design_id]
+        if entry['document'] is not None and entry['seq'] > entry['flushed_seq']:
+            self._journals[design_id] = {
+                'document': entry['document'],
+                'seq': entry['seq'],
+                'flushed_seq': entry['flushed_seq'],
+                'expires_at': time.monotonic() + self.journal_ttl,
+            }
+
+    async def remove_collaborator(self, design_id, user_id):
+        entry = self._get(design_id)
+        if entry is None:
+            return None
+        entry['collaborators'].pop(user_id, None)
+        snapshot = self._snapshot(entry)
+        if entry['collaborators']:
+            self._touch(entry)
+        self._close_if_empty(design_id, entry)
+        return snapshot
+
+    async def expire_collaborators(self, design_id, cutoff):
+        entry = self._get(design_id)
+        if entry is None:
+            return None, []
+        removed = [
+            entry['collaborators'].pop(user_id)
+            for user_id, collaborator in list(entry['collaborators'].items())
+            if (collaborator.get('last_seen') or 0) < cutoff
+        ]
+        snapshot = self._snapshot(entry)
+        if removed:
+            self._close_if_empty(design_id, entry)
+        return snapshot, removed
+
+    async def list_sessions(self):
+        return [design_id for design_id in list(self._sessions) if self._get(design_id)]
+
+    async def delete_session(self, design_id):
+        self._sessions.pop(design_id, None)
+        self._journals.pop(design_id, None)
+
+    async def has_document(self, design_id):
+        entry = self._get(design_id)
+        return entry is not None and entry['document'] is not None
+
+    async def seed_document(self, design_id, document):
+        entry = self._get(design_id)
+        if entry is None or entry['document'] is not None:
+            return False
+        entry['document'] = {
+            'obstacles': dict(document['obstacles']),
+            'path': document['path'],
+            'meta': dict(document['meta']),
+        }
+        self._touch(entry)
+        return True
+
+    async def apply_operation(self, design_id, message):
+        entry = self._get(design_id)
+        kind, key = operation_target(message.get('type'), message.get('payload'))
+        if entry is None or kind is None:
+            return None
+        if entry['document'] is None:
+            entry['document'] = {'obstacles': {}, 'path': None, 'meta': {}}
+        document = entry['document']
+
+        current = document['obstacles'].get(key) if kind == 'obstacle' else document['path']
+        value = apply_to_target(message['type'], message['payload'], current)
+        if kind == 'path':
+            document['path'] = value
+        elif value is None:
+            document['obstacles'].pop(key, None)
+        else:
+            document['obstacles'][key] = value
+
+        entry['seq'] += 1
+        entry['operations'].append(dict(message, seq=entry['seq']))
+        self._touch(entry)
+        return entry['seq']
+
+    async def get_document(self, design_id):
+        entry = self._get(design_id)
+        if entry is None or entry['document'] is None:
+            return None, 0
+        document = entry['document']
+        return merge_document(
+            document['obstacles'].values(), document['path'], document['meta']
+        ), entry['seq']
+
+    async def get_operations_since(self, design_id, seq):
+        entry = self._get(design_id)
+        if entry is None:
+            return None
+        if seq > entry['seq']:
+            # 客户端序号来自已结束的旧会话
+            return None
+        if seq == entry['seq']:
+            return []
+        operations = entry['operations']
+        if not operations or operations[0]['seq'] > seq + 1:
+            return None
+        return [op for op in operations if op['seq'] > seq]
+
+    async def get_journal(self, design_id):
+        entry = self._get_journal_entry(design_id)
+        if entry is None or entry['document'] is None:
+            return None, 0, 0
+        document = entry['document']
+        return merge_document(
+            document['obstacles'].values(), document['path'], document['meta']
+        ), entry['seq'], entry['flushed_seq']
+
+    async def mark_flushed(self, design_id, seq):
+        entry = self._get_journal_entry(design_id)
+        if entry is None or entry['document'] is None:
+            return False
+        entry['flushed_seq'] = max(entry['flushed_seq'], seq)
+        return True
+
+    async def discard_journal(self, design_id):
+        if self._get(design_id) is not None:
+            return False
+        journal = self._get_retained(design_id)
+        if journal is None or journal['seq'] > journal['flushed_seq']:
+            return False
+        del self._journals[design_id]
+        return True
+
+    async def list_journals(self):
+        design_ids = [
+            design_id for design_id in list(self._sessions)
+            if (self._get(design_id) or {}).get('document') is not None
+        ]
+        design_ids += [
+            design_id for design_id in list(self._journals)
+            if design_id not in self._sessions and self._get_retained(design_id)
+        ]
+        return design_ids
+
+
+class RedisSessionStore(BaseSessionStore):
+    """
+    基于Redis的共享会话存储
+
+    - 按设计ID对 hosts 做一致性哈希分片（与 channels_redis 的分片方式相同）
+    - 每个会话对应以下键，均使用 {design_id} 哈希标签：
+        meta          哈希，会话元数据
+        collaborators 哈希，field 为用户ID，value 为协作者JSON
+        doc           哈希，设计文档的 seq / flushed_seq / path / meta 字段
+        obstacles     哈希，field 为障碍物ID，value 为障碍物JSON
+        ops           列表，带序号的操作日志（保留最近 max_operations 条）
+    - 协作者相关写操作通过 MULTI 或 Lua 脚本原子执行；文档操作以 doc 键为
+      WATCH 对象做乐观事务，冲突时重试。每次写入同时刷新所有键的TTL
+    """
+
+    # 会话存在时原子添加协作者（已存在时不覆盖），并刷新TTL
+    ADD_COLLABORATOR_SCRIPT = """
+        if redis.call('EXISTS', KEYS[1]) == 0 then
+            return 0
+        end
+        local added = redis.call('HSETNX', KEYS[2], ARGV[1], ARGV[2])
+        for i = 1, #KEYS do
+            redis.call('EXPIRE', KEYS[i], ARGV[3])
+        end
+        return added
+    """
+
+    # 原子更新协作者字段
+    UPDATE_COLLABORATOR_SCRIPT = """
+        local raw = redis.call('HGET', KEYS[2], ARGV[1])
+        if not raw then
+            return false
+        end
+        local collaborator = cjson.decode(raw)
+        for k, v in pairs(cjson.decode(ARGV[2])) do
+            collaborator[k] = v
+        end
+        raw = cjson.encode(collaborator)
+        redis.call('HSET', KEYS[2], ARGV[1], raw)
+        for i = 1, #KEYS do
+            redis.call('EXPIRE', KEYS[i], ARGV[3])
+        end
+        return raw
+    """
+
+    # 删除没有剩余协作者的会话，仍有未落库编辑时保留文档（ARGV[3] 为保留时间）
+    _CLOSE_SESSION_LUA = """
+        local function close_session()
+            local seq = tonumber(redis.call('HGET', KEYS[3], 'seq') or '0')
+            local flushed = tonumber(redis.call('HGET', KEYS[3], 'flushed_seq') or '0')
+            if seq > flushed then
+                redis.call('DEL', KEYS[1], KEYS[2], KEYS[5])
+                redis.call('EXPIRE', KEYS[3], ARGV[3])
+                redis.call('EXPIRE', KEYS[4], ARGV[3])
+            else
+                redis.call('DEL', unpack(KEYS))
+            end
+        end
+    """
+
+    # 原子移除协作者，没有剩余协作者时删除整个会话
+    REMOVE_COLLABORATOR_SCRIPT = _CLOSE_SESSION_LUA + """
+        local meta = redis.call('HGETALL', KEYS[1])
+        if #meta == 0 then
+            return false
+        end
+        redis.call('HDEL', KEYS[2], ARGV[1])
+        local collaborators = redis.call('HGETALL', KEYS[2])
+        if #collaborators == 0 then
+            close_session()
+        else
+            for i = 1, #KEYS do
+                redis.call('EXPIRE', KEYS[i], ARGV[2])
+            end
+        end
+        return {meta, collaborators}
+    """
+
+    # 原子移除 last_seen 早于 ARGV[1] 的协作者，不刷新TTL
+    EXPIRE_COLLABORATORS_SCRIPT = _CLOSE_SESSION_LUA + """
+        local meta = redis.call('HGETALL', KEYS[1])
+        if #meta == 0 then
+            return false
+        end
+        local collaborators = redis.call('HGETALL', KEYS[2])
+        local removed = {}
+        for i = 1, #collaborators, 2 do
+            local collaborator = cjson.decode(collaborators[i + 1])
+            if (tonumber(collaborator['last_seen']) or 0) < tonumber(ARGV[1]) then
+                redis.call('HDEL', KEYS[2], collaborators[i])
+                table.insert(removed, collaborators[i + 1])
+            end
+        end
+        if #removed > 0 then
+            collaborators = redis.call('HGETALL', KEYS[2])
+            if #collaborators == 0 then
+                close_session()
+            end
+        end
+        return {meta, collaborators, removed}
+    """
+
+    # 记录已落库的序号（只增不减）
+    MARK_FLUSHED_SCRIPT = """
+        if redis.call('EXISTS', KEYS[1]) == 0 then
+            return 0
+        end
+        local flushed = tonumber(redis.call('HGET', KEYS[1], 'flushed_seq') or '0')
+        if tonumber(ARGV[1]) > flushed then
+            redis.call('HSET', KEYS[1], 'flushed_seq', ARGV[1])
+        end
+        return 1
+    """
+
+    # 会话已结束且文档已全部落库时删除文档
+    DISCARD_JOURNAL_SCRIPT = """
+        if redis.call('EXISTS', KEYS[1]) == 1 then
+            return 0
+        end
+        local seq = tonumber(redis.call('HGET', KEYS[3], 'seq') or '0')
+        local flushed = tonumber(redis.call('HGET', KEYS[3], 'flushed_seq') or '0')
+        if seq > flushed then
+            return 0
+        end
+        return redis.call('DEL', KEYS[3], KEYS[4], KEYS[5])
+    """
+
+    def __init__(self, hosts=None, prefix='collab:session', ttl=DEFAULT_SESSION_TTL,
+                 max_operations=DEFAULT_MAX_OPERATIONS, journal_ttl=DEFAULT_JOURNAL_TTL,
+                 **options):
+        super().__init__(ttl=ttl, max_operations=max_operations,
+                         journal_ttl=journal_ttl, **options)
+        if hosts is None:
+            # 默认复用 CHANNEL_LAYERS 中配置的Redis
+            hosts = settings.CHANNEL_LAYERS['default'].get(
+                'CONFIG', {}).get('hosts', [('127.0.0.1', 6379)])
+        self.hosts = list(hosts)
+        self.prefix = prefix
+        self._clients = [None] * len(self.hosts)
+
+    def _client(self, design_id):
+        """根据设计ID选择分片并返回对应的Redis客户端"""
+        index = binascii.crc32(str(design_id).encode('utf-8')) % len(self.hosts)
+        return self._client_at(index)
+
+    def _client_at(self, index):
+        import redis.asyncio as aioredis
+
+        if self._clients[index] is None:
+            host = self.hosts[index]
+            if isinstance(host, str):
+                client = aioredis.Redis.from_url(host, decode_responses=True)
+            elif isinstance(host, dict):
+                # 与 channels_redis 相同的写法：{'address': 'redis://...', ...其他连接参数}
+                options = dict(host)
+                address = options.pop('address', None)
+                if isinstance(address, (tuple, list)):
+                    options.update(host=address[0], port=address[1])
+                    address = None
+                if address:
+                    client = aioredis.Redis.from_url(address, decode_responses=True, **options)
+                else:
+                    client = aioredis.Redis(decode_responses=True, **options)
+            else:
+                client = aioredis.Redis(
+                    host=host[0], port=host[1], decode_responses=True)
+            self._clients[index] = client
+        return self._clients[index]
+
+    def _keys(self, design_id):
+        # 使用 {design_id} 哈希标签，保证同一会话的键在Redis Cluster中落在同一槽位
+        base = f'{self.prefix}:{{{design_id}}}'
+        return (
+            f'{base}:meta',
+            f'{base}:collaborators',
+            f'{base}:doc',
+            f'{base}:obstacles',
+            f'{base}:ops',
+        )
+
+    def _expire_all(self, pipe, design_id):
+        for key in self._keys(design_id):
+            pipe.expire(key, self.ttl)
+
+    @staticmethod
+    def _pairs_to_dict(pairs):
+        if isinstance(pairs, dict):
+            return pairs
+        return dict(zip(pairs[::2], pairs[1::2]))
+
+    def _decode_session(self, meta, collaborators):
+        meta = self._pairs_to_dict(meta)
+        collaborators = self._pairs_to_dict(collaborators)
+        return _build_session(meta, (json.loads(c) for c in collaborators.values()))
+
+    async def get_session(self, design_id):
+        meta_key, collaborators_key = self._keys(design_id)[:2]
+        async with self._client(design_id).pipeline(transaction=True) as pipe:
+            meta, collaborators = await pipe.hgetall(meta_key).hgetall(collaborators_key).execute()
+        if not meta:
+            return None
+        return self._decode_session(meta, collaborators)
+
+    async def session_exists(self, design_id):
+        meta_key = self._keys(design_id)[0]
+        return bool(await self._client(design_id).exists(meta_key))
+
+    async def get_or_create_session(self, design_id):
+        meta_key, collaborators_key = self._keys(design_id)[:2]
+        meta = _new_session_meta(design_id)
+        async with self._client(design_id).pipeline(transaction=True) as pipe:
+            pipe.hsetnx(meta_key, 'id', meta['id'])
+            pipe.hsetnx(meta_key, 'design_id', meta['design_id'])
+            pipe.hsetnx(meta_key, 'created_at', meta['created_at'])
+            self._expire_all(pipe, design_id)
+            pipe.hgetall(meta_key)
+            pipe.hgetall(collaborators_key)
+            results = await pipe.execute()
+        return self._decode_session(results[-2], results[-1]), bool(results[0])
+
+    async def claim_role(self, design_id, role, user_id):
+        meta_key = self._keys(design_id)[0]
+        client = self._client(design_id)
+        if not await client.exists(meta_key):
+            return False
+        async with client.pipeline(transaction=True) as pipe:
+            claimed, _ = await pipe.hsetnx(meta_key, role, user_id).expire(meta_key, self.ttl).execute()
+        return bool(claimed)
+
+    async def get_collaborator(self, design_id, user_id):
+        collaborators_key = self._keys(design_id)[1]
+        raw = await self._client(design_id).hget(collaborators_key, user_id)
+        return json.loads(raw) if raw else None
+
+    async def add_collaborator(self, design_id, collaborator):
+        keys = self._keys(design_id)
+        added = await self._client(design_id).eval(
+            self.ADD_COLLABORATOR_SCRIPT, len(keys), *keys,
+            collaborator['id'], json.dumps(collaborator), self.ttl)
+        return bool(added)
+
+    async def update_collaborator(self, design_id, user_id, **fields):
+        keys = self._keys(design_id)
+        raw = await self._client(design_id).eval(
+            self.UPDATE_COLLABORATOR_SCRIPT, len(keys), *keys,
+            user_id, json.dumps(fields), self.ttl)
+        return json.loads(raw) if raw else None
+
+    async def remove_collaborator(self, design_id, user_id):
+        keys = self._keys(design_id)
+        result = await self._client(design_id).eval(
+            self.REMOVE_COLLABORATOR_SCRIPT, len(keys), *keys,
+            user_id, self.ttl, self.journal_ttl)
+        if not result:
+            return None
+        return self._decode_session(result[0], result[1])
+
+    async def expire_collaborators(self, design_id, cutoff):
+        keys = self._keys(design_id)
+        result = await self._client(design_id).eval(
+            self.EXPIRE_COLLABORATORS_SCRIPT, len(keys), *keys,
+            cutoff, self.ttl, self.journal_ttl)
+        if not result:
+            return None, []
+        return (self._decode_session(result[0], result[1]),
+                [json.loads(raw) for raw in result[2]])
+
+    async def list_sessions(self):
+        # 开销与键总数相关，只在低频的全量清理中使用
+        return await self._scan_design_ids('meta')
+
+    async def _scan_design_ids(self, suffix):
+        """逐个分片 SCAN 指定类型的键，返回其中的设计ID"""
+        pattern = f'{self.prefix}:{{*}}:{suffix}'
+        start = len(self.prefix) + 2
+        end = -len(f'}}:{suffix}')
+        design_ids = []
+        for index in range(len(self.hosts)):
+            async for key in self._client_at(index).scan_iter(match=pattern, count=500):
+                design_ids.append(key[start:end])
+        return design_ids
+
+    async def delete_session(self, design_id):
+        await self._client(design_id).delete(*self._keys(design_id))
+
+    async def has_document(self, design_id):
+        doc_key = self._keys(design_id)[2]
+        return bool(await self._client(design_id).hexists(doc_key, 'seq'))
+
+    async def seed_document(self, design_id, document):
+        _, _, doc_key, obstacles_key, _ = self._keys(design_id)
+        seeded = False
+
+        async def seed(pipe):
+            nonlocal seeded
+            if await pipe.hexists(doc_key, 'seq'):
+                return
+            pipe.multi()
+            pipe.hset(doc_key, mapping={
+                'seq': 0,
+                'path': json.dumps(document['path']),
+                'meta': json.dumps(document['meta']),
+            })
+            if document['obstacles']:
+                pipe.hset(obstacles_key, mapping={
+                    obstacle_id: json.dumps(obstacle)
+                    for obstacle_id, obstacle in document['obstacles'].items()
+                })
+            self._expire_all(pipe, design_id)
+            seeded = True
+
+        await self._client(design_id).transaction(seed, doc_key)
+        return seeded
+
+    async def apply_operation(self, design_id, message):
+        meta_key, _, doc_key, obstacles_key, ops_key = self._keys(design_id)
+        kind, key = operation_target(message.get('type'), message.get('payload'))
+        if kind is None:
+            return None
+        seq = None
+
+        async def apply(pipe):
+            nonlocal seq
+            # 会话已结束或不存在时不写入，避免留下孤立的文档和操作日志
+            if not await pipe.exists(meta_key):
+                return
+            # 读取当前序号和目标字段
+            if kind == 'path':
+                current_seq, raw = await pipe.hmget(doc_key, 'seq', 'path')
+            else:
+                current_seq = await pipe.hget(doc_key, 'seq')
+                raw = await pipe.hget(obstacles_key, key)
+            current = json.loads(raw) if raw else None
+            value = apply_to_target(message['type'], message['payload'], current)
+            seq = int(current_seq or 0) + 1
+
+            pipe.multi()
+            pipe.hset(doc_key, 'seq', seq)
+            if kind == 'path':
+                pipe.hset(doc_key, 'path', json.dumps(value))
+            elif value is None:
+                pipe.hdel(obstacles_key, key)
+            else:
+                pipe.hset(obstacles_key, key, json.dumps(value))
+            pipe.rpush(ops_key, json.dumps(dict(message, seq=seq)))
+            pipe.ltrim(ops_key, -self.max_operations, -1)
+            self._expire_all(pipe, design_id)
+
+        await self._client(design_id).transaction(apply, meta_key, doc_key)
+        return seq
+
+    async def get_document(self, design_id):
+        document, seq, _ = await self.get_journal(design_id)
+        return document, seq
+
+    async def get_operations_since(self, design_id, seq):
+        _, _, doc_key, _, ops_key = self._keys(design_id)
+        async with self._client(design_id).pipeline(transaction=True) as pipe:
+            current_seq, operations = await pipe.hget(doc_key, 'seq').lrange(ops_key, 0, -1).execute()
+        if current_seq is None:
+            return None
+        if seq > int(current_seq):
+            # 客户端序号来自已结束的旧会话
+            return None
+        if seq == int(current_seq):
+            return []
+        operations = [json.loads(op) for op in operations]
+        if not operations or operations[0]['seq'] > seq + 1:
+            return None
+        return [op for op in operations if op['seq'] > seq]
+
+    async def get_journal(self, design_id):
+        _, _, doc_key, obstacles_key, _ = self._keys(design_id)
+        async with self._client(design_id).pipeline(transaction=True) as pipe:
+            doc, obstacles = await pipe.hgetall(doc_key).hgetall(obstacles_key).execute()
+        if not doc:
+            return None, 0, 0
+        return merge_document(
+            (json.loads(o) for o in obstacles.values()),
+            json.loads(doc.get('path') or 'null'),
+            json.loads(doc.get('meta') or '{}'),
+        ), int(doc.get('seq') or 0), int(doc.get('flushed_seq') or 0)
+
+    async def mark_flushed(self, design_id, seq):
+        doc_key = self._keys(design_id)[2]
+        return bool(await self._client(design_id).eval(
+            self.MARK_FLUSHED_SCRIPT, 1, doc_key, seq))
+
+    async def discard_journal(self, design_id):
+        keys = self._keys(design_id)
+        return bool(await self._client(design_id).eval(
+            self.DISCARD_JOURNAL_SCRIPT, len(keys), *keys))
+
+    async def list_journals(self):
+        # 只在恢复任务中使用
+        return await self._scan_design_ids('doc')
+
+
+_session_store = None
+
+
+def get_session_store():
+    """获取配置的会话存储后端（进程内单例）"""
+    global _session_store
+    if _session_store is None:
+        config = getattr(settings, 'COLLABORATION_SESSION_STORE', {})
+        backend = import_string(
+            config.get('BACKEND', 'user.session_store.InMemorySessionStore'))
+        _session_store = backend(**config.get('OPTIONS', {}))
+    return _session_store
+
+
+@receiver(setting_changed)
+def reset_session_store(setting, **kwargs):
+    """配置变化时（测试、基准中 override_settings）重新创建会话存储"""
+    global _session_store
+    if setting == 'COLLABORATION_SESSION_STORE':
+        _session_store = None
@@ -0,0 +1,33 @@
+"""
+用户模块信号处理
+
+在相关模型变化时清理依赖它们的缓存。
+"""
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .access_cache import invalidate_design_access, invalidate_user_access
+from .models import Design, MembershipPlan, UserProfile
+from .plan_registry import get_plan_registry
+
+
+@receiver(post_save, sender=Design)
+@receiver(post_delete, sender=Design)
+def design_changed(sender, instance, **kwargs):
+    """设计保存（包括分享/取消分享）或删除时，清理协作权限缓存"""
+    invalidate_design_access(instance.pk)
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def user_profile_changed(sender, instance, **kwargs):
+    """用户会员状态变化时，清理协作权限缓存"""
+    invalidate_user_access(instance.user_id)
+
+
+@receiver(post_save, sender=MembershipPlan)
+@receiver(post_delete, sender=MembershipPlan)
+def membership_plan_changed(sender, instance, **kwargs):
+    """会员计划保存或删除时，使各进程的计划目录缓存失效"""
+    get_plan_registry().invalidate()
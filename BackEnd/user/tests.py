@@ -1,3 +1,1311 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from Cryptodome.PublicKey import RSA
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+try:
+    import fakeredis
+    import lupa  # noqa: F401  fakeredis 执行 Lua 脚本需要
+except ImportError:  # pragma: no cover - 可选的测试依赖
+    fakeredis = None
+
+from .fake_alipay import get_fake_alipay_gateway
+from .message_encoding import broadcast_event, encode_message
+from .middleware import JWTAuthMiddleware
+from .access_cache import get_collaboration_access
+from .compact_protocol import SUBPROTOCOL, CompactCodec, CompactProtocolError
+from .consumers import CollaborationConsumer
+from .content_storage import blob_digest, collect_garbage
+from .cursor_aggregator import publish_cursor
+from .design_document import split_document
+from .design_persistence import DesignWriteBehind, save_design_document
+from .membership import apply_membership_transitions
+from .models import Design, DesignLike, MembershipOrder, MembershipPlan, RenderJob, StoredBlob, UserProfile
+from .order_reconciler import reconcile_pending_orders
+from .plan_registry import get_plan_registry
+from .presence import PresenceReaper, get_presence_reaper
+from .render_jobs import process_render_jobs
+from .routing import websocket_urlpatterns
+from .session_store import InMemorySessionStore, RedisSessionStore, get_session_store
+from .utils import get_alipay_client, get_shared_cache, reset_alipay_client
+
+# 测试使用进程内缓存，不连接（也不清空）开发环境的 Redis 共享缓存
+TEST_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-default'},
+    'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-shared'},
+}
+
+
+def client_message(message_type, payload, sender_id='1', **fields):
+    """客户端发送的协作消息"""
+    return {'type': message_type, 'senderId': sender_id, 'senderName': f'user{sender_id}',
+            'payload': payload, **fields}
+
+
+def add_obstacle(obstacle_id, x=0):
+    return client_message('add_obstacle', {'id': obstacle_id, 'type': 'SINGLE', 'position': {'x': x, 'y': 0}})
+
+
+class SessionStoreTestsMixin:
+    """两种会话存储后端共用的测试"""
+
+    def make_store(self, **options):
+        raise NotImplementedError
+
+    async def test_collaborators_and_roles(self):
+        store = self.make_store()
+        self.assertIsNone(await store.get_session('1'))
+        session, created = await store.get_or_create_session('1')
+        self.assertTrue(created)
+        self.assertEqual((await store.get_or_create_session('1'))[0]['id'], session['id'])
+
+        self.assertTrue(await store.add_collaborator('1', {'id': '10', 'username': 'a'}))
+        self.assertFalse(await store.add_collaborator('1', {'id': '10', 'username': 'a'}))
+        self.assertTrue(await store.add_collaborator('1', {'id': '11', 'username': 'b'}))
+        self.assertTrue(await store.claim_role('1', 'owner', '10'))
+        self.assertFalse(await store.claim_role('1', 'owner', '11'))
+        self.assertEqual((await store.update_collaborator('1', '11', color='#fff'))['color'], '#fff')
+        self.assertIsNone(await store.update_collaborator('1', '99', color='#fff'))
+
+        session = await store.get_session('1')
+        self.assertEqual(session['owner'], '10')
+        self.assertEqual(sorted(c['id'] for c in session['collaborators']), ['10', '11'])
+
+        # 最后一个协作者离开时删除会话
+        self.assertEqual(len((await store.remove_collaborator('1', '10'))['collaborators']), 1)
+        self.assertEqual((await store.remove_collaborator('1', '11'))['collaborators'], [])
+        self.assertFalse(await store.session_exists('1'))
+        self.assertIsNone(await store.remove_collaborator('1', '11'))
+
+        # 会话已结束时不能再添加协作者
+        self.assertFalse(await store.add_collaborator('1', {'id': '12', 'username': 'c'}))
+        self.assertIsNone(await store.get_collaborator('1', '12'))
+        self.assertFalse(await store.session_exists('1'))
+
+    async def test_expire_collaborators(self):
+        store = self.make_store()
+        await store.get_or_create_session('1')
+        await store.add_collaborator('1', {'id': '10', 'username': 'a', 'last_seen': 100})
+        await store.add_collaborator('1', {'id': '11', 'username': 'b', 'last_seen': 200})
+
+        session, removed = await store.expire_collaborators('1', 150)
+        self.assertEqual([c['id'] for c in removed], ['10'])
+        self.assertEqual([c['id'] for c in session['collaborators']], ['11'])
+        _, removed = await store.expire_collaborators('1', 300)
+        self.assertEqual([c['id'] for c in removed], ['11'])
+        self.assertFalse(await store.session_exists('1'))
+        self.assertEqual(await store.expire_collaborators('1', 300), (None, []))
+
+    async def test_operation_log_and_resync(self):
+        store = self.make_store(max_operations=3)
+        self.assertIsNone(await store.apply_operation('1', add_obstacle('o1')))
+        await store.get_or_create_session('1')
+        self.assertTrue(await store.seed_document('1', split_document({'name': 'course', 'obstacles': []})))
+        self.assertFalse(await store.seed_document('1', split_document({'name': 'other'})))
+
+        seqs = [await store.apply_operation('1', add_obstacle(f'o{index}', x=index)) for index in range(4)]
+        self.assertEqual(seqs, [1, 2, 3, 4])
+        update = {'type': 'update_obstacle', 'payload': {'obstacleId': 'o0', 'updates': {'position': {'x': 9, 'y': 9}}}}
+        self.assertEqual(await store.apply_operation('1', update), 5)
+        self.assertEqual(await store.apply_operation('1', {'type': 'remove_obstacle', 'payload': {'obstacleId': 'o1'}}), 6)
+        self.assertIsNone(await store.apply_operation('1', {'type': 'chat', 'payload': {}}))
+
+        document, seq = await store.get_document('1')
+        self.assertEqual(seq, 6)
+        self.assertEqual(document['name'], 'course')
+        obstacles = {obstacle['id']: obstacle for obstacle in document['obstacles']}
+        self.assertEqual(sorted(obstacles), ['o0', 'o2', 'o3'])
+        self.assertEqual(obstacles['o0']['position'], {'x': 9, 'y': 9})
+
+        # 日志只保留最近 3 条，更早的序号需要全量同步
+        self.assertEqual([op['seq'] for op in await store.get_operations_since('1', 3)], [4, 5, 6])
+        self.assertEqual(await store.get_operations_since('1', 6), [])
+        self.assertIsNone(await store.get_operations_since('1', 2))
+        self.assertIsNone(await store.get_operations_since('1', 7))
+
+    async def test_unflushed_journal_survives_session_end(self):
+        store = self.make_store()
+        await store.get_or_create_session('1')
+        await store.add_collaborator('1', {'id': '10', 'username': 'a'})
+        await store.seed_document('1', split_document({'obstacles': []}))
+        await store.apply_operation('1', add_obstacle('o1'))
+        await store.remove_collaborator('1', '10')
+
+        # 会话已结束，编辑不再写入，但未落库的文档保留
+        self.assertIsNone(await store.apply_operation('1', add_obstacle('o2')))
+        self.assertFalse(await store.discard_journal('1'))
+        document, seq, flushed_seq = await store.get_journal('1')
+        self.assertEqual(([o['id'] for o in document['obstacles']], seq, flushed_seq), (['o1'], 1, 0))
+        self.assertEqual(await store.list_journals(), ['1'])
+
+        self.assertTrue(await store.mark_flushed('1', 1))
+        self.assertTrue(await store.discard_journal('1'))
+        self.assertEqual(await store.list_journals(), [])
+
+
+class InMemorySessionStoreTests(SessionStoreTestsMixin, SimpleTestCase):
+    """进程内会话存储"""
+
+    def make_store(self, **options):
+        return InMemorySessionStore(**options)
+
+    async def test_sessions_expire(self):
+        store = self.make_store(ttl=0.05)
+        await store.get_or_create_session('1')
+        await asyncio.sleep(0.1)
+        self.assertFalse(await store.session_exists('1'))
+
+
+@skipUnless(fakeredis, '需要安装 fakeredis 和 lupa')
+class RedisSessionStoreTests(SessionStoreTestsMixin, SimpleTestCase):
+    """Redis 会话存储（使用 fakeredis，两个分片）"""
+
+    def make_store(self, **options):
+        store = RedisSessionStore(hosts=[('shard-a', 6379), ('shard-b', 6379)], **options)
+        store._clients = [fakeredis.FakeAsyncRedis(server=fakeredis.FakeServer(), decode_responses=True)
+                          for _ in store.hosts]
+        return store
+
+    def test_host_formats(self):
+        store = RedisSessionStore(hosts=[
+            'redis://url-host:6380/2', {'address': 'redis://address-host:6381/3', 'password': 'secret'},
+            {'address': ('tuple-host', 6382)}, ('pair-host', 6383)])
+        kwargs = [store._client_at(index).connection_pool.connection_kwargs for index in range(4)]
+        self.assertEqual([(k['host'], k['port']) for k in kwargs],
+                         [('url-host', 6380), ('address-host', 6381), ('tuple-host', 6382), ('pair-host', 6383)])
+        self.assertEqual((kwargs[1]['db'], kwargs[1]['password']), (3, 'secret'))
+
+    async def test_keys_have_ttl(self):
+        store = self.make_store(ttl=100)
+        await store.get_or_create_session('1')
+        await store.add_collaborator('1', {'id': '10', 'username': 'a'})
+        await store.seed_document('1', split_document({'obstacles': []}))
+        await store.apply_operation('1', add_obstacle('o1'))
+        client = store._client('1')
+        for key in store._keys('1'):
+            self.assertTrue(0 < await client.ttl(key) <= 100, key)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CollaborationConsumerTests(TestCase):
+    """协作 WebSocket：加入、编辑操作、断线重连同步"""
+
+    def setUp(self):
+        # 每个测试使用新的进程内会话存储和 channel layer
+        override = override_settings(
+            CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+            COLLABORATION_SESSION_STORE={'BACKEND': 'user.session_store.InMemorySessionStore'},
+            COLLABORATION_PERSIST_INTERVAL=60, COLLABORATION_PRESENCE_INTERVAL=60)
+        override.enable()
+        self.addCleanup(override.disable)
+        get_shared_cache().clear()
+        get_plan_registry().invalidate()
+
+        premium = MembershipPlan.objects.create(
+            name='高级会员', code='premium', monthly_price=20, yearly_price=200)
+        self.users = []
+        for username in ('alice', 'bob', 'carol'):
+            # 连接使用 JWT，不需要密码（设置密码的哈希计算很慢）
+            user = User.objects.create(username=username)
+            UserProfile.objects.create(
+                user=user, membership_plan=premium, is_premium=username != 'carol',
+                premium_expire_date=timezone.now() + timedelta(days=30))
+            self.users.append(user)
+        self.design = Design.objects.create(title='course', author=self.users[0], is_shared=True)
+
+    async def connect(self, user, via_link=False, subprotocols=None):
+        application = JWTAuthMiddleware(URLRouter(websocket_urlpatterns))
+        query = (f'token={AccessToken.for_user(user)}' if user else '') + ('&via_link=true' if via_link else '')
+        communicator = WebsocketCommunicator(
+            application, f'/ws/collaboration/{self.design.pk}/?{query}', subprotocols=subprotocols)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def join(self, user, via_link=False, subprotocols=None):
+        """连接并读取连接成功和加入消息"""
+        communicator = await self.connect(user, via_link, subprotocols)
+        self.assertEqual((await communicator.receive_json_from())['type'], 'connection_established')
+        self.assertEqual((await communicator.receive_json_from())['type'], 'join')
+        return communicator
+
+    async def close(self, *communicators):
+        for communicator in communicators:
+            await communicator.disconnect()
+        reaper = get_presence_reaper()
+        if reaper._task is not None:
+            reaper._task.cancel()
+
+    async def test_join_and_operations_are_sequenced(self):
+        alice = await self.join(self.users[0])
+        bob = await self.join(self.users[1], via_link=True)
+        join = await alice.receive_json_from()
+        session = join['payload']['session']
+        self.assertEqual(session['owner'], str(self.users[0].id))
+        self.assertEqual(session['initiator'], str(self.users[0].id))
+        self.assertEqual(sorted(c['username'] for c in session['collaborators']), ['alice', 'bob'])
+
+        await alice.send_json_to(add_obstacle('o1'))
+        await alice.send_json_to({'type': 'update_obstacle', 'payload': {
+            'obstacleId': 'o1', 'updates': {'rotation': 30}}})
+        for communicator in (alice, bob):
+            messages = [await communicator.receive_json_from() for _ in range(2)]
+            self.assertEqual([(m['type'], m['seq']) for m in messages],
+                             [('add_obstacle', 1), ('update_obstacle', 2)])
+
+        document, seq = await get_session_store().get_document(str(self.design.pk))
+        self.assertEqual((seq, document['obstacles'][0]['rotation']), (2, 30))
+        await self.close(alice, bob)
+
+    async def test_compact_and_json_clients_share_a_session(self):
+        alice = await self.join(self.users[0])
+        bob = await self.join(self.users[1], subprotocols=[SUBPROTOCOL])
+        await alice.receive_json_from()
+
+        client = CompactCodec()
+        await bob.send_to(bytes_data=client.encode(add_obstacle('o1', x=5)))
+        message = await alice.receive_json_from()
+        self.assertEqual((message['type'], message['seq'], message['senderId']),
+                         ('add_obstacle', 1, str(self.users[1].id)))
+        self.assertEqual(message['payload']['position'], {'x': 5, 'y': 0})
+
+        # 紧凑客户端收到的回显是二进制帧，JSON 客户端的编辑同样转换为二进制帧
+        echo = CompactCodec().decode((await bob.receive_output())['bytes'])
+        self.assertEqual(echo['payload']['id'], 'o1')
+        await alice.send_json_to({'type': 'chat', 'payload': {'text': 'hi'}})
+        self.assertEqual(json.loads((await bob.receive_output())['text'])['type'], 'chat')
+        await alice.receive_json_from()
+        await self.close(alice, bob)
+
+    async def test_resync_returns_missing_operations_or_full_document(self):
+        alice = await self.join(self.users[0])
+        for index in range(3):
+            await alice.send_json_to(add_obstacle(f'o{index}'))
+            await alice.receive_json_from()
+
+        await alice.send_json_to({'type': 'sync_request', 'payload': {'lastSeq': 1}})
+        response = await alice.receive_json_from()
+        self.assertEqual(response['type'], 'sync_response')
+        self.assertEqual(response['payload']['seq'], 3)
+        self.assertEqual([op['seq'] for op in response['payload']['operations']], [2, 3])
+        self.assertEqual((await alice.receive_json_from())['type'], 'session_update')
+
+        await alice.send_json_to({'type': 'sync_request', 'payload': {'lastSeq': -1}})
+        response = await alice.receive_json_from()
+        self.assertEqual(response['payload']['seq'], 3)
+        self.assertEqual([o['id'] for o in response['payload']['obstacles']], ['o0', 'o1', 'o2'])
+        await alice.receive_json_from()
+        await self.close(alice)
+
+    async def test_heartbeat_refreshes_presence_without_broadcast(self):
+        alice = await self.join(self.users[0])
+        store = get_session_store()
+        design_id = str(self.design.pk)
+        await store.update_collaborator(design_id, str(self.users[0].id), last_seen=0)
+
+        await alice.send_json_to({'type': 'heartbeat'})
+        self.assertTrue(await alice.receive_nothing())
+        collaborator = await store.get_collaborator(design_id, str(self.users[0].id))
+        self.assertGreater(collaborator['last_seen'], 0)
+        await self.close(alice)
+
+    async def test_last_leave_writes_document_back(self):
+        alice = await self.join(self.users[0])
+        await alice.send_json_to(add_obstacle('o1'))
+        await alice.receive_json_from()
+        await self.close(alice)
+
+        self.assertFalse(await get_session_store().session_exists(str(self.design.pk)))
+        design = await Design.objects.aget(pk=self.design.pk)
+        self.assertEqual(design.obstacle_count, 1)
+
+    async def test_non_premium_user_is_rejected(self):
+        carol = await self.connect(self.users[2])
+        self.assertEqual((await carol.receive_json_from())['type'], 'error')
+        self.assertEqual((await carol.receive_output())['code'], 4003)
+
+    async def test_link_connections_need_login_and_design_access(self):
+        self.design.is_shared = False
+        await self.design.asave()
+        design_id = str(self.design.pk)
+
+        anonymous = await self.connect(None, via_link=True)
+        self.assertEqual((await anonymous.receive_json_from())['type'], 'error')
+        self.assertEqual((await anonymous.receive_output())['code'], 4001)
+        # 被拒绝的连接不会创建会话，也不会加载设计文档
+        self.assertFalse(await get_session_store().session_exists(design_id))
+        self.assertFalse(await get_session_store().has_document(design_id))
+
+        alice = await self.join(self.users[0])
+        bob = await self.connect(self.users[1], via_link=True)
+        self.assertEqual((await bob.receive_json_from())['type'], 'error')
+        self.assertEqual((await bob.receive_output())['code'], 4004)
+        self.assertTrue(await alice.receive_nothing())
+        await self.close(alice)
+
+    async def test_link_collaborator_cannot_edit_design(self):
+        alice = await self.join(self.users[0])
+        bob = await self.join(self.users[1], via_link=True)
+        await alice.receive_json_from()
+
+        await bob.send_json_to(add_obstacle('o1'))
+        self.assertEqual((await bob.receive_json_from())['type'], 'error')
+        self.assertTrue(await alice.receive_nothing())
+        document, seq = await get_session_store().get_document(str(self.design.pk))
+        self.assertEqual((seq, document['obstacles']), (0, []))
+
+        # 会话结束后写回的设计不包含被拒绝的编辑
+        await self.close(bob, alice)
+        design = await Design.objects.aget(pk=self.design.pk)
+        self.assertEqual(design.obstacle_count, 0)
+
+    async def test_register_recreates_ended_session(self):
+        consumer = CollaborationConsumer()
+        consumer.design_id = str(self.design.pk)
+        consumer.user = self.users[1]
+        consumer.is_via_link = True
+        consumer.session_store = get_session_store()
+
+        session, role, is_new = await consumer._register_collaborator()
+        self.assertTrue(is_new)
+        self.assertEqual(role, 'collaborator')
+        self.assertEqual([c['username'] for c in session['collaborators']], ['bob'])
+        self.assertTrue(await consumer.session_store.has_document(consumer.design_id))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class PresenceReaperTests(TestCase):
+    """失效协作者清理"""
+
+    def setUp(self):
+        override = override_settings(
+            CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+            COLLABORATION_SESSION_STORE={'BACKEND': 'user.session_store.InMemorySessionStore'})
+        override.enable()
+        self.addCleanup(override.disable)
+        user = User.objects.create(username='reaper')
+        self.design = Design.objects.create(title='course', author=user)
+
+    async def test_stale_collaborators_are_removed_and_session_closed(self):
+        store = get_session_store()
+        design_id = str(self.design.pk)
+        await store.get_or_create_session(design_id)
+        await store.seed_document(design_id, split_document({'obstacles': []}))
+        await store.add_collaborator(design_id, {'id': '1', 'username': 'gone', 'last_seen': time.time() - 100})
+        await store.add_collaborator(design_id, {'id': '2', 'username': 'here', 'last_seen': time.time()})
+        await store.apply_operation(design_id, add_obstacle('o1'))
+
+        channel_layer = get_channel_layer()
+        channel = await channel_layer.new_channel()
+        await channel_layer.group_add(f'collaboration_{design_id}', channel)
+        reaper = PresenceReaper(store, interval=1, timeout=10)
+
+        await reaper.sweep(full=True)
+        leave = json.loads((await channel_layer.receive(channel))['text'])
+        self.assertEqual((leave['type'], leave['senderName']), ('leave', 'gone'))
+        self.assertEqual([c['username'] for c in leave['payload']['session']['collaborators']], ['here'])
+
+        # 剩余协作者也失效后删除会话，并写回未落库的编辑
+        await store.update_collaborator(design_id, '2', last_seen=time.time() - 100)
+        await reaper.sweep(full=True)
+        self.assertFalse(await store.session_exists(design_id))
+        self.assertEqual(await store.list_journals(), [])
+        design = await Design.objects.aget(pk=self.design.pk)
+        self.assertEqual(design.obstacle_count, 1)
+
+
+class RecordingChannelLayer:
+    """记录 group_send 调用的 channel layer"""
+
+    def __init__(self):
+        self.sent = []
+
+    async def group_send(self, group, event):
+        self.sent.append((time.monotonic(), group, json.loads(event['text'])))
+
+
+def cursor_move(sender_id, x, timestamp):
+    return client_message('cursor_move', {'x': x, 'y': 0}, sender_id, timestamp=timestamp)
+
+
+class CursorAggregatorTests(SimpleTestCase):
+    """光标移动合并"""
+
+    async def test_disabled_by_default_forwards_each_move(self):
+        layer = RecordingChannelLayer()
+        for x in range(3):
+            await publish_cursor(layer, 'cursor_room_default', cursor_move('1', x, f'2026-01-01T00:00:0{x}'))
+        self.assertEqual([message['type'] for _, _, message in layer.sent], ['cursor_move'] * 3)
+
+    @override_settings(COLLABORATION_CURSOR_WINDOW_MS=20, COLLABORATION_CURSOR_MAX_FRAME_RATE=0)
+    async def test_moves_in_window_are_merged_into_one_batch(self):
+        layer = RecordingChannelLayer()
+        for x in range(5):
+            await publish_cursor(layer, 'cursor_room_merge', cursor_move('1', x, f'2026-01-01T00:00:0{x}'))
+        await publish_cursor(layer, 'cursor_room_merge', cursor_move('2', 9, '2026-01-01T00:00:05'))
+        # 乱序到达的旧位置不覆盖新位置
+        await publish_cursor(layer, 'cursor_room_merge', cursor_move('1', -1, '2026-01-01T00:00:00'))
+        await asyncio.sleep(0.1)
+
+        self.assertEqual(len(layer.sent), 1)
+        _, group, message = layer.sent[0]
+        self.assertEqual((group, message['type']), ('cursor_room_merge', 'cursor_batch'))
+        positions = {cursor['senderId']: cursor['payload']['x'] for cursor in message['payload']['cursors']}
+        self.assertEqual(positions, {'1': 4, '2': 9})
+
+    @override_settings(COLLABORATION_CURSOR_WINDOW_MS=5, COLLABORATION_CURSOR_MAX_FRAME_RATE=10)
+    async def test_frame_rate_is_capped_per_room(self):
+        layer = RecordingChannelLayer()
+        deadline = time.monotonic() + 0.45
+        x = 0
+        while time.monotonic() < deadline:
+            x += 1
+            for room in ('cursor_room_a', 'cursor_room_b'):
+                await publish_cursor(layer, room, cursor_move('1', x, f'{x:08d}'))
+            await asyncio.sleep(0.005)
+        await asyncio.sleep(0.25)
+
+        for room in ('cursor_room_a', 'cursor_room_b'):
+            frames = [sent_at for sent_at, group, _ in layer.sent if group == room]
+            # 0.45 秒内按每秒 10 帧最多 5 帧，另一个房间的帧不占用本房间的配额
+            self.assertLessEqual(len(frames), 6)
+            self.assertGreaterEqual(len(frames), 4)
+            gaps = [later - earlier for earlier, later in zip(frames, frames[1:])]
+            self.assertGreaterEqual(min(gaps), 0.09)
+            # 最后一帧是最新位置
+            last = [message for _, group, message in layer.sent if group == room][-1]
+            self.assertEqual(last['payload']['cursors'][0]['payload']['x'], x)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CollaborationAccessTests(TestCase):
+    """协作连接权限检查"""
+
+    def setUp(self):
+        # 测试之间数据库回滚后ID可能重复，清空上一个测试缓存的权限
+        get_shared_cache().clear()
+        get_plan_registry().invalidate()
+        self.premium = MembershipPlan.objects.create(
+            name='高级会员', code='premium', monthly_price=20, yearly_price=200)
+        self.user = User.objects.create_user(username='member', password='password')
+        self.profile = UserProfile.objects.create(
+            user=self.user, membership_plan=self.premium, is_premium=True,
+            premium_expire_date=timezone.now() + timedelta(days=1))
+        self.design = Design.objects.create(title='course', author=self.user)
+
+    def test_premium_access_ends_at_expiry_without_cron(self):
+        self.assertTrue(get_collaboration_access(self.user.id, self.design.id)['is_premium'])
+        with self.assertNumQueries(0):
+            get_collaboration_access(self.user.id, self.design.id)
+
+        # expire_memberships 尚未执行，资料中仍为高级会员；到期后缓存也不再有效
+        later = timezone.now() + timedelta(days=2)
+        with mock.patch('user.access_cache.timezone.now', return_value=later):
+            self.assertFalse(get_collaboration_access(self.user.id, self.design.id)['is_premium'])
+
+    def test_pending_plan_continues_expired_plan(self):
+        self.profile.premium_expire_date = timezone.now() - timedelta(minutes=1)
+        self.profile.pending_membership_plan = self.premium
+        self.profile.pending_membership_start_date = self.profile.premium_expire_date
+        self.profile.pending_membership_expire_date = timezone.now() + timedelta(days=30)
+        self.profile.save()
+        self.assertTrue(get_collaboration_access(self.user.id, self.design.id)['is_premium'])
+
+        self.profile.pending_membership_plan = None
+        self.profile.save()
+        self.assertFalse(get_collaboration_access(self.user.id, self.design.id)['is_premium'])
+
+
+class MessageEncodingTests(SimpleTestCase):
+    """广播消息在发送端编码一次"""
+
+    def test_broadcast_event_carries_encoded_text(self):
+        message = {'type': 'update_obstacle', 'senderName': '张三', 'payload': {'rotation': 1.5}}
+        event = broadcast_event(message)
+        self.assertEqual(event['type'], 'collaboration_message')
+        self.assertEqual(event['message_type'], 'update_obstacle')
+        self.assertEqual(json.loads(event['text']), message)
+        # orjson 不支持的非字符串键回退到标准库
+        self.assertEqual(json.loads(encode_message({1: 'a'})), {'1': 'a'})
+
+    async def test_consumer_forwards_text_and_legacy_events(self):
+        consumer = CollaborationConsumer()
+        consumer.compact_codec = None
+        sent = []
+
+        async def send(text_data=None, bytes_data=None):
+            sent.append(text_data)
+
+        consumer.send = send
+        message = {'type': 'chat', 'payload': {'text': 'hi'}}
+        event = broadcast_event(message)
+        await consumer.collaboration_message(event)
+        await consumer.collaboration_message({'type': 'collaboration_message', 'message': message})
+        self.assertEqual(sent[0], event['text'])
+        self.assertEqual(json.loads(sent[1]), message)
+
+
+class CompactCodecTests(SimpleTestCase):
+    """紧凑编码的编解码"""
+
+    def round_trip(self, client, server, message):
+        return server.decode(client.encode(message))
+
+    def test_round_trip(self):
+        # 客户端和服务器使用相同的帧格式，各自维护一个方向的索引表
+        client, server = CompactCodec(), CompactCodec()
+        obstacle = {
+            'id': 'obstacle-1', 'type': 'SINGLE', 'position': {'x': 12.25, 'y': 0.1}, 'rotation': -45,
+            'poles': [{'height': 1.3, 'color': '#ff0000'}], 'visible': True, 'customField': None,
+        }
+        messages = [
+            {'type': 'add_obstacle', 'senderId': '7', 'senderName': 'alice',
+             'timestamp': '2026-01-01T00:00:00.123Z', 'payload': obstacle},
+            {'type': 'update_obstacle', 'payload': {'obstacleId': 'obstacle-1', 'updates': {'rotation': 90}}},
+            {'type': 'update_path', 'payload': {'pathId': 'path', 'updates': {
+                'points': [{'x': 1, 'y': 2}], 'visible': False}}},
+            {'type': 'cursor_move', 'payload': {'x': 3, 'y': 4}},
+            {'type': 'remove_obstacle', 'payload': {'obstacleId': 'obstacle-1'}},
+        ]
+        for message in messages:
+            decoded = self.round_trip(client, server, message)
+            self.assertEqual(decoded['type'], message['type'])
+            self.assertEqual(decoded['payload'], message['payload'])
+        decoded = self.round_trip(client, server, messages[0])
+        self.assertEqual(decoded['timestamp'], '2026-01-01T00:00:00.123Z')
+
+    def test_repeated_updates_send_only_changed_fields(self):
+        client, server = CompactCodec(), CompactCodec()
+        first = {'type': 'update_obstacle', 'payload': {
+            'obstacleId': 'o1', 'updates': {'position': {'x': 1, 'y': 1}, 'rotation': 10}}}
+        second = {'type': 'update_obstacle', 'payload': {
+            'obstacleId': 'o1', 'updates': {'position': {'x': 1, 'y': 1}, 'rotation': 20}}}
+        first_frame = client.encode(first)
+        second_frame = client.encode(second)
+        self.assertLess(len(second_frame), len(first_frame))
+        server.decode(first_frame)
+        self.assertEqual(server.decode(second_frame)['payload'], {'obstacleId': 'o1', 'updates': {'rotation': 20}})
+
+    def test_unsupported_and_invalid_frames(self):
+        codec = CompactCodec()
+        self.assertIsNone(codec.encode({'type': 'chat', 'payload': {'text': 'hi'}}))
+        for frame in (b'', b'\x09\x00\x00\x00', b'\x06\x00\x00\x00', b'\x01\x04\x00\x02\x00'):
+            with self.assertRaises(CompactProtocolError):
+                codec.decode(frame)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class DesignWriteBehindTests(TestCase):
+    """协作编辑延迟写回设计记录"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        user = User.objects.create_user(username='writer', password='password')
+        self.design = Design.objects.create(title='course', author=user)
+        self.store = InMemorySessionStore()
+        self.writer = DesignWriteBehind(self.store, interval=0.05)
+
+    async def start_session(self):
+        design_id = str(self.design.pk)
+        await self.store.get_or_create_session(design_id)
+        await self.store.add_collaborator(design_id, {'id': '1', 'username': 'user1'})
+        await self.store.seed_document(design_id, split_document({'name': 'course', 'obstacles': []}))
+        return design_id
+
+    async def test_scheduled_edits_are_coalesced_into_one_write(self):
+        design_id = await self.start_session()
+        for index in range(3):
+            await self.store.apply_operation(design_id, add_obstacle(f'o{index}'))
+            self.writer.schedule(design_id)
+        await asyncio.sleep(0.2)
+
+        design = await Design.objects.aget(pk=self.design.pk)
+        self.assertEqual(design.obstacle_count, 3)
+        self.assertEqual(await self.store.get_journal(design_id), (design.document, 3, 3))
+
+    async def test_journal_outlives_session_until_flushed(self):
+        design_id = await self.start_session()
+        await self.store.apply_operation(design_id, add_obstacle('o1'))
+        await self.store.remove_collaborator(design_id, '1')
+        self.assertFalse(await self.store.session_exists(design_id))
+        self.assertEqual(await self.store.list_journals(), [design_id])
+
+        self.assertTrue(await self.writer.flush(design_id, close=True))
+        self.assertEqual(await self.store.list_journals(), [])
+        design = await Design.objects.aget(pk=self.design.pk)
+        self.assertEqual(design.obstacle_count, 1)
+        # 会话结束时生成设计文件
+        self.assertEqual(blob_digest(design.download.name), design.document_hash)
+
+    async def test_flushes_of_one_design_never_overlap(self):
+        design_id = await self.start_session()
+        active, overlaps = 0, []
+        get_journal = self.store.get_journal
+
+        async def slow_get_journal(design_id):
+            nonlocal active
+            active += 1
+            overlaps.append(active)
+            await asyncio.sleep(0.01)
+            try:
+                return await get_journal(design_id)
+            finally:
+                active -= 1
+
+        self.store.get_journal = slow_get_journal
+
+        async def flush_later(delay):
+            await asyncio.sleep(delay)
+            await self.store.apply_operation(design_id, add_obstacle(f'o{delay}'))
+            await self.writer.flush(design_id)
+
+        # 前一次写回释放锁时仍有写回在等待，之后到达的写回必须使用同一把锁
+        await asyncio.gather(*(flush_later(delay) for delay in (0, 0, 0, 0.015, 0.025, 0.035)))
+        self.assertEqual(max(overlaps), 1)
+        self.assertEqual(self.writer._locks, {})
+        _, seq, flushed_seq = await get_journal(design_id)
+        self.assertEqual(seq, flushed_seq)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class DesignListQueryCountTests(TestCase):
+    """设计列表接口的查询次数不随当前页的条数增加"""
+
+    # 分页计数 + 带作者和点赞标注的列表查询
+    EXPECTED_QUERIES = 2
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create_user(username='viewer', password='password')
+        cls.authors = [User.objects.create_user(username=f'author_{i}', password='password')
+                       for i in range(3)]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def create_designs(self, count, **kwargs):
+        for i in range(count):
+            author = kwargs.get('author') or self.authors[i % len(self.authors)]
+            design = Design.objects.create(
+                title=f'design_{Design.objects.count()}', author=author, image='design.png',
+                is_shared=kwargs.get('is_shared', True))
+            if i % 2:
+                DesignLike.objects.create(design=design, user=self.viewer)
+
+    def assert_list_queries(self, url, count):
+        with self.assertNumQueries(self.EXPECTED_QUERIES):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), count)
+        return response.data['results']
+
+    def test_shared_designs_query_count(self):
+        self.create_designs(1)
+        self.assert_list_queries('/user/designs/shared/', 1)
+        self.create_designs(8)
+        self.assert_list_queries('/user/designs/shared/', 9)
+
+    def test_my_designs_query_count(self):
+        self.create_designs(1, author=self.viewer, is_shared=False)
+        self.assert_list_queries('/user/designs/my/', 1)
+        self.create_designs(8, author=self.viewer, is_shared=False)
+        self.assert_list_queries('/user/designs/my/', 9)
+
+    def test_shared_designs_is_liked(self):
+        self.create_designs(9)
+        results = self.assert_list_queries('/user/designs/shared/', 9)
+        liked = {item['title'] for item in results if item['is_liked']}
+        expected = set(DesignLike.objects.filter(user=self.viewer)
+                       .values_list('design__title', flat=True))
+        self.assertEqual(len(expected), 4)
+        self.assertEqual(liked, expected)
+        self.assertTrue(all(item['author_username'].startswith('author_') for item in results))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SharedDesignCursorPaginationTests(TestCase):
+    """公开设计库的键集分页"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create_user(username='viewer', password='password')
+        author = User.objects.create_user(username='author', password='password')
+        cls.designs = [
+            Design.objects.create(title=f'design_{i}', author=author, image='design.png',
+                                  is_shared=True)
+            for i in range(20)
+        ]
+        # 创建时间相同的记录按 id 区分先后
+        Design.objects.filter(id__in=[d.id for d in cls.designs[5:10]]).update(
+            create_time=cls.designs[5].create_time)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def test_walks_all_pages_in_order(self):
+        url = '/user/designs/shared/?pagination=cursor&page_size=6&with_count=true'
+        response = self.client.get(url)
+        self.assertEqual(response.data['count'], 20)
+        seen = [item['id'] for item in response.data['results']]
+        url = response.data['next']
+        while url:
+            # 后续页面只执行一次列表查询，不统计总数
+            with self.assertNumQueries(1):
+                response = self.client.get(url)
+            self.assertNotIn('count', response.data)
+            seen.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+
+        expected = list(Design.objects.filter(is_shared=True)
+                        .order_by('-create_time', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/user/designs/shared/?pagination=cursor&cursor=bad')
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class PlanRegistryTests(TestCase):
+    """会员计划目录缓存"""
+
+    def setUp(self):
+        # 测试之间的回滚不会触发信号，先丢弃上一个测试留下的快照
+        get_plan_registry().invalidate()
+        self.plan = MembershipPlan.objects.create(
+            name='高级会员', code='premium', monthly_price=20, yearly_price=200)
+        self.user = User.objects.create_user(username='buyer', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_lookups_are_cached_until_plan_changes(self):
+        registry = get_plan_registry()
+        self.assertEqual(registry.get(self.plan.id).code, 'premium')
+        with self.assertNumQueries(0):
+            registry.get(self.plan.id)
+            registry.by_code('premium')
+            registry.active_plans()
+
+        self.plan.is_active = False
+        self.plan.save()
+        self.assertIsNone(registry.get(self.plan.id, active_only=True))
+        self.assertEqual(registry.active_plan_data(), ())
+
+    def test_reloads_after_shared_cache_is_cleared(self):
+        registry = get_plan_registry()
+        # 快照使用的是初始化的版本号
+        get_shared_cache().clear()
+        self.assertEqual(registry.get(self.plan.id).name, '高级会员')
+
+        # 版本号被清除后计划发生变化（直接更新数据库，不触发信号）
+        get_shared_cache().clear()
+        MembershipPlan.objects.filter(pk=self.plan.pk).update(name='专业会员')
+        self.assertEqual(registry.get(self.plan.id).name, '专业会员')
+
+    def test_my_profile_does_not_query_plans(self):
+        get_plan_registry().active_plans()
+        # 只查询用户资料和设计数量
+        with self.assertNumQueries(2):
+            response = self.client.get('/user/users/my_profile/')
+        self.assertEqual([plan['code'] for plan in response.data['available_plans']], ['premium'])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class MembershipTransitionTests(TestCase):
+    """批量推进到期会员"""
+
+    def setUp(self):
+        get_shared_cache().clear()
+        get_plan_registry().invalidate()
+        self.premium = MembershipPlan.objects.create(
+            name='高级会员', code='premium', monthly_price=20, yearly_price=200, storage_limit=100)
+        self.now = timezone.now()
+
+    def create_profile(self, username, expire_in, pending_expire_in=None):
+        user = User.objects.create(username=username)
+        profile = UserProfile(user=user, membership_plan=self.premium, is_premium=True,
+                              premium_expire_date=self.now + expire_in)
+        if pending_expire_in is not None:
+            profile.pending_membership_plan = self.premium
+            profile.pending_membership_start_date = profile.premium_expire_date
+            profile.pending_membership_expire_date = self.now + pending_expire_in
+        profile.save()
+        return profile
+
+    def test_transitions_are_applied_in_chunks(self):
+        day = timedelta(days=1)
+        expired = [self.create_profile(f'expired_{i}', -day) for i in range(2)]
+        promoted = self.create_profile('promoted', -day, pending_expire_in=30 * day)
+        pending_expired = self.create_profile('pending_expired', -2 * day, pending_expire_in=-day)
+        active = self.create_profile('active', day)
+
+        self.assertEqual(apply_membership_transitions(now=self.now, dry_run=True),
+                         {'promoted': 2, 'expired': 3})
+        with mock.patch('user.membership.invalidate_user_access') as invalidate:
+            counts = apply_membership_transitions(now=self.now, chunk_size=2)
+        self.assertEqual(counts, {'promoted': 2, 'expired': 3})
+        self.assertEqual(invalidate.call_count, 4)
+
+        for profile in expired + [pending_expired]:
+            profile.refresh_from_db()
+            self.assertFalse(profile.is_premium)
+            self.assertEqual(profile.membership_plan.code, 'free')
+            self.assertIsNone(profile.pending_membership_plan_id)
+        promoted.refresh_from_db()
+        self.assertTrue(promoted.is_premium)
+        self.assertEqual(promoted.premium_expire_date, self.now + 30 * day)
+        self.assertIsNone(promoted.pending_membership_plan_id)
+        active.refresh_from_db()
+        self.assertTrue(active.is_premium)
+        self.assertEqual(apply_membership_transitions(now=self.now, chunk_size=2),
+                         {'promoted': 0, 'expired': 0})
+
+    def test_transitions_invalidate_cached_access(self):
+        profile = self.create_profile('member', timedelta(days=1))
+        design = Design.objects.create(title='course', author=profile.user)
+        self.assertTrue(get_collaboration_access(profile.user_id, design.id)['is_premium'])
+
+        # 批量 UPDATE 不触发信号，缓存的权限仍未过期，需要通过用户版本号失效
+        apply_membership_transitions(now=self.now + timedelta(days=2))
+        self.assertFalse(get_collaboration_access(profile.user_id, design.id)['is_premium'])
+
+
+@override_settings(ALIPAY_USE_FAKE_GATEWAY=True, CACHES=TEST_CACHES)
+class OrderReconcileTests(TestCase):
+    """待支付订单对账（使用本地模拟的支付宝网关）"""
+
+    def setUp(self):
+        get_plan_registry().invalidate()
+        self.gateway = get_fake_alipay_gateway()
+        self.gateway.reset()
+        self.plan = MembershipPlan.objects.create(
+            name='高级会员', code='premium', monthly_price=20, yearly_price=200, storage_limit=100)
+        self.user = User.objects.create_user(username='buyer', password='password')
+        UserProfile.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_order(self):
+        response = self.client.post('/user/api/payment/create-order/',
+                                    {'plan_id': self.plan.id, 'billing_cycle': 'month'})
+        return MembershipOrder.objects.get(order_id=response.data['order']['order_id'])
+
+    def reconcile(self, order):
+        """在订单下次查询时间执行一轮对账"""
+        order.refresh_from_db()
+        return reconcile_pending_orders(now=order.next_check_at)
+
+    def test_paid_order_updates_membership(self):
+        order = self.create_order()
+        self.assertEqual(self.reconcile(order)['pending'], 1)
+
+        self.gateway.pay(order.order_id)
+        self.assertEqual(self.reconcile(order)['paid'], 1)
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'paid')
+        self.assertIsNone(order.next_check_at)
+        profile = UserProfile.objects.get(user=self.user)
+        self.assertTrue(profile.is_premium)
+        self.assertEqual(profile.membership_plan, self.plan)
+
+    def test_backoff_after_failures(self):
+        order = self.create_order()
+        self.gateway.fail_next(3)
+        delays = []
+        for _ in range(3):
+            checked_at = MembershipOrder.objects.get(pk=order.pk).next_check_at
+            self.assertEqual(self.reconcile(order)['failed'], 1)
+            order.refresh_from_db()
+            delays.append((order.next_check_at - checked_at).total_seconds())
+        self.assertEqual(delays, [5, 10, 20])
+        # 未到下次查询时间的订单不会被查询
+        queries = self.gateway.queries
+        reconcile_pending_orders(now=order.next_check_at - timedelta(seconds=1))
+        self.assertEqual(self.gateway.queries, queries)
+
+    def test_closed_trade_cancels_order(self):
+        order = self.create_order()
+        self.gateway.close(order.order_id)
+        self.assertEqual(self.reconcile(order)['closed'], 1)
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'canceled')
+
+    def test_notify_and_reconcile_process_payment_once(self):
+        order = self.create_order()
+        self.gateway.pay(order.order_id)
+        data, sign = self.gateway.notify(order.order_id)
+        response = self.client.post('/user/api/payment/alipay/notify/', {**data, 'sign': sign})
+        self.assertEqual(response.data['message'], 'SUCCESS')
+        expire_date = UserProfile.objects.get(user=self.user).premium_expire_date
+
+        order.next_check_at = timezone.now()
+        counts = reconcile_pending_orders(now=order.next_check_at)
+        self.assertEqual(counts['checked'], 0)
+        self.assertEqual(UserProfile.objects.get(user=self.user).premium_expire_date, expire_date)
+
+    def test_order_status_reads_local_state(self):
+        order = self.create_order()
+        self.gateway.pay(order.order_id)
+        queries = self.gateway.queries
+        response = self.client.get(f'/user/api/payment/order-status/{order.order_id}/')
+        self.assertEqual(response.data['order']['status'], 'pending')
+        self.assertEqual(self.gateway.queries, queries)
+
+
+class AlipayClientCacheTests(SimpleTestCase):
+    """支付宝客户端进程内缓存"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.key_dir = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, cls.key_dir)
+        key = RSA.generate(2048)
+        cls.private_key_path = os.path.join(cls.key_dir, 'app_private_key.pem')
+        cls.public_key_path = os.path.join(cls.key_dir, 'alipay_public_key.pem')
+        with open(cls.private_key_path, 'wb') as f:
+            f.write(key.export_key())
+        with open(cls.public_key_path, 'wb') as f:
+            f.write(key.publickey().export_key())
+
+    def setUp(self):
+        override = override_settings(
+            ALIPAY_USE_FAKE_GATEWAY=False, ALIPAY_KEY_VERSION=1,
+            ALIPAY_APP_PRIVATE_KEY_PATH=self.private_key_path,
+            ALIPAY_ALIPAY_PUBLIC_KEY_PATH=self.public_key_path)
+        override.enable()
+        self.addCleanup(override.disable)
+        reset_alipay_client()
+        self.addCleanup(reset_alipay_client)
+
+    def test_client_is_reused(self):
+        client = get_alipay_client()
+        with mock.patch('user.utils.build_alipay_client') as build:
+            self.assertIs(get_alipay_client(), client)
+        build.assert_not_called()
+
+    def test_key_version_change_rebuilds_client(self):
+        client = get_alipay_client()
+        with override_settings(ALIPAY_KEY_VERSION=2):
+            rebuilt = get_alipay_client()
+        self.assertIsNot(rebuilt, client)
+        self.assertIsNot(get_alipay_client(), rebuilt)
+
+    def test_key_file_change_rebuilds_client(self):
+        client = get_alipay_client()
+        stat = os.stat(self.private_key_path)
+        os.utime(self.private_key_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        rebuilt = get_alipay_client()
+        self.assertIsNot(rebuilt, client)
+        self.assertIs(get_alipay_client(), rebuilt)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class DesignRenditionTests(TestCase):
+    """设计图片缩略图"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.user = User.objects.create_user(username='artist', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        buffer = io.BytesIO()
+        Image.new('RGBA', (2000, 1500), (0, 128, 0, 255)).save(buffer, 'PNG')
+        self.png = buffer.getvalue()
+
+    def test_upload_creates_renditions(self):
+        response = self.client.post('/user/designs/', {
+            'title': 'course', 'image': ContentFile(self.png, name='course.png')})
+        design = Design.objects.get(pk=response.data['id'])
+        self.assertEqual(len(design.image_hash), 64)
+        self.assertIn(design.image_hash, response.data['thumbnail_url'])
+
+        path = response.data['thumbnail_url'].split('/media/', 1)[1]
+        with Image.open(f'{self.media_root}/{path}') as thumbnail:
+            self.assertEqual(thumbnail.size, (320, 240))
+
+    def test_missing_renditions_are_generated_on_request(self):
+        design = Design.objects.create(title='legacy', author=self.user, is_shared=True,
+                                       image=ContentFile(self.png, name='legacy.png'))
+        response = self.client.get('/user/designs/shared/')
+        self.assertIn(f'/designs/{design.pk}/renditions/thumbnail/',
+                      response.data['results'][0]['thumbnail_url'])
+
+        # 匿名请求不生成缩略图，重定向到原图
+        response = APIClient().get(f'/user/designs/{design.pk}/renditions/thumbnail/')
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].endswith(design.image.url))
+        design.refresh_from_db()
+        self.assertEqual(design.image_hash, '')
+
+        response = self.client.get(f'/user/designs/{design.pk}/renditions/thumbnail/')
+        self.assertEqual(response.status_code, 302)
+        design.refresh_from_db()
+        self.assertIn(design.image_hash, response['Location'])
+
+    def test_private_design_renditions_need_author(self):
+        design = Design.objects.create(title='private', author=self.user,
+                                       image=ContentFile(self.png, name='private.png'))
+        url = f'/user/designs/{design.pk}/renditions/thumbnail/'
+        self.assertEqual(APIClient().get(url).status_code, 403)
+        other = APIClient()
+        other.force_authenticate(User.objects.create(username='other'))
+        self.assertEqual(other.get(url).status_code, 403)
+        design.refresh_from_db()
+        self.assertEqual(design.image_hash, '')
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CourseRenderTests(TestCase):
+    """设计图服务端渲染"""
+
+    COURSE = {
+        'name': 'course', 'fieldWidth': 60, 'fieldHeight': 40,
+        'obstacles': [
+            {'type': 'SINGLE', 'position': {'x': 10, 'y': 10}, 'rotation': 45,
+             'poles': [{'width': 4, 'height': 0.3, 'color': '#c0392b', 'number': '1'}]},
+            {'type': 'WALL', 'position': {'x': 30, 'y': 20}, 'rotation': 0, 'poles': [],
+             'wallProperties': {'width': 4, 'height': 1, 'color': '#A0522D'}},
+        ],
+        'path': {'visible': True, 'startPoint': {'x': 2, 'y': 2}, 'endPoint': {'x': 50, 'y': 30},
+                 'points': [{'x': 2, 'y': 2, 'controlPoint2': {'x': 5, 'y': 2}},
+                            {'x': 12, 'y': 12, 'controlPoint1': {'x': 10, 'y': 6}}]},
+    }
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.user = User.objects.create_user(username='designer', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.design = Design.objects.create(
+            title='course', author=self.user,
+            download=ContentFile(json.dumps(self.COURSE).encode(), name='course.json'))
+
+    def test_pdf_download_is_queued_deduplicated_and_cached(self):
+        url = f'/user/designs/{self.design.pk}/download/'
+        first = self.client.get(url, {'type': 'pdf'})
+        second = self.client.get(url, {'type': 'pdf'})
+        self.assertEqual(first.status_code, 202)
+        self.assertEqual(second.data['job']['job_id'], first.data['job']['job_id'])
+        self.assertEqual(RenderJob.objects.count(), 1)
+
+        self.assertEqual(process_render_jobs(), 1)
+        job_id = first.data['job']['job_id']
+        response = self.client.get(f'/user/api/render-jobs/{job_id}/')
+        self.assertEqual(response.data['job']['status'], 'done')
+        path = response.data['job']['download_url'].split('/media/', 1)[1]
+        with open(f'{self.media_root}/{path}', 'rb') as f:
+            self.assertTrue(f.read().startswith(b'%PDF'))
+
+        # 已渲染的内容直接返回文件地址
+        cached = self.client.get(url, {'type': 'pdf'})
+        self.assertEqual(cached.status_code, 200)
+        self.assertEqual(cached.data['download_url'], response.data['job']['download_url'])
+        self.assertEqual(cached.data['downloads_count'], 3)
+
+    def test_png_dpi_controls_pixel_size(self):
+        url = f'/user/designs/{self.design.pk}/download/'
+        self.client.get(url, {'type': 'png', 'dpi': 72})
+        process_render_jobs()
+        response = self.client.get(url, {'type': 'png', 'dpi': 72})
+        path = response.data['download_url'].split('/media/', 1)[1]
+        with Image.open(f'{self.media_root}/{path}') as image:
+            # A4 横向 297mm x 210mm
+            self.assertEqual(image.size, (842, 595))
+
+        response = self.client.get(url, {'type': 'png', 'dpi': 5000})
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalid_design_file_fails_without_retry(self):
+        self.design.download.save('broken.json', ContentFile(b'not json'))
+        response = self.client.get(f'/user/designs/{self.design.pk}/download/', {'type': 'pdf'})
+        process_render_jobs()
+        job = RenderJob.objects.get(job_id=response.data['job']['job_id'])
+        self.assertEqual((job.status, job.attempts), ('failed', 1))
+        self.assertEqual(self.client.get(
+            f'/user/api/render-jobs/{job.job_id}/result/').status_code, 409)
+
+    def test_jobs_for_private_designs_are_hidden_from_other_users(self):
+        response = self.client.get(f'/user/designs/{self.design.pk}/download/', {'type': 'pdf'})
+        job_id = response.data['job']['job_id']
+        process_render_jobs()
+        self.assertEqual(self.client.get(f'/user/api/render-jobs/{job_id}/').status_code, 200)
+
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user(username='other', password='password'))
+        self.assertEqual(other.get(f'/user/api/render-jobs/{job_id}/').status_code, 404)
+        self.assertEqual(other.get(f'/user/api/render-jobs/{job_id}/result/').status_code, 404)
+
+        self.design.is_shared = True
+        self.design.save(update_fields=['is_shared'])
+        self.assertEqual(other.get(f'/user/api/render-jobs/{job_id}/result/').status_code, 302)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ContentAddressedStorageTests(TestCase):
+    """按内容寻址的设计文件存储"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = User.objects.create_user(username='saver', password='password')
+
+    def create_design(self, content):
+        return Design.objects.create(title='course', author=self.user,
+                                     download=ContentFile(content, name='design.json'))
+
+    def test_identical_files_are_stored_once_and_collected_when_unreferenced(self):
+        first = self.create_design(b'{"obstacles": []}')
+        second = self.create_design(b'{"obstacles": []}')
+        self.assertEqual(first.download.name, second.download.name)
+        self.assertTrue(first.download.name.startswith('blobs/'))
+        self.assertEqual(StoredBlob.objects.count(), 1)
+        path = os.path.join(self.media_root, first.download.name)
+
+        first.delete()
+        counts = collect_garbage(grace_period=0)
+        self.assertEqual((counts['referenced'], counts['deleted']), (1, 0))
+        self.assertEqual(StoredBlob.objects.get().ref_count, 1)
+
+        second.delete()
+        # 保护期内不清理
+        self.assertEqual(collect_garbage()['deleted'], 0)
+        self.assertEqual(collect_garbage(grace_period=0)['deleted'], 1)
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(StoredBlob.objects.exists())
+
+        # 清理后再次保存相同内容时重新写入
+        third = self.create_design(b'{"obstacles": []}')
+        self.assertEqual(third.download.read(), b'{"obstacles": []}')
+
+    def test_blobs_referenced_by_hash_survive_gc(self):
+        design = Design.objects.create(title='course', author=self.user,
+                                       image=ContentFile(b'original image', name='course.png'))
+        digest = blob_digest(design.image.name)
+        # 图片已更换（缩略图重新生成失败），缩略图仍按原图哈希寻址
+        Design.objects.filter(pk=design.pk).update(image='', image_hash=digest)
+        call_command('gc_blobs', '--grace-period', '0', stdout=io.StringIO())
+        self.assertEqual(StoredBlob.objects.get(digest=digest).ref_count, 1)
+
+        # 未完成的渲染任务引用设计文件的哈希
+        source = self.create_design(b'{"obstacles": []}')
+        RenderJob.objects.create(design=design, file_format='pdf', dpi=150,
+                                 source_hash=blob_digest(source.download.name))
+        source.delete()
+        Design.objects.filter(pk=design.pk).update(image_hash='')
+        self.assertEqual(collect_garbage(grace_period=0)['deleted'], 1)
+        self.assertFalse(StoredBlob.objects.filter(digest=digest).exists())
+        self.assertTrue(StoredBlob.objects.filter(name=source.download.name).exists())
+
+        RenderJob.objects.update(status='done')
+        self.assertEqual(collect_garbage(grace_period=0)['deleted'], 1)
+        self.assertFalse(StoredBlob.objects.exists())
+
+
+@override_settings(CACHES=TEST_CACHES)
+class DesignSummaryTests(TestCase):
+    """设计文档、摘要字段和设计文件按需生成"""
+
+    COURSE = {
+        'name': 'course', 'fieldWidth': 90, 'fieldHeight': 60,
+        'obstacles': [
+            {'id': 'a', 'type': 'SINGLE', 'position': {'x': 10, 'y': 10}, 'poles': []},
+            {'id': 'b', 'type': 'SINGLE', 'position': {'x': 20, 'y': 10}, 'poles': []},
+            {'id': 'c', 'type': 'WATER', 'position': {'x': 30, 'y': 10}, 'poles': []},
+        ],
+        'path': {'visible': True, 'points': [{'x': 0, 'y': 0}, {'x': 30, 'y': 40}]},
+    }
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.user = User.objects.create_user(username='indexer', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        buffer = io.BytesIO()
+        Image.new('RGB', (40, 30)).save(buffer, 'PNG')
+        self.png = buffer.getvalue()
+
+    def upload(self, course, **data):
+        response = self.client.post('/user/designs/', {
+            'title': 'course', 'image': ContentFile(self.png, name='course.png'),
+            'download': ContentFile(json.dumps(course).encode(), name='course.json'), **data})
+        return Design.objects.get(pk=response.data['id'])
+
+    def test_upload_extracts_summary(self):
+        design = self.upload(self.COURSE)
+        self.assertEqual(design.obstacle_count, 3)
+        self.assertEqual((design.field_width, design.field_height, design.path_length), (90, 60, 50))
+        self.assertEqual(design.obstacle_types, {'SINGLE': 2, 'WATER': 1})
+        self.assertEqual(blob_digest(design.download.name), design.document_hash)
+
+    def test_design_file_is_regenerated_after_collaboration_edit(self):
+        design = self.upload(self.COURSE)
+        edited = {**self.COURSE, 'obstacles': self.COURSE['obstacles'][:1]}
+        save_design_document(design.pk, edited)
+        design.refresh_from_db()
+        self.assertEqual(design.obstacle_count, 1)
+
+        # 列表只返回已有文件的地址，不生成文件
+        response = self.client.get('/user/designs/my/')
+        self.assertTrue(response.data['results'][0]['download'].endswith(design.download.url))
+        self.assertEqual(Design.objects.get(pk=design.pk).download.name, design.download.name)
+
+        response = self.client.get(f'/user/designs/{design.pk}/download/')
+        path = response.data['download_url'].split('/media/', 1)[1]
+        with open(f'{self.media_root}/{path}', 'rb') as f:
+            self.assertEqual(json.load(f)['obstacles'], edited['obstacles'])
+        self.assertEqual(blob_digest(Design.objects.get(pk=design.pk).download.name), design.document_hash)
+
+    def test_shared_gallery_filters_and_sorts_by_summary(self):
+        large = self.upload(self.COURSE, is_shared=True)
+        small = self.upload({**self.COURSE, 'obstacles': self.COURSE['obstacles'][:1]}, is_shared=True)
+
+        response = self.client.get('/user/designs/shared/', {'ordering': 'obstacle_count'})
+        self.assertEqual([item['id'] for item in response.data['results']], [small.pk, large.pk])
+        response = self.client.get('/user/designs/shared/', {'obstacle_type': 'WATER', 'min_obstacles': 2})
+        self.assertEqual([item['id'] for item in response.data['results']], [large.pk])
+        self.assertEqual(self.client.get('/user/designs/shared/', {'min_obstacles': 'x'}).status_code, 400)
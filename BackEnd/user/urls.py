@@ -1,7 +1,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from rest_framework_simplejwt.views import TokenRefreshView
-from .views import RegisterView, LoginView, DesignViewSet, ForgotPasswordView, ResetPasswordView, CSRFTokenView, UserViewSet, CustomObstacleViewSet, create_membership_order, get_user_orders, get_order_status, alipay_notify, PaymentSuccessView
+from .views import RegisterView, LoginView, DesignViewSet, ForgotPasswordView, ResetPasswordView, CSRFTokenView, UserViewSet, CustomObstacleViewSet, create_membership_order, get_user_orders, get_order_status, alipay_notify, PaymentSuccessView, get_render_job, render_job_result
 
 # 创建路由器并注册视图集
 router = DefaultRouter()
@@ -30,4 +30,8 @@ urlpatterns = [
          get_order_status, name='get_order_status'),
     path('api/payment/alipay/notify/', alipay_notify, name='alipay_notify'),
     path('payment/success/', PaymentSuccessView.as_view(), name='payment_success'),
+
+    # 设计图渲染任务
+    path('api/render-jobs/<uuid:job_id>/', get_render_job, name='get_render_job'),
+    path('api/render-jobs/<uuid:job_id>/result/', render_job_result, name='render_job_result'),
 ]
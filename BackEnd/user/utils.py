@@ -2,12 +2,14 @@ import json
 from alipay.utils import AliPayConfig
 from alipay import AliPay
 from django.conf import settings
+from django.core.cache import caches
 from urllib.parse import urljoin
 import random
 import string
 from hashlib import sha1
 import time
 import os
+import threading
 import uuid
 from rest_framework.response import Response
 from rest_framework import status
@@ -37,6 +39,15 @@ def get_absolute_media_url(path):
     return urljoin(base_url, path)
 
 
+def get_shared_cache():
+    """
+    获取多个进程共享的缓存（CACHES['shared']，未配置时使用默认缓存）
+
+    用于失效版本号、调试开关、定时任务锁等需要在所有进程间一致的状态。
+    """
+    return caches['shared' if 'shared' in settings.CACHES else 'default']
+
+
 def generate_token():
     """生成一个随机令牌"""
     random_str = ''.join(random.choices(
@@ -53,9 +64,9 @@ def generate_token():
 
 # 初始化支付宝客户端
 
-def get_alipay_client():
+def build_alipay_client():
     """
-    获取支付宝客户端实例
+    读取密钥文件并创建支付宝客户端（每次调用都会解析RSA密钥，请使用 get_alipay_client）
     需要在settings.py中配置以下参数:
     - ALIPAY_APPID: 支付宝应用ID
     - ALIPAY_APP_PRIVATE_KEY_PATH: 应用私钥路径
@@ -64,9 +75,10 @@ def get_alipay_client():
     - ALIPAY_RETURN_URL: 支付宝同步返回URL
     - ALIPAY_DEBUG: 是否为沙箱环境(布尔值)
     """
-    app_private_key_string = open(settings.ALIPAY_APP_PRIVATE_KEY_PATH).read()
-    alipay_public_key_string = open(
-        settings.ALIPAY_ALIPAY_PUBLIC_KEY_PATH).read()
+    with open(settings.ALIPAY_APP_PRIVATE_KEY_PATH) as f:
+        app_private_key_string = f.read()
+    with open(settings.ALIPAY_ALIPAY_PUBLIC_KEY_PATH) as f:
+        alipay_public_key_string = f.read()
 
     alipay = AliPay(
         appid=settings.ALIPAY_APPID,
@@ -80,6 +92,63 @@ def get_alipay_client():
     return alipay
 
 
+def _alipay_fingerprint():
+    """
+    决定是否需要重新创建客户端的配置指纹：相关配置、ALIPAY_KEY_VERSION，
+    以及两个密钥文件的修改时间和大小（替换密钥文件后自动重新加载）
+    """
+    files = []
+    for path in (settings.ALIPAY_APP_PRIVATE_KEY_PATH, settings.ALIPAY_ALIPAY_PUBLIC_KEY_PATH):
+        try:
+            stat = os.stat(path)
+            files.append((path, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            files.append((path, None, None))
+    return (settings.ALIPAY_APPID, settings.ALIPAY_NOTIFY_URL, settings.ALIPAY_DEBUG,
+            getattr(settings, 'ALIPAY_KEY_VERSION', 0), tuple(files))
+
+
+# (配置指纹, 客户端)，整体替换，读取时不需要加锁
+_alipay_cached = (None, None)
+_alipay_client_lock = threading.Lock()
+
+
+def get_alipay_client():
+    """
+    获取支付宝客户端实例（进程内缓存，线程安全）
+
+    创建客户端需要读取密钥文件并解析RSA密钥，原先每次创建订单、验证回调、查询订单都会
+    重新创建。现在只在首次调用、密钥文件变化或配置（含 ALIPAY_KEY_VERSION）变化时创建，
+    每次调用只检查两个密钥文件的修改时间。客户端签名和验签不修改自身状态，可在线程间共享。
+
+    ALIPAY_USE_FAKE_GATEWAY 为 True 时返回本地模拟网关（见 user.fake_alipay）。
+    """
+    global _alipay_cached
+
+    if getattr(settings, 'ALIPAY_USE_FAKE_GATEWAY', False):
+        from .fake_alipay import get_fake_alipay_gateway
+        return get_fake_alipay_gateway()
+
+    fingerprint = _alipay_fingerprint()
+    cached_fingerprint, client = _alipay_cached
+    if client is not None and cached_fingerprint == fingerprint:
+        return client
+
+    with _alipay_client_lock:
+        cached_fingerprint, client = _alipay_cached
+        if client is None or cached_fingerprint != fingerprint:
+            client = build_alipay_client()
+            _alipay_cached = (fingerprint, client)
+        return client
+
+
+def reset_alipay_client():
+    """丢弃缓存的支付宝客户端，下次调用 get_alipay_client 时重新创建"""
+    global _alipay_cached
+    with _alipay_client_lock:
+        _alipay_cached = (None, None)
+
+
 def create_alipay_order(order_id, subject, total_amount, return_url=None):
     """
     创建支付宝支付订单，返回支付链接
@@ -9,27 +9,37 @@ from .serializers import UserRegisterSerializer, UserLoginSerializer, ForgotPass
 from rest_framework import serializers
 from rest_framework import viewsets
 from rest_framework.parsers import MultiPartParser, FormParser
-from .models import Design, PasswordResetToken, DesignLike, UserProfile, MembershipPlan, CustomObstacle, MembershipOrder
+from .models import Design, PasswordResetToken, DesignLike, UserProfile, CustomObstacle, MembershipOrder
 from .serializers import DesignSerializer, DesignListSerializer, CustomObstacleSerializer, MembershipOrderSerializer, CreateMembershipOrderSerializer
 import uuid
 from django.core.mail import send_mail
+from django.core.files.storage import default_storage
 from django.conf import settings
 from django.urls import reverse
 from django.utils import timezone
-from datetime import timedelta, datetime
+from datetime import timedelta
 from django.template.loader import render_to_string
 from django.utils.html import strip_tags
 from django.middleware.csrf import get_token
 from django.views.decorators.csrf import ensure_csrf_cookie, csrf_exempt
 from django.utils.decorators import method_decorator
 from rest_framework.decorators import action, api_view, permission_classes
-from django.db.models import F
-from .utils import get_absolute_media_url, create_alipay_order, verify_alipay_callback, query_alipay_order, success_response, error_response
+from django.db.models import F, Exists, OuterRef
+from .utils import get_absolute_media_url, create_alipay_order, verify_alipay_callback, success_response, error_response
 from rest_framework.exceptions import PermissionDenied
 from django.views.generic import TemplateView
 import logging
 from django.contrib.auth import authenticate
 from rest_framework.pagination import PageNumberPagination
+from .pagination import KeysetPagination, use_cursor_pagination
+from .membership import get_membership
+from .order_reconciler import mark_order_paid, schedule_first_check
+from .plan_registry import get_plan_registry, plan_data
+from .renditions import generate_renditions, get_renditions, rendition_url
+from .course_renderer import DEFAULT_DPI as DEFAULT_RENDER_DPI, RenderError
+from .render_jobs import job_data, request_render, visible_jobs
+from .design_summary import filter_by_summary, index_design_file, materialize_design_file
+from django.http import HttpResponseRedirect
 
 # Create your views here.
 
@@ -125,9 +135,6 @@ class LoginView(APIView):
         if serializer.is_valid():
             user = serializer.validated_data['user']
 
-            # 添加会员状态检查
-            check_and_update_membership(user)
-
             refresh = RefreshToken.for_user(user)
             return success_response('登录成功', {
                 'user_id': user.id,
@@ -256,13 +263,32 @@ class DesignViewSet(viewsets.ModelViewSet):
         """根据不同的操作返回不同的查询集"""
         if self.action == 'shared_designs':
             # 公开分享的设计
-            return Design.objects.filter(is_shared=True)
-        # 默认只返回当前用户的设计
-        return Design.objects.filter(author=self.request.user)
+            queryset = Design.objects.filter(is_shared=True)
+        else:
+            # 默认只返回当前用户的设计
+            queryset = Design.objects.filter(author=self.request.user)
+        return self.with_list_annotations(queryset)
+
+    def with_list_annotations(self, queryset):
+        """
+        预加载序列化所需的关联数据，避免列表中每条设计单独查询
+
+        - 作者通过 select_related 一并查询
+        - 当前用户是否已点赞通过 Exists 子查询标注为 user_has_liked
+        - 设计文档只在需要重新生成设计文件时才加载
+        """
+        queryset = queryset.select_related('author').defer('document')
+        user = self.request.user
+        if user.is_authenticated:
+            queryset = queryset.annotate(user_has_liked=Exists(
+                DesignLike.objects.filter(design=OuterRef('pk'), user=user)))
+        return queryset
 
     def perform_create(self, serializer):
-        """保存时自动设置作者为当前用户"""
-        serializer.save(author=self.request.user)
+        """保存时自动设置作者为当前用户，解析设计文件并生成缩略图"""
+        design = serializer.save(author=self.request.user)
+        index_design_file(design)
+        generate_renditions(design)
 
     def perform_update(self, serializer):
         """更新设计时保留原作者"""
@@ -271,9 +297,16 @@ class DesignViewSet(viewsets.ModelViewSet):
         print(
             f"更新设计: ID={instance.id}, 标题={instance.title}, 作者={instance.author}")
 
-        # 确保更新时保留原作者
+        # 确保更新时保留原作者；更换图片时清除旧的图片哈希并重新生成缩略图
         try:
-            serializer.save(author=instance.author)
+            if 'image' in serializer.validated_data:
+                design = serializer.save(author=instance.author, image_hash='')
+                generate_renditions(design)
+            else:
+                design = serializer.save(author=instance.author)
+            # 上传了新的设计文件时重新解析文档和摘要
+            if serializer.validated_data.get('download'):
+                index_design_file(design)
             print(f"设计更新成功: ID={instance.id}")
         except Exception as e:
             print(f"设计更新失败: ID={instance.id}, 错误={str(e)}")
@@ -281,8 +314,27 @@ class DesignViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['get'], url_path='shared')
     def shared_designs(self, request):
-        """获取所有公开分享的设计"""
-        queryset = self.get_queryset()
+        """
+        获取所有公开分享的设计
+
+        默认使用页码分页；传 pagination=cursor 时使用按 (create_time, id) 的键集分页，
+        深层页面不再执行 COUNT(*) 和 OFFSET 扫描
+
+        筛选和排序使用设计摘要字段（见 design_summary），参数见 filter_by_summary()
+        """
+        try:
+            queryset, ordering = filter_by_summary(self.get_queryset(), request.query_params)
+        except ValueError as e:
+            return error_response(str(e), status.HTTP_400_BAD_REQUEST)
+        if ordering:
+            if use_cursor_pagination(request):
+                return error_response('键集分页只支持按创建时间排序', status.HTTP_400_BAD_REQUEST)
+            queryset = queryset.order_by(ordering, '-id')
+        if use_cursor_pagination(request):
+            paginator = KeysetPagination('-create_time', page_size=settings.REST_FRAMEWORK['PAGE_SIZE'])
+            page = paginator.paginate_queryset(queryset, request, view=self)
+            serializer = self.get_serializer(page, many=True)
+            return paginator.get_paginated_response(serializer.data)
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = self.get_serializer(page, many=True)
@@ -293,7 +345,7 @@ class DesignViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'], url_path='my')
     def my_designs(self, request):
         """获取当前用户的所有设计"""
-        queryset = Design.objects.filter(author=request.user)
+        queryset = self.get_queryset()
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = self.get_serializer(page, many=True)
@@ -370,7 +422,12 @@ class DesignViewSet(viewsets.ModelViewSet):
 
     @action(detail=True, methods=['get'], url_path='download')
     def download_design(self, request, pk=None):
-        """下载设计并增加下载计数"""
+        """
+        下载设计并增加下载计数
+
+        type=pdf 以及没有上传图片或指定了 dpi 参数的 type=png 根据设计文件在服务端渲染，
+        尚未渲染时返回 202 和渲染任务，由 render_worker 命令在后台渲染。
+        """
         try:
             # 获取下载类型参数，默认为json
             file_type = request.query_params.get('type', 'json').lower()
@@ -384,28 +441,46 @@ class DesignViewSet(viewsets.ModelViewSet):
             if design.author != request.user and not design.is_shared:
                 return error_response('您无权下载未共享的设计', status.HTTP_403_FORBIDDEN)
 
-            # 检查是否有下载文件
-            if not design.download and file_type == 'json':
-                return error_response('该设计没有可下载的JSON文件', status.HTTP_404_NOT_FOUND)
+            # 检查是否有下载文件（PDF以及没有上传图片或指定了DPI的PNG需要根据设计文件渲染）
+            needs_render = file_type == 'pdf' or (
+                file_type == 'png' and (not design.image or 'dpi' in request.query_params))
 
-            # 检查是否有图片文件
-            if not design.image and file_type == 'png':
-                return error_response('该设计没有可下载的PNG图片', status.HTTP_404_NOT_FOUND)
+            # 协作编辑后设计文件按需由设计文档重新生成
+            if file_type == 'json' or needs_render:
+                materialize_design_file(design)
+            if not design.download and (file_type == 'json' or needs_render):
+                return error_response('该设计没有可下载的设计文件', status.HTTP_404_NOT_FOUND)
+
+            storage_path = job = None
+            if needs_render:
+                # 已渲染过的直接返回文件，否则交给 render_worker 渲染
+                try:
+                    storage_path, job = request_render(
+                        design, file_type, request.query_params.get('dpi', DEFAULT_RENDER_DPI), request.user)
+                except RenderError as e:
+                    return error_response(str(e), status.HTTP_400_BAD_REQUEST)
 
             # 增加下载计数
             Design.objects.filter(pk=pk).update(downloads_count=F('downloads_count') + 1)
             design.refresh_from_db()
 
+            if job is not None:
+                # 客户端连接 ws/render/jobs/<job_id>/ 或查询 api/render-jobs/<job_id>/ 等待完成
+                return success_response('文件正在生成中', {
+                    'job': job_data(job),
+                    'filename': f"{design.title}.{file_type}",
+                    'file_type': file_type,
+                    'downloads_count': design.downloads_count
+                }, status.HTTP_202_ACCEPTED)
+
             # 根据文件类型返回不同的下载URL
-            if file_type == 'json':
+            if storage_path:
+                download_url = get_absolute_media_url(default_storage.url(storage_path))
+            elif file_type == 'json':
                 download_url = get_absolute_media_url(design.download.url)
-                filename = f"{design.title}.json"
-            elif file_type == 'png':
+            else:
                 download_url = get_absolute_media_url(design.image.url)
-                filename = f"{design.title}.png"
-            elif file_type == 'pdf':
-                # 这里需要实现PDF生成逻辑，暂时返回错误
-                return error_response('PDF下载功能正在开发中，敬请期待', status.HTTP_501_NOT_IMPLEMENTED)
+            filename = f"{design.title}.{file_type}"
 
             # 返回下载URL和文件名
             return success_response('下载成功', {
@@ -418,22 +493,39 @@ class DesignViewSet(viewsets.ModelViewSet):
         except Design.DoesNotExist:
             return error_response('设计不存在', status.HTTP_404_NOT_FOUND)
 
+    @action(detail=True, methods=['get'], url_path=r'renditions/(?P<name>[a-z]+)',
+            url_name='rendition', permission_classes=[AllowAny])
+    def rendition(self, request, pk=None, name=None):
+        """
+        按需生成缩略图并重定向到图片文件
+
+        缩略图尚未生成的已分享设计（历史数据或上传时生成失败），序列化器返回的缩略图地址
+        指向本接口，列表中的 <img> 请求不带登录信息，因此本接口不要求登录：
+        - 与 download_design 相同，只有作者和已分享的设计可以访问
+        - 只为登录用户在请求中生成缩略图，匿名请求重定向到原图
+        """
+        design = get_object_or_404(Design, pk=pk)
+        user = request.user
+        is_author = user.is_authenticated and design.author_id == user.id
+        if not is_author and not design.is_shared:
+            return error_response('您无权查看未共享的设计', status.HTTP_403_FORBIDDEN)
+        if not design.image or name not in get_renditions():
+            return error_response('缩略图不存在', status.HTTP_404_NOT_FOUND)
+        if not design.image_hash and (not user.is_authenticated or not generate_renditions(design)):
+            # 匿名请求或生成失败时退回原图
+            return HttpResponseRedirect(get_absolute_media_url(design.image.url))
+        return HttpResponseRedirect(rendition_url(design, name))
+
     def create(self, request, *args, **kwargs):
         """创建设计前检查存储限制"""
         user = request.user
-        
-        check_and_update_membership(user)
-        
-        try:
-            profile = user.profile
-        except UserProfile.DoesNotExist:
-            profile = UserProfile.objects.create(user=user)
+        membership = get_membership(user)
 
         # 获取用户的设计数量
         user_designs_count = Design.objects.filter(author=user).count()
 
         # 检查是否超出存储限制
-        storage_limit = profile.get_storage_limit()
+        storage_limit = membership.get_storage_limit()
         if user_designs_count >= storage_limit:
             return error_response(
                 f'您已达到存储限制（{storage_limit}个设计）。升级为会员可获得更多存储空间！',
@@ -442,8 +534,8 @@ class DesignViewSet(viewsets.ModelViewSet):
                     'is_limit_reached': True,
                     'current_count': user_designs_count,
                     'limit': storage_limit,
-                    'is_premium': profile.is_premium,
-                    'is_premium_active': profile.is_premium_active()
+                    'is_premium': membership.is_premium,
+                    'is_premium_active': membership.is_premium_active()
                 }
             )
 
@@ -485,10 +577,8 @@ class UserViewSet(viewsets.ModelViewSet):
             # 获取会员计划
             membership_plan = None
             if membership_plan_id:
-                try:
-                    membership_plan = MembershipPlan.objects.get(
-                        id=membership_plan_id, is_active=True)
-                except MembershipPlan.DoesNotExist:
+                membership_plan = get_plan_registry().get(membership_plan_id, active_only=True)
+                if membership_plan is None:
                     return error_response("指定的会员计划不存在或未激活", status.HTTP_400_BAD_REQUEST)
 
             # 设置会员状态
@@ -520,82 +610,48 @@ class UserViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['get'])
     def check_premium(self, request):
-        """检查用户会员状态（轻量级接口）"""
-        user = request.user
-        
-        check_and_update_membership(user)
-        
-        profile, created = UserProfile.objects.get_or_create(user=user)
-        
+        """检查用户会员状态（轻量级接口，只读）"""
         return success_response('查询成功', {
-            'is_premium_active': profile.is_premium_active()
+            'is_premium_active': get_membership(request.user).is_premium_active()
         })
 
     @action(detail=False, methods=['get'])
     def my_profile(self, request):
         """获取当前用户资料"""
         user = request.user
-        
-        check_and_update_membership(user)
-        
-        # 获取或创建用户资料
-        profile, created = UserProfile.objects.get_or_create(user=user)
+
+        # 当前有效的会员状态（到期、待生效计划已计算在内）
+        membership = get_membership(user)
 
         # 获取用户设计数量
         design_count = Design.objects.filter(author=user).count()
 
-        # 获取可用的会员计划
-        plans = MembershipPlan.objects.filter(is_active=True)
-
         # 构建响应数据
         data = {
             'success': True,
             'username': user.username,
             'email': user.email,
-            'is_premium': profile.is_premium,
-            'is_premium_active': profile.is_premium_active(),
+            'is_premium': membership.is_premium,
+            'is_premium_active': membership.is_premium_active(),
             'design_count': design_count,
-            'design_storage_limit': profile.storage_limit,
-            'available_plans': [],
+            'design_storage_limit': membership.storage_limit,
+            # 可用的会员计划（从计划目录缓存读取）
+            'available_plans': list(get_plan_registry().active_plan_data()),
         }
 
         # 添加当前会员计划
-        if profile.membership_plan:
-            data['membership_plan'] = {
-                'id': profile.membership_plan.id,
-                'name': profile.membership_plan.name,
-                'code': profile.membership_plan.code,
-                'monthly_price': float(profile.membership_plan.monthly_price),
-                'yearly_price': float(profile.membership_plan.yearly_price),
-                'storage_limit': profile.membership_plan.storage_limit
-            }
-            data['premium_expire_date'] = profile.premium_expire_date
+        if membership.membership_plan:
+            data['membership_plan'] = plan_data(membership.membership_plan)
+            data['premium_expire_date'] = membership.premium_expire_date
 
         # 添加待生效的会员计划信息
-        if profile.pending_membership_plan:
+        if membership.pending_membership_plan:
             data['pending_membership_plan'] = {
-                'id': profile.pending_membership_plan.id,
-                'name': profile.pending_membership_plan.name,
-                'code': profile.pending_membership_plan.code,
-                'monthly_price': float(profile.pending_membership_plan.monthly_price),
-                'yearly_price': float(profile.pending_membership_plan.yearly_price),
-                'storage_limit': profile.pending_membership_plan.storage_limit,
-                'start_date': profile.pending_membership_start_date,
-                'expire_date': profile.pending_membership_expire_date
+                **plan_data(membership.pending_membership_plan),
+                'start_date': membership.pending_membership_start_date,
+                'expire_date': membership.pending_membership_expire_date
             }
 
-        # 添加可用的会员计划
-        for plan in plans:
-            data['available_plans'].append({
-                'id': plan.id,
-                'name': plan.name,
-                'code': plan.code,
-                'monthly_price': float(plan.monthly_price),
-                'yearly_price': float(plan.yearly_price),
-                'storage_limit': plan.storage_limit,
-                'description': plan.description
-            })
-
         return Response(data)
 
     @action(detail=False, methods=['post'])
@@ -737,11 +793,12 @@ class CustomObstacleViewSet(viewsets.ModelViewSet):
         user = request.user
         count = CustomObstacle.objects.filter(user=user).count()
 
-        # 从会员计划中获取自定义障碍物数量限制
+        # 从当前有效的会员计划中获取自定义障碍物数量限制
+        membership = get_membership(user)
         max_count = 10  # 默认限制（免费用户）
         is_unlimited = False
-        if hasattr(user, 'profile') and user.profile.membership_plan:
-            plan_limit = user.profile.membership_plan.custom_obstacle_limit
+        if membership.membership_plan:
+            plan_limit = membership.get_custom_obstacle_limit()
             if plan_limit is not None:
                 max_count = plan_limit
             else:
@@ -752,7 +809,7 @@ class CustomObstacleViewSet(viewsets.ModelViewSet):
             'count': count,
             'max_count': max_count if not is_unlimited else None,
             'is_unlimited': is_unlimited,
-            'is_premium': hasattr(user, 'profile') and user.profile.is_premium_active()
+            'is_premium': membership.is_premium_active()
         })
 
     @action(detail=False, methods=['get'], url_path='shared')
@@ -760,6 +817,9 @@ class CustomObstacleViewSet(viewsets.ModelViewSet):
         """
         获取其他用户共享的障碍物
         支持分页、搜索和排序
+
+        传 pagination=cursor 时使用按 (created_at, id) 的键集分页，
+        此时只支持按创建时间排序
         """
         # 获取所有标记为共享的障碍物，排除当前用户的
         shared_obstacles = CustomObstacle.objects.filter(
@@ -781,7 +841,12 @@ class CustomObstacleViewSet(viewsets.ModelViewSet):
             shared_obstacles = shared_obstacles.order_by('-created_at')
 
         # 分页
-        paginator = StandardResultsSetPagination()
+        if use_cursor_pagination(request):
+            if ordering not in ('created_at', '-created_at'):
+                ordering = '-created_at'
+            paginator = KeysetPagination(ordering, page_size=StandardResultsSetPagination.page_size)
+        else:
+            paginator = StandardResultsSetPagination()
         page = paginator.paginate_queryset(shared_obstacles, request)
         
         if page is not None:
@@ -817,72 +882,14 @@ class CustomObstacleViewSet(viewsets.ModelViewSet):
 logger = logging.getLogger(__name__)
 
 
-def check_and_update_membership(user):
-    """检查并更新用户的会员状态"""
-    try:
-        profile = user.profile
-        now = timezone.now()
-
-        if profile.is_premium and profile.premium_expire_date and profile.premium_expire_date <= now:
-            logger.info(f"用户 {user.username} 的会员已过期，检查是否有待生效的会员计划")
-
-            if profile.pending_membership_plan:
-                logger.info(f"用户 {user.username} 有待生效的会员计划，将其激活")
-
-                profile.membership_plan = profile.pending_membership_plan
-                profile.premium_expire_date = profile.pending_membership_expire_date
-                profile.is_premium = True
-
-                if profile.membership_plan and profile.membership_plan.storage_limit:
-                    profile.storage_limit = profile.membership_plan.storage_limit
-
-                profile.pending_membership_plan = None
-                profile.pending_membership_start_date = None
-                profile.pending_membership_expire_date = None
-
-                profile.save()
-                logger.info(
-                    f"用户 {user.username} 的待生效会员计划已激活，新会员类型：{profile.membership_plan.name}")
-
-            elif not profile.is_premium_active():
-                logger.info(
-                    f"用户 {user.username} 的会员已过期，没有待生效的会员计划，重置为非会员状态")
-                
-                try:
-                    free_plan = MembershipPlan.objects.get(code='free')
-                except MembershipPlan.DoesNotExist:
-                    free_plan = MembershipPlan.objects.create(
-                        name='免费用户',
-                        code='free',
-                        monthly_price=0,
-                        yearly_price=0,
-                        storage_limit=5,
-                        custom_obstacle_limit=10,
-                        description='免费用户计划，限制存储5个设计'
-                    )
-                
-                profile.is_premium = False
-                profile.membership_plan = free_plan
-                profile.storage_limit = 5
-                profile.save()
-                
-                logger.info(f"用户 {user.username} 的会员状态已重置为免费用户")
-
-        return True
-    except Exception as e:
-        logger.error(f"检查用户会员状态时出错: {str(e)}")
-        return False
-
-
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def create_membership_order(request):
     """创建会员订单并返回支付链接"""
     serializer = CreateMembershipOrderSerializer(data=request.data)
     if serializer.is_valid():
-        # 获取会员计划
-        plan = MembershipPlan.objects.get(
-            id=serializer.validated_data['plan_id'])
+        # 获取会员计划（序列化器校验时已从计划目录缓存取出）
+        plan = serializer.validated_data['plan']
         # 获取用户
         user = request.user
 
@@ -906,8 +913,9 @@ def create_membership_order(request):
                 subject=subject,
                 total_amount=float(order.amount)
             )
-            # 保存支付链接
+            # 保存支付链接，并安排后台查询支付状态
             order.payment_url = pay_url
+            schedule_first_check(order)
             order.save()
 
             # 返回订单信息和支付链接
@@ -975,35 +983,33 @@ def get_order_status(request, order_id):
             'order': MembershipOrderSerializer(order).data
         })
 
-    # 如果未支付，查询支付宝订单状态
-    try:
-        query_result = query_alipay_order(order.order_id)
-        logger.info(f"支付宝查询结果: {query_result}")
-
-        # 处理查询结果
-        if query_result.get('trade_status') == 'TRADE_SUCCESS':
-            # 更新订单状态
-            order.status = 'paid'
-            order.trade_no = query_result.get('trade_no')
-            order.payment_time = datetime.now()
-            order.save()
+    # 未支付时只返回本地状态：支付结果由支付宝异步通知和 reconcile_orders 命令更新，
+    # 客户端可以连接 ws/payment/orders/<order_id>/ 等待状态变化的推送
+    return success_response('订单未支付或支付处理中', {
+        'order': MembershipOrderSerializer(order).data
+    })
 
-            # 更新用户会员状态
-            update_user_membership(request.user, order)
 
-            return success_response('支付成功', {
-                'order': MembershipOrderSerializer(order).data
-            })
-        else:
-            return success_response('订单未支付或支付处理中', {
-                'order': MembershipOrderSerializer(order).data,
-                'alipay_status': query_result.get('trade_status')
-            })
-    except Exception as e:
-        logger.error(f"查询支付宝订单状态失败: {str(e)}")
-        return error_response(f'查询订单状态失败: {str(e)}', status.HTTP_500_INTERNAL_SERVER_ERROR, {
-            'order': MembershipOrderSerializer(order).data
-        })
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_render_job(request, job_id):
+    """
+    查询渲染任务状态
+
+    只能查询自己请求的任务，或有权下载对应设计的任务（见 render_jobs.visible_jobs）。
+    """
+    job = get_object_or_404(visible_jobs(request.user), job_id=job_id)
+    return success_response('查询成功', {'job': job_data(job)})
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def render_job_result(request, job_id):
+    """渲染完成后重定向到结果文件（权限与 get_render_job 相同）"""
+    job = get_object_or_404(visible_jobs(request.user), job_id=job_id)
+    if job.status != 'done':
+        return error_response('文件尚未生成完成', status.HTTP_409_CONFLICT, {'job': job_data(job)})
+    return HttpResponseRedirect(job_data(job)['download_url'])
 
 
 @api_view(['POST'])
@@ -1036,20 +1042,9 @@ def alipay_notify(request):
 
         # 处理不同的交易状态
         if trade_status == 'TRADE_SUCCESS' or trade_status == 'TRADE_FINISHED':
-            # 如果订单已处理，防止重复更新
-            if order.status == 'paid':
+            # 更新订单和会员状态；订单已处理（包括对账已处理）时不重复更新
+            if mark_order_paid(order.order_id, data.get('trade_no')) is None:
                 return Response({'message': 'SUCCESS', 'detail': '订单已处理'})
-
-            # 更新订单状态
-            order.status = 'paid'
-            order.trade_no = data.get('trade_no')
-            order.payment_time = datetime.now()
-            order.save()
-
-            # 更新用户会员状态
-            update_user_membership(order.user, order)
-
-            logger.info(f"订单 {out_trade_no} 支付成功，交易号: {data.get('trade_no')}")
             return Response({'message': 'SUCCESS'})
         else:
             # 其他状态不处理
@@ -1058,90 +1053,6 @@ def alipay_notify(request):
         logger.error(f"处理支付宝回调时出错: {str(e)}")
         return Response({'message': 'FAIL', 'detail': str(e)})
 
-
-def update_user_membership(user, order):
-    """更新用户会员状态"""
-    # 获取用户资料
-    profile = user.profile
-
-    # 获取当前时间
-    now = datetime.now()
-
-    # 会员计划等级映射（数字越大等级越高）
-    plan_level = {
-        'standard': 1,
-        'premium': 2,
-        # 未来可能添加的其他计划
-    }
-
-    # 设置会员到期时间
-    if order.billing_cycle == 'month':
-        duration = timedelta(days=30)
-    else:  # year
-        duration = timedelta(days=365)
-
-    # 判断是否已经是会员
-    if profile.is_premium_active():
-        current_plan_code = profile.membership_plan.code if profile.membership_plan else 'free'
-        new_plan_code = order.membership_plan.code if order.membership_plan else 'free'
-
-        # 获取当前和新计划的等级
-        current_level = plan_level.get(current_plan_code, 0)
-        new_level = plan_level.get(new_plan_code, 0)
-
-        # 1. 升级会员（立即生效，重置到期时间）
-        if new_level > current_level:
-            logger.info(
-                f"用户 {user.username} 升级会员: {current_plan_code} -> {new_plan_code}")
-            profile.membership_plan = order.membership_plan
-            profile.premium_expire_date = now + duration
-
-        # 2. 同等级续费（延长到期时间）
-        elif new_level == current_level:
-            logger.info(f"用户 {user.username} 续费相同等级会员: {current_plan_code}")
-            # 从当前到期时间起延长
-            if profile.premium_expire_date and profile.premium_expire_date > now:
-                profile.premium_expire_date = profile.premium_expire_date + duration
-            else:
-                profile.premium_expire_date = now + duration
-
-        # 3. 降级会员（当前会员到期后生效）
-        else:
-            logger.info(
-                f"用户 {user.username} 降级会员: {current_plan_code} -> {new_plan_code}，将在当前会员到期后生效")
-
-            # 创建会员变更记录(可选，如果需要记录变更历史)
-            # MembershipChangeLog.objects.create(...)
-
-            # 存储降级信息，但暂不更新当前会员
-            profile.pending_membership_plan = order.membership_plan
-            profile.pending_membership_start_date = profile.premium_expire_date
-            profile.pending_membership_expire_date = profile.premium_expire_date + duration
-
-            # 注意：此处不修改当前会员计划和到期时间
-            # 需要添加一个定时任务或登录检查来处理会员到期后的降级
-    else:
-        # 用户之前不是会员，直接激活
-        logger.info(f"用户 {user.username} 首次开通会员: {order.membership_plan.name}")
-        profile.membership_plan = order.membership_plan
-        profile.premium_expire_date = now + duration
-        profile.is_premium = True
-
-    # 更新存储限制
-    if order.membership_plan:
-        # 如果是降级但还没生效，不降低存储限制
-        if not hasattr(profile, 'pending_membership_plan') or profile.pending_membership_plan is None:
-            profile.storage_limit = order.membership_plan.storage_limit
-
-    # 保存更改
-    profile.save()
-
-    logger.info(
-        f"用户 {user.username} 的会员状态已更新，当前会员类型：{profile.membership_plan.name if profile.membership_plan else '无'}")
-
-    # 返回更新后的用户资料
-    return profile
-
 # 支付成功页面重定向
 
 